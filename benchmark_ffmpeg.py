@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Benchmark reproducible de los comandos que genera build_ffmpeg_command.
+
+Genera clips sintéticos con lavfi (testsrc2, mandelbrot y ruido, con audio senoidal o de ruido)
+en 480p, 720p, 1080p y 4K, ejecuta cada ruta de procesamiento (scale, watermark, trim, mute,
+extract_audio y GIF) bajo el mismo supervisor que usa el worker y guarda un informe JSON con
+fps de codificación, multiplicador de velocidad, tamaño de salida, segundos de CPU y RSS máximo.
+
+Uso:
+    python benchmark_ffmpeg.py --output bench.json
+    python benchmark_ffmpeg.py --output bench.json --baseline bench_baseline.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+
+from src.core.ffmpeg import build_ffmpeg_command
+from src.core.ffmpeg_supervisor import run_ffmpeg
+
+RESOLUTIONS = {
+    "480p": (854, 480),
+    "720p": (1280, 720),
+    "1080p": (1920, 1080),
+    "4K": (3840, 2160),
+}
+
+FRAME_RATE = 30
+
+# Fuente de vídeo y de audio de cada clip sintético.
+SOURCES = {
+    "testsrc2": (
+        "testsrc2=size={w}x{h}:rate={fps}:duration={d}",
+        "sine=frequency=440:sample_rate=48000:duration={d}",
+    ),
+    "mandelbrot": (
+        "mandelbrot=size={w}x{h}:rate={fps},trim=duration={d}",
+        "sine=frequency=1000:sample_rate=48000:duration={d}",
+    ),
+    "noise": (
+        "color=c=gray:size={w}x{h}:rate={fps}:duration={d},noise=alls=60:allf=t+u",
+        "anoisesrc=color=pink:sample_rate=48000:duration={d}",
+    ),
+}
+
+WATERMARK_PATH = os.path.join("assets", "watermark.png")
+
+# Cada ruta es la processing_config de una tarea real.
+PATHS = {
+    "scale": {"quality": "720p"},
+    "watermark": {"watermark": {"type": "image", "position": "bottom_right"}},
+    "trim": {"trim_times": "00:00:01-00:00:04"},
+    "mute": {"mute_audio": True},
+    "extract_audio": {"extract_audio": True},
+    "gif": {"gif_options": {"duration": 3, "fps": 15}},
+}
+
+# Umbrales relativos para marcar una regresión frente a la línea base.
+REGRESSION_RULES = {
+    "encode_fps": "lower",
+    "speed": "lower",
+    "output_size": "higher",
+    "cpu_seconds": "higher",
+    "peak_rss_kb": "higher",
+}
+
+
+def ffmpeg_version() -> str:
+    try:
+        output = subprocess.run(["ffmpeg", "-version"], capture_output=True, text=True, check=True).stdout
+        return output.splitlines()[0]
+    except Exception:
+        return "desconocida"
+
+
+def generate_clip(workdir: str, source: str, resolution: str, duration: float) -> str:
+    width, height = RESOLUTIONS[resolution]
+    video_src, audio_src = SOURCES[source]
+    path = os.path.join(workdir, f"{source}_{resolution}_{duration:g}s.mp4")
+    if os.path.exists(path):
+        return path
+    command = [
+        "ffmpeg", "-y", "-hide_banner", "-loglevel", "error",
+        "-f", "lavfi", "-i", video_src.format(w=width, h=height, fps=FRAME_RATE, d=duration),
+        "-f", "lavfi", "-i", audio_src.format(d=duration),
+        "-t", str(duration),
+        # Intermedio casi sin pérdidas para que la entrada no condicione el resultado.
+        "-c:v", "libx264", "-preset", "ultrafast", "-crf", "10", "-pix_fmt", "yuv420p",
+        "-c:a", "aac", "-b:a", "192k", "-shortest", path,
+    ]
+    subprocess.run(command, check=True)
+    return path
+
+
+async def run_case(clip_path: str, path_name: str, outdir: str, clip_duration: float) -> dict:
+    config = json.loads(json.dumps(PATHS[path_name]))
+    task = {"_id": "benchmark", "file_type": "video", "processing_config": config}
+    base_name = f"{os.path.splitext(os.path.basename(clip_path))[0]}_{path_name}"
+    output_base = os.path.join(outdir, f"{base_name}.mp4")
+    watermark = WATERMARK_PATH if "watermark" in config else None
+
+    commands, output_path = build_ffmpeg_command(task, clip_path, output_base, watermark_path=watermark)
+    result = await run_ffmpeg(commands[0], duration=clip_duration)
+    if not result.ok:
+        return {"error": result.kill_reason or f"código {result.returncode}", "log": "".join(result.stderr_tail[-5:])}
+
+    processed = result.processed_seconds
+    wall = result.wall_time or 1e-9
+    produces_video = path_name != "extract_audio"
+    if path_name == "gif":
+        frame_rate = config["gif_options"]["fps"]
+    else:
+        frame_rate = FRAME_RATE
+    report = {
+        "wall_seconds": round(wall, 3),
+        "media_seconds": round(processed, 3),
+        "speed": round(processed / wall, 3),
+        "encode_fps": round(processed * frame_rate / wall, 2) if produces_video else None,
+        "output_size": os.path.getsize(output_path) if os.path.exists(output_path) else 0,
+        "cpu_seconds": round(result.cpu_time, 3),
+        "peak_rss_kb": result.max_rss_kb,
+    }
+    if os.path.exists(output_path):
+        os.remove(output_path)
+    return report
+
+
+def compare(report: dict, baseline: dict, threshold: float) -> list:
+    """Devuelve las métricas que empeoraron más que `threshold` respecto a la línea base."""
+    regressions = []
+    for case, metrics in report["results"].items():
+        base_metrics = baseline.get("results", {}).get(case)
+        if not base_metrics or "error" in metrics or "error" in base_metrics:
+            continue
+        for metric, worse_when in REGRESSION_RULES.items():
+            current, previous = metrics.get(metric), base_metrics.get(metric)
+            if not current or not previous:
+                continue
+            change = (current - previous) / previous
+            if (worse_when == "lower" and change < -threshold) or (worse_when == "higher" and change > threshold):
+                regressions.append({
+                    "case": case,
+                    "metric": metric,
+                    "baseline": previous,
+                    "current": current,
+                    "change_pct": round(change * 100, 1),
+                })
+    return regressions
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark de build_ffmpeg_command con clips sintéticos.")
+    parser.add_argument("--output", default="bench_report.json", help="Ruta del informe JSON.")
+    parser.add_argument("--baseline", help="Informe previo contra el que comparar.")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Variación relativa que se considera regresión (0.10 = 10%%).")
+    parser.add_argument("--duration", type=float, default=10.0, help="Duración en segundos de cada clip.")
+    parser.add_argument("--resolutions", nargs="+", default=list(RESOLUTIONS), choices=list(RESOLUTIONS))
+    parser.add_argument("--sources", nargs="+", default=list(SOURCES), choices=list(SOURCES))
+    parser.add_argument("--paths", nargs="+", default=list(PATHS), choices=list(PATHS))
+    parser.add_argument("--workdir", help="Directorio para los clips generados (se reutilizan entre ejecuciones).")
+    args = parser.parse_args()
+
+    if not shutil.which("ffmpeg"):
+        print("[ERROR] ffmpeg no está instalado o no está en el PATH.")
+        sys.exit(2)
+
+    workdir = args.workdir or os.path.join(tempfile.gettempdir(), "ffmpeg_bench_clips")
+    outdir = tempfile.mkdtemp(prefix="ffmpeg_bench_out_")
+    os.makedirs(workdir, exist_ok=True)
+
+    report = {
+        "meta": {
+            "created_at": datetime.utcnow().isoformat(),
+            "ffmpeg": ffmpeg_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "clip_duration": args.duration,
+            "frame_rate": FRAME_RATE,
+        },
+        "results": {},
+    }
+
+    try:
+        for source in args.sources:
+            for resolution in args.resolutions:
+                print(f"🎬 Generando clip {source} {resolution}...")
+                clip = generate_clip(workdir, source, resolution, args.duration)
+                for path_name in args.paths:
+                    case = f"{source}/{resolution}/{path_name}"
+                    metrics = await run_case(clip, path_name, outdir, args.duration)
+                    report["results"][case] = metrics
+                    if "error" in metrics:
+                        print(f"  ❌ {case}: {metrics['error']}")
+                    else:
+                        fps = metrics["encode_fps"] if metrics["encode_fps"] is not None else "-"
+                        print(
+                            f"  ✅ {case}: {fps} fps, x{metrics['speed']}, {metrics['output_size'] / 1024:.0f} KB, "
+                            f"CPU {metrics['cpu_seconds']}s, RSS {metrics['peak_rss_kb'] / 1024:.0f} MB"
+                        )
+    finally:
+        shutil.rmtree(outdir, ignore_errors=True)
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        report["regressions"] = regressions
+        if regressions:
+            exit_code = 1
+            print(f"\n⚠️ {len(regressions)} regresiones respecto a {args.baseline}:")
+            for item in regressions:
+                print(f"  - {item['case']} {item['metric']}: {item['baseline']} → {item['current']} ({item['change_pct']:+}%)")
+        else:
+            print(f"\n✅ Sin regresiones respecto a {args.baseline}.")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print(f"\n📄 Informe guardado en {args.output}")
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
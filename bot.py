@@ -9,11 +9,17 @@ from dotenv import load_dotenv
 load_dotenv()
 
 from pyrogram import Client
-from pyrogram.enums import ParseMode
 
 # Importar componentes de la aplicación DESPUÉS de cargar el .env
 from src.db.mongo_manager import db_instance
+from src.core.admin_manager import admin_manager
 from src.core.worker import worker_loop
+from src.db.archiver import task_archiver
+from src.core.peer_storage import seed_peers_from_dialogs
+from src.core.userbot_pool import userbot_pool
+from src.core.batch_ingest import batch_ingestor
+from src.core.channel_monitor import channel_monitor
+from src.core.dc_warmup import use_kept_media_sessions, warm_up_media_dcs
 
 # Configuración de logging mejorada para diagnóstico claro
 logging.basicConfig(
@@ -53,6 +59,13 @@ if missing_vars:
 # Definición de los plugins que el bot cargará
 PLUGINS = dict(root="src/plugins")
 
+async def _seed_userbot_peers(user_client: Client):
+    """Puebla el almacén de peers en la primera ejecución de la cuenta, sin retrasar el arranque."""
+    try:
+        await seed_peers_from_dialogs(user_client)
+    except Exception as e:
+        logger.warning(f"No se pudo inicializar el almacén de peers del userbot: {e}")
+
 # --- Punto de Entrada Principal ---
 async def main():
     """
@@ -63,9 +76,6 @@ async def main():
     user_client = None
     
     try:
-        # Ya hemos validado las variables de entorno al inicio
-        USERBOT_SESSION_STRING = os.getenv("USERBOT_SESSION_STRING")
-        
         # Cliente Bot
         app = Client(
             SESSION_NAME,
@@ -75,21 +85,19 @@ async def main():
             plugins=PLUGINS,
             workers=20
         )
+        # Las descargas reutilizan una sesión de medios por DC en lugar de abrir una por archivo
+        use_kept_media_sessions(app)
 
-        # Cliente UserBot para operaciones restringidas
-        user_client = Client(
-            name="user_bot",
-            api_id=int(API_ID),
-            api_hash=API_HASH,
-            session_string=USERBOT_SESSION_STRING,
-            parse_mode=ParseMode.HTML,
-            no_updates=True
-        )
+        # Cuentas UserBot para operaciones restringidas: USERBOT_SESSION_STRING es la principal y
+        # USERBOT_SESSION_STRINGS añade secundarias. Todas usan peers persistentes en la base de datos.
+        userbot_pool.build_clients(API_ID, API_HASH)
+        user_client = userbot_pool.primary.client
 
         # 1. Conectar y inicializar la base de datos
         logger.info("Iniciando conexión con la base de datos...")
         await db_instance.init_db()
         logger.info("Conexión con la base de datos establecida y índices asegurados.")
+        await admin_manager.start_ban_sync()
         
         # 2. Iniciar los clientes de Telegram
         logger.info("Iniciando clientes de Telegram...")
@@ -98,9 +106,9 @@ async def main():
         await app.start()
         logger.info("Bot iniciado correctamente")
         
-        # Intentar iniciar el userbot
-        await user_client.start()
-        logger.info("UserBot iniciado correctamente")
+        # Iniciar las cuentas del userbot
+        await userbot_pool.start()
+        logger.info(f"UserBot iniciado correctamente ({len(userbot_pool.accounts)} cuenta(s) en el pool)")
             
         # Health check y log de información
         bot_info = await app.get_me()
@@ -116,10 +124,35 @@ async def main():
     
         # Guardar el cliente de userbot en un lugar accesible
         app.user_client = user_client
+        for account in userbot_pool.accounts:
+            asyncio.create_task(_seed_userbot_peers(account.client))
         
+        # Sesiones de medios de los DCs más usados abiertas antes de la primera tarea
+        try:
+            await asyncio.wait_for(warm_up_media_dcs({
+                "bot": [app],
+                "userbot": [account.client for account in userbot_pool.accounts],
+            }), timeout=30)
+        except Exception as e:
+            logger.warning(f"Precalentamiento de DCs de medios incompleto: {e}")
+
+        # Ingestas por lotes que quedaron a medias: siguen desde su cursor
+        try:
+            await batch_ingestor.resume(app)
+        except Exception as e:
+            logger.warning(f"No se pudieron reanudar las ingestas por lotes: {e}")
+
+        # Canales monitoreados: updates de la cuenta principal y puesta al día desde last_message_id
+        try:
+            await channel_monitor.start()
+        except Exception as e:
+            logger.warning(f"No se pudo iniciar el monitoreo de canales: {e}")
+
         # 3. Iniciar el worker asíncrono que procesará las tareas en segundo plano
         logger.info("Iniciando el bucle del worker para procesar tareas...")
         worker_task = asyncio.create_task(worker_loop(app))
+        if db_instance.backend_name == "mongo":
+            asyncio.create_task(task_archiver.run())
         
         # 4. Mantener todo corriendo
         logger.info("¡El bot está en línea y listo para recibir tareas!")
@@ -130,13 +163,20 @@ async def main():
         raise
     finally:
         # Asegurar una detención limpia de los clientes
+        try:
+            await db_instance.flush_task_updates()
+            await db_instance.flush_user_activity()
+            await db_instance.flush_counters()
+        except Exception as e:
+            logger.error(f"Error vaciando las escrituras pendientes: {e}")
         try:
             if app and app.is_initialized:
                 logger.info("Deteniendo el bot...")
                 await app.stop()
-            if user_client and user_client.is_initialized:
+            if user_client:
+                await channel_monitor.stop()
                 logger.info("Deteniendo el userbot...")
-                await user_client.stop()
+                await userbot_pool.stop()
             logger.info("Clientes detenidos de forma segura.")
         except Exception as e:
             logger.error(f"Error al detener los clientes: {e}")
@@ -1,3 +1,4 @@
+import asyncio
 import logging
 from datetime import datetime
 from typing import Dict, List, Optional, Tuple
@@ -8,24 +9,51 @@ logger = logging.getLogger(__name__)
 class AdminManager:
     def __init__(self):
         self.db = db_instance
+        # Usuarios baneados en memoria: user_id -> ban_info. Evita ir a la DB en cada mensaje.
+        self._banned: Dict[int, Optional[Dict]] = {}
+        self._bans_loaded = False
+        self._ban_watch_task: Optional[asyncio.Task] = None
+
+    async def start_ban_sync(self):
+        """Carga los baneos con una consulta proyectada y los mantiene al día con un change stream."""
+        self._banned = await self.db.get_banned_users()
+        self._bans_loaded = True
+        logger.info(f"{len(self._banned)} usuarios baneados cargados en memoria.")
+        if self._ban_watch_task is None:
+            self._ban_watch_task = asyncio.create_task(self._watch_bans())
+
+    async def _watch_bans(self):
+        pipeline = [{"$match": {"$or": [
+            {"operationType": {"$in": ["insert", "replace", "delete"]}},
+            {"updateDescription.updatedFields.banned": {"$exists": True}},
+        ]}}]
+
+        async def _on_change(change: Dict):
+            user_id = change["documentKey"]["_id"]
+            document = change.get("fullDocument") or {}
+            if change["operationType"] != "delete" and document.get("banned"):
+                self._banned[user_id] = document.get("ban_info")
+            else:
+                self._banned.pop(user_id, None)
+
+        if not await self.db.watch_collection("user_settings", pipeline, _on_change, full_document="updateLookup"):
+            logger.warning("Sin change streams: los baneos hechos desde otros procesos no se verán hasta reiniciar.")
+
+    def is_banned(self, user_id: int) -> bool:
+        """Comprobación O(1) en memoria para el middleware."""
+        return user_id in self._banned
         
     async def ban_user(self, user_id: int, reason: str = None, admin_id: int = None) -> bool:
         """Banea a un usuario del bot."""
         try:
-            await self.db.user_settings.update_one(
-                {"_id": user_id},
-                {
-                    "$set": {
-                        "banned": True,
-                        "ban_info": {
-                            "reason": reason,
-                            "banned_by": admin_id,
-                            "banned_at": datetime.utcnow()
-                        }
-                    }
-                },
-                upsert=True
-            )
+            was_banned = user_id in self._banned
+            ban_info = {"reason": reason, "banned_by": admin_id, "banned_at": datetime.utcnow()}
+            created = await self.db.set_user_ban(user_id, ban_info)
+            self._banned[user_id] = ban_info
+            if created:
+                self.db.increment_counters(None, {"users_total": 1})
+            if not was_banned:
+                self.db.increment_counters(None, {"users_banned": 1})
             logger.info(f"Usuario {user_id} baneado por {admin_id}. Razón: {reason}")
             return True
         except Exception as e:
@@ -35,28 +63,25 @@ class AdminManager:
     async def unban_user(self, user_id: int, admin_id: int = None) -> bool:
         """Desbanea a un usuario del bot."""
         try:
-            result = await self.db.user_settings.update_one(
-                {"_id": user_id},
-                {
-                    "$set": {"banned": False},
-                    "$push": {
-                        "unban_history": {
-                            "unbanned_by": admin_id,
-                            "unbanned_at": datetime.utcnow()
-                        }
-                    }
-                }
-            )
+            was_banned = user_id in self._banned
+            modified = await self.db.clear_user_ban(user_id, admin_id)
+            self._banned.pop(user_id, None)
+            if was_banned:
+                self.db.increment_counters(None, {"users_banned": -1})
             logger.info(f"Usuario {user_id} desbaneado por {admin_id}")
-            return result.modified_count > 0
+            return modified
         except Exception as e:
             logger.error(f"Error al desbanear usuario {user_id}: {e}")
             return False
             
     async def is_user_banned(self, user_id: int) -> Tuple[bool, Optional[Dict]]:
         """Verifica si un usuario está baneado y retorna la información del ban."""
+        if self._bans_loaded:
+            if user_id in self._banned:
+                return True, self._banned[user_id]
+            return False, None
         try:
-            user_data = await self.db.user_settings.find_one({"_id": user_id})
+            user_data = await self.db.get_user_document(user_id)
             if user_data and user_data.get("banned", False):
                 return True, user_data.get("ban_info")
             return False, None
@@ -65,30 +90,21 @@ class AdminManager:
             return False, None
             
     async def get_user_stats(self) -> Dict:
-        """Obtiene estadísticas generales de usuarios."""
+        """Obtiene estadísticas generales de usuarios a partir de los documentos de contadores."""
         try:
-            stats = {
-                "total_users": await self.db.user_settings.count_documents({}),
-                "banned_users": await self.db.user_settings.count_documents({"banned": True}),
-                "active_today": await self.db.tasks.count_documents({
-                    "created_at": {"$gte": datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)}
-                }),
-                "total_tasks": await self.db.tasks.count_documents({}),
-                "tasks_completed": await self.db.tasks.count_documents({"status": "done"}),
-                "tasks_failed": await self.db.tasks.count_documents({"status": "error"}),
-                "monitored_channels": await self.db.monitored_channels.count_documents({"active": True})
+            counters = await self.db.get_counters("global")
+            today = await self.db.get_counters(f"daily:{datetime.utcnow():%Y-%m-%d}")
+            return {
+                "total_users": counters.get("users_total", 0),
+                "banned_users": counters.get("users_banned", 0),
+                "active_today": today.get("tasks_created", 0),
+                "total_tasks": counters.get("tasks_created", 0),
+                "tasks_completed": counters.get("tasks_done", 0),
+                "tasks_failed": counters.get("tasks_error", 0),
+                "monitored_channels": counters.get("monitored_channels", 0),
+                # Usuarios más activos (top 5)
+                "top_users": await self.db.get_top_users_by_tasks(5),
             }
-            
-            # Usuarios más activos (top 5)
-            top_users = await self.db.tasks.aggregate([
-                {"$group": {"_id": "$user_id", "total": {"$sum": 1}}},
-                {"$sort": {"total": -1}},
-                {"$limit": 5}
-            ]).to_list(length=5)
-            
-            stats["top_users"] = top_users
-            
-            return stats
         except Exception as e:
             logger.error(f"Error al obtener estadísticas: {e}")
             return {}
@@ -96,14 +112,13 @@ class AdminManager:
     async def get_user_details(self, user_id: int) -> Dict:
         """Obtiene detalles específicos de un usuario."""
         try:
-            user_data = await self.db.user_settings.find_one({"_id": user_id}) or {}
+            user_data = await self.db.get_user_document(user_id) or {}
+            counters = await self.db.get_counters(f"user:{user_id}")
             user_stats = {
-                "total_tasks": await self.db.tasks.count_documents({"user_id": user_id}),
-                "completed_tasks": await self.db.tasks.count_documents({"user_id": user_id, "status": "done"}),
-                "failed_tasks": await self.db.tasks.count_documents({"user_id": user_id, "status": "error"}),
-                "monitored_channels": await self.db.monitored_channels.count_documents(
-                    {"user_id": user_id, "active": True}
-                ),
+                "total_tasks": counters.get("tasks_created", 0),
+                "completed_tasks": counters.get("tasks_done", 0),
+                "failed_tasks": counters.get("tasks_error", 0),
+                "monitored_channels": counters.get("monitored_channels", 0),
                 "first_seen": user_data.get("created_at", datetime.utcnow()),
                 "last_active": user_data.get("last_active", datetime.utcnow()),
                 "banned": user_data.get("banned", False),
@@ -113,4 +128,7 @@ class AdminManager:
             return user_stats
         except Exception as e:
             logger.error(f"Error al obtener detalles del usuario {user_id}: {e}")
-            return {}
\ No newline at end of file
+            return {}
+
+# Instancia singleton para ser usada en todo el proyecto.
+admin_manager = AdminManager()
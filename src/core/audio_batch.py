@@ -0,0 +1,49 @@
+# --- START OF FILE src/core/audio_batch.py ---
+
+import asyncio
+import logging
+import os
+from typing import List, Optional
+
+from src.core.ffmpeg_supervisor import FFmpegRunResult, run_ffmpeg
+
+logger = logging.getLogger(__name__)
+
+# Trabajos de audio por copia de flujos (etiquetas, carátula, extracción) que corren a la vez.
+AUDIO_POOL_WORKERS = int(os.getenv("AUDIO_POOL_WORKERS", "2"))
+# Un trabajo de copia de flujos tarda segundos; si supera este límite se mata.
+AUDIO_JOB_TIMEOUT = float(os.getenv("AUDIO_JOB_TIMEOUT", "300"))
+
+_CODEC_OPTIONS = ("-c", "-codec", "-c:a", "-codec:a", "-acodec", "-c:v", "-codec:v", "-vcodec")
+
+
+def is_stream_copy(command: List[str]) -> bool:
+    """True si todos los códecs del comando son `copy` (no hay recodificación)."""
+    codecs = [command[i + 1] for i, arg in enumerate(command[:-1]) if arg in _CODEC_OPTIONS]
+    return bool(codecs) and all(codec == "copy" for codec in codecs)
+
+
+class AudioBatchProcessor:
+    """
+    Cola acotada para los trabajos de audio sin recodificación. Varias tareas de audio se
+    ejecutan en paralelo, como mucho AUDIO_POOL_WORKERS, bajo el supervisor de FFmpeg (prioridad,
+    cancelación y contabilidad de recursos) sin bloquear el bucle de eventos del bot.
+    """
+
+    def __init__(self, max_workers: int = AUDIO_POOL_WORKERS):
+        self.max_workers = max_workers
+        self._slots = asyncio.Semaphore(max_workers)
+
+    async def submit(self, command: List[str], cancel_token=None,
+                     timeout: float = AUDIO_JOB_TIMEOUT) -> FFmpegRunResult:
+        """
+        Ejecuta un trabajo cuando hay hueco. `timeout` solo se aplica a las copias de flujos: un
+        comando que recodifica usa el techo normal del supervisor.
+        """
+        wall_limit: Optional[float] = timeout if is_stream_copy(command) else None
+        async with self._slots:
+            return await run_ffmpeg(command, cancel_token=cancel_token, wall_limit=wall_limit)
+
+
+# Instancia singleton para ser usada en todo el proyecto.
+audio_batch = AudioBatchProcessor()
@@ -0,0 +1,279 @@
+# --- START OF FILE src/core/batch_ingest.py ---
+
+import asyncio
+import logging
+import os
+import re
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple, Union
+from urllib.parse import parse_qs
+
+from pyrogram import Client
+from pyrogram.errors import FloodWait
+
+from src.core.userbot_pool import userbot_pool, UserbotAccount
+from src.db.backend import build_task_document
+from src.db.mongo_manager import db_instance
+from src.helpers.metrics import metrics
+from src.helpers.outbound import outbound, PRIORITY_STATUS
+from src.helpers.peer_cache import peer_cache
+from src.helpers.utils import escape_html
+
+logger = logging.getLogger(__name__)
+
+# Ids por llamada a get_messages (Telegram no acepta más de 200 por petición).
+BATCH_FETCH_SIZE = max(1, min(int(os.getenv("BATCH_FETCH_SIZE", "200")), 200))
+# Mensajes que puede recorrer una sola ingesta (evita recorrer un canal enorme por un enlace mal escrito).
+BATCH_MAX_MESSAGES = int(os.getenv("BATCH_MAX_MESSAGES", "20000"))
+
+BATCH_TASK_TYPE = "batch_ingest"
+BATCH_STATUS = "ingesting"
+
+ChatRef = Union[int, str]
+
+# t.me/c/123/100-250, t.me/canal/100-250, t.me/canal/100- (hasta el último) y t.me/canal/all (todo),
+# con límites de fecha opcionales: ?desde=2024-01-01&hasta=2024-03-31
+_BATCH_LINK = re.compile(
+    r"t\.me/(?:c/(?P<internal>\d+)|(?P<username>[A-Za-z]\w{3,}))/"
+    r"(?:(?P<start>\d+)-(?P<end>\d*)|(?P<all>all|todo))/?(?:\?(?P<query>\S*))?$"
+)
+
+# (atributo del mensaje, file_type de la tarea, extensión por defecto)
+_MEDIA_KINDS = (
+    ("video", "video", ".mp4"),
+    ("animation", "video", ".mp4"),
+    ("audio", "audio", ".mp3"),
+    ("voice", "audio", ".ogg"),
+    ("document", "document", ""),
+)
+
+
+@dataclass
+class BatchSpec:
+    """Mensajes a ingerir de un chat: rango de ids y/o ventana de fechas [since, until)."""
+    chat_ref: ChatRef
+    start_id: Optional[int] = None
+    end_id: Optional[int] = None
+    since: Optional[datetime] = None
+    until: Optional[datetime] = None
+
+
+def _parse_day(value: str) -> datetime:
+    return datetime.strptime(value.strip(), "%Y-%m-%d")
+
+
+def parse_batch_link(url: str) -> Optional[BatchSpec]:
+    """Interpreta un enlace de rango o de chat completo. Devuelve None si es un enlace normal."""
+    match = _BATCH_LINK.search(url.strip())
+    if not match:
+        return None
+    chat_ref: ChatRef = int(f"-100{match['internal']}") if match["internal"] else match["username"]
+    spec = BatchSpec(chat_ref)
+    if match["start"]:
+        spec.start_id = int(match["start"])
+        spec.end_id = int(match["end"]) if match["end"] else None
+        if spec.end_id is not None and spec.end_id < spec.start_id:
+            spec.start_id, spec.end_id = spec.end_id, spec.start_id
+    query = parse_qs(match["query"] or "")
+    try:
+        if since := (query.get("desde") or query.get("since")):
+            spec.since = _parse_day(since[0])
+        if until := (query.get("hasta") or query.get("until")):
+            spec.until = _parse_day(until[0]) + timedelta(days=1)  # el día indicado se incluye
+    except ValueError:
+        raise ValueError("Las fechas deben tener el formato AAAA-MM-DD.")
+    return spec
+
+
+async def _last_id_before(client: Client, chat_id: int, before: Optional[datetime] = None) -> int:
+    """Id del último mensaje del chat anterior a `before` (o del último, sin fecha). 0 si no hay."""
+    kwargs = {"offset_date": before} if before else {}
+    async for message in client.get_chat_history(chat_id, limit=1, **kwargs):
+        return message.id
+    return 0
+
+
+async def resolve_bounds(client: Client, chat_id: int, spec: BatchSpec) -> Tuple[int, int]:
+    """
+    Convierte la especificación en un rango de ids cerrado. Las fechas se traducen a ids con una
+    sola consulta al historial cada una, así el recorrido posterior va siempre por lotes de ids.
+    """
+    start_id = spec.start_id
+    if start_id is None:
+        start_id = (await _last_id_before(client, chat_id, spec.since) + 1) if spec.since else 1
+    end_id = spec.end_id
+    if end_id is None:
+        end_id = await _last_id_before(client, chat_id, spec.until)
+    return start_id, end_id
+
+
+def task_from_message(user_id: int, message, batch_id: str, join_ref: Optional[str] = None) -> Optional[Dict]:
+    """Documento de tarea pendiente para un mensaje con medio; None si no tiene un medio procesable."""
+    if message is None or getattr(message, "empty", False):
+        return None
+    for attr, file_type, default_ext in _MEDIA_KINDS:
+        media = getattr(message, attr, None)
+        if media is not None:
+            break
+    else:
+        return None
+    file_name = getattr(media, "file_name", None) or f"{attr}_{message.id}{default_ext}"
+    metadata = {
+        "size": getattr(media, "file_size", 0) or 0,
+        "duration": getattr(media, "duration", 0) or 0,
+        "width": getattr(media, "width", 0) or 0,
+        "height": getattr(media, "height", 0) or 0,
+        "mime_type": getattr(media, "mime_type", None),
+    }
+    return build_task_document(user_id, file_type, file_name, metadata=metadata, custom_fields={
+        # Sin file_id: el file_id del userbot no sirve al bot, el worker descarga desde el mensaje.
+        "source": {"chat_id": message.chat.id, "message_id": message.id, "join_ref": join_ref},
+        "batch_id": batch_id,
+        "dedupe_key": f"{batch_id}:{message.chat.id}:{message.id}",
+    })
+
+
+def _in_window(message, since: Optional[datetime], until: Optional[datetime]) -> bool:
+    date = getattr(message, "date", None)
+    if date is None:
+        return since is None and until is None
+    date = date.replace(tzinfo=None)
+    return (since is None or date >= since) and (until is None or date < until)
+
+
+class BatchIngestor:
+    """
+    Ingesta de rangos de mensajes y chats completos como tareas pendientes.
+    Cada ingesta es un documento `batch_ingest` en estado `ingesting` con su cursor (siguiente id
+    a leer), sin ordinal de /p ni contadores de tareas. Los mensajes se piden de BATCH_FETCH_SIZE
+    en BATCH_FETCH_SIZE, cada página se inserta con un único add_tasks y el cursor se guarda
+    después. Al reiniciar se reanudan desde el cursor; la dedupe_key de cada tarea evita duplicar
+    la página que estuviera a medias.
+    """
+
+    def __init__(self):
+        self._jobs: Dict[str, asyncio.Task] = {}
+
+    async def start(self, bot: Client, user_id: int, spec: BatchSpec, status_message) -> Dict:
+        """Resuelve el chat y el rango, crea la tarea de ingesta y la lanza en segundo plano."""
+        join_ref = spec.chat_ref if isinstance(spec.chat_ref, str) else None
+        account = await userbot_pool.pick(spec.chat_ref, join_ref=join_ref)
+        chat = await peer_cache.get_chat(account.client, spec.chat_ref)
+        start_id, end_id = await resolve_bounds(account.client, chat.id, spec)
+        if end_id < start_id:
+            raise ValueError("No hay mensajes en el rango indicado.")
+        if end_id - start_id + 1 > BATCH_MAX_MESSAGES:
+            raise ValueError(f"El rango abarca {end_id - start_id + 1} mensajes; el máximo por lote es {BATCH_MAX_MESSAGES}.")
+
+        job = build_task_document(user_id, BATCH_TASK_TYPE, f"Lote de {chat.title or chat.id}", status=BATCH_STATUS,
+                                  custom_fields={
+                                      "batch": {
+                                          "chat_id": chat.id, "chat_title": chat.title, "join_ref": join_ref,
+                                          "start_id": start_id, "end_id": end_id, "cursor": start_id,
+                                          "since": spec.since, "until": spec.until,
+                                          "scanned": 0, "created": 0,
+                                      },
+                                      "status_message": {"chat_id": status_message.chat.id, "message_id": status_message.id},
+                                  })
+        job_id = await db_instance.add_job_document(job)
+        job["_id"] = job_id
+        self.launch(bot, job)
+        return job
+
+    def launch(self, bot: Client, job: Dict) -> asyncio.Task:
+        job_id = str(job["_id"])
+        running = self._jobs.get(job_id)
+        if running is not None and not running.done():
+            return running
+        task = asyncio.create_task(self._run(bot, job))
+        self._jobs[job_id] = task
+        task.add_done_callback(lambda _: self._jobs.pop(job_id, None))
+        return task
+
+    async def resume(self, bot: Client) -> int:
+        """Relanza las ingestas que quedaron a medias en la ejecución anterior."""
+        jobs = await db_instance.get_tasks_by_status(BATCH_STATUS, limit=1000)
+        for job in jobs:
+            self.launch(bot, job)
+        if jobs:
+            logger.info(f"[BATCH] {len(jobs)} ingesta(s) por lotes reanudada(s) desde su cursor.")
+        return len(jobs)
+
+    # --- Internos ---
+
+    async def _notify(self, bot: Client, job: Dict, text: str, wait: bool = False):
+        """Edita el mensaje de estado de la ingesta; solo se espera la entrega del mensaje final."""
+        target = job.get("status_message")
+        if not target:
+            return
+        delivery = outbound.edit(bot, target["chat_id"], target["message_id"], text, priority=PRIORITY_STATUS)
+        if wait:
+            await delivery
+
+    @staticmethod
+    def _progress_text(batch: Dict) -> str:
+        total = batch["end_id"] - batch["start_id"] + 1
+        return (
+            f"📦 <b>Importando lote de {batch.get('chat_title') or batch['chat_id']}</b>\n"
+            f"Mensajes revisados: {batch['scanned']}/{total}\n"
+            f"Archivos añadidos al panel: {batch['created']}"
+        )
+
+    async def _fetch_page(self, account: UserbotAccount, batch: Dict, ids: List[int]) -> Tuple[List, UserbotAccount]:
+        """get_messages de una página; ante FloodWait sigue con otra cuenta o espera a que pase."""
+        while True:
+            try:
+                messages = await account.client.get_messages(batch["chat_id"], ids)
+                metrics.inc("batch.get_messages")
+                return (messages if isinstance(messages, list) else [messages]), account
+            except FloodWait as e:
+                userbot_pool.report_flood(account, e.value)
+                account = await userbot_pool.pick(batch["chat_id"], batch.get("join_ref"), exclude=[account])
+                if account.throttled:
+                    await asyncio.sleep(max(account.flood_until - time.monotonic(), 1))
+
+    async def _run(self, bot: Client, job: Dict):
+        job_id, user_id, batch = str(job["_id"]), job["user_id"], job["batch"]
+        try:
+            account = await userbot_pool.pick(batch["chat_id"], batch.get("join_ref"))
+            while batch["cursor"] <= batch["end_id"]:
+                ids = list(range(batch["cursor"], min(batch["cursor"] + BATCH_FETCH_SIZE, batch["end_id"] + 1)))
+                messages, account = await self._fetch_page(account, batch, ids)
+                docs = [doc for message in messages
+                        if message is not None and _in_window(message, batch.get("since"), batch.get("until"))
+                        and (doc := task_from_message(user_id, message, job_id, batch.get("join_ref")))]
+                if docs:
+                    batch["created"] += len(await db_instance.add_tasks(docs))
+                batch["scanned"] += len(ids)
+                batch["cursor"] = ids[-1] + 1
+                await db_instance.update_task_fields(job_id, {
+                    "batch.cursor": batch["cursor"], "batch.scanned": batch["scanned"], "batch.created": batch["created"]
+                })
+                # El cursor se escribe ya, no en el write-behind: si el proceso cae, se reanuda desde aquí.
+                await db_instance.flush_task_updates(job_id)
+                await self._notify(bot, job, self._progress_text(batch))
+
+            await db_instance.update_task_fields(job_id, {"status": "done"})
+            metrics.inc("batch.jobs_done")
+            logger.info(f"[BATCH] Ingesta {job_id} terminada: {batch['created']} tareas de {batch['scanned']} mensajes.")
+            await self._notify(bot, job, (
+                f"✅ <b>Lote importado</b>\n"
+                f"Mensajes revisados: {batch['scanned']}\n"
+                f"Archivos añadidos al panel: {batch['created']}\n\n"
+                f"Usa /panel para configurarlos y procesarlos."
+            ), wait=True)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"[BATCH] Ingesta {job_id} detenida en el mensaje {batch['cursor']}: {e}", exc_info=True)
+            await db_instance.update_task_fields(job_id, {"status": "error", "last_error": str(e)})
+            try:
+                await self._notify(bot, job, f"❌ <b>La importación del lote se detuvo</b>\n<code>{escape_html(str(e))}</code>", wait=True)
+            except Exception:
+                pass
+
+
+# Instancia singleton para ser usada en todo el proyecto.
+batch_ingestor = BatchIngestor()
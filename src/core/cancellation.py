@@ -0,0 +1,162 @@
+# --- START OF FILE src/core/cancellation.py ---
+
+import asyncio
+import logging
+import os
+from typing import Callable, Dict, List, Optional
+
+from src.core.exceptions import TaskCancelledError
+
+logger = logging.getLogger(__name__)
+
+# Segundos que se le dan a FFmpeg para terminar limpiamente antes de matarlo.
+FFMPEG_TERMINATE_GRACE = float(os.getenv("FFMPEG_TERMINATE_GRACE", "5"))
+# Intervalo del sondeo de respaldo cuando la DB no soporta change streams.
+CANCEL_POLL_INTERVAL = float(os.getenv("CANCEL_POLL_INTERVAL", "1"))
+
+
+async def terminate_process(process, grace: float = FFMPEG_TERMINATE_GRACE):
+    """Termina un subproceso asyncio con SIGTERM y lo mata si no sale a tiempo."""
+    if process.returncode is not None:
+        return
+    try:
+        process.terminate()
+    except ProcessLookupError:
+        return
+    try:
+        await asyncio.wait_for(process.wait(), timeout=grace)
+    except asyncio.TimeoutError:
+        logger.warning(f"El proceso {process.pid} no respondió a SIGTERM en {grace}s. Forzando kill.")
+        try:
+            process.kill()
+        except ProcessLookupError:
+            return
+        await process.wait()
+
+
+class CancellationToken:
+    """
+    Token de cancelación cooperativa de una tarea.
+    Lo consultan los callbacks de progreso de Pyrogram (para llamar a stop_transmission)
+    y mantiene registrados los subprocesos de FFmpeg para terminarlos al cancelar.
+    """
+
+    def __init__(self, task_id: str):
+        self.task_id = task_id
+        self.reason: Optional[str] = None
+        self._event = asyncio.Event()
+        self._processes: set = set()
+        self._callbacks: List[Callable[[], None]] = []
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason: str = "Cancelada por el usuario"):
+        """Marca el token como cancelado y detiene los subprocesos asociados."""
+        if self.cancelled:
+            return
+        self.reason = reason
+        self._event.set()
+        logger.info(f"[CANCEL] Tarea {self.task_id} cancelada: {reason}")
+        for process in list(self._processes):
+            asyncio.create_task(terminate_process(process))
+        for callback in list(self._callbacks):
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Error en callback de cancelación de la tarea {self.task_id}: {e}")
+
+    def attach_process(self, process):
+        """Asocia un subproceso al token. Si ya estaba cancelado, se termina de inmediato."""
+        self._processes.add(process)
+        if self.cancelled:
+            asyncio.create_task(terminate_process(process))
+
+    def detach_process(self, process):
+        self._processes.discard(process)
+
+    def add_callback(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """Registra un callback síncrono que se ejecuta al cancelar. Devuelve la función para quitarlo."""
+        self._callbacks.append(callback)
+        if self.cancelled:
+            callback()
+        return lambda: self._callbacks.remove(callback) if callback in self._callbacks else None
+
+    def stop_transmission_if_cancelled(self, client):
+        """Para usar dentro de un callback de progreso de Pyrogram: aborta la transferencia."""
+        if self.cancelled:
+            client.stop_transmission()
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise TaskCancelledError(self.reason or "Tarea cancelada.")
+
+    async def wait(self):
+        await self._event.wait()
+
+
+class CancellationRegistry:
+    """Registro en proceso de los tokens de las tareas activas, indexado por task_id."""
+
+    def __init__(self):
+        self._tokens: Dict[str, CancellationToken] = {}
+
+    def create(self, task_id: str) -> CancellationToken:
+        token = self._tokens.get(task_id)
+        if token is None:
+            token = CancellationToken(task_id)
+            self._tokens[task_id] = token
+        return token
+
+    def get(self, task_id: str) -> Optional[CancellationToken]:
+        return self._tokens.get(task_id)
+
+    def release(self, task_id: str):
+        self._tokens.pop(task_id, None)
+
+    def cancel(self, task_id: str, reason: str = "Cancelada por el usuario") -> bool:
+        """Señal en proceso: cancela la tarea si se está ejecutando en este proceso."""
+        token = self._tokens.get(task_id)
+        if not token:
+            return False
+        token.cancel(reason)
+        return True
+
+    def active_task_ids(self) -> List[str]:
+        return [task_id for task_id, token in self._tokens.items() if not token.cancelled]
+
+    async def watch_database(self):
+        """
+        Propaga a los tokens locales los cambios de estado a 'cancelled' hechos en la DB
+        (por ejemplo desde otro proceso del bot). Usa un change stream y, si el servidor
+        no lo soporta, recurre a un sondeo de las tareas activas cada CANCEL_POLL_INTERVAL.
+        """
+        from src.db.mongo_manager import db_instance
+
+        pipeline = [{"$match": {
+            "operationType": "update",
+            "updateDescription.updatedFields.status": "cancelled"
+        }}]
+
+        async def _on_change(change: Dict):
+            self.cancel(str(change["documentKey"]["_id"]), "Cancelada desde la base de datos")
+
+        watching = await db_instance.watch_collection("tasks", pipeline, _on_change)
+        if watching:
+            return
+
+        logger.info("[CANCEL] Change streams no disponibles. Usando sondeo de cancelaciones.")
+        while True:
+            try:
+                task_ids = self.active_task_ids()
+                if task_ids:
+                    for task_id in await db_instance.get_cancelled_task_ids(task_ids):
+                        self.cancel(task_id, "Cancelada desde la base de datos")
+            except Exception as e:
+                logger.error(f"[CANCEL] Error sondeando cancelaciones: {e}")
+            await asyncio.sleep(CANCEL_POLL_INTERVAL)
+
+
+# Instancia singleton para ser usada en todo el proyecto.
+cancellation_registry = CancellationRegistry()
@@ -11,6 +11,8 @@ from pyrogram.errors import (
     UserAlreadyParticipant, ChannelPrivate
 )
 
+from src.helpers.peer_cache import peer_cache
+
 logger = logging.getLogger(__name__)
 
 class ChannelJoiner:
@@ -34,7 +36,7 @@ class ChannelJoiner:
 
             # Intentar obtener info del chat primero
             try:
-                chat = await client.get_chat(channel_identifier)
+                chat = await peer_cache.get_chat(client, channel_identifier)
             except Exception as e:
                 logger.warning(f"Error al obtener info del chat {channel_identifier}: {e}")
                 chat = None
@@ -42,7 +44,7 @@ class ChannelJoiner:
             if chat:
                 # Verificar si ya somos miembros
                 try:
-                    member = await client.get_chat_member(chat.id, "me")
+                    member = await peer_cache.get_chat_member(client, chat.id, "me")
                     if member and not member.status.name == "LEFT":
                         return True, "✅ Ya eres miembro del canal", chat
                 except Exception:
@@ -55,6 +57,7 @@ class ChannelJoiner:
                         chat = await client.join_chat(channel_identifier)
                     else:
                         await client.join_chat(chat.id)
+                    peer_cache.invalidate_chat(client, chat.id)
                     
                     self._update_join_attempt(channel_identifier)
                     return True, "✅ Unido exitosamente al canal", chat
@@ -1,126 +1,346 @@
-from pyrogram import Client
-from typing import List, Dict, Optional
+# --- START OF FILE src/core/channel_monitor.py ---
+
 import asyncio
 import logging
-from datetime import datetime
-from ..db.mongo_manager import MongoManager
-from .exceptions import ChannelMonitorError
-from .worker import Worker
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
+
+from pyrogram import Client, filters
+from pyrogram.errors import FloodWait
+from pyrogram.handlers import DisconnectHandler, MessageHandler
+
+from src.core.batch_ingest import BATCH_FETCH_SIZE, task_from_message
+from src.core.userbot_pool import userbot_pool, UserbotAccount
+from src.db.mongo_manager import db_instance
+from src.helpers.metrics import metrics
+from src.helpers.peer_cache import peer_cache
 
 logger = logging.getLogger(__name__)
 
+# Canales que se rellenan a la vez (cada relleno pide páginas de BATCH_FETCH_SIZE mensajes).
+CHANNEL_BACKFILL_CONCURRENCY = int(os.getenv("CHANNEL_BACKFILL_CONCURRENCY", "3"))
+# Pausa base entre páginas de relleno (segundos); crece con cada FloodWait y vuelve a bajar poco a poco.
+CHANNEL_BACKFILL_PAGE_DELAY = float(os.getenv("CHANNEL_BACKFILL_PAGE_DELAY", "1"))
+# Pausa máxima entre páginas de relleno (segundos).
+CHANNEL_BACKFILL_MAX_DELAY = float(os.getenv("CHANNEL_BACKFILL_MAX_DELAY", "60"))
+# Cada cuánto se guarda last_message_id de un canal con actividad (segundos).
+CHANNEL_CHECKPOINT_INTERVAL = float(os.getenv("CHANNEL_CHECKPOINT_INTERVAL", "5"))
+# Espera tras una desconexión antes de resincronizar los canales (segundos).
+CHANNEL_RESYNC_DELAY = float(os.getenv("CHANNEL_RESYNC_DELAY", "10"))
+
+# Grupo propio para no interferir con otros handlers del userbot.
+MONITOR_HANDLER_GROUP = 10
+
+
+@dataclass
+class MonitoredChannel:
+    """
+    Estado en memoria de un canal: quién lo monitorea, hasta qué mensaje se ha ingerido sin huecos
+    (last_message_id, el cursor) y el mayor id visto o conocido (high_water).
+    """
+    channel_id: int
+    user_ids: Set[int] = field(default_factory=set)
+    last_message_id: int = 0
+    high_water: int = 0
+    backfill: Optional[asyncio.Task] = None
+    persisted_id: int = 0
+    persisted_at: float = 0.0
+
+
 class ChannelMonitor:
-    def __init__(self, client: Client, mongo: MongoManager, worker: Worker):
-        self.client = client
-        self.mongo = mongo
-        self.worker = worker
-        self.monitoring_tasks: Dict[int, asyncio.Task] = {}
-        
-    async def add_monitored_channel(self, channel_id: int, user_id: int) -> bool:
-        """Añade un canal para monitoreo continuo"""
+    """
+    Monitoreo de canales por updates de la cuenta userbot principal. Un MessageHandler filtrado
+    por el conjunto de canales monitoreados convierte cada post con medio en una tarea pendiente
+    de cada usuario suscrito, en cuanto llega.
+
+    last_message_id es un cursor: solo avanza sobre mensajes contiguos ya ingeridos y se guarda
+    tras cada página. Si un post salta por encima del cursor, o tras una reconexión o un reinicio,
+    un relleno pide hacia delante desde el cursor hasta el último id conocido, sin descartar nada.
+    Los rellenos de distintos canales comparten CHANNEL_BACKFILL_CONCURRENCY huecos y una pausa
+    entre páginas que se adapta a los FloodWait recibidos.
+    """
+
+    def __init__(self):
+        self._channels: Dict[int, MonitoredChannel] = {}
+        self._client: Optional[Client] = None
+        self._handlers: list = []
+        self._resync: Optional[asyncio.Task] = None
+        self._backfill_slots = asyncio.Semaphore(CHANNEL_BACKFILL_CONCURRENCY)
+        self._page_delay = CHANNEL_BACKFILL_PAGE_DELAY
+
+    # --- Ciclo de vida ---
+
+    async def start(self) -> int:
+        """Carga los canales activos, registra los handlers en la cuenta principal y se pone al día."""
+        account = userbot_pool.primary
+        if account is None:
+            return 0
+        self._client = account.client
+        for doc in await db_instance.get_active_monitored_channels():
+            channel = self._channels.setdefault(doc["channel_id"], MonitoredChannel(doc["channel_id"]))
+            channel.user_ids.add(doc["user_id"])
+            channel.last_message_id = max(channel.last_message_id, doc.get("last_message_id") or 0)
+            channel.persisted_id = channel.high_water = channel.last_message_id
+
+        monitored = filters.create(lambda _, __, message: message.chat is not None and message.chat.id in self._channels)
+        self._handlers = [
+            (MessageHandler(self._on_message, monitored & filters.channel), MONITOR_HANDLER_GROUP),
+            (DisconnectHandler(self._on_disconnect), MONITOR_HANDLER_GROUP),
+        ]
+        for handler, group in self._handlers:
+            self._client.add_handler(handler, group)
+        metrics.set_gauge("monitor.channels", len(self._channels))
+        logger.info(f"[MONITOR] {len(self._channels)} canal(es) monitoreado(s) por updates de {account.name}.")
+
+        self._resync = asyncio.create_task(self.resync())
+        return len(self._channels)
+
+    async def stop(self):
+        if self._resync is not None:
+            self._resync.cancel()
+        backfills = [channel.backfill for channel in self._channels.values() if channel.backfill is not None]
+        for task in backfills:
+            task.cancel()
+        await asyncio.gather(*backfills, return_exceptions=True)
+        if self._client is not None:
+            for handler, group in self._handlers:
+                try:
+                    self._client.remove_handler(handler, group)
+                except Exception:
+                    pass
+        self._handlers = []
+        for channel in self._channels.values():
+            await self._checkpoint(channel, force=True)
+
+    # --- Alta y baja ---
+
+    async def add_monitored_channel(self, channel_id: int, user_id: int, join_ref: Optional[str] = None) -> bool:
+        """
+        Empieza a monitorear un canal para un usuario. La cuenta principal tiene que ser miembro
+        (recibe los updates); si no lo es y hay `join_ref`, se une. Solo se ingieren los posts
+        nuevos: el punto de partida es el último mensaje actual del canal.
+        """
+        account = userbot_pool.primary
+        if account is None:
+            return False
         try:
-            # Verificar si ya existe
-            if await self.mongo.is_channel_monitored(channel_id, user_id):
+            if await db_instance.is_channel_monitored(channel_id, user_id):
                 return False
-                
-            # Intentar unirse al canal si no está unido
-            try:
-                chat = await self.client.get_chat(channel_id)
-                if not chat.is_restricted:
+            if not await userbot_pool.is_member(account, channel_id):
+                if not join_ref or not await userbot_pool.join(account, join_ref):
+                    logger.warning(f"[MONITOR] La cuenta principal no es miembro del canal {channel_id}.")
                     return False
-            except Exception as e:
-                logger.error(f"Error al verificar canal {channel_id}: {str(e)}")
+            if not await db_instance.add_monitored_channel(channel_id, user_id):
                 return False
-                
-            # Registrar en la base de datos
-            await self.mongo.add_monitored_channel(channel_id, user_id)
-            
-            # Iniciar tarea de monitoreo
-            self.start_monitoring(channel_id, user_id)
+
+            channel = self._channels.get(channel_id)
+            if channel is None:
+                channel = MonitoredChannel(channel_id)
+                channel.last_message_id = channel.high_water = await self._top_message_id(account.client, channel_id)
+                self._channels[channel_id] = channel
+            channel.user_ids.add(user_id)
+            await self._checkpoint(channel, force=True)
+            metrics.set_gauge("monitor.channels", len(self._channels))
             return True
-            
         except Exception as e:
             logger.error(f"Error al añadir canal monitoreado: {str(e)}")
             return False
-            
-    def start_monitoring(self, channel_id: int, user_id: int):
-        """Inicia el monitoreo de un canal"""
-        if channel_id not in self.monitoring_tasks:
-            task = asyncio.create_task(self._monitor_channel(channel_id, user_id))
-            self.monitoring_tasks[channel_id] = task
-            
-    async def stop_monitoring(self, channel_id: int):
-        """Detiene el monitoreo de un canal"""
-        if channel_id in self.monitoring_tasks:
-            self.monitoring_tasks[channel_id].cancel()
-            del self.monitoring_tasks[channel_id]
-            
-    async def _monitor_channel(self, channel_id: int, user_id: int):
-        """Monitorea un canal continuamente"""
-        last_message_id = 0
-        while True:
-            try:
-                # Obtener últimos mensajes
-                messages = await self.client.get_chat_history(
-                    chat_id=channel_id,
-                    limit=100,
-                    offset_id=last_message_id
-                )
-                
-                for message in messages:
-                    if message.id > last_message_id:
-                        last_message_id = message.id
-                        
-                        # Procesar si contiene media
-                        if message.media:
-                            await self.worker.process_restricted_media(
-                                message,
-                                user_id,
-                                is_monitored=True
-                            )
-                
-                # Esperar intervalo antes de siguiente check
-                await asyncio.sleep(300)  # 5 minutos
-                
-            except Exception as e:
-                logger.error(f"Error monitoreando canal {channel_id}: {str(e)}")
-                await asyncio.sleep(600)  # 10 minutos en caso de error
-                
+
+    async def remove_monitored_channel(self, channel_id: int, user_id: int) -> bool:
+        """Elimina un canal de monitoreo"""
+        try:
+            removed = await db_instance.remove_monitored_channel(channel_id, user_id)
+            channel = self._channels.get(channel_id)
+            if channel is not None:
+                channel.user_ids.discard(user_id)
+                if not channel.user_ids:
+                    if channel.backfill is not None:
+                        channel.backfill.cancel()
+                    await self._checkpoint(channel, force=True)
+                    self._channels.pop(channel_id, None)
+            metrics.set_gauge("monitor.channels", len(self._channels))
+            return removed
+        except Exception as e:
+            logger.error(f"Error eliminando canal monitoreado: {str(e)}")
+            return False
+
     async def list_monitored_channels(self, user_id: int) -> List[Dict]:
         """Lista los canales monitoreados de un usuario"""
         try:
-            channels = await self.mongo.get_monitored_channels(user_id)
+            channels = await db_instance.get_monitored_channels(user_id)
+            chats = await peer_cache.get_chats(userbot_pool.primary.client, [channel["channel_id"] for channel in channels])
             result = []
-            
+
             for channel in channels:
-                try:
-                    chat = await self.client.get_chat(channel["channel_id"])
-                    result.append({
-                        "channel_id": channel["channel_id"],
-                        "title": chat.title,
-                        "username": chat.username,
-                        "added_on": channel["added_on"]
-                    })
-                except Exception:
+                chat = chats.get(channel["channel_id"])
+                result.append({
+                    "channel_id": channel["channel_id"],
                     # Si no se puede obtener info del canal, usar datos básicos
-                    result.append({
-                        "channel_id": channel["channel_id"],
-                        "title": "Canal no disponible",
-                        "username": None,
-                        "added_on": channel["added_on"]
-                    })
-                    
+                    "title": chat.title if chat else "Canal no disponible",
+                    "username": chat.username if chat else None,
+                    "added_on": channel["added_on"]
+                })
+
             return result
-            
+
         except Exception as e:
             logger.error(f"Error listando canales monitoreados: {str(e)}")
             return []
 
-    async def remove_monitored_channel(self, channel_id: int, user_id: int) -> bool:
-        """Elimina un canal de monitoreo"""
+    # --- Updates ---
+
+    async def _on_message(self, client: Client, message):
+        channel = self._channels.get(message.chat.id)
+        if channel is None:
+            return
+        metrics.inc("monitor.updates")
+        if message.id <= channel.last_message_id:
+            return  # ya visto (p. ej. recuperado por un relleno)
+        # El post se ingiere al momento; el cursor solo avanza si no deja hueco detrás.
+        await self._ingest(channel, [message])
+        channel.high_water = max(channel.high_water, message.id)
+        backfilling = channel.backfill is not None and not channel.backfill.done()
+        if not backfilling and message.id == channel.last_message_id + 1:
+            channel.last_message_id = message.id
+            await self._checkpoint(channel)
+        else:
+            if not backfilling:
+                metrics.inc("monitor.gaps")
+            self._schedule_backfill(channel)
+
+    async def _on_disconnect(self, client: Client):
+        """Pyrogram llama a esto cada vez que la sesión se cae; al volver se buscan los huecos."""
+        metrics.inc("monitor.disconnects")
+        if self._resync is None or self._resync.done():
+            self._resync = asyncio.create_task(self._resync_after_reconnect())
+
+    async def _resync_after_reconnect(self):
+        await asyncio.sleep(CHANNEL_RESYNC_DELAY)
+        await self.resync()
+
+    # --- Relleno incremental ---
+
+    async def resync(self):
+        """Rellena cada canal desde su cursor hasta su último mensaje actual (arranque o reconexión)."""
+        tasks = [self._schedule_backfill(channel, probe_top=True) for channel in list(self._channels.values())]
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _schedule_backfill(self, channel: MonitoredChannel, probe_top: bool = False) -> asyncio.Task:
+        """Lanza el relleno del canal si no hay uno en marcha (el que ya corre recoge el nuevo high_water)."""
+        if channel.backfill is None or channel.backfill.done():
+            channel.backfill = asyncio.create_task(self._backfill(channel, probe_top))
+        return channel.backfill
+
+    async def _backfill(self, channel: MonitoredChannel, probe_top: bool = False):
+        """
+        Pide hacia delante desde last_message_id hasta high_water en páginas de BATCH_FETCH_SIZE ids,
+        guardando el cursor tras cada página. Un reinicio a mitad continúa desde la última página
+        guardada; la dedupe_key de las tareas evita duplicar lo que ya se ingirió en directo.
+        """
         try:
-            await self.stop_monitoring(channel_id)
-            return await self.mongo.remove_monitored_channel(channel_id, user_id)
+            async with self._backfill_slots:
+                account = userbot_pool.primary
+                if probe_top:
+                    channel.high_water = max(channel.high_water, await self._top_message_id(account.client, channel.channel_id))
+                if not channel.last_message_id:
+                    # Canal sin punto de partida: se toma el actual y solo se ingiere lo nuevo.
+                    channel.last_message_id = channel.high_water
+                    await self._checkpoint(channel, force=True)
+                    return
+
+                first, recovered = channel.last_message_id + 1, 0
+                while channel.last_message_id < channel.high_water:
+                    cursor = channel.last_message_id
+                    ids = list(range(cursor + 1, min(cursor + 1 + BATCH_FETCH_SIZE, channel.high_water + 1)))
+                    messages, account = await self._fetch(account, channel.channel_id, ids)
+                    recovered += await self._ingest(channel, messages)
+                    channel.last_message_id = ids[-1]
+                    await self._checkpoint(channel, force=True)
+                    metrics.inc("monitor.backfill.pages")
+                    metrics.inc("monitor.backfill.messages", len(ids))
+                    if channel.last_message_id < channel.high_water:
+                        await asyncio.sleep(self._page_delay)
+
+                if channel.last_message_id >= first:
+                    logger.info(f"[MONITOR] Canal {channel.channel_id} al día hasta {channel.last_message_id}: "
+                                f"{recovered} tarea(s) recuperada(s) de {channel.last_message_id - first + 1} mensajes.")
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
-            logger.error(f"Error eliminando canal monitoreado: {str(e)}")
-            return False
\ No newline at end of file
+            logger.warning(f"[MONITOR] Relleno del canal {channel.channel_id} detenido en {channel.last_message_id}: {e}")
+
+    def _throttle(self, seconds: float):
+        """FloodWait recibido: la pausa entre páginas se duplica (al menos hasta lo pedido por Telegram)."""
+        self._page_delay = min(max(self._page_delay * 2, seconds), CHANNEL_BACKFILL_MAX_DELAY)
+        metrics.set_gauge("monitor.backfill.page_delay", self._page_delay)
+
+    def _relax(self):
+        """Página servida sin FloodWait: la pausa vuelve poco a poco a la base."""
+        self._page_delay = max(self._page_delay * 0.8, CHANNEL_BACKFILL_PAGE_DELAY)
+        metrics.set_gauge("monitor.backfill.page_delay", self._page_delay)
+
+    async def _fetch(self, account: UserbotAccount, channel_id: int, ids: List[int]):
+        """get_messages de una página; ante FloodWait frena los rellenos y sigue con otra cuenta o espera."""
+        while True:
+            try:
+                messages = await account.client.get_messages(channel_id, ids)
+                self._relax()
+                return (messages if isinstance(messages, list) else [messages]), account
+            except FloodWait as e:
+                userbot_pool.report_flood(account, e.value)
+                self._throttle(e.value)
+                account = await self._member_account(channel_id, exclude=account)
+
+    @staticmethod
+    async def _member_account(channel_id: int, exclude: UserbotAccount) -> UserbotAccount:
+        """
+        Otra cuenta fuera de FloodWait que sea miembro del canal (una que no lo sea recibiría
+        ChannelPrivate y el cursor no avanzaría). Si no queda ninguna, espera a la principal, que es
+        la que monitoriza los canales.
+        """
+        candidates = sorted((a for a in userbot_pool.accounts if a is not exclude and not a.throttled),
+                            key=lambda a: (a.load, a.index))
+        for account in candidates:
+            if await userbot_pool.is_member(account, channel_id):
+                return account
+        primary = userbot_pool.primary
+        await asyncio.sleep(max(primary.flood_until - time.monotonic(), 1))
+        return primary
+
+    @staticmethod
+    async def _top_message_id(client: Client, channel_id: int) -> int:
+        async for message in client.get_chat_history(channel_id, limit=1):
+            return message.id
+        return 0
+
+    # --- Persistencia ---
+
+    async def _ingest(self, channel: MonitoredChannel, messages: List) -> int:
+        """Crea una tarea pendiente por mensaje con medio y usuario suscrito."""
+        docs = [doc for message in messages if message is not None
+                for user_id in channel.user_ids
+                if (doc := task_from_message(user_id, message, f"monitor:{user_id}"))]
+        if not docs:
+            return 0
+        created = len(await db_instance.add_tasks(docs))
+        metrics.inc("monitor.tasks_created", created)
+        return created
+
+    async def _checkpoint(self, channel: MonitoredChannel, force: bool = False):
+        """Guarda last_message_id del canal, como mucho cada CHANNEL_CHECKPOINT_INTERVAL salvo `force`."""
+        if channel.last_message_id <= channel.persisted_id:
+            return
+        now = time.monotonic()
+        if not force and now - channel.persisted_at < CHANNEL_CHECKPOINT_INTERVAL:
+            return
+        try:
+            await db_instance.update_last_message_id(channel.channel_id, channel.last_message_id)
+            channel.persisted_id, channel.persisted_at = channel.last_message_id, now
+        except Exception as e:
+            logger.warning(f"[MONITOR] No se pudo guardar el último mensaje del canal {channel.channel_id}: {e}")
+
+
+# Instancia singleton para ser usada en todo el proyecto.
+channel_monitor = ChannelMonitor()
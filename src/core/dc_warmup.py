@@ -0,0 +1,259 @@
+# --- START OF FILE src/core/dc_warmup.py ---
+
+import asyncio
+import functools
+import inspect
+import logging
+import os
+import time
+import types
+from collections import Counter
+from typing import AsyncGenerator, Callable, Dict, List, Optional
+
+from pyrogram import Client, raw, utils
+from pyrogram.errors import AuthBytesInvalid
+from pyrogram.file_id import FileId, FileType, ThumbnailSource
+from pyrogram.session import Auth, Session
+
+from src.db.mongo_manager import db_instance
+from src.helpers.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+MEDIA_DC_WARMUP_ENABLED = os.getenv("MEDIA_DC_WARMUP_ENABLED", "true").lower() == "true"
+# DCs que se abren por tipo de cliente (los más usados según la telemetría).
+MEDIA_DC_WARMUP_TOP = int(os.getenv("MEDIA_DC_WARMUP_TOP", "2"))
+# Días de telemetría de transferencias que se consideran.
+MEDIA_DC_TELEMETRY_DAYS = int(os.getenv("MEDIA_DC_TELEMETRY_DAYS", "7"))
+
+_MEDIA_ATTRIBUTES = ("video", "document", "audio", "animation", "voice", "video_note", "sticker")
+# Tamaño de bloque de upload.GetFile, el mismo que usa Pyrogram.
+_CHUNK_SIZE = 1024 * 1024
+
+
+def file_dc(file_ref) -> Optional[int]:
+    """DC donde está un archivo, a partir de su file_id o de un Message con medio."""
+    file_id = file_ref if isinstance(file_ref, str) else None
+    if file_id is None and file_ref is not None:
+        for attr in _MEDIA_ATTRIBUTES:
+            media = getattr(file_ref, attr, None)
+            if media is not None:
+                file_id = getattr(media, "file_id", None)
+                break
+        else:
+            file_id = getattr(getattr(file_ref, "photo", None), "file_id", None)
+    if not file_id:
+        return None
+    try:
+        return FileId.decode(file_id).dc_id
+    except Exception:
+        return None
+
+
+async def open_media_session(client: Client, dc_id: int) -> float:
+    """
+    Abre y guarda en client.media_sessions la sesión de medios de `dc_id`: clave de autorización y,
+    fuera del DC propio, exportar/importar la autorización. La sesión se mantiene viva con los pings
+    de Pyrogram y la cierra client.stop(). Devuelve los segundos que costó abrirla (0 si ya estaba).
+    """
+    async with client.media_sessions_lock:
+        if dc_id in client.media_sessions:
+            return 0.0
+        started = time.monotonic()
+        test_mode = await client.storage.test_mode()
+        if dc_id != await client.storage.dc_id():
+            session = Session(client, dc_id, await Auth(client, dc_id, test_mode).create(), test_mode, is_media=True)
+            await session.start()
+            for _ in range(3):
+                exported_auth = await client.invoke(raw.functions.auth.ExportAuthorization(dc_id=dc_id))
+                try:
+                    await session.invoke(raw.functions.auth.ImportAuthorization(id=exported_auth.id, bytes=exported_auth.bytes))
+                except AuthBytesInvalid:
+                    continue
+                break
+            else:
+                await session.stop()
+                raise AuthBytesInvalid
+        else:
+            session = Session(client, dc_id, await client.storage.auth_key(), test_mode, is_media=True)
+            await session.start()
+        client.media_sessions[dc_id] = session
+        return time.monotonic() - started
+
+
+async def _drop_media_session(client: Client, dc_id: int, session: Session):
+    async with client.media_sessions_lock:
+        if client.media_sessions.get(dc_id) is session:
+            del client.media_sessions[dc_id]
+    try:
+        await session.stop()
+    except Exception:
+        pass
+
+
+def _file_location(file_id: FileId):
+    """InputFileLocation de un FileId, construido igual que en Client.get_file."""
+    if file_id.file_type == FileType.CHAT_PHOTO:
+        if file_id.chat_id > 0:
+            peer = raw.types.InputPeerUser(user_id=file_id.chat_id, access_hash=file_id.chat_access_hash)
+        elif file_id.chat_access_hash == 0:
+            peer = raw.types.InputPeerChat(chat_id=-file_id.chat_id)
+        else:
+            peer = raw.types.InputPeerChannel(channel_id=utils.get_channel_id(file_id.chat_id),
+                                              access_hash=file_id.chat_access_hash)
+        return raw.types.InputPeerPhotoFileLocation(
+            peer=peer, photo_id=file_id.media_id,
+            big=file_id.thumbnail_source == ThumbnailSource.CHAT_PHOTO_BIG
+        )
+    location_type = raw.types.InputPhotoFileLocation if file_id.file_type == FileType.PHOTO else raw.types.InputDocumentFileLocation
+    return location_type(id=file_id.media_id, access_hash=file_id.access_hash,
+                         file_reference=file_id.file_reference, thumb_size=file_id.thumbnail_size)
+
+
+async def _get_file(self: Client, file_id: FileId, file_size: int = 0, limit: int = 0, offset: int = 0,
+                    progress: Optional[Callable] = None, progress_args: tuple = ()) -> AsyncGenerator[bytes, None]:
+    """
+    Client.get_file sobre la sesión de medios guardada del DC. Pyrogram 2.0.106 abre y cierra una
+    sesión (y en DCs ajenos otra clave y otra autorización exportada) en cada descarga; aquí se abre
+    una vez y se reutiliza. Si la sesión falla o Telegram redirige a un CDN, la descarga sigue desde
+    el bloque en curso con el get_file original, que abre su propia sesión.
+    """
+    done = 0
+    total = abs(limit) or (1 << 31) - 1
+    async with self.get_file_semaphore:
+        location = _file_location(file_id)
+        offset_bytes = abs(offset) * _CHUNK_SIZE
+        session = self.media_sessions.get(file_id.dc_id)
+        while True:
+            try:
+                if session is None:
+                    await open_media_session(self, file_id.dc_id)
+                    session = self.media_sessions[file_id.dc_id]
+                r = await session.invoke(
+                    raw.functions.upload.GetFile(location=location, offset=offset_bytes, limit=_CHUNK_SIZE),
+                    sleep_threshold=30
+                )
+            except Exception as e:
+                logger.warning(f"[DC_WARMUP] {self.name}: la sesión de medios del DC {file_id.dc_id} falló ({e}); "
+                               f"se descarta y la descarga sigue con una sesión nueva.")
+                metrics.inc("telegram.media.session_fallbacks")
+                if session is not None:
+                    await _drop_media_session(self, file_id.dc_id, session)
+                break
+            if not isinstance(r, raw.types.upload.File):
+                break  # FileCdnRedirect: el get_file original sabe descifrar y verificar el CDN.
+
+            chunk = r.bytes
+            yield chunk
+            done += 1
+            offset_bytes += _CHUNK_SIZE
+            if progress:
+                func = functools.partial(progress, min(offset_bytes, file_size) if file_size != 0 else offset_bytes,
+                                         file_size, *progress_args)
+                if inspect.iscoroutinefunction(progress):
+                    await func()
+                else:
+                    await self.loop.run_in_executor(self.executor, func)
+            if len(chunk) < _CHUNK_SIZE or done >= total:
+                return
+
+    async for chunk in Client.get_file(self, file_id, file_size, total - done if limit else 0,
+                                       abs(offset) + done, progress, progress_args):
+        yield chunk
+
+
+def use_kept_media_sessions(client: Client):
+    """Hace que las descargas de `client` reutilicen las sesiones de medios guardadas por DC."""
+    client.get_file = types.MethodType(_get_file, client)
+
+
+class TransferProbe:
+    """
+    Mide el tiempo hasta el primer bloque de una descarga, separando las que encontraron la
+    sesión de medios ya abierta (warm) de las que tuvieron que abrirla (cold).
+    """
+
+    def __init__(self, client: Client, kind: str, dc_id: Optional[int]):
+        self.kind = kind
+        self.dc_id = dc_id
+        self.warm = dc_id is not None and dc_id in getattr(client, "media_sessions", {})
+        self.started = time.monotonic()
+        self._reported = False
+
+    def first_chunk(self):
+        if self._reported or self.dc_id is None:
+            return
+        self._reported = True
+        label = "warm" if self.warm else "cold"
+        metrics.observe(f"telegram.media.first_chunk_ms.{self.kind}.{label}", (time.monotonic() - self.started) * 1000)
+
+    def wrap(self, progress: Optional[Callable]) -> Callable:
+        """Envuelve el callback de progreso de Pyrogram conservando si es síncrono o asíncrono."""
+        if progress is None:
+            def _probe(current, total, *args):
+                self.first_chunk()
+            return _probe
+        if inspect.iscoroutinefunction(progress):
+            @functools.wraps(progress)
+            async def _async_probe(current, total, *args):
+                self.first_chunk()
+                return await progress(current, total, *args)
+            return _async_probe
+
+        @functools.wraps(progress)
+        def _sync_probe(current, total, *args):
+            self.first_chunk()
+            return progress(current, total, *args)
+        return _sync_probe
+
+
+def probe_transfer(client: Client, kind: str, file_ref) -> TransferProbe:
+    """Anota en la telemetría el DC de la transferencia y devuelve su medidor de primer bloque."""
+    dc_id = file_dc(file_ref)
+    if dc_id is not None:
+        db_instance.record_media_dc(kind, dc_id)
+    return TransferProbe(client, kind, dc_id)
+
+
+async def _default_dc(client: Client) -> Optional[int]:
+    try:
+        return await client.storage.dc_id()
+    except Exception:
+        return None
+
+
+async def warm_up_media_dcs(clients: Dict[str, List[Client]]) -> Dict[str, Dict[int, float]]:
+    """
+    Abre por adelantado las sesiones de medios de los DCs más usados por cada tipo de cliente
+    ("bot", "userbot") en los últimos MEDIA_DC_TELEMETRY_DAYS días. Sin telemetría se abre el DC
+    propio de la cuenta. Devuelve {cliente: {dc: ms que costó abrir}}: es el tiempo hasta el primer
+    byte que se ahorra la primera descarga de cada DC.
+    """
+    if not MEDIA_DC_WARMUP_ENABLED:
+        return {}
+    try:
+        usage = await db_instance.get_media_dc_usage(MEDIA_DC_TELEMETRY_DAYS)
+    except Exception as e:
+        logger.warning(f"[DC_WARMUP] Sin telemetría de DCs: {e}")
+        usage = {}
+
+    report: Dict[str, Dict[int, float]] = {}
+    for kind, kind_clients in clients.items():
+        ranked = Counter({dc: n for (k, dc), n in usage.items() if k == kind})
+        top = [dc for dc, _ in ranked.most_common(MEDIA_DC_WARMUP_TOP)]
+        for client in kind_clients:
+            dcs = top or [dc for dc in [await _default_dc(client)] if dc is not None]
+            results = await asyncio.gather(*(open_media_session(client, dc) for dc in dcs), return_exceptions=True)
+            opened = {}
+            for dc, result in zip(dcs, results):
+                if isinstance(result, Exception):
+                    logger.warning(f"[DC_WARMUP] {client.name}: no se pudo abrir la sesión de medios del DC {dc}: {result}")
+                    continue
+                opened[dc] = result * 1000
+                metrics.observe(f"telegram.media.session_open_ms.{kind}", result * 1000)
+            report[client.name] = opened
+            if opened:
+                detail = ", ".join(f"DC{dc} {ms:.0f} ms" for dc, ms in opened.items())
+                logger.info(f"[DC_WARMUP] {client.name} ({kind}): sesiones de medios abiertas ({detail}). "
+                            f"Ese tiempo ya no se suma al primer byte de la primera descarga de cada DC.")
+    return report
@@ -33,4 +33,9 @@ class AuthenticationError(BaseBotException):
     def __init__(self, service_name: str, message: str = "Fallo de autenticación."):
         self.service_name = service_name
         full_message = f"Error de autenticación con {service_name}: {message}"
-        super().__init__(full_message)
\ No newline at end of file
+        super().__init__(full_message)
+
+class TaskCancelledError(BaseBotException):
+    """Lanzada cuando una tarea en curso es cancelada por el usuario."""
+    def __init__(self, message="La tarea fue cancelada."):
+        super().__init__(message)
@@ -23,13 +23,24 @@ def get_media_info(file_path: str) -> dict:
 def build_ffmpeg_command(
     task: Dict, input_path: str, output_path: str,
     watermark_path: Optional[str] = None, replace_audio_path: Optional[str] = None,
-    audio_thumb_path: Optional[str] = None, subs_path: Optional[str] = None
+    audio_thumb_path: Optional[str] = None, subs_path: Optional[str] = None,
+    media_info: Optional[dict] = None
 ) -> Tuple[List[List[str]], str]:
-    
+    """
+    `media_info` es la salida de get_media_info(input_path). Quien llama desde el bucle de eventos
+    la obtiene antes con asyncio.to_thread: ffprobe bloquea hasta 60 s.
+    """
     config = task.get('processing_config', {})
+    media_info = media_info if media_info is not None else {}
     
     if config.get('extract_audio'):
-        return _build_extract_audio_command(input_path, output_path)
+        return _build_extract_audio_command(input_path, output_path, media_info)
+
+    if gif_options := config.get('gif_options'):
+        return _build_gif_command(input_path, output_path, gif_options)
+
+    if is_audio_metadata_task(task):
+        return _build_audio_metadata_command(input_path, output_path, media_info, config.get('audio_tags', {}), audio_thumb_path)
     
     return _build_video_command(task, input_path, output_path, watermark_path, replace_audio_path, subs_path)
 
@@ -163,7 +174,104 @@ def _build_video_command(
     
     return [command], output_path
 
-def _build_extract_audio_command(input_path: str, output_path_base: str) -> Tuple[List[List[str]], str]:
-    final_output_path = f"{os.path.splitext(output_path_base)[0]}.m4a"
-    command = ["ffmpeg", "-y", "-i", input_path, "-vn", "-c:a", "copy", final_output_path]
-    return [command], final_output_path
\ No newline at end of file
+def _build_gif_command(input_path: str, output_path_base: str, gif_options: Dict) -> Tuple[List[List[str]], str]:
+    """GIF con paleta propia (palettegen/paletteuse) para evitar el bandeado de la paleta genérica."""
+    final_output_path = f"{os.path.splitext(output_path_base)[0]}.gif"
+    duration = gif_options.get('duration', 5)
+    fps = gif_options.get('fps', 15)
+    width = gif_options.get('width', 480)
+
+    command = ["ffmpeg", "-y", "-hide_banner"]
+    if start := gif_options.get('start'):
+        command.extend(["-ss", str(start)])
+    command.extend(["-t", str(duration), "-i", input_path])
+    gif_filter = (
+        f"fps={fps},scale={width}:-1:flags=lanczos,"
+        "split[s0][s1];[s0]palettegen=stats_mode=diff[p];[s1][p]paletteuse=dither=bayer"
+    )
+    command.extend(["-filter_complex", gif_filter, "-an", "-loop", "0", final_output_path])
+    return [command], final_output_path
+
+# Contenedor nativo de cada códec de audio: permite copiar el flujo sin recodificar.
+AUDIO_CODEC_CONTAINERS = {
+    "mp3": ".mp3",
+    "aac": ".m4a",
+    "alac": ".m4a",
+    "opus": ".opus",
+    "vorbis": ".ogg",
+    "flac": ".flac",
+}
+# Contenedores que admiten la carátula como flujo attached_pic.
+COVER_ART_CONTAINERS = {".mp3", ".m4a", ".flac"}
+
+_TAG_KEYS = ("title", "artist", "album")
+
+def get_audio_codec(media_info: dict) -> Optional[str]:
+    """Devuelve el códec del primer flujo de audio según ffprobe."""
+    for stream in media_info.get("streams", []):
+        if stream.get("codec_type") == "audio":
+            return stream.get("codec_name")
+    return None
+
+def get_audio_container(codec: Optional[str]) -> Optional[str]:
+    return AUDIO_CODEC_CONTAINERS.get(codec or "")
+
+def is_audio_metadata_task(task: Dict) -> bool:
+    """Una tarea de audio que solo cambia etiquetas o carátula se resuelve con copia de flujos."""
+    config = task.get('processing_config', {})
+    if task.get('file_type') != 'audio':
+        return False
+    if not (config.get('audio_tags') or config.get('audio_thumbnail_file_id')):
+        return False
+    reencode_keys = ('trim_times', 'quality', 'transcode', 'watermark', 'replace_audio_file_id', 'mute_audio', 'gif_options')
+    return not any(config.get(key) for key in reencode_keys)
+
+def is_stream_copy_audio_task(task: Dict) -> bool:
+    """Tareas de audio ligeras (sin filtros) que el worker manda a la cola de audio si el comando es copia pura."""
+    return bool(task.get('processing_config', {}).get('extract_audio')) or is_audio_metadata_task(task)
+
+def _build_extract_audio_command(input_path: str, output_path_base: str, media_info: dict) -> Tuple[List[List[str]], str]:
+    codec = get_audio_codec(media_info)
+    extension = get_audio_container(codec)
+    base = os.path.splitext(output_path_base)[0]
+    if extension:
+        final_output_path = f"{base}{extension}"
+        command = ["ffmpeg", "-y", "-i", input_path, "-map", "0:a:0", "-vn", "-c:a", "copy", final_output_path]
+    else:
+        # Códec sin contenedor de audio propio (ac3, dts, pcm...): se recodifica a AAC.
+        logger.info(f"Códec de audio '{codec}' sin contenedor nativo. Se recodificará a AAC.")
+        final_output_path = f"{base}.m4a"
+        command = ["ffmpeg", "-y", "-i", input_path, "-map", "0:a:0", "-vn", "-c:a", "aac", "-b:a", "192k", final_output_path]
+    return [command], final_output_path
+
+def _build_audio_metadata_command(
+    input_path: str, output_path_base: str, media_info: dict, tags: Dict, cover_path: Optional[str]
+) -> Tuple[List[List[str]], str]:
+    """Reescribe etiquetas y carátula con copia pura de flujos, sin recodificar el audio."""
+    codec = get_audio_codec(media_info)
+    extension = get_audio_container(codec) or ".mka"
+    final_output_path = f"{os.path.splitext(output_path_base)[0]}{extension}"
+
+    command = ["ffmpeg", "-y", "-i", input_path]
+    supports_cover = extension in COVER_ART_CONTAINERS
+    if cover_path and supports_cover:
+        command.extend(["-i", cover_path])
+
+    command.extend(["-map", "0:a", "-map_metadata", "0"])
+    if cover_path and supports_cover:
+        command.extend(["-map", "1:v:0", "-disposition:v:0", "attached_pic"])
+        command.extend(["-metadata:s:v", "title=Album cover", "-metadata:s:v", "comment=Cover (front)"])
+    elif supports_cover:
+        # Se conserva la carátula original si la hubiera.
+        command.extend(["-map", "0:v?", "-disposition:v", "attached_pic"])
+    elif cover_path:
+        logger.warning(f"El contenedor {extension} no admite carátula. Solo se escribirán las etiquetas.")
+
+    command.extend(["-c", "copy"])
+    for key in _TAG_KEYS:
+        if value := (tags or {}).get(key):
+            command.extend(["-metadata", f"{key}={value}"])
+    if extension == ".mp3":
+        command.extend(["-id3v2_version", "3"])
+    command.append(final_output_path)
+    return [command], final_output_path
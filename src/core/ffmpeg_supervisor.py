@@ -0,0 +1,222 @@
+# --- START OF FILE src/core/ffmpeg_supervisor.py ---
+
+import asyncio
+import logging
+import os
+import re
+import shutil
+import signal
+import subprocess
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from src.core.exceptions import FFmpegProcessingError, TaskCancelledError
+
+logger = logging.getLogger(__name__)
+
+# --- Prioridad del proceso hijo ---
+# nice 10 e ionice best-effort/7 dejan CPU y disco libres para los handlers del bot.
+FFMPEG_NICE = int(os.getenv("FFMPEG_NICE", "10"))
+FFMPEG_IONICE_CLASS = os.getenv("FFMPEG_IONICE_CLASS", "2")  # 1=realtime, 2=best-effort, 3=idle, vacío=desactivado
+FFMPEG_IONICE_LEVEL = int(os.getenv("FFMPEG_IONICE_LEVEL", "7"))
+
+# --- Límites de ejecución ---
+# Segundos sin que avance out_time antes de considerar el proceso colgado.
+FFMPEG_STALL_TIMEOUT = float(os.getenv("FFMPEG_STALL_TIMEOUT", "120"))
+# Techo de tiempo real: FFMPEG_WALL_FACTOR veces la duración del medio, nunca menos de FFMPEG_MIN_WALL.
+FFMPEG_WALL_FACTOR = float(os.getenv("FFMPEG_WALL_FACTOR", "6"))
+FFMPEG_MIN_WALL = float(os.getenv("FFMPEG_MIN_WALL", "600"))
+# Techo cuando no se conoce la duración del medio.
+FFMPEG_MAX_WALL_UNKNOWN = float(os.getenv("FFMPEG_MAX_WALL_UNKNOWN", "7200"))
+# Segundos de gracia entre SIGTERM y SIGKILL.
+FFMPEG_KILL_GRACE = float(os.getenv("FFMPEG_KILL_GRACE", "5"))
+
+_OUT_TIME_US_PATTERN = re.compile(r"^out_time_(?:us|ms)=(\d+)")
+_STATS_TIME_PATTERN = re.compile(r"time=(\d{2}):(\d{2}):(\d{2})\.(\d{2})")
+_PROGRESS_KEY_PATTERN = re.compile(r"^[a-z_0-9]+=\S*$")
+
+ProgressCallback = Callable[[float], Awaitable[None]]
+
+
+class FFmpegRunResult:
+    """Resultado de una ejecución supervisada de FFmpeg, con la contabilidad de recursos de os.wait4."""
+
+    def __init__(self, command: List[str]):
+        self.command = command
+        self.returncode: Optional[int] = None
+        self.stderr_tail: List[str] = []
+        self.processed_seconds = 0.0
+        self.wall_time = 0.0
+        self.cpu_user = 0.0
+        self.cpu_system = 0.0
+        self.max_rss_kb = 0
+        self.kill_reason: Optional[str] = None
+
+    @property
+    def cpu_time(self) -> float:
+        return self.cpu_user + self.cpu_system
+
+    @property
+    def ok(self) -> bool:
+        return self.returncode == 0 and self.kill_reason is None
+
+    def as_dict(self) -> Dict:
+        return {
+            "returncode": self.returncode,
+            "wall_time": round(self.wall_time, 3),
+            "cpu_user": round(self.cpu_user, 3),
+            "cpu_system": round(self.cpu_system, 3),
+            "cpu_time": round(self.cpu_time, 3),
+            "max_rss_kb": self.max_rss_kb,
+            "processed_seconds": round(self.processed_seconds, 3),
+            "kill_reason": self.kill_reason,
+        }
+
+    def raise_for_status(self):
+        if self.ok:
+            return
+        log = "".join(self.stderr_tail[-10:])
+        if self.kill_reason:
+            raise FFmpegProcessingError(f"FFmpeg fue detenido: {self.kill_reason}.", log=log)
+        raise FFmpegProcessingError(f"FFmpeg falló con código {self.returncode}.", log=log)
+
+
+def compute_wall_limit(duration: float) -> float:
+    """Techo de tiempo real para un trabajo, escalado por la duración del medio."""
+    if duration and duration > 0:
+        return max(FFMPEG_MIN_WALL, duration * FFMPEG_WALL_FACTOR)
+    return FFMPEG_MAX_WALL_UNKNOWN
+
+
+def _priority_prefix() -> List[str]:
+    """
+    Prefijo `nice`/`ionice` con la prioridad configurada. Ambos hacen exec, así que el PID no
+    cambia; no se usa preexec_fn porque no es seguro con los hilos de Motor y Pyrogram.
+    """
+    prefix: List[str] = []
+    if FFMPEG_NICE and shutil.which("nice"):
+        prefix.extend(["nice", "-n", str(FFMPEG_NICE)])
+    if FFMPEG_IONICE_CLASS and shutil.which("ionice"):
+        prefix.extend(["ionice", "-c", FFMPEG_IONICE_CLASS])
+        if FFMPEG_IONICE_CLASS in ("1", "2"):
+            prefix.extend(["-n", str(FFMPEG_IONICE_LEVEL)])
+    return prefix
+
+
+def _with_progress_output(command: List[str]) -> List[str]:
+    """Garantiza que FFmpeg informe out_time por stderr para poder detectar bloqueos."""
+    if "-progress" in command or not command or os.path.basename(command[0]) != "ffmpeg":
+        return command
+    return [command[0], "-nostats", "-progress", "pipe:2", *command[1:]]
+
+
+async def run_ffmpeg(
+    command: List[str],
+    duration: float = 0.0,
+    on_progress: Optional[ProgressCallback] = None,
+    cancel_token=None,
+    stall_timeout: float = FFMPEG_STALL_TIMEOUT,
+    wall_limit: Optional[float] = None,
+) -> FFmpegRunResult:
+    """
+    Ejecuta FFmpeg bajo supervisión: prioridad reducida (nice/ionice), detección de bloqueos
+    por out_time, techo de tiempo real y contabilidad de CPU y RSS máximo mediante os.wait4.
+    No lanza por códigos de salida; usa `result.raise_for_status()`. Sí lanza
+    TaskCancelledError si el token de cancelación se activa.
+    """
+    command = _with_progress_output(command)
+    wall_limit = wall_limit or compute_wall_limit(duration)
+    result = FFmpegRunResult(command)
+    loop = asyncio.get_running_loop()
+
+    process = subprocess.Popen(
+        _priority_prefix() + command,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+    )
+    started = time.monotonic()
+    # Reaper propio: os.wait4 devuelve el rusage exacto de este hijo.
+    reaper = loop.run_in_executor(None, os.wait4, process.pid, 0)
+
+    reader = asyncio.StreamReader()
+    transport, _ = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), process.stderr)
+    tail: deque = deque(maxlen=30)
+    state = {"last_advance": started}
+
+    async def _pump_stderr():
+        async for raw_line in reader:
+            line = raw_line.decode("utf-8", "ignore")
+            seconds = None
+            if match := _OUT_TIME_US_PATTERN.match(line):
+                seconds = int(match.group(1)) / 1_000_000
+            elif match := _STATS_TIME_PATTERN.search(line):
+                h, m, s, cs = map(int, match.groups())
+                seconds = h * 3600 + m * 60 + s + cs / 100
+            elif not _PROGRESS_KEY_PATTERN.match(line.strip()):
+                tail.append(line)
+
+            if seconds is not None and seconds > result.processed_seconds:
+                result.processed_seconds = seconds
+                state["last_advance"] = time.monotonic()
+                if on_progress:
+                    try:
+                        await on_progress(seconds)
+                    except Exception as e:
+                        logger.debug(f"Error en callback de progreso de FFmpeg: {e}")
+
+    async def _terminate(reason: str):
+        result.kill_reason = reason
+        logger.warning(f"[FFMPEG] Deteniendo PID {process.pid}: {reason}")
+        # Señales con os.kill: los métodos de Popen hacen waitpid y robarían el rusage a wait4.
+        try:
+            os.kill(process.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(reaper), timeout=FFMPEG_KILL_GRACE)
+        except asyncio.TimeoutError:
+            try:
+                os.kill(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+    pump = asyncio.create_task(_pump_stderr())
+    try:
+        while not reaper.done():
+            await asyncio.wait({reaper}, timeout=0.5)
+            if reaper.done():
+                break
+            now = time.monotonic()
+            if cancel_token is not None and cancel_token.cancelled:
+                await _terminate("cancelado")
+            elif now - state["last_advance"] > stall_timeout:
+                await _terminate(f"sin progreso durante {stall_timeout:.0f}s")
+            elif now - started > wall_limit:
+                await _terminate(f"superó el límite de {wall_limit:.0f}s")
+        _, status, rusage = await reaper
+    finally:
+        if not reaper.done():
+            os.kill(process.pid, signal.SIGKILL)
+            await asyncio.shield(reaper)
+        try:
+            await asyncio.wait_for(pump, timeout=2)
+        except Exception:
+            pump.cancel()
+        transport.close()
+
+    # Evita que Popen intente volver a recoger un PID que ya recogimos con wait4.
+    process.returncode = result.returncode = os.waitstatus_to_exitcode(status)
+    result.wall_time = time.monotonic() - started
+    result.cpu_user, result.cpu_system = rusage.ru_utime, rusage.ru_stime
+    result.max_rss_kb = rusage.ru_maxrss
+    result.stderr_tail = list(tail)
+
+    logger.info(
+        f"[FFMPEG] PID {process.pid} terminó con código {result.returncode} en {result.wall_time:.1f}s "
+        f"(CPU {result.cpu_time:.1f}s, RSS máx {result.max_rss_kb / 1024:.1f} MB)"
+    )
+    if result.kill_reason == "cancelado":
+        raise TaskCancelledError(cancel_token.reason or "Tarea cancelada.")
+    return result
@@ -0,0 +1,135 @@
+# --- START OF FILE src/core/peer_storage.py ---
+
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import List, Optional, Set, Tuple
+
+from pyrogram import Client
+from pyrogram.storage import MemoryStorage
+from pyrogram.storage.sqlite_storage import get_input_peer
+
+from src.db.mongo_manager import db_instance
+from src.helpers.cache import TTLCache
+from src.helpers.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Igual que Pyrogram: un username resuelto hace más de esto se vuelve a pedir a Telegram.
+PEER_USERNAME_TTL = float(os.getenv("PEER_USERNAME_TTL", str(8 * 60 * 60)))
+# Peers ya escritos que se recuerdan para no reescribir los que no cambian.
+PEER_PERSISTED_CACHE_SIZE = int(os.getenv("PEER_PERSISTED_CACHE_SIZE", "50000"))
+
+
+class PersistentPeerStorage(MemoryStorage):
+    """
+    Almacenamiento de sesión de Pyrogram para clientes con session string: la sesión sigue en
+    memoria, pero los peers (id, access_hash, username) se copian a la base de datos compartida.
+    Pyrogram llama a update_peers con cada respuesta y cada update, así que el almacén se llena
+    solo; cuando un peer no está en memoria (p. ej. tras reiniciar) se busca por índice en la
+    base de datos en lugar de recorrer los diálogos.
+    """
+
+    def __init__(self, name: str, session_string: Optional[str] = None, db=db_instance):
+        super().__init__(name, session_string)
+        self.db = db
+        self._owner_id: Optional[int] = None
+        # peer_id -> (access_hash, username) de la última escritura
+        self._persisted = TTLCache(maxsize=PEER_PERSISTED_CACHE_SIZE, ttl=6 * 3600)
+        self._writes: Set[asyncio.Task] = set()
+
+    async def _owner(self) -> Optional[int]:
+        if self._owner_id is None:
+            self._owner_id = await self.user_id()
+        return self._owner_id
+
+    async def update_peers(self, peers: List[Tuple]):
+        await super().update_peers(peers)
+        owner_id = await self._owner()
+        if not owner_id:
+            return
+        changed = [peer for peer in peers if self._persisted.get(peer[0]) != (peer[1], peer[3])]
+        if not changed:
+            return
+        for peer in changed:
+            self._persisted.set(peer[0], (peer[1], peer[3]))
+        # La escritura no bloquea el procesamiento de updates de Pyrogram.
+        task = asyncio.create_task(self._persist(owner_id, changed))
+        self._writes.add(task)
+        task.add_done_callback(self._writes.discard)
+
+    async def _persist(self, owner_id: int, peers: List[Tuple]):
+        try:
+            await self.db.upsert_telegram_peers(owner_id, peers)
+            metrics.inc("telegram.peers.persisted", len(peers))
+        except Exception as e:
+            for peer in peers:
+                self._persisted.pop(peer[0])
+            logger.warning(f"[PEERS] No se pudieron guardar {len(peers)} peers: {e}")
+
+    async def _restore(self, doc: dict):
+        """Carga en la sesión en memoria un peer leído de la base de datos y devuelve su InputPeer."""
+        peer = (doc["peer_id"], doc["access_hash"], doc["type"], doc.get("username"), doc.get("phone_number"))
+        await super().update_peers([peer])
+        self._persisted.set(peer[0], (peer[1], peer[3]))
+        return get_input_peer(peer[0], peer[1], peer[2])
+
+    async def get_peer_by_id(self, peer_id: int):
+        try:
+            return await super().get_peer_by_id(peer_id)
+        except KeyError:
+            owner_id = await self._owner()
+            doc = await self.db.get_telegram_peer(owner_id, peer_id) if owner_id else None
+            if doc is None:
+                metrics.inc("telegram.peers.db_miss")
+                raise
+            metrics.inc("telegram.peers.db_hit")
+            return await self._restore(doc)
+
+    async def get_peer_by_username(self, username: str):
+        try:
+            return await super().get_peer_by_username(username)
+        except KeyError:
+            owner_id = await self._owner()
+            doc = await self.db.get_telegram_peer_by_username(owner_id, username) if owner_id else None
+            fresh_after = datetime.utcnow() - timedelta(seconds=PEER_USERNAME_TTL)
+            if doc is None or not doc.get("updated_at") or doc["updated_at"] < fresh_after:
+                metrics.inc("telegram.peers.db_miss")
+                raise
+            metrics.inc("telegram.peers.db_hit")
+            return await self._restore(doc)
+
+    async def close(self):
+        if self._writes:
+            await asyncio.gather(*self._writes, return_exceptions=True)
+        await super().close()
+
+
+def use_persistent_peer_storage(client: Client) -> Client:
+    """
+    Sustituye el almacenamiento en memoria de un cliente con session string o in_memory por
+    PersistentPeerStorage. Debe llamarse antes de client.start(). Los clientes con fichero de
+    sesión ya conservan sus peers y se dejan como están.
+    """
+    if isinstance(client.storage, MemoryStorage) and not isinstance(client.storage, PersistentPeerStorage):
+        client.storage = PersistentPeerStorage(client.name, client.session_string)
+    return client
+
+
+async def seed_peers_from_dialogs(client: Client) -> int:
+    """
+    Primera ejecución de una cuenta: recorre sus diálogos una vez para poblar el almacén
+    (update_peers persiste cada página). Si la cuenta ya tiene peers guardados no hace nada.
+    """
+    storage = client.storage
+    if not isinstance(storage, PersistentPeerStorage):
+        return 0
+    owner_id = await storage._owner()
+    if not owner_id or await storage.db.has_telegram_peers(owner_id):
+        return 0
+    count = 0
+    async for _ in client.get_dialogs():
+        count += 1
+    logger.info(f"[PEERS] Almacén de peers inicializado con {count} diálogos de la cuenta {owner_id}.")
+    return count
@@ -11,6 +11,8 @@ from src.db.mongo_manager import db_instance
 from src.helpers.messages import BotMessages
 from src.helpers.keyboards import build_cancel_button
 from src.core.task_processor import TaskProcessor
+from src.core.cancellation import cancellation_registry
+from src.helpers.outbound import outbound, PRIORITY_STATUS, PRIORITY_PROGRESS
 
 logger = logging.getLogger(__name__)
 
@@ -53,6 +55,7 @@ class ProcessingManager:
             return False
             
         self.active_tasks[task_id]['cancel_requested'] = True
+        cancellation_registry.cancel(task_id)
         return True
         
     async def update_task_status(self, client: Client, task_id: str, status: str, details: Optional[str] = None) -> None:
@@ -63,12 +66,12 @@ class ProcessingManager:
         task_info = self.active_tasks[task_id]
         try:
             keyboard = build_cancel_button(task_id) if status == "processing" else None
-            await client.edit_message_text(
-                chat_id=task_info['chat_id'],
-                message_id=task_info['message_id'],
-                text=f"{status}\n{details if details else ''}",
+            await outbound.edit(
+                client, task_info['chat_id'], task_info['message_id'],
+                f"{status}\n{details if details else ''}",
                 reply_markup=keyboard,
-                parse_mode=ParseMode.HTML
+                parse_mode=ParseMode.HTML,
+                priority=PRIORITY_STATUS
             )
         except Exception as e:
             logger.error(f"Error updating task status: {e}")
@@ -100,16 +103,12 @@ class ProcessingManager:
         
         progress_msg = BotMessages.processing_status(current, total, action, speed, eta, elapsed)
         
-        try:
-            keyboard = build_cancel_button(task_id)
-            await client.edit_message_text(
-                chat_id=task_info['chat_id'],
-                message_id=task_info['message_id'],
-                text=progress_msg,
-                reply_markup=keyboard,
-                parse_mode=ParseMode.HTML
-            )
-        except Exception as e:
-            logger.debug(f"Error updating progress: {e}")
+        # No se espera la entrega: el planificador agrupa las actualizaciones por mensaje.
+        outbound.edit(
+            client, task_info['chat_id'], task_info['message_id'], progress_msg,
+            reply_markup=build_cancel_button(task_id),
+            parse_mode=ParseMode.HTML,
+            priority=PRIORITY_PROGRESS
+        )
 
 processing_manager = ProcessingManager()
\ No newline at end of file
@@ -0,0 +1,295 @@
+# --- START OF FILE src/core/progress_bus.py ---
+
+import asyncio
+import logging
+import math
+import os
+import time
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Sequence
+
+from pyrogram.errors import MessageNotModified
+
+from src.db.mongo_manager import db_instance
+from src.helpers.metrics import metrics
+from src.helpers.outbound import outbound, PRIORITY_PROGRESS
+from src.helpers.utils import format_status_message
+
+logger = logging.getLogger(__name__)
+
+# Cada cuánto se convierte un callback de progreso en evento (segundos).
+PROGRESS_SAMPLE_INTERVAL = float(os.getenv("PROGRESS_SAMPLE_INTERVAL", "1.5"))
+# Peso de la última muestra en la media móvil exponencial de la velocidad.
+PROGRESS_EWMA_ALPHA = float(os.getenv("PROGRESS_EWMA_ALPHA", "0.3"))
+# Cada cuánto se escribe el progreso en el documento de la tarea (segundos).
+PROGRESS_DOC_INTERVAL = float(os.getenv("PROGRESS_DOC_INTERVAL", "10"))
+
+
+@dataclass
+class ProgressEvent:
+    """Muestra de progreso de una etapa (o texto de estado si `text` no es None)."""
+    task_id: str
+    user_id: Optional[int]
+    title: str
+    status_tag: str
+    engine: str
+    file_info: Optional[str]
+    current: float
+    total: float
+    percentage: float
+    speed: float
+    eta: float
+    elapsed: float
+    final: bool = False
+    text: Optional[str] = None
+
+
+class ProgressSink(ABC):
+    """Destino de los eventos de un contexto. emit() no debe bloquear: se llama en el bucle."""
+
+    @abstractmethod
+    def emit(self, ctx: "ProgressContext", event: ProgressEvent): ...
+
+    async def close(self, ctx: "ProgressContext"):
+        pass
+
+
+def format_progress_event(event: ProgressEvent) -> str:
+    return format_status_message(
+        operation_title=event.title,
+        percentage=event.percentage,
+        processed_bytes=event.current,
+        total_bytes=event.total,
+        speed=event.speed,
+        eta=event.eta,
+        elapsed=event.elapsed,
+        status_tag=event.status_tag,
+        engine=event.engine,
+        user_id=event.user_id,
+        file_info=event.file_info
+    )
+
+
+class TelegramStatusSink(ProgressSink):
+    """Edita el mensaje de estado a través del planificador de salida (solo el último texto)."""
+
+    def __init__(self, message, formatter: Optional[Callable[[ProgressEvent], str]] = None, client=None):
+        self.message = message
+        self.client = client or message._client
+        self.formatter = formatter or format_progress_event
+        self._last_text = ""
+
+    def emit(self, ctx, event):
+        if self.message is None:
+            return
+        text = event.text if event.text is not None else self.formatter(event)
+        if not text or text == self._last_text:
+            return
+        self._last_text = text
+        message = self.message
+        # Sin parse_mode explícito: el modo por defecto del cliente ya interpreta el HTML.
+        delivery = outbound.edit(self.client, message.chat.id, message.id, text, priority=PRIORITY_PROGRESS)
+
+        def _on_delivered(future):
+            error = future.exception()
+            if error is None or isinstance(error, MessageNotModified):
+                return
+            if "MESSAGE_ID_INVALID" in str(error):
+                logger.warning(f"No se pudo editar el mensaje de estado de la tarea {ctx.task_id} (ID: {message.id}). Probablemente fue borrado.")
+                if self.message is message:
+                    self.message = None
+            else:
+                logger.error(f"Error al editar el mensaje de estado de la tarea {ctx.task_id}: {error}")
+
+        delivery.add_done_callback(_on_delivered)
+
+
+class MetricsSink(ProgressSink):
+    """Gauges por tarea mientras dura y un histograma de velocidad por motor al cerrar cada etapa."""
+
+    def emit(self, ctx, event):
+        if event.text is not None:
+            return
+        prefix = f"progress.task.{ctx.task_id}."
+        metrics.set_gauge(prefix + "percentage", round(event.percentage, 1))
+        metrics.set_gauge(prefix + "speed", event.speed)
+        metrics.set_gauge(prefix + "eta", event.eta if math.isfinite(event.eta) else -1)
+        if event.final and event.elapsed > 0:
+            metrics.observe(f"progress.speed.{event.engine.lower() or 'unknown'}", event.current / event.elapsed)
+
+    async def close(self, ctx):
+        metrics.remove_prefix(f"progress.task.{ctx.task_id}.")
+
+
+class TaskDocumentSink(ProgressSink):
+    """Copia el progreso en el documento de la tarea como telemetría, como mucho cada PROGRESS_DOC_INTERVAL."""
+
+    def __init__(self, interval: float = PROGRESS_DOC_INTERVAL):
+        self.interval = interval
+        self._last_write = 0.0
+        self._writes: set = set()
+
+    def emit(self, ctx, event):
+        now = time.monotonic()
+        if event.text is None and not event.final and now - self._last_write < self.interval:
+            return
+        self._last_write = now
+        progress = {
+            "stage": event.text if event.text is not None else event.title,
+            "percentage": round(event.percentage, 1),
+            "current": event.current,
+            "total": event.total,
+            "speed": event.speed,
+            "eta": event.eta if math.isfinite(event.eta) else None,
+            "updated_at": datetime.utcnow(),
+        }
+        task = asyncio.create_task(db_instance.write_task_telemetry(ctx.task_id, {"progress": progress}))
+        self._writes.add(task)
+        task.add_done_callback(self._writes.discard)
+
+    async def close(self, ctx):
+        if self._writes:
+            await asyncio.gather(*self._writes, return_exceptions=True)
+
+
+def task_sinks(message) -> List[ProgressSink]:
+    """Destinos de una tarea de la cola: mensaje de estado, métricas y documento de la tarea."""
+    return [TelegramStatusSink(message), MetricsSink(), TaskDocumentSink()]
+
+
+class ProgressContext:
+    """
+    Progreso de una tarea. Los callbacks crudos (Pyrogram, FFmpeg) llegan a update(); solo uno
+    cada PROGRESS_SAMPLE_INTERVAL se convierte en evento, con velocidad suavizada (EWMA) y ETA,
+    y se reparte a los sinks.
+    """
+
+    def __init__(self, task_id: str, user_id: Optional[int] = None, sinks: Sequence[ProgressSink] = (),
+                 cancel_token=None, client=None):
+        self.task_id = task_id
+        self.user_id = user_id
+        self.sinks = list(sinks)
+        self.cancel_token = cancel_token
+        self.client = client
+        self.started = time.monotonic()
+        self.stage("")
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def stage(self, title: str, status_tag: str = "", engine: str = "", file_info: Optional[str] = None,
+              total: float = 0):
+        """Empieza una etapa nueva (descarga, FFmpeg, subida...): reinicia el cronómetro y la velocidad."""
+        self.title, self.status_tag, self.engine, self.file_info = title, status_tag, engine, file_info
+        self.total = total
+        self.stage_started = time.monotonic()
+        self._last_sample_at = self.stage_started
+        self._last_current = 0.0
+        self._speed: Optional[float] = None
+        self._finished = False
+
+    def raise_if_cancelled(self):
+        if self.cancel_token:
+            self.cancel_token.raise_if_cancelled()
+
+    def text(self, text: str):
+        """Publica un texto de estado sin progreso (p. ej. 'Descargando subtítulos...')."""
+        self._fan_out(ProgressEvent(self.task_id, self.user_id, self.title, self.status_tag, self.engine,
+                                    self.file_info, 0, 0, 0, 0, math.inf, self.elapsed, text=text))
+
+    async def update(self, current: float, total: Optional[float] = None):
+        """Muestra cruda de la etapa actual. Solo se emite si toca por intervalo o si la etapa acaba."""
+        if total:
+            self.total = total
+        total = self.total
+        if total > 0 and current > total:
+            current = total
+        final = total > 0 and current >= total
+        now = time.monotonic()
+        if self._finished or (not final and now - self._last_sample_at < PROGRESS_SAMPLE_INTERVAL):
+            return
+
+        window = now - self._last_sample_at
+        if window > 0:
+            rate = (current - self._last_current) / window
+            self._speed = rate if self._speed is None else PROGRESS_EWMA_ALPHA * rate + (1 - PROGRESS_EWMA_ALPHA) * self._speed
+        self._last_sample_at, self._last_current = now, current
+        self._finished = final
+
+        speed = max(self._speed or 0.0, 0.0)
+        eta = (total - current) / speed if speed > 0 and total > 0 else (0.0 if final else math.inf)
+        self._fan_out(ProgressEvent(
+            self.task_id, self.user_id, self.title, self.status_tag, self.engine, self.file_info,
+            current, total, (current / total) * 100 if total > 0 else 0, speed, eta,
+            now - self.stage_started, final=final
+        ))
+
+    async def pyrogram_callback(self, current: int, total: int, title: str, status: str, db_total_size: int,
+                                file_info: Optional[str] = None, engine: str = "Pyrogram"):
+        """
+        Callback de progreso para Pyrogram. Es asíncrono, así que Pyrogram lo espera en el propio
+        bucle: no hay salto de hilo por bloque. La etapa cambia sola al cambiar el título o el archivo.
+        """
+        if self.cancel_token and self.client is not None:
+            self.cancel_token.stop_transmission_if_cancelled(self.client)
+        if (title, status, file_info, engine) != (self.title, self.status_tag, self.file_info, self.engine):
+            self.stage(title, status, engine, file_info)
+        await self.update(current, total if total > 0 else db_total_size)
+
+    def _fan_out(self, event: ProgressEvent):
+        for sink in self.sinks:
+            try:
+                sink.emit(self, event)
+            except Exception as e:
+                logger.error(f"[PROGRESS] El sink {type(sink).__name__} falló en la tarea {self.task_id}: {e}")
+
+
+class ProgressBus:
+    """Registro de contextos de progreso indexado por task_id."""
+
+    def __init__(self):
+        self._contexts: Dict[str, ProgressContext] = {}
+
+    def open(self, task_id: str, *, user_id: Optional[int] = None, sinks: Sequence[ProgressSink] = (),
+             cancel_token=None, client=None) -> ProgressContext:
+        if task_id in self._contexts:
+            logger.warning(f"[PROGRESS] La tarea {task_id} ya tenía un contexto abierto; se reemplaza.")
+        ctx = ProgressContext(task_id, user_id, sinks, cancel_token, client)
+        self._contexts[task_id] = ctx
+        metrics.set_gauge("progress.contexts", len(self._contexts))
+        return ctx
+
+    def get(self, task_id: str) -> Optional[ProgressContext]:
+        return self._contexts.get(task_id)
+
+    async def close(self, task_id: str, ctx: Optional[ProgressContext] = None):
+        """Quita el contexto (si sigue siendo `ctx`, cuando se indica) y cierra sus sinks."""
+        current = self._contexts.get(task_id)
+        if ctx is None or current is ctx:
+            self._contexts.pop(task_id, None)
+            metrics.set_gauge("progress.contexts", len(self._contexts))
+        ctx = ctx or current
+        if ctx is None:
+            return
+        for sink in ctx.sinks:
+            try:
+                await sink.close(ctx)
+            except Exception as e:
+                logger.error(f"[PROGRESS] Error cerrando el sink {type(sink).__name__} de la tarea {task_id}: {e}")
+
+    @asynccontextmanager
+    async def track(self, task_id: str, **kwargs):
+        """Abre el contexto de la tarea y lo cierra al salir, pase lo que pase."""
+        ctx = self.open(task_id, **kwargs)
+        try:
+            yield ctx
+        finally:
+            await self.close(task_id, ctx)
+
+
+# Instancia singleton para ser usada en todo el proyecto.
+progress_bus = ProgressBus()
@@ -6,6 +6,9 @@ from typing import Optional, Tuple, Dict
 
 from pyrogram import Client
 from src.db.mongo_manager import db_instance
+from src.helpers.peer_cache import peer_cache
+from src.core.peer_storage import use_persistent_peer_storage
+from src.core.userbot_pool import userbot_pool
 
 logger = logging.getLogger(__name__)
 
@@ -19,6 +22,10 @@ class UserbotHandler:
 
     async def ensure_client(self) -> Optional[Client]:
         """Asegura que el cliente del userbot esté iniciado."""
+        # Con el pool en marcha se usa su cuenta menos cargada en vez de abrir otra sesión.
+        if userbot_pool.accounts:
+            return (await userbot_pool.pick()).client
+
         if not all([self.api_id, self.api_hash, self.session_string]):
             logger.error("Faltan credenciales para el userbot")
             return None
@@ -32,6 +39,7 @@ class UserbotHandler:
                     session_string=self.session_string,
                     in_memory=True
                 )
+                use_persistent_peer_storage(self._client)
                 await self._client.start()
                 logger.info("Cliente userbot iniciado exitosamente")
             except Exception as e:
@@ -58,7 +66,7 @@ class UserbotHandler:
 
         try:
             # Intentar obtener información del chat
-            chat = await client.get_chat(channel_identifier)
+            chat = await peer_cache.get_chat(client, channel_identifier)
             
             # Verificar si es un canal
             if not chat.type.name.endswith("CHANNEL"):
@@ -67,7 +75,7 @@ class UserbotHandler:
 
             # Verificar si ya somos miembros
             try:
-                member = await client.get_chat_member(chat.id, "me")
+                member = await peer_cache.get_chat_member(client, chat.id, "me")
                 if member.status.name == "LEFT":
                     # Intentar unirse si no somos miembros
                     if chat.username:  # Canal público
@@ -79,7 +87,8 @@ class UserbotHandler:
                         await client.join_chat(channel_identifier)
                     
                     # Verificar que la unión fue exitosa
-                    member = await client.get_chat_member(chat.id, "me")
+                    peer_cache.invalidate_chat(client, chat.id)
+                    member = await peer_cache.get_chat_member(client, chat.id, "me")
                     if member.status.name == "LEFT":
                         logger.error(f"No se pudo unir al canal {chat.id}")
                         return None, None
@@ -0,0 +1,288 @@
+# --- START OF FILE src/core/userbot_pool.py ---
+
+import asyncio
+import inspect
+import logging
+import os
+import re
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Iterable, List, Optional, Union
+
+from pyrogram import Client
+from pyrogram.enums import ParseMode
+from pyrogram.errors import FloodWait, UserAlreadyParticipant
+
+from src.core.dc_warmup import probe_transfer, use_kept_media_sessions
+from src.core.peer_storage import use_persistent_peer_storage
+from src.helpers.metrics import metrics
+from src.helpers.peer_cache import peer_cache
+
+logger = logging.getLogger(__name__)
+
+# Cuentas secundarias (además de USERBOT_SESSION_STRING), separadas por comas o saltos de línea.
+USERBOT_SESSION_STRINGS = os.getenv("USERBOT_SESSION_STRINGS", "")
+# Descargas/subidas simultáneas por cuenta.
+USERBOT_MAX_TRANSFERS = int(os.getenv("USERBOT_MAX_TRANSFERS", "2"))
+# Segundos que se aparta a una cuenta cuya descarga quedó incompleta (Pyrogram no propaga el FloodWait).
+USERBOT_INCOMPLETE_BACKOFF = float(os.getenv("USERBOT_INCOMPLETE_BACKOFF", "60"))
+
+_MEDIA_ATTRIBUTES = ("video", "document", "audio", "animation", "voice", "video_note", "photo", "sticker")
+
+ChatRef = Union[int, str]
+
+
+def media_file_size(message) -> int:
+    """Tamaño en bytes del medio de un mensaje según Telegram (0 si no se conoce)."""
+    for attr in _MEDIA_ATTRIBUTES:
+        media = getattr(message, attr, None)
+        if media is not None:
+            return getattr(media, "file_size", 0) or 0
+    return 0
+
+
+class IncompleteDownloadError(Exception):
+    """La descarga terminó sin error pero el archivo no tiene el tamaño esperado (o no existe)."""
+
+
+class UserbotAccount:
+    """Una sesión del pool con su límite de transferencias y su estado de FloodWait."""
+
+    def __init__(self, client: Client, index: int):
+        self.client = client
+        self.index = index
+        self.name = f"ub{index}"
+        self.transfers = asyncio.Semaphore(USERBOT_MAX_TRANSFERS)
+        self.active = 0
+        self.flood_until = 0.0
+
+    @property
+    def throttled(self) -> bool:
+        return time.monotonic() < self.flood_until
+
+    @property
+    def load(self) -> float:
+        return self.active / max(USERBOT_MAX_TRANSFERS, 1)
+
+
+class UserbotPool:
+    """
+    Pool de cuentas userbot. El enrutador elige la cuenta menos cargada que no esté en FloodWait
+    y sea miembro del chat; si ninguna disponible lo es, une a una de ellas. Un FloodWait solo
+    aparta a la cuenta que lo recibe, el resto sigue atendiendo descargas.
+    """
+
+    def __init__(self):
+        self.accounts: List[UserbotAccount] = []
+
+    # --- Ciclo de vida ---
+
+    def build_clients(self, api_id: int, api_hash: str) -> List[Client]:
+        """Crea un cliente por session string configurado; el primero es la cuenta principal."""
+        sessions = [os.getenv("USERBOT_SESSION_STRING", "")]
+        sessions += [s for s in re.split(r"[\s,]+", USERBOT_SESSION_STRINGS) if s]
+        self.accounts = []
+        for session in dict.fromkeys(s for s in sessions if s):
+            index = len(self.accounts)
+            client = Client(
+                name="user_bot" if index == 0 else f"user_bot_{index}",
+                api_id=int(api_id),
+                api_hash=api_hash,
+                session_string=session,
+                parse_mode=ParseMode.HTML,
+                # Solo la principal recibe updates: es la que atiende los canales monitoreados.
+                no_updates=index != 0
+            )
+            use_persistent_peer_storage(client)
+            use_kept_media_sessions(client)
+            self.accounts.append(UserbotAccount(client, index))
+        return [account.client for account in self.accounts]
+
+    async def start(self):
+        """Arranca las cuentas. Si falla una secundaria se descarta; si falla la principal, se propaga."""
+        started = []
+        for account in self.accounts:
+            try:
+                await account.client.start()
+                me = await peer_cache.get_me(account.client)
+                logger.info(f"[USERBOT_POOL] Cuenta {account.name} iniciada: {me.first_name} ({me.id}).")
+                started.append(account)
+            except Exception as e:
+                if account.index == 0:
+                    raise
+                logger.error(f"[USERBOT_POOL] No se pudo iniciar la cuenta {account.name}: {e}")
+        self.accounts = started
+        metrics.set_gauge("userbot.pool.accounts", len(self.accounts))
+
+    async def stop(self):
+        for account in self.accounts:
+            try:
+                if account.client.is_initialized:
+                    await account.client.stop()
+            except Exception as e:
+                logger.error(f"[USERBOT_POOL] Error deteniendo la cuenta {account.name}: {e}")
+
+    @property
+    def primary(self) -> Optional[UserbotAccount]:
+        return self.accounts[0] if self.accounts else None
+
+    def account_for(self, client: Client) -> Optional[UserbotAccount]:
+        return next((account for account in self.accounts if account.client is client), None)
+
+    # --- Enrutado ---
+
+    def report_flood(self, account: UserbotAccount, seconds: float):
+        account.flood_until = max(account.flood_until, time.monotonic() + seconds)
+        metrics.inc(f"userbot.{account.name}.floodwait")
+        metrics.inc(f"userbot.{account.name}.flood_seconds", seconds)
+        logger.warning(f"[USERBOT_POOL] Cuenta {account.name} en FloodWait {seconds}s: se enruta a las demás.")
+
+    def report_incomplete(self, account: UserbotAccount, path: Optional[str], expected: int):
+        """
+        Descarga truncada o sin archivo. Pyrogram 2.0.106 registra y descarta cualquier error de
+        get_file (también un FloodWait largo), así que esto es lo único que se ve: se aparta a la
+        cuenta USERBOT_INCOMPLETE_BACKOFF segundos y se borra el archivo parcial.
+        """
+        account.flood_until = max(account.flood_until, time.monotonic() + USERBOT_INCOMPLETE_BACKOFF)
+        metrics.inc(f"userbot.{account.name}.incomplete_downloads")
+        got = os.path.getsize(path) if path and os.path.exists(path) else None
+        logger.warning(f"[USERBOT_POOL] Descarga incompleta con la cuenta {account.name} "
+                       f"({got} de {expected} bytes): se reintenta con otra cuenta.")
+        if got is not None:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    async def is_member(self, account: UserbotAccount, chat_id: ChatRef) -> bool:
+        try:
+            member = await peer_cache.get_chat_member(account.client, chat_id, "me")
+        except Exception:
+            return False
+        return member.status.name not in ("LEFT", "BANNED")
+
+    async def pick(self, chat_id: Optional[ChatRef] = None, join_ref: Optional[str] = None,
+                   exclude: Iterable[UserbotAccount] = ()) -> UserbotAccount:
+        """
+        Cuenta para operar sobre `chat_id`: la menos cargada, fuera de FloodWait y miembro del chat.
+        Si ninguna disponible es miembro y hay `join_ref` (username o enlace de invitación), une a la
+        menos cargada. Si todas están en FloodWait devuelve la que antes sale de él.
+        """
+        if not self.accounts:
+            raise RuntimeError("No hay cuentas userbot configuradas.")
+        excluded = set(id(account) for account in exclude)
+        pool = [account for account in self.accounts if id(account) not in excluded] or self.accounts
+        available = sorted((a for a in pool if not a.throttled), key=lambda a: (a.load, a.index))
+        if not available:
+            return min(pool, key=lambda a: a.flood_until)
+        if chat_id is None:
+            return available[0]
+
+        for account in available:
+            if await self.is_member(account, chat_id):
+                return account
+
+        if join_ref:
+            for account in available:
+                if await self.join(account, join_ref):
+                    return account
+        return available[0]
+
+    async def join(self, account: UserbotAccount, join_ref: str) -> bool:
+        try:
+            chat = await account.client.join_chat(join_ref)
+            peer_cache.invalidate_chat(account.client, chat.id)
+        except UserAlreadyParticipant:
+            pass
+        except FloodWait as e:
+            self.report_flood(account, e.value)
+            return False
+        except Exception as e:
+            logger.warning(f"[USERBOT_POOL] La cuenta {account.name} no pudo unirse a {join_ref}: {e}")
+            return False
+        peer_cache.invalidate_chat(account.client, join_ref)
+        metrics.inc(f"userbot.{account.name}.joins")
+        logger.info(f"[USERBOT_POOL] Cuenta {account.name} unida a {join_ref}.")
+        return True
+
+    # --- Transferencias ---
+
+    @asynccontextmanager
+    async def transfer(self, account: UserbotAccount):
+        """Reserva un hueco de transferencia de la cuenta y anota un FloodWait si se produce."""
+        async with account.transfers:
+            account.active += 1
+            metrics.set_gauge(f"userbot.{account.name}.active", account.active)
+            try:
+                yield account
+            except FloodWait as e:
+                self.report_flood(account, e.value)
+                raise
+            finally:
+                account.active -= 1
+                metrics.set_gauge(f"userbot.{account.name}.active", account.active)
+
+    def record_transfer(self, account: UserbotAccount, direction: str, nbytes: int, seconds: float):
+        metrics.inc(f"userbot.{account.name}.{direction}_bytes", nbytes)
+        if seconds > 0 and nbytes:
+            metrics.observe(f"userbot.{account.name}.{direction}_mbps", nbytes * 8 / seconds / 1_000_000)
+
+    async def download_media(self, message, join_ref: Optional[str] = None,
+                             on_account: Optional[Callable[[UserbotAccount], Any]] = None,
+                             cancel_token=None, **kwargs) -> tuple:
+        """
+        Descarga el medio de `message` con la cuenta que lo obtuvo o, si está en FloodWait, con otra
+        cuenta miembro del chat (volviendo a pedir el mensaje). Un FloodWait durante la transferencia
+        no llega como excepción (Pyrogram lo descarta y devuelve un archivo truncado o None), así que
+        cada intento se valida contra el file_size del medio; si no cuadra, la cuenta se aparta y se
+        reintenta con otra.
+        `on_account(account)` devuelve (o una corrutina que devuelve) los kwargs extra de esa cuenta
+        (p. ej. progress_args).
+        Con `cancel_token`, una descarga que vuelve vacía porque se canceló (stop_transmission también
+        devuelve None) lanza TaskCancelledError: no se aparta la cuenta ni se reintenta.
+        Devuelve (ruta, cuenta usada).
+        """
+        chat_id, message_id = message.chat.id, message.id
+        progress = kwargs.pop("progress", None)
+        tried: List[UserbotAccount] = []
+        account = self.account_for(message._client)
+        last_error: Optional[BaseException] = None
+        for _ in range(len(self.accounts)):
+            if cancel_token:
+                cancel_token.raise_if_cancelled()
+            if account is None or account.throttled or account in tried:
+                account = await self.pick(chat_id, join_ref, exclude=tried)
+                if account in tried:
+                    break
+            tried.append(account)
+            try:
+                target = message if message._client is account.client else await account.client.get_messages(chat_id, message_id)
+                extra = on_account(account) if on_account else {}
+                if inspect.isawaitable(extra):
+                    extra = await extra
+                probe = probe_transfer(account.client, "userbot", target)
+                async with self.transfer(account):
+                    started = time.monotonic()
+                    path = await account.client.download_media(target, progress=probe.wrap(progress), **kwargs, **extra)
+                if cancel_token and cancel_token.cancelled:
+                    if path and os.path.exists(path):
+                        os.remove(path)
+                    cancel_token.raise_if_cancelled()
+                expected = media_file_size(target)
+                if not path or not os.path.exists(path) or (expected and os.path.getsize(path) != expected):
+                    self.report_incomplete(account, path, expected)
+                    last_error = IncompleteDownloadError(f"Descarga incompleta con la cuenta {account.name}.")
+                    account = None
+                    continue
+                self.record_transfer(account, "download", os.path.getsize(path), time.monotonic() - started)
+                return path, account
+            except FloodWait as e:
+                last_error = e
+                account = None
+        if last_error is not None:
+            raise last_error
+        raise RuntimeError("Ninguna cuenta userbot pudo descargar el mensaje.")
+
+
+# Instancia singleton para ser usada en todo el proyecto.
+userbot_pool = UserbotPool()
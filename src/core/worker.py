@@ -4,114 +4,81 @@ import logging
 import time
 import os
 import asyncio
-import re
 import shutil
-from datetime import datetime
 from zipfile import ZipFile, ZIP_DEFLATED
 from pyrogram.enums import ParseMode
-from bson.objectid import ObjectId
-from typing import Dict, List, Optional
+from pyrogram.errors import MessageNotModified
+from typing import List
 
 from src.db.mongo_manager import db_instance
-from src.helpers.utils import (format_status_message, sanitize_filename,
-                               escape_html, _edit_status_message,
-                               generate_summary_caption)
+from src.helpers.utils import sanitize_filename, escape_html, generate_summary_caption
 from src.core import ffmpeg
 from src.core import downloader
 from src.core.ffmpeg import get_media_info
+from src.core.ffmpeg_supervisor import run_ffmpeg
+from src.core.audio_batch import audio_batch, is_stream_copy
+from src.core.cancellation import cancellation_registry
+from src.core.exceptions import TaskCancelledError
+from src.helpers.outbound import outbound, PRIORITY_STATUS
+from src.core.userbot_pool import userbot_pool
+from src.core.progress_bus import progress_bus, ProgressContext, task_sinks
+from src.core.dc_warmup import probe_transfer
 
 logger = logging.getLogger(__name__)
 DOWNLOAD_DIR = os.path.join(os.getcwd(), "downloads")
 OUTPUT_DIR = os.path.join(os.getcwd(), "outputs")
 
-class ProgressContext:
-    def __init__(self, bot, message, task, loop):
-        self.bot, self.message, self.task, self.loop = bot, message, task, loop
-        self.start_time, self.last_update_time, self.last_update_text = time.time(), 0, ""
-    def reset_timer(self):
-        self.start_time, self.last_update_time = time.time(), 0
-
-progress_tracker: Dict[int, ProgressContext] = {}
-
-def _progress_callback_pyrogram(
-    current: int,
-    total: int,
-    user_id: int,
-    title: str,
-    status: str,
-    db_total_size: int,
-    file_info: Optional[str] = None
-):
-    ctx = progress_tracker.get(user_id)
-    if not ctx: return
-    final_total = total if total > 0 else db_total_size
-    if current > final_total: current = final_total
-    now = time.time()
-    if now - ctx.last_update_time < 1.5 and current < final_total: return
-    ctx.last_update_time = now
-    elapsed = now - ctx.start_time
-    speed = current / elapsed if elapsed > 0 else 0
-    eta = (final_total - current) / speed if current > 0 and speed > 0 else float('inf')
-    percentage = (current / final_total) * 100 if final_total > 0 else 0
-    text = format_status_message(
-        operation_title=title,
-        percentage=percentage,
-        processed_bytes=current,
-        total_bytes=final_total,
-        speed=speed,
-        eta=eta,
-        elapsed=elapsed,
-        status_tag=status,
-        engine="Pyrogram",
-        user_id=user_id,
-        file_info=file_info
-    )
-    coro = _edit_status_message(user_id, text, progress_tracker)
-    asyncio.run_coroutine_threadsafe(coro, ctx.loop)
-
-async def _run_command_with_progress(user_id: int, command: List[str], input_path: str):
-    media_info = get_media_info(input_path)
+async def _run_command_with_progress(progress: ProgressContext, task: dict, command: List[str], input_path: str, media_info: dict):
     try: duration = float(media_info.get("format", {}).get("duration", "0"))
     except (TypeError, ValueError): duration = 0
-    time_pattern, ctx = re.compile(r"time=(\d{2}):(\d{2}):(\d{2})\.(\d{2})"), progress_tracker.get(user_id)
-    if not ctx: return
-    ctx.reset_timer()
-    file_info = os.path.basename(input_path)
-    process = await asyncio.create_subprocess_exec(*command, stderr=asyncio.subprocess.PIPE)
-    all_stderr_lines = []
-    async for line in process.stderr:
-        log_line = line.decode('utf-8', 'ignore')
-        all_stderr_lines.append(log_line)
-        if match := time_pattern.search(log_line):
-            if duration > 0:
-                now = time.time()
-                if now - ctx.last_update_time < 1.5: continue
-                ctx.last_update_time = now
-                h, m, s, cs = map(int, match.groups())
-                processed_time = h * 3600 + m * 60 + s + cs / 100
-                if processed_time > duration: processed_time = duration
-                percentage, elapsed = (processed_time / duration) * 100, now - ctx.start_time
-                speed = processed_time / elapsed if elapsed > 0 else 0
-                eta = (duration - processed_time) / speed if speed > 0 else float('inf')
-                text = format_status_message(
-                    operation_title="→ Processing ...",
-                    percentage=percentage,
-                    processed_bytes=processed_time,
-                    total_bytes=duration,
-                    speed=speed,
-                    eta=eta,
-                    elapsed=elapsed,
-                    status_tag="#Processing - #FFmpeg",
-                    engine="FFmpeg",
-                    user_id=user_id,
-                    file_info=file_info
-                )
-                await _edit_status_message(user_id, text, progress_tracker)
-    await process.wait()
-    if process.returncode != 0:
-        raise Exception(f"FFmpeg falló con código {process.returncode}. Log:\n{''.join(all_stderr_lines[-10:])}") # Solo los últimos 10 logs
+    progress.stage("→ Processing ...", "#Processing - #FFmpeg", "FFmpeg", os.path.basename(input_path), total=duration)
+
+    async def _on_progress(processed_time: float):
+        if duration > 0: await progress.update(processed_time)
+
+    result = await run_ffmpeg(command, duration=duration, on_progress=_on_progress, cancel_token=progress.cancel_token)
+    await _record_ffmpeg_stats(task, result)
+    result.raise_for_status()
+
+def _log_delivery_failure(future: asyncio.Future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.error(f"No se pudo entregar el mensaje final de una tarea: {future.exception()}")
+
+def _deliver_final_status(bot, user_id: int, status_message, text: str, send_on_failure: bool = True):
+    """
+    Encola el texto final (cancelación o error) en el planificador de salida sin esperarlo: durante
+    una pausa global por FloodWait, esperar bloquearía la limpieza y el hueco del worker.
+    Si la edición falla y `send_on_failure`, se envía como mensaje nuevo.
+    """
+    def _send_new():
+        outbound.call(
+            user_id, lambda: bot.send_message(user_id, text, parse_mode=ParseMode.HTML), priority=PRIORITY_STATUS
+        ).add_done_callback(_log_delivery_failure)
+
+    if status_message is None:
+        if send_on_failure:
+            _send_new()
+        return
 
-async def _process_media_task(bot, task: dict, dl_dir: str):
+    def _on_delivered(future: asyncio.Future):
+        if future.cancelled() or future.exception() is None or isinstance(future.exception(), MessageNotModified):
+            return
+        if send_on_failure:
+            logger.warning(f"No se pudo editar el mensaje final para {user_id}: {future.exception()}. Enviando uno nuevo.")
+            _send_new()
+
+    outbound.edit_message(
+        status_message, text, parse_mode=ParseMode.HTML, priority=PRIORITY_STATUS
+    ).add_done_callback(_on_delivered)
+
+async def _record_ffmpeg_stats(task: dict, result):
+    """Guarda en el documento de la tarea el consumo de CPU y memoria del proceso FFmpeg."""
+    try:
+        await db_instance.write_task_telemetry(str(task['_id']), {"ffmpeg_stats": result.as_dict()})
+    except Exception as e:
+        logger.warning(f"No se pudieron guardar las estadísticas de FFmpeg: {e}")
+
+async def _process_media_task(bot, task: dict, dl_dir: str, progress: ProgressContext):
     user_id, config = task['user_id'], task.get('processing_config', {})
     original_filename = task.get('original_filename', 'archivo.mkv')
 
@@ -119,24 +86,45 @@ async def _process_media_task(bot, task: dict, dl_dir: str):
     if file_id := task.get('file_id'):
         actual_download_path = os.path.join(dl_dir, original_filename)
         db_total_size = task.get('file_metadata', {}).get('size', 0)
+        probe = probe_transfer(bot, "bot", file_id)
         await bot.download_media(
             file_id,
             file_name=actual_download_path,
-            progress=_progress_callback_pyrogram,
+            progress=probe.wrap(progress.pyrogram_callback),
             progress_args=(
-                user_id,
                 "↓ Downloading ...",
                 "#Download - #Telegram",
                 db_total_size,
                 os.path.basename(actual_download_path)
             )
         )
+    elif source := task.get('source'):
+        # Tareas importadas por lotes: el medio se descarga con el userbot desde el mensaje de origen.
+        actual_download_path = os.path.join(dl_dir, original_filename)
+        account = await userbot_pool.pick(source['chat_id'], join_ref=source.get('join_ref'))
+        source_message = await account.client.get_messages(source['chat_id'], source['message_id'])
+        if not source_message or source_message.empty:
+            raise FileNotFoundError("El mensaje de origen ya no existe.")
+        await userbot_pool.download_media(
+            source_message,
+            join_ref=source.get('join_ref'),
+            cancel_token=progress.cancel_token,
+            file_name=actual_download_path,
+            progress=progress.pyrogram_callback,
+            progress_args=(
+                "↓ Downloading ...",
+                "#Download - #Userbot",
+                task.get('file_metadata', {}).get('size', 0),
+                os.path.basename(actual_download_path)
+            )
+        )
     elif url := task.get('url'):
         base_path = os.path.join(dl_dir, sanitize_filename(task.get('final_filename', 'url_download')))
-        await _edit_status_message(user_id, "Descargando desde URL...", progress_tracker)
+        progress.text("Descargando desde URL...")
         actual_download_path = await asyncio.to_thread(downloader.download_from_url, url, base_path, config.get('download_format_id'))
-    else: raise ValueError("La tarea no contiene 'file_id' ni 'url'.")
+    else: raise ValueError("La tarea no contiene 'file_id', 'source' ni 'url'.")
 
+    progress.raise_if_cancelled()
     if not actual_download_path or not os.path.exists(actual_download_path):
         raise FileNotFoundError("La descarga del archivo principal falló.")
 
@@ -145,23 +133,23 @@ async def _process_media_task(bot, task: dict, dl_dir: str):
     watermark_path, watermark_text, replace_audio_path, audio_thumb_path, subs_path = None, None, None, None, None
     if wm_conf := config.get('watermark', {}):
         if wm_conf.get('type') == 'image' and (wm_id := wm_conf.get('file_id')):
-            await _edit_status_message(user_id, "Descargando marca de agua...", progress_tracker)
+            progress.text("Descargando marca de agua...")
             watermark_path = await bot.download_media(wm_id, file_name=os.path.join(dl_dir, "watermark_img"))
         elif wm_conf.get('type') == 'text':
             watermark_text = wm_conf.get('text')
 
     if audio_file_id := config.get('replace_audio_file_id'):
-        await _edit_status_message(user_id, "Descargando nuevo audio...", progress_tracker)
+        progress.text("Descargando nuevo audio...")
         replace_audio_path = await bot.download_media(audio_file_id, file_name=os.path.join(dl_dir, "new_audio"))
     if thumb_file_id := config.get('audio_thumbnail_file_id'):
-        await _edit_status_message(user_id, "Descargando carátula...", progress_tracker)
+        progress.text("Descargando carátula...")
         audio_thumb_path = await bot.download_media(thumb_file_id, file_name=os.path.join(dl_dir, "audio_thumb"))
     if subs_file_id := config.get('subs_file_id'):
-        await _edit_status_message(user_id, "Descargando subtítulos...", progress_tracker)
+        progress.text("Descargando subtítulos...")
         subs_path = await bot.download_media(subs_file_id, file_name=os.path.join(dl_dir, "subtitles.srt"))
 
     if config.get('gif_options'): output_extension = ".gif"
-    elif config.get('extract_audio'): output_extension = ".m4a"
+    elif config.get('extract_audio'): output_extension = ".m4a"  # build_ffmpeg_command la ajusta al códec real
     elif config.get('transcode'): output_extension = ".mp4"
     else: _, original_ext = os.path.splitext(original_filename); output_extension = original_ext if original_ext in ['.mp4', '.mkv', '.mov', '.webm', '.mp3', '.m4a', '.flac'] else ".mkv"
 
@@ -169,39 +157,51 @@ async def _process_media_task(bot, task: dict, dl_dir: str):
     output_path = os.path.join(OUTPUT_DIR, f"{final_filename_base}{output_extension}")
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
 
+    # ffprobe se ejecuta una sola vez y fuera del bucle de eventos; sirve para el comando y para el progreso.
+    media_info = await asyncio.to_thread(get_media_info, actual_download_path)
     command_groups, definitive_output_path = ffmpeg.build_ffmpeg_command(
         task=task, input_path=actual_download_path, output_path=output_path, watermark_path=watermark_path,
-        replace_audio_path=replace_audio_path, audio_thumb_path=audio_thumb_path, subs_path=subs_path
+        replace_audio_path=replace_audio_path, audio_thumb_path=audio_thumb_path, subs_path=subs_path,
+        media_info=media_info
     )
 
     if watermark_text:
         logger.info(f"Aplicando marca de agua de texto: {watermark_text}")
         # Aquí se puede añadir lógica para manejar marcas de agua de texto en FFmpeg
 
-    if command_groups: await _run_command_with_progress(user_id, command_groups[0], actual_download_path)
+    progress.raise_if_cancelled()
+    if command_groups and ffmpeg.is_stream_copy_audio_task(task) and is_stream_copy(command_groups[0]):
+        progress.text("Escribiendo audio sin recodificar...")
+        result = await audio_batch.submit(command_groups[0], cancel_token=progress.cancel_token)
+        progress.raise_if_cancelled()
+        await _record_ffmpeg_stats(task, result)
+        result.raise_for_status()
+    elif command_groups: await _run_command_with_progress(progress, task, command_groups[0], actual_download_path, media_info)
 
     if not os.path.exists(definitive_output_path):
         raise FileNotFoundError(f"FFmpeg finalizó pero el archivo de salida '{definitive_output_path}' no fue creado.")
 
     final_size = os.path.getsize(definitive_output_path)
     caption = generate_summary_caption(task, initial_size, final_size, os.path.basename(definitive_output_path))
-    ctx = progress_tracker.get(user_id)
-    if ctx: ctx.reset_timer()
 
     file_type = task.get('file_type', 'video')
 
     if definitive_output_path.endswith('.gif'): sender_func, kwargs = bot.send_animation, {'animation': definitive_output_path}
     elif file_type == 'video' and not config.get('extract_audio'): sender_func, kwargs = bot.send_video, {'video': definitive_output_path}
-    elif file_type == 'audio' or config.get('extract_audio'): sender_func, kwargs = bot.send_audio, {'audio': definitive_output_path}
+    elif file_type == 'audio' or config.get('extract_audio'):
+        sender_func, kwargs = bot.send_audio, {'audio': definitive_output_path}
+        tags = config.get('audio_tags') or {}
+        if tags.get('title'): kwargs['title'] = tags['title']
+        if tags.get('artist'): kwargs['performer'] = tags['artist']
+        if audio_thumb_path: kwargs['thumb'] = audio_thumb_path
     else: sender_func, kwargs = bot.send_document, {'document': definitive_output_path}
 
     await sender_func(
         user_id,
         caption=caption,
         parse_mode=ParseMode.HTML,
-        progress=_progress_callback_pyrogram,
+        progress=progress.pyrogram_callback,
         progress_args=(
-            user_id,
             "↑ Uploading ...",
             "#Upload - #Telegram",
             final_size,
@@ -209,35 +209,36 @@ async def _process_media_task(bot, task: dict, dl_dir: str):
         ),
         **kwargs
     )
+    progress.raise_if_cancelled()
     return definitive_output_path
 
-async def _process_join_task(bot, task: dict, dl_dir: str):
+async def _process_join_task(bot, task: dict, dl_dir: str, progress: ProgressContext):
     user_id, source_task_ids = task['user_id'], task.get('source_task_ids', [])
     if not source_task_ids: raise ValueError("Tarea de unión sin source_task_ids.")
-    await _edit_status_message(user_id, f"Iniciando unión de {len(source_task_ids)} videos...", progress_tracker)
+    progress.text(f"Iniciando unión de {len(source_task_ids)} videos...")
     file_list_path = os.path.join(dl_dir, "file_list.txt")
     with open(file_list_path, 'w', encoding='utf-8') as f:
         for i, tid in enumerate(source_task_ids):
             source_task = await db_instance.get_task(str(tid))
             if not source_task or not source_task.get('file_id'): continue
             filename, dl_path = sanitize_filename(source_task.get('original_filename', f'v_{i}.mp4')), os.path.join(dl_dir, f"{i}_{filename}")
-            await _edit_status_message(user_id, f"Descargando video {i+1}/{len(source_task_ids)}...", progress_tracker)
+            progress.text(f"Descargando video {i+1}/{len(source_task_ids)}...")
             await bot.download_media(source_task['file_id'], file_name=dl_path)
+            progress.raise_if_cancelled()
             f.write(f"file '{dl_path.replace('\'', '\\\'')}'\n")
     output_path = os.path.join(OUTPUT_DIR, f"{sanitize_filename(task.get('final_filename', 'union_video'))}.mp4")
     command = ["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", file_list_path, "-c", "copy", output_path]
-    await _edit_status_message(user_id, "Uniendo videos...", progress_tracker)
-    process = await asyncio.create_subprocess_exec(*command, stderr=asyncio.subprocess.PIPE)
-    _, stderr = await process.communicate()
-    if process.returncode != 0: raise Exception(f"FFmpeg (concat) falló: {stderr.decode()}")
+    progress.text("Uniendo videos...")
+    result = await run_ffmpeg(command, cancel_token=progress.cancel_token)
+    await _record_ffmpeg_stats(task, result)
+    result.raise_for_status()
     final_size = os.path.getsize(output_path)
     await bot.send_video(
         user_id,
         video=output_path,
         caption=f"✅ Unión de {len(source_task_ids)} videos completada.",
-        progress=_progress_callback_pyrogram,
+        progress=progress.pyrogram_callback,
         progress_args=(
-            user_id,
             "↑ Uploading ...",
             "#Upload - #Telegram",
             final_size,
@@ -246,7 +247,7 @@ async def _process_join_task(bot, task: dict, dl_dir: str):
     )
     return output_path
 
-async def _process_zip_task(bot, task: dict, dl_dir: str):
+async def _process_zip_task(bot, task: dict, dl_dir: str, progress: ProgressContext):
     user_id, source_task_ids = task['user_id'], task.get('source_task_ids', [])
     if not source_task_ids: raise ValueError("Tarea de compresión sin source_task_ids.")
     output_path = os.path.join(OUTPUT_DIR, f"{sanitize_filename(task.get('final_filename', 'comprimido'))}.zip")
@@ -255,18 +256,18 @@ async def _process_zip_task(bot, task: dict, dl_dir: str):
             source_task = await db_instance.get_task(str(tid))
             if not source_task or not source_task.get('file_id'): continue
             filename, dl_path = sanitize_filename(source_task.get('original_filename', f'f_{i}')), os.path.join(dl_dir, filename)
-            await _edit_status_message(user_id, f"Descargando para ZIP: {i+1}/{len(source_task_ids)}...", progress_tracker)
+            progress.text(f"Descargando para ZIP: {i+1}/{len(source_task_ids)}...")
             await bot.download_media(source_task['file_id'], file_name=dl_path)
-            await _edit_status_message(user_id, f"Añadiendo al ZIP: {filename}", progress_tracker)
+            progress.raise_if_cancelled()
+            progress.text(f"Añadiendo al ZIP: {filename}")
             zf.write(dl_path, arcname=filename)
     final_size = os.path.getsize(output_path)
     await bot.send_document(
         user_id,
         document=output_path,
         caption=f"✅ Compresión de {len(source_task_ids)} archivos completada.",
-        progress=_progress_callback_pyrogram,
+        progress=progress.pyrogram_callback,
         progress_args=(
-            user_id,
             "↑ Uploading ...",
             "#Upload - #Telegram",
             final_size,
@@ -299,6 +300,8 @@ async def process_task(bot, task: dict):
                 parse_mode=ParseMode.HTML
             )
             return
+
+    cancel_token = cancellation_registry.create(task_id)
     try:
         task = await db_instance.get_task(task_id)
         if not task: raise Exception("Tarea no encontrada.")
@@ -311,39 +314,40 @@ async def process_task(bot, task: dict):
         file_type = task.get('file_type', 'video')
         original_filename = task.get('original_filename') or task.get('url', 'Tarea sin nombre')
         status_message = await bot.send_message(user_id, "✅ Tarea recibida. Preparando...", parse_mode=ParseMode.HTML)
-        global progress_tracker; progress_tracker[user_id] = ProgressContext(bot, status_message, task, asyncio.get_running_loop())
+        progress = progress_bus.open(task_id, user_id=user_id, sinks=task_sinks(status_message),
+                                     cancel_token=cancel_token, client=bot)
         task_dir = os.path.join(DOWNLOAD_DIR, task_id); os.makedirs(task_dir, exist_ok=True); files_to_clean.add(task_dir)
 
         definitive_output_path = None
-        if file_type in ['video', 'audio', 'document']: definitive_output_path = await _process_media_task(bot, task, task_dir)
-        elif file_type == 'join_operation': definitive_output_path = await _process_join_task(bot, task, task_dir)
-        elif file_type == 'zip_operation': definitive_output_path = await _process_zip_task(bot, task, task_dir)
+        if file_type in ['video', 'audio', 'document']: definitive_output_path = await _process_media_task(bot, task, task_dir, progress)
+        elif file_type == 'join_operation': definitive_output_path = await _process_join_task(bot, task, task_dir, progress)
+        elif file_type == 'zip_operation': definitive_output_path = await _process_zip_task(bot, task, task_dir, progress)
         else: raise NotImplementedError(f"Tipo de tarea '{file_type}' no implementado.")
 
         if definitive_output_path: files_to_clean.add(definitive_output_path)
-        await db_instance.update_task(task_id, "status", "done")
+        await db_instance.finish_task(task_id, "done")
         # [FIX] Manejo seguro de la eliminación del mensaje de estado.
         if status_message:
             try: await status_message.delete()
             except Exception: pass
 
+    except TaskCancelledError as e:
+        logger.info(f"Tarea {task_id} detenida por cancelación: {e}")
+        await db_instance.finish_task(task_id, "cancelled")
+        cancel_text = f"🚫 <b>Tarea cancelada</b>\n<code>{escape_html(original_filename)}</code>"
+        _deliver_final_status(bot, user_id, status_message, cancel_text, send_on_failure=False)
+
     except Exception as e:
         logger.critical(f"Error procesando tarea {task_id}: {e}", exc_info=True)
         error_message = f"❌ <b>Error Fatal en Tarea</b>\n<code>{escape_html(original_filename)}</code>\n\n<b>Motivo:</b>\n<pre>{escape_html(str(e))}</pre>"
-        await db_instance.update_task(task_id, "status", "error")
-        await db_instance.update_task(task_id, "last_error", str(e))
+        # Si la tarea ya se canceló (cancel_task ya la contó), ni se pisa el estado ni se cuenta como error.
+        await db_instance.finish_task(task_id, "error", {"last_error": str(e)})
 
-        # [FIX] Manejo seguro de la edición/envío del mensaje de error.
-        if status_message:
-            try: await status_message.edit_text(error_message, parse_mode=ParseMode.HTML)
-            except Exception:
-                logger.warning(f"No se pudo editar mensaje de error para {user_id}. Enviando uno nuevo.")
-                await bot.send_message(user_id, error_message, parse_mode=ParseMode.HTML)
-        else:
-            await bot.send_message(user_id, error_message, parse_mode=ParseMode.HTML)
+        _deliver_final_status(bot, user_id, status_message, error_message)
 
     finally:
-        if user_id in progress_tracker: del progress_tracker[user_id]
+        cancellation_registry.release(task_id)
+        await progress_bus.close(task_id)
         for fpath in files_to_clean:
             try:
                 if os.path.isdir(fpath): shutil.rmtree(fpath, ignore_errors=True)
@@ -352,7 +356,7 @@ async def process_task(bot, task: dict):
 
 async def process_restricted_content(bot, task: dict) -> None:
     """Procesa contenido de canales restringidos"""
-    user_id = task['user_id']
+    user_id, task_id = task['user_id'], str(task['_id'])
     message_link = task.get('message_link')
     status_message = None
     
@@ -367,6 +371,7 @@ async def process_restricted_content(bot, task: dict) -> None:
             "🔄 <b>Procesando contenido restringido...</b>",
             parse_mode=ParseMode.HTML
         )
+        progress = progress_bus.open(task_id, user_id=user_id, sinks=task_sinks(status_message), client=bot)
         
         # Intentar obtener el mensaje
         try:
@@ -384,13 +389,15 @@ async def process_restricted_content(bot, task: dict) -> None:
             raise ValueError("El mensaje no contiene archivos multimedia")
             
         # Actualizar mensaje de estado
-        await status_message.edit_text(
+        await outbound.edit_message(
+            status_message,
             "⬇️ <b>Descargando archivo del canal restringido...</b>",
-            parse_mode=ParseMode.HTML
+            parse_mode=ParseMode.HTML,
+            priority=PRIORITY_STATUS
         )
         
         # Preparar directorios
-        task_dir = os.path.join(DOWNLOAD_DIR, str(task['_id']))
+        task_dir = os.path.join(DOWNLOAD_DIR, task_id)
         os.makedirs(task_dir, exist_ok=True)
         
         # Descargar el archivo
@@ -398,9 +405,8 @@ async def process_restricted_content(bot, task: dict) -> None:
         file_path = await bot.download_media(
             message,
             file_name=os.path.join(task_dir, file_basename),
-            progress=_progress_callback_pyrogram,
+            progress=progress.pyrogram_callback,
             progress_args=(
-                user_id,
                 "↓ Downloading ...",
                 "#Download - #Restricted",
                 message.media.file_size if hasattr(message.media, 'file_size') else 0,
@@ -412,9 +418,11 @@ async def process_restricted_content(bot, task: dict) -> None:
             raise Exception("Error al descargar el archivo")
             
         # Actualizar estado
-        await status_message.edit_text(
+        await outbound.edit_message(
+            status_message,
             "⬆️ <b>Subiendo archivo procesado...</b>",
-            parse_mode=ParseMode.HTML
+            parse_mode=ParseMode.HTML,
+            priority=PRIORITY_STATUS
         )
         
         # Determinar tipo de archivo y enviar
@@ -424,9 +432,8 @@ async def process_restricted_content(bot, task: dict) -> None:
                 video=file_path,
                 caption=f"✅ <b>Archivo descargado exitosamente</b>\n🔗 De: {message_link}",
                 parse_mode=ParseMode.HTML,
-                progress=_progress_callback_pyrogram,
+                progress=progress.pyrogram_callback,
                 progress_args=(
-                    user_id,
                     "↑ Uploading ...",
                     "#Upload - #Restricted",
                     os.path.getsize(file_path),
@@ -439,9 +446,8 @@ async def process_restricted_content(bot, task: dict) -> None:
                 document=file_path,
                 caption=f"✅ <b>Archivo descargado exitosamente</b>\n🔗 De: {message_link}",
                 parse_mode=ParseMode.HTML,
-                progress=_progress_callback_pyrogram,
+                progress=progress.pyrogram_callback,
                 progress_args=(
-                    user_id,
                     "↑ Uploading ...",
                     "#Upload - #Restricted",
                     os.path.getsize(file_path),
@@ -454,9 +460,8 @@ async def process_restricted_content(bot, task: dict) -> None:
                 audio=file_path,
                 caption=f"✅ <b>Archivo descargado exitosamente</b>\n🔗 De: {message_link}",
                 parse_mode=ParseMode.HTML,
-                progress=_progress_callback_pyrogram,
+                progress=progress.pyrogram_callback,
                 progress_args=(
-                    user_id,
                     "↑ Uploading ...",
                     "#Upload - #Restricted",
                     os.path.getsize(file_path),
@@ -479,17 +484,13 @@ async def process_restricted_content(bot, task: dict) -> None:
             
     except Exception as e:
         error_msg = f"❌ <b>Error al procesar contenido restringido</b>\n<code>{escape_html(str(e))}</code>"
-        if status_message:
-            try:
-                await status_message.edit_text(error_msg, parse_mode=ParseMode.HTML)
-            except Exception:
-                await bot.send_message(user_id, error_msg, parse_mode=ParseMode.HTML)
-        else:
-            await bot.send_message(user_id, error_msg, parse_mode=ParseMode.HTML)
+        _deliver_final_status(bot, user_id, status_message, error_msg)
         
         # Actualizar estado de la tarea
-        await db_instance.update_task(str(task['_id']), "status", "error")
-        await db_instance.update_task(str(task['_id']), "last_error", str(e))
+        await db_instance.finish_task(task_id, "error", {"last_error": str(e)})
+
+    finally:
+        await progress_bus.close(task_id)
 
 class TaskQueue:
     def __init__(self, max_concurrent_tasks=3, min_task_interval=5):
@@ -527,6 +528,7 @@ class TaskQueue:
 async def worker_loop(bot_instance):
     logger.info("[WORKER] Bucle del worker iniciado.")
     os.makedirs(DOWNLOAD_DIR, exist_ok=True); os.makedirs(OUTPUT_DIR, exist_ok=True)
+    asyncio.create_task(cancellation_registry.watch_database())
     
     task_queue = TaskQueue(max_concurrent_tasks=3, min_task_interval=5)
     
@@ -542,9 +544,12 @@ async def worker_loop(bot_instance):
                         logger.error(f"Task for user {user_id} failed: {e}")
                     task_queue.remove_task(user_id)
             
+            # El claim necesita ver los estados recién escritos: se vacían las escrituras diferidas.
+            await db_instance.flush_task_updates()
+
             # Get available users not currently processing tasks
             available_users = [
-                uid for uid in (await db_instance.tasks.distinct("user_id", {"status": "queued"}))
+                uid for uid in (await db_instance.get_queued_user_ids())
                 if uid not in task_queue.active_tasks and task_queue.can_start_task(uid)
             ]
             
@@ -557,21 +562,8 @@ async def worker_loop(bot_instance):
                 if len(task_queue.active_tasks) >= task_queue.max_concurrent_tasks:
                     break
                     
-                queue_position = await db_instance.tasks.count_documents({"status": "processing"}) + 1
-                task = await db_instance.tasks.find_one_and_update(
-                    {
-                        "status": "queued",
-                        "user_id": user_id
-                    },
-                    {
-                        "$set": {
-                            "status": "processing",
-                            "processed_at": datetime.utcnow(),
-                            "queue_position": queue_position
-                        }
-                    },
-                    sort=[('priority', -1), ('created_at', 1)]
-                )
+                queue_position = await db_instance.count_tasks_by_status("processing") + 1
+                task = await db_instance.claim_next_task(user_id, queue_position)
                 
                 if task:
                     try:
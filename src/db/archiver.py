@@ -0,0 +1,90 @@
+# --- START OF FILE src/db/archiver.py ---
+
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+
+from pymongo.errors import BulkWriteError
+
+from src.db.mongo_manager import db_instance, TERMINAL_TASK_STATUSES
+
+logger = logging.getLogger(__name__)
+
+# Horas que una tarea terminada permanece en `tasks` antes de archivarse.
+TASK_ARCHIVE_AFTER_HOURS = float(os.getenv("TASK_ARCHIVE_AFTER_HOURS", "24"))
+# Cada cuánto se ejecuta una pasada del archivador.
+TASK_ARCHIVE_INTERVAL = float(os.getenv("TASK_ARCHIVE_INTERVAL", "600"))
+# Documentos movidos por lote.
+TASK_ARCHIVE_BATCH = int(os.getenv("TASK_ARCHIVE_BATCH", "500"))
+
+# Campos voluminosos que no se conservan en el archivo.
+ARCHIVE_STRIPPED_FIELDS = ("processing_config", "file_metadata")
+
+
+class TaskArchiver:
+    """
+    Mueve las tareas terminadas y antiguas de `tasks` a `tasks_archive` (con TTL), para que
+    la colección caliente solo contenga trabajo activo y sus índices quepan en memoria.
+    """
+
+    def __init__(self, db=db_instance):
+        self.db = db
+
+    def _archivable_filter(self) -> dict:
+        cutoff = datetime.utcnow() - timedelta(hours=TASK_ARCHIVE_AFTER_HOURS)
+        statuses = list(TERMINAL_TASK_STATUSES)
+        return {"$or": [
+            {"status": {"$in": statuses}, "finished_at": {"$lt": cutoff}},
+            # Tareas terminadas antes de que existiera finished_at.
+            {"status": {"$in": statuses}, "finished_at": None, "created_at": {"$lt": cutoff}},
+        ]}
+
+    async def archive_batch(self) -> int:
+        """Mueve un lote. Devuelve cuántas tareas salieron de `tasks`."""
+        projection = {field: 0 for field in ARCHIVE_STRIPPED_FIELDS}
+        cursor = self.db.tasks.find(self._archivable_filter(), projection).limit(TASK_ARCHIVE_BATCH)
+        docs = await cursor.to_list(length=TASK_ARCHIVE_BATCH)
+        if not docs:
+            return 0
+
+        now = datetime.utcnow()
+        for doc in docs:
+            doc["archived_at"] = now
+        try:
+            await self.db.tasks_archive.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            # Duplicados de una pasada anterior interrumpida: ya están archivados.
+            if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+                raise
+
+        ids = [doc["_id"] for doc in docs]
+        result = await self.db.tasks.delete_many({"_id": {"$in": ids}, "status": {"$in": list(TERMINAL_TASK_STATUSES)}})
+        return result.deleted_count
+
+    async def run_once(self) -> int:
+        total = 0
+        while True:
+            moved = await self.archive_batch()
+            total += moved
+            if moved < TASK_ARCHIVE_BATCH:
+                break
+            await asyncio.sleep(0)
+        if total:
+            logger.info(f"[ARCHIVE] {total} tareas terminadas movidas a tasks_archive.")
+        return total
+
+    async def run(self):
+        logger.info(f"[ARCHIVE] Archivador iniciado (tareas terminadas hace más de {TASK_ARCHIVE_AFTER_HOURS:g}h).")
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"[ARCHIVE] Error archivando tareas: {e}", exc_info=True)
+            await asyncio.sleep(TASK_ARCHIVE_INTERVAL)
+
+
+# Instancia singleton para ser usada en todo el proyecto.
+task_archiver = TaskArchiver()
@@ -0,0 +1,346 @@
+# --- START OF FILE src/db/backend.py ---
+
+import os
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+# Motor de almacenamiento: "mongo" (Atlas / servidor MongoDB) o "sqlite" (fichero local).
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "mongo").strip().lower()
+
+# Estados finales: se escriben de inmediato junto con lo que hubiera pendiente de la tarea.
+TERMINAL_TASK_STATUSES = {"done", "error", "cancelled", "completed", "failed"}
+# Estados desde los que una tarea todavía puede cancelarse.
+CANCELLABLE_TASK_STATUSES = ("pending_processing", "queued", "processing")
+
+# Tareas por página en /panel.
+PANEL_PAGE_SIZE = int(os.getenv("PANEL_PAGE_SIZE", "10"))
+# Vida de una sesión de búsqueda (segundos).
+SEARCH_SESSION_TTL = int(os.getenv("SEARCH_SESSION_TTL", "3600"))
+
+
+def default_user_settings(user_id: int) -> Dict:
+    """Documento de ajustes de un usuario nuevo."""
+    return {
+        "_id": user_id,
+        "created_at": datetime.utcnow(),
+        "user_state": {"status": "idle", "data": {}},
+        "restricted_channels": {},  # Almacena info de canales restringidos
+        "last_used_userbot": datetime.utcnow()  # Para control de rate limit
+    }
+
+
+def build_task_document(user_id: int, file_type: str, file_name: Optional[str] = None,
+                        final_filename: Optional[str] = None, url: Optional[str] = None,
+                        file_id: Optional[str] = None, processing_config: Optional[Dict] = None,
+                        status: str = "pending_processing", metadata: Optional[Dict] = None,
+                        custom_fields: Optional[Dict] = None) -> Dict:
+    """Documento de una tarea nueva, común a todos los backends."""
+    # Lógica mejorada para determinar el nombre de archivo final
+    if final_filename:
+        final_name = final_filename
+    elif file_name:
+        final_name = os.path.splitext(file_name)[0]
+    else:
+        final_name = f"tarea_{int(datetime.utcnow().timestamp())}"
+
+    task_doc = {
+        "user_id": int(user_id),
+        "url": url,
+        "file_id": file_id,
+        "original_filename": file_name,
+        "final_filename": final_name,
+        "file_type": file_type,
+        "status": status,
+        "created_at": datetime.utcnow(),
+        "processed_at": None,
+        "processing_config": processing_config or {},
+        "last_error": None,
+        "file_metadata": metadata or {}
+    }
+    if custom_fields:
+        task_doc.update(custom_fields)
+    return task_doc
+
+
+class StorageBackend(ABC):
+    """
+    Superficie de estado del bot: tareas, ajustes de usuario, perfiles, canales monitoreados,
+    sesiones de búsqueda y contadores. La implementan `Database` (Motor/MongoDB) y
+    `SQLiteDatabase` (SQLite embebido); el resto del código solo usa estos métodos.
+    """
+
+    backend_name = "abstract"
+
+    @abstractmethod
+    async def init_db(self):
+        """Prepara el almacenamiento (índices, esquema) y arranca las tareas de fondo."""
+
+    # --- Tareas ---
+
+    @abstractmethod
+    async def add_task(self, user_id: int, file_type: str, file_name: Optional[str] = None,
+                       final_filename: Optional[str] = None, url: Optional[str] = None,
+                       file_id: Optional[str] = None, processing_config: Optional[Dict] = None,
+                       status: str = "pending_processing", metadata: Optional[Dict] = None,
+                       custom_fields: Optional[Dict] = None) -> Any: ...
+
+    @abstractmethod
+    async def create_task(self, task_data: dict) -> Optional[str]: ...
+
+    @abstractmethod
+    async def add_tasks(self, task_docs: List[Dict]) -> List[Any]:
+        """
+        Inserta varias tareas (documentos de build_task_document) en una sola escritura.
+        Las que traen una `dedupe_key` ya existente se omiten. Devuelve los ids insertados.
+        """
+
+    @abstractmethod
+    async def add_job_document(self, job_doc: Dict) -> Any:
+        """
+        Inserta un documento de control (p. ej. una ingesta por lotes) en la colección de tareas.
+        No es una tarea del usuario: no recibe ordinal de /p ni cuenta en los contadores de tareas.
+        """
+
+    @abstractmethod
+    async def get_task(self, task_id: str) -> Optional[Dict]: ...
+
+    @abstractmethod
+    async def get_tasks_by_status(self, status: str, limit: int = 100) -> List[Dict]:
+        """Tareas de todos los usuarios con `status`, por orden de creación."""
+
+    @abstractmethod
+    async def get_pending_tasks(self, user_id: int, file_type_filter: Optional[str] = None,
+                                status_filter: str = "pending_processing") -> List[Dict]: ...
+
+    @abstractmethod
+    async def get_task_by_ordinal(self, user_id: int, ordinal: int,
+                                  status: str = "pending_processing") -> Optional[Dict]: ...
+
+    @abstractmethod
+    async def ensure_task_ordinals(self, tasks: List[Dict]): ...
+
+    @abstractmethod
+    async def count_user_tasks(self, user_id: int, status: str = "pending_processing") -> int: ...
+
+    @abstractmethod
+    async def get_tasks_page(self, user_id: int, status: str = "pending_processing",
+                             cursor: Optional[Tuple[datetime, Any]] = None, backwards: bool = False,
+                             limit: int = PANEL_PAGE_SIZE) -> Tuple[List[Dict], bool]: ...
+
+    @abstractmethod
+    async def update_task_fields(self, task_id: str, fields: Dict[str, Any]): ...
+
+    async def update_task(self, task_id: str, field: str, value: Any):
+        """Actualización diferida de un campo de la tarea (ver update_task_fields)."""
+        return await self.update_task_fields(task_id, {field: value})
+
+    @abstractmethod
+    async def finish_task(self, task_id: str, status: str, fields: Optional[Dict[str, Any]] = None) -> bool:
+        """
+        Escribe un estado final ('done', 'error', 'cancelled') con `fields` y cuenta la transición,
+        solo si la tarea no tenía ya un estado final (p. ej. tras cancel_task). Devuelve si se aplicó.
+        """
+
+    @abstractmethod
+    async def update_task_field(self, task_id: str, field: str, value: Any): ...
+
+    @abstractmethod
+    async def update_task_config(self, task_id: str, key: str, value: Any): ...
+
+    @abstractmethod
+    async def unset_task_config_key(self, task_id: str, key: str): ...
+
+    async def write_task_telemetry(self, task_id: str, fields: Dict[str, Any]):
+        """Escritura de progreso/estadísticas que puede perderse sin consecuencias."""
+        await self.update_task_fields(task_id, fields)
+
+    @abstractmethod
+    async def delete_task_by_id(self, task_id: str): ...
+
+    @abstractmethod
+    async def delete_all_pending_tasks(self, user_id: int): ...
+
+    @abstractmethod
+    async def cancel_task(self, task_id: str) -> bool: ...
+
+    @abstractmethod
+    async def get_cancelled_task_ids(self, task_ids: List[str]) -> List[str]: ...
+
+    # --- Cola del worker ---
+
+    @abstractmethod
+    async def get_queued_user_ids(self) -> List[int]: ...
+
+    @abstractmethod
+    async def count_tasks_by_status(self, status: str) -> int: ...
+
+    @abstractmethod
+    async def claim_next_task(self, user_id: int, queue_position: int) -> Optional[Dict]:
+        """Pasa a 'processing' la tarea en cola más prioritaria del usuario y la devuelve."""
+
+    # --- Escrituras diferidas (los backends sin write-behind no hacen nada) ---
+
+    async def flush_task_updates(self, task_id: Optional[str] = None):
+        pass
+
+    async def flush_user_activity(self):
+        pass
+
+    async def flush_counters(self):
+        pass
+
+    def start_write_behind(self):
+        pass
+
+    # --- Contadores ---
+
+    @abstractmethod
+    def increment_counters(self, user_id: Optional[int], fields: Dict[str, int],
+                           global_fields: Optional[Dict[str, int]] = None): ...
+
+    @abstractmethod
+    def record_task_event(self, user_id: int, event: str): ...
+
+    @abstractmethod
+    async def get_counters(self, key: str) -> Dict: ...
+
+    @abstractmethod
+    def record_media_dc(self, kind: str, dc_id: int):
+        """Cuenta una transferencia de medios desde `dc_id` por un cliente `kind` ("bot"/"userbot") en el día."""
+
+    async def get_media_dc_usage(self, days: int = 7) -> Dict[Tuple[str, int], int]:
+        """Transferencias por (tipo de cliente, DC) en los últimos `days` días."""
+        usage: Dict[Tuple[str, int], int] = {}
+        today = datetime.utcnow()
+        for offset in range(days):
+            counters = await self.get_counters(f"daily:{today - timedelta(days=offset):%Y-%m-%d}")
+            for field, value in counters.items():
+                if not field.startswith("media_dc_"):
+                    continue
+                kind, _, dc_id = field[len("media_dc_"):].rpartition("_")
+                if kind and dc_id.isdigit():
+                    usage[(kind, int(dc_id))] = usage.get((kind, int(dc_id)), 0) + value
+        return usage
+
+    @abstractmethod
+    async def get_top_users_by_tasks(self, limit: int = 5) -> List[Dict]: ...
+
+    @abstractmethod
+    async def rebuild_counters(self) -> int: ...
+
+    # --- Usuarios ---
+
+    @abstractmethod
+    def touch_user_activity(self, user_id: int, when: Optional[datetime] = None): ...
+
+    @abstractmethod
+    async def get_user_settings(self, user_id: int) -> Dict: ...
+
+    @abstractmethod
+    async def get_user_document(self, user_id: int) -> Optional[Dict]:
+        """Documento de ajustes tal cual está almacenado, sin crearlo si no existe."""
+
+    @abstractmethod
+    async def add_restricted_channel(self, user_id: int, channel_id: int, channel_title: str) -> bool: ...
+
+    @abstractmethod
+    async def get_restricted_channels(self, user_id: int) -> Dict: ...
+
+    @abstractmethod
+    async def set_user_state(self, user_id: int, status: str, data: Optional[Dict] = None): ...
+
+    @abstractmethod
+    async def get_user_state(self, user_id: int) -> Dict: ...
+
+    @abstractmethod
+    async def register_user(self, user_id: int) -> bool: ...
+
+    def invalidate_user_cache(self, user_id: int):
+        pass
+
+    @abstractmethod
+    async def get_banned_users(self) -> Dict[int, Optional[Dict]]: ...
+
+    @abstractmethod
+    async def set_user_ban(self, user_id: int, ban_info: Dict) -> bool:
+        """Marca al usuario como baneado. Devuelve True si el usuario no existía y se ha creado."""
+
+    @abstractmethod
+    async def clear_user_ban(self, user_id: int, admin_id: Optional[int] = None) -> bool:
+        """Quita el baneo y anota el desbaneo. Devuelve True si se modificó el usuario."""
+
+    # --- Perfiles ---
+
+    @abstractmethod
+    async def add_preset(self, user_id: int, preset_name: str, config_data: Dict): ...
+
+    @abstractmethod
+    async def get_user_presets(self, user_id: int) -> List[Dict]: ...
+
+    @abstractmethod
+    async def get_preset_by_id(self, preset_id: str) -> Optional[Dict]: ...
+
+    @abstractmethod
+    async def delete_preset_by_id(self, preset_id: str): ...
+
+    # --- Canales monitoreados ---
+
+    @abstractmethod
+    async def add_monitored_channel(self, channel_id: int, user_id: int) -> bool: ...
+
+    @abstractmethod
+    async def is_channel_monitored(self, channel_id: int, user_id: int) -> bool: ...
+
+    @abstractmethod
+    async def get_monitored_channels(self, user_id: int) -> List[Dict]: ...
+
+    @abstractmethod
+    async def remove_monitored_channel(self, channel_id: int, user_id: int) -> bool: ...
+
+    @abstractmethod
+    async def get_active_monitored_channels(self, limit: int = 5000) -> List[Dict]:
+        """Canales monitoreados activos de todos los usuarios (uno por canal y usuario)."""
+
+    @abstractmethod
+    async def update_last_message_id(self, channel_id: int, message_id: int):
+        """Avanza last_message_id en todas las suscripciones del canal; nunca lo hace retroceder."""
+
+    # --- Sesiones de búsqueda ---
+
+    @abstractmethod
+    async def create_search_session(self, user_id: int, data: Dict) -> str: ...
+
+    @abstractmethod
+    async def get_search_session(self, session_id: str) -> Optional[Dict]: ...
+
+    @abstractmethod
+    async def delete_search_session(self, session_id: str): ...
+
+    # --- Peers de Telegram (ver src/core/peer_storage.py) ---
+    # Cada peer es la tupla de Pyrogram (id, access_hash, type, username, phone_number),
+    # guardada por cuenta propietaria: los access_hash solo valen para la cuenta que los obtuvo.
+
+    @abstractmethod
+    async def upsert_telegram_peers(self, owner_id: int, peers: List[Tuple]): ...
+
+    @abstractmethod
+    async def get_telegram_peer(self, owner_id: int, peer_id: int) -> Optional[Dict]: ...
+
+    @abstractmethod
+    async def get_telegram_peer_by_username(self, owner_id: int, username: str) -> Optional[Dict]: ...
+
+    @abstractmethod
+    async def has_telegram_peers(self, owner_id: int) -> bool: ...
+
+    # --- Notificaciones entre procesos ---
+
+    async def watch_collection(self, collection: str, pipeline: List[Dict],
+                               handler: Callable[[Dict], Awaitable[None]],
+                               full_document: Optional[str] = None) -> bool:
+        """
+        Escucha cambios de `collection` hechos por otros procesos. Devuelve False si el
+        backend no lo soporta, y el llamador recurre a sondeo o a la coherencia por TTL.
+        """
+        return False
+
@@ -0,0 +1,224 @@
+# --- START OF FILE src/db/indexes.py ---
+
+import logging
+import os
+from typing import Any, Dict, List
+
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+
+from src.db.backend import SEARCH_SESSION_TTL
+
+logger = logging.getLogger(__name__)
+
+# Días que se conservan las tareas en tasks_archive antes de que las borre el TTL.
+TASK_ARCHIVE_TTL_DAYS = float(os.getenv("TASK_ARCHIVE_TTL_DAYS", "90"))
+
+# --- Registro declarativo de índices ---
+# Cada índice indica qué consultas de mongo_manager.py, worker.py, admin_manager.py o
+# channel_monitor.py atiende. Los conteos sin filtro (count_documents({})) no usan índices
+# y no se declaran aquí.
+INDEX_REGISTRY: Dict[str, List[Dict[str, Any]]] = {
+    "tasks": [
+        {
+            "name": "claim_queue_index",
+            "keys": [("status", ASCENDING), ("user_id", ASCENDING), ("priority", DESCENDING), ("created_at", ASCENDING)],
+            "serves": "worker: distinct user_id por status, claim find_one_and_update, count por status",
+        },
+        {
+            "name": "user_status_created_id_index",
+            "keys": [("user_id", ASCENDING), ("status", ASCENDING), ("created_at", ASCENDING), ("_id", ASCENDING)],
+            "serves": "get_pending_tasks, get_tasks_page (cursor created_at+_id), count_user_tasks, delete_all_pending_tasks",
+        },
+        {
+            "name": "user_ordinal_index",
+            "keys": [("user_id", ASCENDING), ("ordinal", ASCENDING)],
+            "options": {"unique": True, "partialFilterExpression": {"ordinal": {"$exists": True}}},
+            "serves": "get_task_by_ordinal (/p N)",
+        },
+        {
+            "name": "worker_queue_index",
+            "keys": [("status", ASCENDING), ("created_at", ASCENDING)],
+            "serves": "get_tasks_by_status (tareas por estado en orden de creación)",
+        },
+        {
+            "name": "archive_scan_index",
+            "keys": [("status", ASCENDING), ("finished_at", ASCENDING), ("created_at", ASCENDING)],
+            "serves": "archiver: tareas terminadas más antiguas que el umbral",
+        },
+        {
+            "name": "dedupe_key_index",
+            "keys": [("dedupe_key", ASCENDING)],
+            "options": {"unique": True, "partialFilterExpression": {"dedupe_key": {"$exists": True}}},
+            "serves": "add_tasks: una tarea por mensaje de origen al reanudar una ingesta por lotes",
+        },
+    ],
+    "tasks_archive": [
+        {
+            "name": "tasks_archive_ttl",
+            "keys": [("archived_at", ASCENDING)],
+            "options": {"expireAfterSeconds": int(TASK_ARCHIVE_TTL_DAYS * 86400)},
+        },
+    ],
+    "user_settings": [
+        {
+            "name": "banned_index",
+            "keys": [("banned", ASCENDING)],
+            "options": {"partialFilterExpression": {"banned": True}},
+            "serves": "admin_manager: carga de baneados, rebuild_counters",
+        },
+    ],
+    "user_presets": [
+        {
+            "name": "user_preset_name_unique",
+            "keys": [("user_id", ASCENDING), ("preset_name", ASCENDING)],
+            "options": {"unique": True},
+            "serves": "add_preset (upsert), get_user_presets ordenado por nombre",
+        },
+    ],
+    "monitored_channels": [
+        {
+            "name": "channel_user_active_index",
+            "keys": [("channel_id", ASCENDING), ("user_id", ASCENDING), ("active", ASCENDING)],
+            "serves": "is_channel_monitored, remove_monitored_channel, update_last_message_id",
+        },
+        {
+            "name": "user_active_index",
+            "keys": [("user_id", ASCENDING), ("active", ASCENDING)],
+            "serves": "get_monitored_channels",
+        },
+        {
+            "name": "active_channel_index",
+            "keys": [("active", ASCENDING), ("channel_id", ASCENDING)],
+            "serves": "get_active_monitored_channels (arranque del monitor)",
+        },
+    ],
+    "counters": [
+        {
+            "name": "scope_tasks_created_index",
+            "keys": [("scope", ASCENDING), ("tasks_created", DESCENDING)],
+            "serves": "get_top_users_by_tasks",
+        },
+    ],
+    "telegram_peers": [
+        {
+            "name": "owner_username_index",
+            "keys": [("owner_id", ASCENDING), ("username", ASCENDING), ("updated_at", DESCENDING)],
+            "serves": "peer_storage: get_peer_by_username, has_telegram_peers (las búsquedas por id van por _id)",
+        },
+    ],
+    "search_sessions": [
+        {"name": "search_sessions_ttl", "keys": [("created_at", ASCENDING)], "options": {"expireAfterSeconds": SEARCH_SESSION_TTL}},
+    ],
+    "search_results": [
+        {"name": "search_results_ttl", "keys": [("created_at", ASCENDING)], "options": {"expireAfterSeconds": SEARCH_SESSION_TTL}},
+    ],
+}
+
+# Índices creados por versiones anteriores que ya cubre otro del registro.
+RETIRED_INDEXES: Dict[str, List[str]] = {
+    "tasks": ["user_status_index", "created_at_index", "user_status_created_index"],
+}
+
+# Forma de cada consulta caliente, para comprobar su plan con explain() al arrancar.
+# Los valores son representativos: solo importa la forma del filtro y del orden.
+QUERY_SHAPES: List[Dict[str, Any]] = [
+    {"collection": "tasks", "origin": "worker.claim",
+     "filter": {"status": "queued", "user_id": 0}, "sort": [("priority", DESCENDING), ("created_at", ASCENDING)]},
+    {"collection": "tasks", "origin": "worker.distinct_queued_users", "filter": {"status": "queued"}},
+    {"collection": "tasks", "origin": "worker.queue_position", "filter": {"status": "processing"}},
+    {"collection": "tasks", "origin": "archiver.archive_batch",
+     "filter": {"status": {"$in": ["done", "error", "cancelled"]}, "finished_at": {"$lt": 0}}},
+    {"collection": "tasks", "origin": "mongo_manager.get_tasks_by_status",
+     "filter": {"status": "ingesting"}, "sort": [("created_at", ASCENDING)]},
+    {"collection": "tasks", "origin": "mongo_manager.get_pending_tasks",
+     "filter": {"user_id": 0, "status": "pending_processing"}, "sort": [("created_at", ASCENDING)]},
+    {"collection": "tasks", "origin": "mongo_manager.get_tasks_page",
+     "filter": {"user_id": 0, "status": "pending_processing",
+                "$or": [{"created_at": {"$gt": 0}}, {"created_at": 0, "_id": {"$gt": 0}}]},
+     "sort": [("created_at", ASCENDING), ("_id", ASCENDING)]},
+    {"collection": "tasks", "origin": "mongo_manager.get_task_by_ordinal",
+     "filter": {"user_id": 0, "ordinal": 0, "status": "pending_processing"}},
+    {"collection": "counters", "origin": "mongo_manager.get_top_users_by_tasks",
+     "filter": {"scope": "user"}, "sort": [("tasks_created", DESCENDING)]},
+    {"collection": "user_settings", "origin": "admin_manager.banned", "filter": {"banned": True}},
+    {"collection": "user_presets", "origin": "mongo_manager.get_user_presets",
+     "filter": {"user_id": 0}, "sort": [("preset_name", ASCENDING)]},
+    {"collection": "monitored_channels", "origin": "mongo_manager.is_channel_monitored",
+     "filter": {"channel_id": 0, "user_id": 0, "active": True}},
+    {"collection": "monitored_channels", "origin": "mongo_manager.get_monitored_channels",
+     "filter": {"user_id": 0, "active": True}},
+    {"collection": "monitored_channels", "origin": "mongo_manager.update_last_message_id", "filter": {"channel_id": 0}},
+    {"collection": "monitored_channels", "origin": "mongo_manager.get_active_monitored_channels",
+     "filter": {"active": True}, "sort": [("channel_id", ASCENDING)]},
+    {"collection": "telegram_peers", "origin": "peer_storage.get_peer_by_username",
+     "filter": {"owner_id": 0, "username": ""}, "sort": [("updated_at", DESCENDING)]},
+]
+
+
+async def ensure_indexes(db):
+    """Crea los índices del registro y retira los obsoletos. Los conflictos se registran, no detienen el arranque."""
+    for collection_name, retired in RETIRED_INDEXES.items():
+        existing = await db[collection_name].index_information()
+        for name in retired:
+            if name in existing:
+                await db[collection_name].drop_index(name)
+                logger.info(f"Índice obsoleto {collection_name}.{name} eliminado.")
+
+    for collection_name, specs in INDEX_REGISTRY.items():
+        for spec in specs:
+            try:
+                await db[collection_name].create_index(spec["keys"], name=spec["name"], **spec.get("options", {}))
+            except OperationFailure as e:
+                logger.error(f"No se pudo crear el índice {collection_name}.{spec['name']}: {e}")
+
+
+def _plan_stages(plan: Dict) -> List[str]:
+    stages = [plan.get("stage", "")]
+    for key in ("inputStage", "queryPlan"):
+        if isinstance(plan.get(key), dict):
+            stages.extend(_plan_stages(plan[key]))
+    for child in plan.get("inputStages", []):
+        stages.extend(_plan_stages(child))
+    return stages
+
+
+async def verify_query_plans(db) -> List[Dict]:
+    """Ejecuta explain() sobre cada forma de consulta y avisa de las que hacen COLLSCAN."""
+    collscans = []
+    for shape in QUERY_SHAPES:
+        cursor = db[shape["collection"]].find(shape["filter"])
+        if shape.get("sort"):
+            cursor = cursor.sort(shape["sort"])
+        try:
+            explanation = await cursor.explain()
+        except OperationFailure as e:
+            logger.warning(f"No se pudo ejecutar explain() para {shape['origin']}: {e}")
+            continue
+        winning_plan = explanation.get("queryPlanner", {}).get("winningPlan", {})
+        if "COLLSCAN" in _plan_stages(winning_plan):
+            collscans.append(shape)
+            logger.warning(
+                f"[INDEXES] COLLSCAN en {shape['collection']} para {shape['origin']}: "
+                f"filtro {list(shape['filter'])} orden {[k for k, _ in shape.get('sort', [])]}"
+            )
+    if not collscans:
+        logger.info(f"[INDEXES] Las {len(QUERY_SHAPES)} consultas calientes usan índices.")
+    return collscans
+
+
+async def report_index_usage(db) -> List[Dict]:
+    """Uso de cada índice según $indexStats (contadores desde el último reinicio del servidor)."""
+    report = []
+    for collection_name in INDEX_REGISTRY:
+        try:
+            async for stat in db[collection_name].aggregate([{"$indexStats": {}}]):
+                report.append({
+                    "collection": collection_name,
+                    "name": stat["name"],
+                    "ops": stat.get("accesses", {}).get("ops", 0),
+                    "since": stat.get("accesses", {}).get("since"),
+                })
+        except OperationFailure as e:
+            logger.warning(f"$indexStats no disponible en {collection_name}: {e}")
+    return report
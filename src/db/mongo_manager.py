@@ -1,19 +1,84 @@
 # --- START OF FILE src/db/mongo_manager.py ---
 
 import os
+import copy
+import time
+import asyncio
+import importlib.util
+import statistics
 import motor.motor_asyncio
 import logging
-from pymongo import ASCENDING
-from pymongo.errors import OperationFailure
+from pymongo import ASCENDING, DESCENDING, ReadPreference, ReturnDocument, UpdateMany, UpdateOne, WriteConcern
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
 from datetime import datetime
 from dotenv import load_dotenv
 from bson.objectid import ObjectId
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Callable, Awaitable, Tuple
+
+from src.db.backend import (
+    StorageBackend, STORAGE_BACKEND, TERMINAL_TASK_STATUSES, CANCELLABLE_TASK_STATUSES,
+    PANEL_PAGE_SIZE, build_task_document, default_user_settings
+)
+from src.helpers.cache import TTLCache
+from src.helpers.metrics import metrics
+from src.db.indexes import ensure_indexes, verify_query_plans
+from src.db.monitoring import mongo_command_monitor
 
 load_dotenv()
 logger = logging.getLogger(__name__)
 
-class Database:
+# Intervalo del vaciado de escrituras diferidas de tareas (write-behind).
+TASK_WRITE_BEHIND_INTERVAL = float(os.getenv("TASK_WRITE_BEHIND_INTERVAL", "1"))
+# Cada cuánto se escriben en bloque las marcas last_active acumuladas en memoria.
+ACTIVITY_FLUSH_INTERVAL = float(os.getenv("ACTIVITY_FLUSH_INTERVAL", "30"))
+
+# Caché en proceso de user_settings y user_presets (por user_id).
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "300"))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "5000"))
+
+# --- Perfil de conexión ---
+# Pool dimensionado para los workers de Pyrogram más el bucle del worker y las tareas de fondo.
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "5"))
+# Compresores del protocolo en orden de preferencia; se omiten los que no tengan su módulo instalado.
+MONGO_COMPRESSORS = os.getenv("MONGO_COMPRESSORS", "zstd,snappy,zlib")
+# Lecturas analíticas del admin (agregaciones, rankings): pueden ir a un secundario.
+MONGO_ANALYTICS_READ_PREFERENCE = os.getenv("MONGO_ANALYTICS_READ_PREFERENCE", "secondaryPreferred")
+# Pings del benchmark de latencia al arrancar.
+MONGO_RTT_SAMPLES = int(os.getenv("MONGO_RTT_SAMPLES", "5"))
+
+_COMPRESSOR_MODULES = {"zstd": "zstandard", "snappy": "snappy", "zlib": "zlib"}
+_READ_PREFERENCES = {
+    "primary": ReadPreference.PRIMARY,
+    "primaryPreferred": ReadPreference.PRIMARY_PREFERRED,
+    "secondary": ReadPreference.SECONDARY,
+    "secondaryPreferred": ReadPreference.SECONDARY_PREFERRED,
+    "nearest": ReadPreference.NEAREST,
+}
+
+def _available_compressors() -> List[str]:
+    compressors = []
+    for name in (c.strip() for c in MONGO_COMPRESSORS.split(",") if c.strip()):
+        module = _COMPRESSOR_MODULES.get(name)
+        if module and importlib.util.find_spec(module) is not None:
+            compressors.append(name)
+        else:
+            logger.warning(f"Compresor de MongoDB '{name}' no disponible; se omite.")
+    return compressors
+
+def _client_options() -> Dict[str, Any]:
+    options: Dict[str, Any] = {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": min(MONGO_MIN_POOL_SIZE, MONGO_MAX_POOL_SIZE),
+        "event_listeners": [mongo_command_monitor],
+    }
+    compressors = _available_compressors()
+    if compressors:
+        options["compressors"] = ",".join(compressors)
+    return options
+
+class Database(StorageBackend):
+    backend_name = "mongo"
     _instance = None
     _initialized = False
 
@@ -26,8 +91,13 @@ class Database:
                 if not mongo_uri:
                     raise ValueError("MONGO_URI no está definida en el archivo .env.")
                 
-                cls._instance.client = motor.motor_asyncio.AsyncIOMotorClient(mongo_uri)
+                client_options = _client_options()
+                cls._instance.client = motor.motor_asyncio.AsyncIOMotorClient(mongo_uri, **client_options)
                 cls._instance.db = cls._instance.client.get_database(db_name)
+                # Misma base con preferencia de lectura para analítica de administración.
+                cls._instance.analytics_db = cls._instance.client.get_database(
+                    db_name, read_preference=_READ_PREFERENCES.get(MONGO_ANALYTICS_READ_PREFERENCE, ReadPreference.SECONDARY_PREFERRED)
+                )
                 
                 # Colecciones
                 cls._instance.tasks = cls._instance.db.tasks
@@ -36,8 +106,30 @@ class Database:
                 cls._instance.search_sessions = cls._instance.db.search_sessions
                 cls._instance.search_results = cls._instance.db.search_results
                 cls._instance.monitored_channels = cls._instance.db.monitored_channels
+                cls._instance.counters = cls._instance.db.counters
+                cls._instance.tasks_archive = cls._instance.db.tasks_archive
+                cls._instance.telegram_peers = cls._instance.db.telegram_peers
+                # Escrituras sin confirmación (w=0) para telemetría de alta frecuencia: perder una es aceptable.
+                cls._instance.tasks_telemetry = cls._instance.tasks.with_options(write_concern=WriteConcern(w=0))
+
+                # Escrituras diferidas de tareas: task_id -> campos pendientes de $set
+                cls._instance._pending_task_updates = {}
+                cls._instance._task_flush_lock = asyncio.Lock()
+                cls._instance._write_behind_task = None
+                # Última actividad por usuario pendiente de escribir: user_id -> datetime
+                cls._instance._pending_activity = {}
+                # Incrementos de contadores pendientes: _id del documento -> {campo: delta}
+                cls._instance._pending_counters = {}
+
+                # Cachés de usuario: user_id -> documento de ajustes / lista de perfiles
+                cls._instance._settings_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+                cls._instance._presets_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+                cls._instance._cache_watch_task = None
                 
-                logger.info("Cliente de base de datos Motor (asíncrono) inicializado.")
+                logger.info(
+                    f"Cliente de base de datos Motor (asíncrono) inicializado: pool {client_options['minPoolSize']}-"
+                    f"{client_options['maxPoolSize']}, compresión {client_options.get('compressors', 'ninguna')}."
+                )
             except Exception as e:
                 logger.critical(f"FALLO CRÍTICO AL INICIALIZAR LA DB: {e}", exc_info=True)
                 raise ConnectionError(f"No se pudo inicializar el cliente de la DB: {e}")
@@ -47,62 +139,109 @@ class Database:
         """Asegura que los índices necesarios para el rendimiento existan en la DB."""
         if self._initialized:
             return
+        await self.warm_up_connections()
         logger.info("Asegurando índices de la base de datos...")
         try:
-            # Índices TTL para limpiar documentos de búsqueda expirados automáticamente.
-            await self.search_sessions.create_index("created_at", expireAfterSeconds=3600, name="search_sessions_ttl")
-            await self.search_results.create_index("created_at", expireAfterSeconds=3600, name="search_results_ttl")
-            
-            # Índices para consultas comunes.
-            await self.tasks.create_index([("user_id", ASCENDING), ("status", ASCENDING)], name="user_status_index")
-            await self.tasks.create_index([("status", ASCENDING), ("created_at", ASCENDING)], name="worker_queue_index")
-
+            await ensure_indexes(self.db)
+            await verify_query_plans(self.db)
             logger.info("Índices de la base de datos verificados y/o creados.")
         except OperationFailure as e:
-            if "Index already exists" in str(e) or "IndexOptionsConflict" in str(e):
-                logger.warning(f"No se crearon los índices porque ya existen o hay un conflicto. Error: {e}")
-            else:
-                logger.error(f"Error inesperado al crear los índices de la DB: {e}", exc_info=True)
+            logger.error(f"Error inesperado al crear los índices de la DB: {e}", exc_info=True)
         finally:
             self._initialized = True
+            self.start_write_behind()
+            if self._cache_watch_task is None:
+                self._cache_watch_task = asyncio.create_task(self._watch_user_caches())
+
+    async def warm_up_connections(self) -> Dict[str, float]:
+        """
+        Abre minPoolSize conexiones con pings concurrentes (el primer update no paga el
+        handshake TLS) y mide la latencia de ida y vuelta con pings secuenciales.
+        """
+        try:
+            warm = max(MONGO_MIN_POOL_SIZE, 1)
+            await asyncio.gather(*(self.client.admin.command("ping") for _ in range(warm)))
+            samples = []
+            for _ in range(max(MONGO_RTT_SAMPLES, 1)):
+                started = time.perf_counter()
+                await self.client.admin.command("ping")
+                samples.append((time.perf_counter() - started) * 1000)
+        except Exception as e:
+            logger.error(f"No se pudo calentar el pool de MongoDB: {e}")
+            return {}
+
+        rtt = {"min": min(samples), "median": statistics.median(samples), "max": max(samples)}
+        for value in samples:
+            metrics.observe("mongo.rtt_ms", value)
+        metrics.set_gauge("mongo.rtt_ms.median", round(rtt["median"], 2))
+        logger.info(
+            f"[MONGO] Pool calentado con {warm} conexiones. RTT ping: "
+            f"min {rtt['min']:.1f} ms, mediana {rtt['median']:.1f} ms, máx {rtt['max']:.1f} ms."
+        )
+        return rtt
+
+    async def write_task_telemetry(self, task_id: str, fields: Dict[str, Any]):
+        """$set sin confirmación (w=0) para progreso y estadísticas que se sobrescriben a menudo."""
+        try:
+            await self.tasks_telemetry.update_one({"_id": ObjectId(task_id)}, {"$set": fields})
+        except Exception as e:
+            logger.debug(f"Telemetría de la tarea {task_id} descartada: {e}")
 
     async def add_task(self, user_id: int, file_type: str, file_name: Optional[str] = None, 
                          final_filename: Optional[str] = None, url: Optional[str] = None,
                          file_id: Optional[str] = None, processing_config: Optional[Dict] = None,
                          status: str = "pending_processing", metadata: Optional[Dict] = None,
                          custom_fields: Optional[Dict] = None) -> ObjectId:
-        
-        # Lógica mejorada para determinar el nombre de archivo final
-        if final_filename:
-            final_name = final_filename
-        elif file_name:
-            final_name = os.path.splitext(file_name)[0]
-        else:
-            final_name = f"tarea_{int(datetime.utcnow().timestamp())}"
-            
-        task_doc = {
-            "user_id": int(user_id),
-            "url": url,
-            "file_id": file_id,
-            "original_filename": file_name,
-            "final_filename": final_name,
-            "file_type": file_type,
-            "status": status,
-            "created_at": datetime.utcnow(),
-            "processed_at": None,
-            "processing_config": processing_config or {},
-            "last_error": None,
-            "file_metadata": metadata or {}
-        }
-        if custom_fields:
-            task_doc.update(custom_fields)
+        task_doc = build_task_document(user_id, file_type, file_name, final_filename, url, file_id,
+                                       processing_config, status, metadata, custom_fields)
+        ordinal = await self._next_task_ordinal(user_id)
+        if ordinal is not None:
+            task_doc["ordinal"] = ordinal
 
         result = await self.tasks.insert_one(task_doc)
+        self.record_task_event(user_id, "created")
+        if status == "queued":
+            self.record_task_event(user_id, "queued")
         logger.info(f"Nueva tarea {result.inserted_id} añadida para el usuario {user_id} con estado '{status}'")
         return result.inserted_id
 
+    async def add_tasks(self, task_docs: List[Dict]) -> List[ObjectId]:
+        if not task_docs:
+            return []
+        # Un $inc por usuario reserva el bloque de ordinales del lote completo.
+        by_user: Dict[int, List[Dict]] = {}
+        for doc in task_docs:
+            by_user.setdefault(doc["user_id"], []).append(doc)
+        for user_id, docs in by_user.items():
+            last = await self._next_task_ordinal(user_id, len(docs))
+            if last is not None:
+                for offset, doc in enumerate(docs):
+                    doc["ordinal"] = last - len(docs) + 1 + offset
+
+        skipped = set()
+        try:
+            await self.tasks.insert_many(task_docs, ordered=False)
+        except BulkWriteError as e:
+            # Duplicados por dedupe_key: el lote ya se insertó en una pasada anterior interrumpida.
+            errors = e.details.get("writeErrors", [])
+            if any(err.get("code") != 11000 for err in errors):
+                raise
+            skipped = {err["index"] for err in errors}
+        inserted = [doc for i, doc in enumerate(task_docs) if i not in skipped]
+        for doc in inserted:
+            self.record_task_event(doc["user_id"], "created")
+        logger.info(f"{len(inserted)} tareas añadidas en lote ({len(skipped)} ya existían).")
+        return [doc["_id"] for doc in inserted]
+
+    async def add_job_document(self, job_doc: Dict) -> ObjectId:
+        result = await self.tasks.insert_one(job_doc)
+        logger.info(f"Documento de control {result.inserted_id} ({job_doc.get('file_type')}) añadido.")
+        return result.inserted_id
+
     async def get_task(self, task_id: str) -> Optional[Dict]:
         try:
+            if str(task_id) in self._pending_task_updates:
+                await self.flush_task_updates(task_id)
             return await self.tasks.find_one({"_id": ObjectId(task_id)})
         except Exception:
             logger.warning(f"Intento de búsqueda con un ID de tarea inválido: {task_id}")
@@ -117,9 +256,324 @@ class Database:
         cursor = self.tasks.find(query).sort("created_at", ASCENDING)
         return await cursor.to_list(length=100) # Límite razonable para el panel
 
-    async def update_task(self, task_id: str, field: str, value: Any):
-        """Alias para update_task_field por compatibilidad con el worker."""
-        return await self.update_task_field(task_id, field, value)
+    # --- Panel paginado ---
+    # Cada tarea recibe al insertarse un ordinal por usuario que no cambia aunque se borren
+    # otras, así /p N es una consulta puntual sobre {user_id, ordinal} y el panel pagina con
+    # un cursor (created_at, _id) en lugar de cargar todas las tareas.
+
+    async def _next_task_ordinal(self, user_id: int, count: int = 1) -> Optional[int]:
+        """
+        Siguiente ordinal del usuario: $inc atómico de task_seq en su documento de contadores.
+        Con `count` reserva un bloque y devuelve el último ordinal del bloque.
+        """
+        key = f"user:{int(user_id)}"
+        for _ in range(2):
+            try:
+                doc = await self.counters.find_one_and_update(
+                    {"_id": key},
+                    {"$inc": {"task_seq": count}, "$setOnInsert": {"scope": "user", "user_id": int(user_id)}},
+                    projection={"task_seq": 1}, upsert=True, return_document=ReturnDocument.AFTER
+                )
+                return doc["task_seq"]
+            except DuplicateKeyError:
+                # Otro upsert creó el documento a la vez; el segundo intento lo actualiza.
+                continue
+            except Exception as e:
+                logger.error(f"No se pudo asignar ordinal de tarea al usuario {user_id}: {e}")
+                return None
+        return None
+
+    async def get_task_by_ordinal(self, user_id: int, ordinal: int,
+                                  status: str = "pending_processing") -> Optional[Dict]:
+        return await self.tasks.find_one({"user_id": int(user_id), "ordinal": int(ordinal), "status": status})
+
+    async def ensure_task_ordinals(self, tasks: List[Dict]):
+        """Asigna ordinal a las tareas creadas antes de que existiera (se numeran al mostrarse)."""
+        for task in tasks:
+            if "ordinal" in task or task.get("user_id") is None:
+                continue
+            ordinal = await self._next_task_ordinal(task["user_id"])
+            if ordinal is None:
+                continue
+            result = await self.tasks.update_one({"_id": task["_id"], "ordinal": {"$exists": False}}, {"$set": {"ordinal": ordinal}})
+            if result.modified_count:
+                task["ordinal"] = ordinal
+
+    async def count_user_tasks(self, user_id: int, status: str = "pending_processing") -> int:
+        return await self.tasks.count_documents({"user_id": int(user_id), "status": status})
+
+    async def get_tasks_page(self, user_id: int, status: str = "pending_processing",
+                             cursor: Optional[Tuple[datetime, ObjectId]] = None, backwards: bool = False,
+                             limit: int = PANEL_PAGE_SIZE) -> Tuple[List[Dict], bool]:
+        """
+        Página de tareas ordenada por (created_at, _id). `cursor` es la clave de la última tarea
+        de la página anterior (o de la primera, si `backwards`). Devuelve las tareas en orden
+        ascendente y si quedan más en la dirección recorrida.
+        """
+        query: Dict[str, Any] = {"user_id": int(user_id), "status": status}
+        op, direction = ("$lt", DESCENDING) if backwards else ("$gt", ASCENDING)
+        if cursor is not None:
+            created_at, oid = cursor
+            query["$or"] = [
+                {"created_at": {op: created_at}},
+                {"created_at": created_at, "_id": {op: oid}},
+            ]
+        find_cursor = self.tasks.find(query, {"processing_config": 0}).sort(
+            [("created_at", direction), ("_id", direction)]).limit(limit + 1)
+        docs = await find_cursor.to_list(length=limit + 1)
+        has_more = len(docs) > limit
+        docs = docs[:limit]
+        if backwards:
+            docs.reverse()
+        return docs, has_more
+
+    async def update_task_fields(self, task_id: str, fields: Dict[str, Any]):
+        """
+        Encola campos para un único $set por tarea. Se escriben en lote cada
+        TASK_WRITE_BEHIND_INTERVAL segundos, o de inmediato si el nuevo estado es final.
+        """
+        pending = self._pending_task_updates.setdefault(str(task_id), {})
+        pending.update(fields)
+        if fields.get("status") in TERMINAL_TASK_STATUSES:
+            # finished_at decide cuándo el archivador puede mover la tarea a tasks_archive.
+            pending.setdefault("finished_at", datetime.utcnow())
+            await self.flush_task_updates(task_id)
+        else:
+            self.start_write_behind()
+
+    async def flush_task_updates(self, task_id: Optional[str] = None):
+        """
+        Escribe las actualizaciones pendientes con un bulk_write. Con `task_id` solo vacía
+        esa tarea; los caminos que necesitan leer lo recién escrito (claim, get_task) la llaman antes.
+        """
+        async with self._task_flush_lock:
+            if task_id is not None:
+                fields = self._pending_task_updates.pop(str(task_id), None)
+                batch = {str(task_id): fields} if fields else {}
+            else:
+                batch, self._pending_task_updates = self._pending_task_updates, {}
+            if not batch:
+                return
+            operations = [UpdateOne(self._flush_filter(tid, fields), {"$set": fields}) for tid, fields in batch.items()]
+            try:
+                await self.tasks.bulk_write(operations, ordered=False)
+            except Exception as e:
+                logger.error(f"Error escribiendo {len(operations)} actualizaciones diferidas de tareas: {e}")
+                # Se reencolan sin pisar valores más nuevos que hayan llegado mientras tanto.
+                for tid, fields in batch.items():
+                    self._pending_task_updates[tid] = {**fields, **self._pending_task_updates.get(tid, {})}
+
+    async def finish_task(self, task_id: str, status: str, fields: Optional[Dict[str, Any]] = None) -> bool:
+        # Escritura directa, no diferida: hay que saber si el filtro encontró la tarea para contarla.
+        if str(task_id) in self._pending_task_updates:
+            await self.flush_task_updates(task_id)
+        task = await self.tasks.find_one_and_update(
+            {"_id": ObjectId(task_id), "status": {"$nin": list(TERMINAL_TASK_STATUSES)}},
+            {"$set": {**(fields or {}), "status": status, "finished_at": datetime.utcnow()}},
+            projection={"user_id": 1}
+        )
+        if task is None:
+            logger.info(f"Tarea {task_id} ya tenía un estado final; no se marca como '{status}'.")
+            return False
+        self.record_task_event(task.get("user_id"), status)
+        return True
+
+    @staticmethod
+    def _flush_filter(task_id: str, fields: Dict[str, Any]) -> Dict[str, Any]:
+        """Un cambio de estado diferido nunca pisa un estado final escrito directamente (p. ej. cancel_task)."""
+        query: Dict[str, Any] = {"_id": ObjectId(task_id)}
+        if "status" in fields:
+            query["status"] = {"$nin": list(TERMINAL_TASK_STATUSES)}
+        return query
+
+    def start_write_behind(self):
+        """Arranca (una sola vez) el bucle que vacía las escrituras diferidas."""
+        if self._write_behind_task is None or self._write_behind_task.done():
+            self._write_behind_task = asyncio.create_task(self._write_behind_loop())
+
+    async def _write_behind_loop(self):
+        last_activity_flush = asyncio.get_running_loop().time()
+        while True:
+            await asyncio.sleep(TASK_WRITE_BEHIND_INTERVAL)
+            if self._pending_task_updates:
+                await self.flush_task_updates()
+            if self._pending_counters:
+                await self.flush_counters()
+            now = asyncio.get_running_loop().time()
+            if self._pending_activity and now - last_activity_flush >= ACTIVITY_FLUSH_INTERVAL:
+                last_activity_flush = now
+                await self.flush_user_activity()
+
+    # --- Contadores incrementales ---
+    # Documentos de la colección `counters`: "global", "user:<id>" y "daily:<YYYY-MM-DD>".
+    # Se mantienen con $inc en cada transición para que /stats y /user sean lecturas puntuales.
+
+    def increment_counters(self, user_id: Optional[int], fields: Dict[str, int], global_fields: Optional[Dict[str, int]] = None):
+        """Acumula incrementos para el contador global y el del usuario; se escriben en el siguiente vaciado."""
+        self._add_pending_counter("global", global_fields if global_fields is not None else fields)
+        if user_id is not None:
+            self._add_pending_counter(f"user:{int(user_id)}", fields)
+        self.start_write_behind()
+
+    def _add_pending_counter(self, key: str, fields: Dict[str, int]):
+        pending = self._pending_counters.setdefault(key, {})
+        for field, delta in fields.items():
+            pending[field] = pending.get(field, 0) + delta
+
+    def record_task_event(self, user_id: int, event: str):
+        """Transición de una tarea: 'created', 'queued', 'done', 'error' o 'cancelled'."""
+        self.increment_counters(user_id, {f"tasks_{event}": 1})
+        if event == "created":
+            self._add_pending_counter(f"daily:{datetime.utcnow():%Y-%m-%d}", {"tasks_created": 1})
+
+    def record_media_dc(self, kind: str, dc_id: int):
+        self._add_pending_counter(f"daily:{datetime.utcnow():%Y-%m-%d}", {f"media_dc_{kind}_{dc_id}": 1})
+        self.start_write_behind()
+
+    def _record_new_users(self, count: int):
+        if count:
+            self.increment_counters(None, {"users_total": count})
+
+    async def flush_counters(self):
+        batch, self._pending_counters = self._pending_counters, {}
+        if not batch:
+            return
+        operations = []
+        for key, fields in batch.items():
+            scope, _, ident = key.partition(":")
+            set_on_insert = {"scope": scope}
+            if scope == "user":
+                set_on_insert["user_id"] = int(ident)
+            operations.append(UpdateOne({"_id": key}, {"$inc": fields, "$setOnInsert": set_on_insert}, upsert=True))
+        try:
+            await self.counters.bulk_write(operations, ordered=False)
+        except Exception as e:
+            logger.error(f"Error escribiendo {len(operations)} contadores: {e}")
+            for key, fields in batch.items():
+                self._add_pending_counter(key, fields)
+
+    async def get_counters(self, key: str) -> Dict:
+        """Lectura puntual de un documento de contadores (incluye lo pendiente de este proceso)."""
+        if self._pending_counters:
+            await self.flush_counters()
+        return await self.counters.find_one({"_id": key}) or {}
+
+    async def get_top_users_by_tasks(self, limit: int = 5) -> List[Dict]:
+        cursor = self.analytics_db.counters.find({"scope": "user"}, {"user_id": 1, "tasks_created": 1}).sort("tasks_created", -1).limit(limit)
+        return [{"_id": doc["user_id"], "total": doc.get("tasks_created", 0)} async for doc in cursor]
+
+    async def rebuild_counters(self) -> int:
+        """
+        Repara los contadores desde las colecciones de origen. Para reparaciones puntuales.
+        Solo se escriben los campos que se pueden recalcular, y el resto de campos y documentos
+        (p. ej. la telemetría de los documentos diarios) no se tocan:
+        - estado actual (monitored_channels, users_total, users_banned): $set;
+        - acumulados de tareas (tasks_created, tasks_done/error/cancelled, task_seq): $max. Las tareas
+          borradas o caducadas ya no se ven, así que el recuento solo puede corregir incrementos
+          perdidos, nunca bajar el valor.
+        tasks_queued cuenta transiciones (una tarea puede encolarse varias veces) y no se deduce del
+        estado actual: se deja como está.
+        Las agregaciones leen de analytics_db (secundario si lo hay).
+        """
+        sets: Dict[str, Dict[str, Any]] = {"global": {"monitored_channels": 0}}
+        maxes: Dict[str, Dict[str, int]] = {"global": {}}
+        meta: Dict[str, Dict[str, Any]] = {"global": {"scope": "global"}}
+        terminal_statuses = ("done", "error", "cancelled")
+
+        def _max(key: str, field: str, n: int):
+            fields = maxes.setdefault(key, {})
+            fields[field] = fields.get(field, 0) + n
+
+        def _user_key(user_id) -> str:
+            key = f"user:{user_id}"
+            meta.setdefault(key, {"scope": "user", "user_id": user_id})
+            return key
+
+        # Las tareas archivadas siguen contando hasta que caduca su TTL en tasks_archive.
+        async for row in self.analytics_db.tasks.aggregate([
+            {"$unionWith": "tasks_archive"},
+            {"$group": {"_id": {"user_id": "$user_id", "status": "$status"}, "n": {"$sum": 1},
+                        "max_ordinal": {"$max": "$ordinal"}}}
+        ]):
+            user_id, status, n = row["_id"].get("user_id"), row["_id"].get("status"), row["n"]
+            keys = ["global"]
+            if user_id is not None:
+                keys.append(_user_key(user_id))
+                # La secuencia de ordinales nunca retrocede: /p N debe seguir apuntando a la misma tarea.
+                if row.get("max_ordinal") is not None:
+                    fields = maxes.setdefault(keys[-1], {})
+                    fields["task_seq"] = max(fields.get("task_seq", 0), row["max_ordinal"])
+            for key in keys:
+                _max(key, "tasks_created", n)
+                if status in terminal_statuses:
+                    _max(key, f"tasks_{status}", n)
+
+        async for row in self.analytics_db.tasks.aggregate([
+            {"$unionWith": "tasks_archive"},
+            {"$group": {"_id": {"$dateToString": {"format": "%Y-%m-%d", "date": "$created_at"}}, "n": {"$sum": 1}}}
+        ]):
+            if row["_id"]:
+                key = f"daily:{row['_id']}"
+                meta.setdefault(key, {"scope": "daily"})
+                _max(key, "tasks_created", row["n"])
+
+        with_channels = []
+        async for row in self.analytics_db.monitored_channels.aggregate([
+            {"$match": {"active": True}}, {"$group": {"_id": "$user_id", "n": {"$sum": 1}}}
+        ]):
+            key = _user_key(row["_id"])
+            with_channels.append(key)
+            sets.setdefault(key, {})["monitored_channels"] = row["n"]
+            sets["global"]["monitored_channels"] += row["n"]
+
+        sets["global"]["users_total"] = await self.analytics_db.user_settings.count_documents({})
+        sets["global"]["users_banned"] = await self.analytics_db.user_settings.count_documents({"banned": True})
+
+        operations = []
+        for key in set(sets) | set(maxes):
+            update: Dict[str, Any] = {"$setOnInsert": meta[key]}
+            if sets.get(key):
+                update["$set"] = sets[key]
+            if maxes.get(key):
+                update["$max"] = maxes[key]
+            operations.append(UpdateOne({"_id": key}, update, upsert=True))
+        # Usuarios que ya no monitorean ningún canal.
+        operations.append(UpdateMany(
+            {"scope": "user", "monitored_channels": {"$gt": 0}, "_id": {"$nin": with_channels}},
+            {"$set": {"monitored_channels": 0}}
+        ))
+        await self.counters.bulk_write(operations, ordered=False)
+        logger.info(f"Contadores reconstruidos: {len(operations) - 1} documentos.")
+        return len(operations) - 1
+
+    # --- Actividad de usuarios ---
+
+    def touch_user_activity(self, user_id: int, when: Optional[datetime] = None):
+        """Registra en memoria la actividad de un usuario; se persiste en lote cada ACTIVITY_FLUSH_INTERVAL."""
+        when = when or datetime.utcnow()
+        previous = self._pending_activity.get(user_id)
+        if previous is None or when > previous:
+            self._pending_activity[user_id] = when
+        self.start_write_behind()
+
+    async def flush_user_activity(self):
+        """Escribe todas las marcas pendientes en un solo bulk_write con $max (nunca retrocede la fecha)."""
+        batch, self._pending_activity = self._pending_activity, {}
+        if not batch:
+            return
+        operations = [
+            UpdateOne({"_id": user_id}, {"$max": {"last_active": when}}, upsert=True)
+            for user_id, when in batch.items()
+        ]
+        try:
+            result = await self.user_settings.bulk_write(operations, ordered=False)
+            self._record_new_users(result.upserted_count)
+        except Exception as e:
+            logger.error(f"Error escribiendo la actividad de {len(operations)} usuarios: {e}")
+            for user_id, when in batch.items():
+                current = self._pending_activity.get(user_id)
+                if current is None or when > current:
+                    self._pending_activity[user_id] = when
 
     async def update_task_field(self, task_id: str, field: str, value: Any):
         """Actualiza un campo de nivel superior en el documento de la tarea."""
@@ -128,13 +582,139 @@ class Database:
     async def update_task_config(self, task_id: str, key: str, value: Any):
         """Actualiza una clave específica dentro del diccionario 'processing_config'."""
         return await self.tasks.update_one({"_id": ObjectId(task_id)}, {"$set": {f"processing_config.{key}": value}})
+
+    async def unset_task_config_key(self, task_id: str, key: str):
+        """Elimina una clave de 'processing_config'."""
+        return await self.tasks.update_one({"_id": ObjectId(task_id)}, {"$unset": {f"processing_config.{key}": ""}})
     
     async def delete_task_by_id(self, task_id: str):
         return await self.tasks.delete_one({"_id": ObjectId(task_id)})
 
     async def delete_all_pending_tasks(self, user_id: int):
         return await self.tasks.delete_many({"user_id": user_id, "status": "pending_processing"})
+
+    async def cancel_task(self, task_id: str) -> bool:
+        """Marca como 'cancelled' una tarea que aún no ha terminado."""
+        try:
+            # Lo diferido de la tarea se escribe antes; si no, un estado pendiente revertiría la cancelación.
+            if str(task_id) in self._pending_task_updates:
+                await self.flush_task_updates(task_id)
+            task = await self.tasks.find_one_and_update(
+                {"_id": ObjectId(task_id), "status": {"$in": list(CANCELLABLE_TASK_STATUSES)}},
+                {"$set": {"status": "cancelled", "cancelled_at": datetime.utcnow(), "finished_at": datetime.utcnow()}},
+                projection={"user_id": 1}
+            )
+            if task:
+                self.record_task_event(task.get("user_id"), "cancelled")
+            return task is not None
+        except Exception as e:
+            logger.error(f"Error al cancelar la tarea {task_id}: {e}")
+            return False
+
+    async def get_cancelled_task_ids(self, task_ids: List[str]) -> List[str]:
+        """Devuelve, de entre los IDs dados, los que están marcados como cancelados."""
+        cursor = self.tasks.find(
+            {"_id": {"$in": [ObjectId(tid) for tid in task_ids]}, "status": "cancelled"},
+            {"_id": 1}
+        )
+        return [str(doc["_id"]) async for doc in cursor]
+
+    # --- Cola del worker ---
+
+    async def get_queued_user_ids(self) -> List[int]:
+        return await self.tasks.distinct("user_id", {"status": "queued"})
+
+    async def count_tasks_by_status(self, status: str) -> int:
+        return await self.tasks.count_documents({"status": status})
+
+    async def get_tasks_by_status(self, status: str, limit: int = 100) -> List[Dict]:
+        return await self.tasks.find({"status": status}).sort("created_at", ASCENDING).to_list(length=limit)
+
+    async def claim_next_task(self, user_id: int, queue_position: int) -> Optional[Dict]:
+        return await self.tasks.find_one_and_update(
+            {"status": "queued", "user_id": user_id},
+            {"$set": {"status": "processing", "processed_at": datetime.utcnow(), "queue_position": queue_position}},
+            sort=[("priority", -1), ("created_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    # --- Change Streams ---
+
+    async def watch_collection(self, collection, pipeline: List[Dict],
+                               handler: Callable[[Dict], Awaitable[None]],
+                               full_document: Optional[str] = None) -> bool:
+        """
+        Escucha un change stream y llama a `handler` por cada evento, reanudando tras errores.
+        Devuelve False de inmediato si el servidor no soporta change streams (standalone);
+        en caso contrario no retorna mientras el bucle siga vivo.
+        """
+        if isinstance(collection, str):
+            collection = self.db[collection]
+        resume_token = None
+        while True:
+            try:
+                async with collection.watch(pipeline, full_document=full_document,
+                                            resume_after=resume_token) as stream:
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        try:
+                            await handler(change)
+                        except Exception as e:
+                            logger.error(f"Error procesando evento de {collection.name}: {e}", exc_info=True)
+            except OperationFailure as e:
+                if e.code in (40573, 40324) or "replica set" in str(e).lower():
+                    logger.warning(f"Change streams no soportados en {collection.name}: {e}")
+                    return False
+                logger.error(f"Change stream de {collection.name} interrumpido: {e}. Reintentando...")
+                resume_token = None
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Change stream de {collection.name} interrumpido: {e}. Reintentando...")
+            await asyncio.sleep(5)
     
+    # --- Invalidación de cachés entre procesos ---
+
+    async def _watch_user_caches(self):
+        """
+        Mantiene coherentes las cachés de usuario cuando hay varios procesos del bot.
+        Sin change streams, la coherencia queda acotada por USER_CACHE_TTL.
+        """
+        # Las actualizaciones que solo tocan last_active no cambian nada de lo cacheado.
+        settings_pipeline = [{"$match": {"$or": [
+            {"operationType": {"$ne": "update"}},
+            {"updateDescription.updatedFields.last_active": {"$exists": False}},
+        ]}}]
+
+        async def _on_settings_change(change: Dict):
+            user_id = change["documentKey"]["_id"]
+            document = change.get("fullDocument")
+            if document is not None and user_id in self._settings_cache:
+                self._settings_cache.set(user_id, document)
+            else:
+                self._settings_cache.pop(user_id)
+
+        async def _on_presets_change(change: Dict):
+            document = change.get("fullDocument")
+            if document is not None:
+                self._presets_cache.pop(document.get("user_id"))
+                return
+            # Borrado: no conocemos el user_id, se busca el perfil en las listas cacheadas.
+            preset_id = change["documentKey"]["_id"]
+            for user_id, presets in list(self._presets_cache.items()):
+                if any(p.get("_id") == preset_id for p in presets):
+                    self._presets_cache.pop(user_id)
+
+        await asyncio.gather(
+            self.watch_collection(self.user_settings, settings_pipeline, _on_settings_change, full_document="updateLookup"),
+            self.watch_collection(self.user_presets, [], _on_presets_change, full_document="updateLookup"),
+        )
+
+    def invalidate_user_cache(self, user_id: int):
+        """Para quien escriba user_settings directamente sin pasar por estos métodos."""
+        self._settings_cache.pop(user_id)
+        self._presets_cache.pop(user_id)
+
     # --- Métodos para Perfiles (Presets) ---
 
     async def add_preset(self, user_id: int, preset_name: str, config_data: Dict):
@@ -143,16 +723,31 @@ class Database:
             "preset_name": preset_name.lower().strip(),
             "config_data": config_data,
         }
-        await self.user_presets.update_one(
+        result = await self.user_presets.update_one(
             {"user_id": user_id, "preset_name": preset_name.lower().strip()},
             {"$set": preset_doc, "$setOnInsert": {"created_at": datetime.utcnow()}},
             upsert=True
         )
+        # Write-through sobre la lista cacheada del usuario.
+        presets = self._presets_cache.get(user_id)
+        if presets is not None:
+            existing = next((p for p in presets if p["preset_name"] == preset_doc["preset_name"]), None)
+            if existing is not None:
+                existing.update(preset_doc)
+            elif result.upserted_id is not None:
+                presets.append({"_id": result.upserted_id, "created_at": datetime.utcnow(), **preset_doc})
+                presets.sort(key=lambda p: p["preset_name"])
+            else:
+                self._presets_cache.pop(user_id)
         logger.info(f"Perfil '{preset_name}' guardado para el usuario {user_id}.")
 
     async def get_user_presets(self, user_id: int) -> List[Dict]:
-        cursor = self.user_presets.find({"user_id": user_id}).sort("preset_name", ASCENDING)
-        return await cursor.to_list(length=50) # Límite de 50 perfiles por usuario
+        presets = self._presets_cache.get(user_id)
+        if presets is None:
+            cursor = self.user_presets.find({"user_id": user_id}).sort("preset_name", ASCENDING)
+            presets = await cursor.to_list(length=50) # Límite de 50 perfiles por usuario
+            self._presets_cache.set(user_id, presets)
+        return copy.deepcopy(presets)
 
     async def get_preset_by_id(self, preset_id: str) -> Optional[Dict]:
         try:
@@ -162,31 +757,61 @@ class Database:
 
     async def delete_preset_by_id(self, preset_id: str):
         try:
-            return await self.user_presets.delete_one({"_id": ObjectId(preset_id)})
+            deleted = await self.user_presets.find_one_and_delete({"_id": ObjectId(preset_id)}, projection={"user_id": 1})
+            if deleted:
+                self._presets_cache.pop(deleted.get("user_id"))
+            return deleted
         except Exception:
             return None
 
     # --- Métodos para Ajustes y Estado del Usuario ---
 
     async def get_user_settings(self, user_id: int) -> Dict:
+        settings = self._settings_cache.get(user_id)
+        if settings is not None:
+            return copy.deepcopy(settings)
         settings = await self.user_settings.find_one({"_id": user_id})
         if not settings:
-            default_settings = {
-                "_id": user_id,
-                "created_at": datetime.utcnow(),
-                "user_state": {"status": "idle", "data": {}},
-                "restricted_channels": {},  # Almacena info de canales restringidos
-                "last_used_userbot": datetime.utcnow()  # Para control de rate limit
-            }
+            default_settings = default_user_settings(user_id)
             await self.user_settings.insert_one(default_settings)
+            self._record_new_users(1)
+            self._settings_cache.set(user_id, copy.deepcopy(default_settings))
             logger.info(f"Nuevo perfil de usuario creado en la DB para el ID: {user_id}")
             return default_settings
-        return settings
+        self._settings_cache.set(user_id, settings)
+        return copy.deepcopy(settings)
+
+    async def get_user_document(self, user_id: int) -> Optional[Dict]:
+        return await self.user_settings.find_one({"_id": user_id})
+
+    async def get_banned_users(self) -> Dict[int, Optional[Dict]]:
+        cursor = self.user_settings.find({"banned": True}, {"_id": 1, "ban_info": 1})
+        return {doc["_id"]: doc.get("ban_info") async for doc in cursor}
+
+    async def set_user_ban(self, user_id: int, ban_info: Dict) -> bool:
+        result = await self.user_settings.update_one(
+            {"_id": user_id},
+            {"$set": {"banned": True, "ban_info": ban_info}},
+            upsert=True
+        )
+        self.invalidate_user_cache(user_id)
+        return result.upserted_id is not None
+
+    async def clear_user_ban(self, user_id: int, admin_id: Optional[int] = None) -> bool:
+        result = await self.user_settings.update_one(
+            {"_id": user_id},
+            {
+                "$set": {"banned": False},
+                "$push": {"unban_history": {"unbanned_by": admin_id, "unbanned_at": datetime.utcnow()}}
+            }
+        )
+        self.invalidate_user_cache(user_id)
+        return result.modified_count > 0
 
     async def add_restricted_channel(self, user_id: int, channel_id: int, channel_title: str) -> bool:
         """Registra un canal restringido para un usuario."""
         try:
-            await self.user_settings.update_one(
+            result = await self.user_settings.update_one(
                 {"_id": user_id},
                 {"$set": {
                     f"restricted_channels.{channel_id}": {
@@ -196,6 +821,12 @@ class Database:
                 }},
                 upsert=True
             )
+            self._record_new_users(1 if result.upserted_id is not None else 0)
+            if (settings := self._settings_cache.get(user_id)) is not None:
+                settings.setdefault("restricted_channels", {})[str(channel_id)] = {
+                    "title": channel_title,
+                    "added_at": datetime.utcnow()
+                }
             return True
         except Exception as e:
             logger.error(f"Error al añadir canal restringido: {e}")
@@ -208,11 +839,15 @@ class Database:
 
     async def set_user_state(self, user_id: int, status: str, data: Optional[Dict] = None):
         state_data = {"status": status, "data": data or {}}
-        return await self.user_settings.update_one(
+        result = await self.user_settings.update_one(
             {"_id": user_id},
             {"$set": {"user_state": state_data}},
             upsert=True
         )
+        self._record_new_users(1 if result.upserted_id is not None else 0)
+        if (settings := self._settings_cache.get(user_id)) is not None:
+            settings["user_state"] = copy.deepcopy(state_data)
+        return result
 
     async def get_user_state(self, user_id: int) -> Dict:
         settings = await self.get_user_settings(user_id)
@@ -228,15 +863,10 @@ class Database:
                 return True
             
             # Crear nuevo usuario
-            user_doc = {
-                "_id": user_id,
-                "created_at": datetime.utcnow(),
-                "user_state": {"status": "idle", "data": {}},
-                "restricted_channels": {},
-                "last_used_userbot": datetime.utcnow()
-            }
+            user_doc = default_user_settings(user_id)
             
             await self.user_settings.insert_one(user_doc)
+            self._record_new_users(1)
             logger.info(f"Usuario {user_id} registrado exitosamente")
             return True
             
@@ -250,11 +880,18 @@ class Database:
             # Agregar timestamp si no existe
             if 'created_at' not in task_data:
                 task_data['created_at'] = datetime.utcnow()
+            if task_data.get("user_id") is not None and "ordinal" not in task_data:
+                ordinal = await self._next_task_ordinal(task_data["user_id"])
+                if ordinal is not None:
+                    task_data["ordinal"] = ordinal
             
             # Insertar en la colección de tareas
             result = await self.tasks.insert_one(task_data)
             
             if result.inserted_id:
+                self.record_task_event(task_data.get("user_id"), "created")
+                if task_data.get("status") == "queued":
+                    self.record_task_event(task_data.get("user_id"), "queued")
                 logger.info(f"Tarea creada exitosamente: {result.inserted_id}")
                 return str(result.inserted_id)
             else:
@@ -277,6 +914,7 @@ class Database:
                 "last_message_id": 0,
                 "active": True
             })
+            self.increment_counters(user_id, {"monitored_channels": 1})
             return True
         except Exception as e:
             logger.error(f"Error al añadir canal monitoreado: {e}")
@@ -303,19 +941,87 @@ class Database:
         """Elimina un canal de la lista de monitoreo"""
         try:
             result = await self.monitored_channels.update_one(
-                {"channel_id": channel_id, "user_id": user_id},
+                {"channel_id": channel_id, "user_id": user_id, "active": True},
                 {"$set": {"active": False}}
             )
+            if result.modified_count > 0:
+                self.increment_counters(user_id, {"monitored_channels": -1})
             return result.modified_count > 0
         except Exception as e:
             logger.error(f"Error al eliminar canal monitoreado: {e}")
             return False
 
+    async def get_active_monitored_channels(self, limit: int = 5000) -> List[Dict]:
+        """Obtiene los canales monitoreados activos de todos los usuarios"""
+        cursor = self.monitored_channels.find({"active": True}).sort("channel_id", ASCENDING)
+        return await cursor.to_list(length=limit)
+
     async def update_last_message_id(self, channel_id: int, message_id: int):
-        """Actualiza el último ID de mensaje procesado para un canal"""
-        await self.monitored_channels.update_one(
+        """Actualiza el último ID de mensaje procesado para un canal (en todas sus suscripciones)"""
+        await self.monitored_channels.update_many(
             {"channel_id": channel_id},
-            {"$set": {"last_message_id": message_id}}
+            {"$max": {"last_message_id": message_id}}
+        )
+
+    # --- Sesiones de búsqueda (caducan por el índice TTL de created_at) ---
+
+    async def create_search_session(self, user_id: int, data: Dict) -> str:
+        result = await self.search_sessions.insert_one({"user_id": user_id, "created_at": datetime.utcnow(), **data})
+        return str(result.inserted_id)
+
+    async def get_search_session(self, session_id: str) -> Optional[Dict]:
+        try:
+            return await self.search_sessions.find_one({"_id": ObjectId(session_id)})
+        except Exception:
+            return None
+
+    async def delete_search_session(self, session_id: str):
+        try:
+            await self.search_sessions.delete_one({"_id": ObjectId(session_id)})
+        except Exception:
+            pass
+
+    # --- Peers de Telegram (_id "<owner_id>:<peer_id>") ---
+
+    async def upsert_telegram_peers(self, owner_id: int, peers: List[Tuple]):
+        now = datetime.utcnow()
+        operations = [
+            UpdateOne(
+                {"_id": f"{owner_id}:{peer_id}"},
+                {"$set": {
+                    "owner_id": owner_id,
+                    "peer_id": peer_id,
+                    "access_hash": access_hash,
+                    "type": peer_type,
+                    "username": username.lower() if username else None,
+                    "phone_number": phone_number,
+                    "updated_at": now,
+                }},
+                upsert=True
+            )
+            for peer_id, access_hash, peer_type, username, phone_number in peers
+        ]
+        if operations:
+            await self.telegram_peers.bulk_write(operations, ordered=False)
+
+    async def get_telegram_peer(self, owner_id: int, peer_id: int) -> Optional[Dict]:
+        return await self.telegram_peers.find_one({"_id": f"{owner_id}:{peer_id}"})
+
+    async def get_telegram_peer_by_username(self, owner_id: int, username: str) -> Optional[Dict]:
+        return await self.telegram_peers.find_one(
+            {"owner_id": owner_id, "username": username.lower()}, sort=[("updated_at", DESCENDING)]
         )
 
-db_instance = Database()
\ No newline at end of file
+    async def has_telegram_peers(self, owner_id: int) -> bool:
+        return await self.telegram_peers.find_one({"owner_id": owner_id}, {"_id": 1}) is not None
+
+
+def _create_db_instance() -> StorageBackend:
+    """Instancia el backend elegido con STORAGE_BACKEND ("mongo" o "sqlite")."""
+    if STORAGE_BACKEND == "sqlite":
+        from src.db.sqlite_backend import SQLiteDatabase
+        return SQLiteDatabase()
+    return Database()
+
+# Instancia singleton para ser usada en todo el proyecto.
+db_instance = _create_db_instance()
\ No newline at end of file
@@ -0,0 +1,106 @@
+# --- START OF FILE src/db/monitoring.py ---
+
+import logging
+import os
+import threading
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+
+from pymongo import monitoring
+
+from src.helpers.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Operaciones más lentas que esto (ms) se registran con la forma de su filtro.
+MONGO_SLOW_QUERY_MS = float(os.getenv("MONGO_SLOW_QUERY_MS", "100"))
+
+# Comandos internos del driver que no interesan en las métricas.
+_IGNORED_COMMANDS = {"hello", "ismaster", "isMaster", "ping", "saslStart", "saslContinue", "endSessions", "buildInfo"}
+
+# Contador de operaciones de la actualización de Telegram en curso (ver begin_update).
+_current_update: ContextVar[Optional[Dict[str, Any]]] = ContextVar("mongo_update_ops", default=None)
+
+
+def filter_shape(value: Any) -> Any:
+    """Sustituye los valores por su tipo: deja la forma de la consulta sin datos de usuarios."""
+    if isinstance(value, dict):
+        return {key: filter_shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [filter_shape(value[0])] if value else []
+    return type(value).__name__
+
+
+def _extract_filter(command_name: str, command: Dict) -> Any:
+    if command_name in ("find", "count", "distinct", "findAndModify", "delete", "update"):
+        if command_name == "update" and command.get("updates"):
+            return command["updates"][0].get("q")
+        if command_name == "delete" and command.get("deletes"):
+            return command["deletes"][0].get("q")
+        return command.get("filter", command.get("query"))
+    if command_name == "aggregate":
+        return [stage for stage in command.get("pipeline", [])[:2]]
+    return None
+
+
+def begin_update(kind: str):
+    """
+    Abre el contador de operaciones de una actualización de Telegram. Lo llama un middleware
+    al principio de cada actualización; el contador anterior del mismo worker del dispatcher
+    se cierra aquí y se vuelca al histograma.
+    """
+    previous = _current_update.get()
+    if previous is not None:
+        metrics.observe("mongo.ops_per_update", previous["ops"], buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55))
+        metrics.observe(f"mongo.ops_per_update.{previous['kind']}", previous["ops"], buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55))
+    _current_update.set({"kind": kind, "ops": 0})
+
+
+class MongoCommandMonitor(monitoring.CommandListener):
+    """Listener de comandos de pymongo: histogramas de latencia, log de consultas lentas y operaciones por update."""
+
+    def __init__(self, slow_ms: float = MONGO_SLOW_QUERY_MS):
+        self.slow_ms = slow_ms
+        self._lock = threading.Lock()
+        self._inflight: Dict[int, tuple] = {}
+
+    def started(self, event):
+        if event.command_name in _IGNORED_COMMANDS:
+            return
+        collection = event.command.get(event.command_name)
+        if event.command_name == "getMore":
+            collection = event.command.get("collection")
+        if not isinstance(collection, str):
+            collection = event.database_name
+        with self._lock:
+            self._inflight[event.request_id] = (collection, event.command_name, _extract_filter(event.command_name, event.command))
+        if (update := _current_update.get()) is not None:
+            update["ops"] += 1
+
+    def _finish(self, event, failed: bool):
+        with self._lock:
+            info = self._inflight.pop(event.request_id, None)
+        if info is None:
+            return
+        collection, command_name, query_filter = info
+        elapsed_ms = event.duration_micros / 1000
+        metrics.observe(f"mongo.latency.{collection}.{command_name}", elapsed_ms)
+        metrics.inc("mongo.ops")
+        if failed:
+            metrics.inc(f"mongo.failed.{collection}.{command_name}")
+        if elapsed_ms >= self.slow_ms:
+            metrics.inc("mongo.slow_ops")
+            logger.warning(
+                f"[MONGO] Operación lenta {command_name} en {collection}: {elapsed_ms:.0f} ms. "
+                f"Forma del filtro: {filter_shape(query_filter)}"
+            )
+
+    def succeeded(self, event):
+        self._finish(event, failed=False)
+
+    def failed(self, event):
+        self._finish(event, failed=True)
+
+
+# Instancia singleton registrada en el cliente de Motor.
+mongo_command_monitor = MongoCommandMonitor()
@@ -0,0 +1,918 @@
+# --- START OF FILE src/db/sqlite_backend.py ---
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from bson.objectid import ObjectId
+
+from src.db.backend import (
+    StorageBackend, TERMINAL_TASK_STATUSES, CANCELLABLE_TASK_STATUSES, PANEL_PAGE_SIZE,
+    SEARCH_SESSION_TTL, build_task_document, default_user_settings
+)
+
+logger = logging.getLogger(__name__)
+
+# Fichero de la base de datos embebida (STORAGE_BACKEND=sqlite).
+SQLITE_PATH = os.getenv("SQLITE_PATH", "data/bot_state.sqlite3")
+# Espera máxima por el lock de escritura cuando otro proceso comparte el fichero.
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+_EPOCH = datetime(1970, 1, 1)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id TEXT PRIMARY KEY,
+    user_id INTEGER,
+    status TEXT,
+    priority INTEGER NOT NULL DEFAULT 0,
+    created_at INTEGER,
+    ordinal INTEGER,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tasks_claim_index ON tasks (status, user_id, priority DESC, created_at);
+CREATE INDEX IF NOT EXISTS tasks_user_status_created_index ON tasks (user_id, status, created_at, id);
+CREATE UNIQUE INDEX IF NOT EXISTS tasks_user_ordinal_index ON tasks (user_id, ordinal) WHERE ordinal IS NOT NULL;
+CREATE UNIQUE INDEX IF NOT EXISTS tasks_dedupe_index ON tasks (json_extract(doc, '$.dedupe_key'))
+    WHERE json_extract(doc, '$.dedupe_key') IS NOT NULL;
+
+CREATE TABLE IF NOT EXISTS user_settings (
+    id INTEGER PRIMARY KEY,
+    banned INTEGER NOT NULL DEFAULT 0,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS user_settings_banned_index ON user_settings (banned) WHERE banned = 1;
+
+CREATE TABLE IF NOT EXISTS user_presets (
+    id TEXT PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    preset_name TEXT NOT NULL,
+    doc TEXT NOT NULL,
+    UNIQUE (user_id, preset_name)
+);
+
+CREATE TABLE IF NOT EXISTS monitored_channels (
+    id TEXT PRIMARY KEY,
+    channel_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    active INTEGER NOT NULL DEFAULT 1,
+    last_message_id INTEGER NOT NULL DEFAULT 0,
+    added_on INTEGER
+);
+CREATE INDEX IF NOT EXISTS monitored_channel_user_active_index ON monitored_channels (channel_id, user_id, active);
+CREATE INDEX IF NOT EXISTS monitored_user_active_index ON monitored_channels (user_id, active);
+CREATE INDEX IF NOT EXISTS monitored_active_channel_index ON monitored_channels (active, channel_id);
+
+CREATE TABLE IF NOT EXISTS search_sessions (
+    id TEXT PRIMARY KEY,
+    user_id INTEGER,
+    created_at INTEGER NOT NULL,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS search_sessions_created_index ON search_sessions (created_at);
+
+CREATE TABLE IF NOT EXISTS counters (
+    id TEXT NOT NULL,
+    field TEXT NOT NULL,
+    value INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (id, field)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS counters_field_value_index ON counters (field, value DESC);
+
+CREATE TABLE IF NOT EXISTS telegram_peers (
+    owner_id INTEGER NOT NULL,
+    peer_id INTEGER NOT NULL,
+    access_hash INTEGER,
+    type TEXT NOT NULL,
+    username TEXT,
+    phone_number TEXT,
+    updated_at INTEGER NOT NULL,
+    PRIMARY KEY (owner_id, peer_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS telegram_peers_username_index ON telegram_peers (owner_id, username, updated_at DESC);
+"""
+
+
+def _to_millis(value: Optional[datetime]) -> Optional[int]:
+    if value is None:
+        return None
+    return int((value - _EPOCH) / timedelta(milliseconds=1))
+
+
+def _from_millis(value: Optional[int]) -> Optional[datetime]:
+    return None if value is None else _EPOCH + timedelta(milliseconds=value)
+
+
+def _json_default(value: Any):
+    if isinstance(value, datetime):
+        return {"$date": _to_millis(value)}
+    if isinstance(value, ObjectId):
+        return {"$oid": str(value)}
+    raise TypeError(f"Tipo no serializable: {type(value).__name__}")
+
+
+def _json_hook(value: Dict) -> Any:
+    if len(value) == 1:
+        if "$date" in value:
+            return _from_millis(value["$date"])
+        if "$oid" in value:
+            return ObjectId(value["$oid"])
+    return value
+
+
+def _dumps(doc: Dict) -> str:
+    return json.dumps({k: v for k, v in doc.items() if k != "_id"}, default=_json_default, ensure_ascii=False)
+
+
+def _loads(raw: str, doc_id: Any) -> Dict:
+    doc = json.loads(raw, object_hook=_json_hook)
+    doc["_id"] = doc_id
+    return doc
+
+
+def _set_path(doc: Dict, path: str, value: Any):
+    """$set con notación de puntos ("processing_config.quality")."""
+    *parents, leaf = path.split(".")
+    target = doc
+    for part in parents:
+        if not isinstance(target.get(part), dict):
+            target[part] = {}
+        target = target[part]
+    target[leaf] = value
+
+
+def _unset_path(doc: Dict, path: str):
+    *parents, leaf = path.split(".")
+    target = doc
+    for part in parents:
+        target = target.get(part)
+        if not isinstance(target, dict):
+            return
+    target.pop(leaf, None)
+
+
+class SQLiteDatabase(StorageBackend):
+    """
+    Backend embebido sobre SQLite en modo WAL. Todas las consultas se ejecutan en un único
+    hilo dedicado (el executor serializa las operaciones), así el bucle de eventos nunca
+    se bloquea y las lecturas-modificaciones-escrituras son atómicas dentro del proceso.
+    Las escrituras usan BEGIN IMMEDIATE para serializarse también con otros procesos.
+    """
+
+    backend_name = "sqlite"
+    _instance = None
+    _initialized = False
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(SQLiteDatabase, cls).__new__(cls)
+            cls._instance.path = SQLITE_PATH
+            cls._instance._conn = None
+            cls._instance._executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="sqlite", initializer=cls._instance._connect
+            )
+            logger.info(f"Backend SQLite configurado en {SQLITE_PATH}.")
+        return cls._instance
+
+    # --- Infraestructura ---
+
+    def _connect(self):
+        """Se ejecuta en el hilo dedicado: la conexión nunca sale de él."""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        self._conn = conn
+
+    @contextmanager
+    def _transaction(self):
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield self._conn
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        else:
+            self._conn.execute("COMMIT")
+
+    async def _run(self, func: Callable, *args) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _submit(self, func: Callable, *args):
+        """Escritura sin esperar el resultado (contadores, actividad). El orden FIFO del hilo se mantiene."""
+        def _log_errors(future):
+            if future.exception() is not None:
+                logger.error(f"Error en escritura SQLite en segundo plano: {future.exception()}")
+        self._executor.submit(func, *args).add_done_callback(_log_errors)
+
+    async def init_db(self):
+        if self._initialized:
+            return
+        await self._run(self._conn_executescript, SCHEMA)
+        self._initialized = True
+        await self._run(self._purge_search_sessions)
+        logger.info(f"Base de datos SQLite lista ({self.path}, WAL).")
+
+    def _conn_executescript(self, script: str):
+        self._conn.executescript(script)
+
+    # --- Tareas ---
+
+    @staticmethod
+    def _task_columns(doc: Dict) -> Tuple:
+        return (
+            doc.get("user_id"), doc.get("status"), int(doc.get("priority") or 0),
+            _to_millis(doc.get("created_at")), doc.get("ordinal"), _dumps(doc),
+        )
+
+    def _load_task(self, conn, task_id: str) -> Optional[Dict]:
+        row = conn.execute("SELECT doc FROM tasks WHERE id = ?", (str(task_id),)).fetchone()
+        return _loads(row["doc"], ObjectId(str(task_id))) if row else None
+
+    def _save_task(self, conn, doc: Dict):
+        conn.execute(
+            "UPDATE tasks SET user_id = ?, status = ?, priority = ?, created_at = ?, ordinal = ?, doc = ? WHERE id = ?",
+            (*self._task_columns(doc), str(doc["_id"]))
+        )
+
+    def _next_ordinal_sync(self, conn, user_id: int) -> int:
+        conn.execute(
+            "INSERT INTO counters (id, field, value) VALUES (?, 'task_seq', 1) "
+            "ON CONFLICT (id, field) DO UPDATE SET value = value + 1",
+            (f"user:{int(user_id)}",)
+        )
+        return conn.execute(
+            "SELECT value FROM counters WHERE id = ? AND field = 'task_seq'", (f"user:{int(user_id)}",)
+        ).fetchone()["value"]
+
+    def _insert_task_sync(self, doc: Dict, assign_ordinal: bool = True) -> ObjectId:
+        with self._transaction() as conn:
+            doc.setdefault("created_at", datetime.utcnow())
+            if assign_ordinal and doc.get("user_id") is not None and "ordinal" not in doc:
+                doc["ordinal"] = self._next_ordinal_sync(conn, doc["user_id"])
+            doc["_id"] = doc.get("_id") or ObjectId()
+            conn.execute(
+                "INSERT INTO tasks (user_id, status, priority, created_at, ordinal, doc, id) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (*self._task_columns(doc), str(doc["_id"]))
+            )
+        return doc["_id"]
+
+    def _insert_tasks_sync(self, docs: List[Dict]) -> List[ObjectId]:
+        inserted = []
+        with self._transaction() as conn:
+            for doc in docs:
+                doc.setdefault("created_at", datetime.utcnow())
+                doc["_id"] = doc.get("_id") or ObjectId()
+                if doc.get("dedupe_key") and conn.execute(
+                    "SELECT 1 FROM tasks WHERE json_extract(doc, '$.dedupe_key') = ?", (doc["dedupe_key"],)
+                ).fetchone():
+                    continue
+                if doc.get("user_id") is not None and "ordinal" not in doc:
+                    doc["ordinal"] = self._next_ordinal_sync(conn, doc["user_id"])
+                conn.execute(
+                    "INSERT INTO tasks (user_id, status, priority, created_at, ordinal, doc, id) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (*self._task_columns(doc), str(doc["_id"]))
+                )
+                inserted.append(doc)
+        return inserted
+
+    async def add_tasks(self, task_docs: List[Dict]) -> List[ObjectId]:
+        if not task_docs:
+            return []
+        inserted = await self._run(self._insert_tasks_sync, task_docs)
+        for doc in inserted:
+            self.record_task_event(doc["user_id"], "created")
+        logger.info(f"{len(inserted)} tareas añadidas en lote ({len(task_docs) - len(inserted)} ya existían).")
+        return [doc["_id"] for doc in inserted]
+
+    async def add_job_document(self, job_doc: Dict) -> ObjectId:
+        job_id = await self._run(self._insert_task_sync, job_doc, False)
+        logger.info(f"Documento de control {job_id} ({job_doc.get('file_type')}) añadido.")
+        return job_id
+
+    async def add_task(self, user_id: int, file_type: str, file_name: Optional[str] = None,
+                       final_filename: Optional[str] = None, url: Optional[str] = None,
+                       file_id: Optional[str] = None, processing_config: Optional[Dict] = None,
+                       status: str = "pending_processing", metadata: Optional[Dict] = None,
+                       custom_fields: Optional[Dict] = None) -> ObjectId:
+        task_doc = build_task_document(user_id, file_type, file_name, final_filename, url, file_id,
+                                       processing_config, status, metadata, custom_fields)
+        task_id = await self._run(self._insert_task_sync, task_doc)
+        self.record_task_event(user_id, "created")
+        if status == "queued":
+            self.record_task_event(user_id, "queued")
+        logger.info(f"Nueva tarea {task_id} añadida para el usuario {user_id} con estado '{status}'")
+        return task_id
+
+    async def create_task(self, task_data: dict) -> Optional[str]:
+        try:
+            task_id = await self._run(self._insert_task_sync, task_data)
+            self.record_task_event(task_data.get("user_id"), "created")
+            if task_data.get("status") == "queued":
+                self.record_task_event(task_data.get("user_id"), "queued")
+            logger.info(f"Tarea creada exitosamente: {task_id}")
+            return str(task_id)
+        except Exception as e:
+            logger.error(f"Error creando tarea: {e}")
+            return None
+
+    async def get_task(self, task_id: str) -> Optional[Dict]:
+        try:
+            ObjectId(str(task_id))
+        except Exception:
+            logger.warning(f"Intento de búsqueda con un ID de tarea inválido: {task_id}")
+            return None
+        return await self._run(lambda: self._load_task(self._conn, task_id))
+
+    def _select_tasks(self, sql: str, params: Tuple) -> List[Dict]:
+        return [_loads(row["doc"], ObjectId(row["id"])) for row in self._conn.execute(sql, params)]
+
+    async def get_pending_tasks(self, user_id: int, file_type_filter: Optional[str] = None,
+                                status_filter: str = "pending_processing") -> List[Dict]:
+        tasks = await self._run(
+            self._select_tasks,
+            "SELECT id, doc FROM tasks WHERE user_id = ? AND status = ? ORDER BY created_at, id",
+            (int(user_id), status_filter)
+        )
+        if file_type_filter:
+            tasks = [task for task in tasks if task.get("file_type") == file_type_filter]
+        return tasks[:100]
+
+    async def get_task_by_ordinal(self, user_id: int, ordinal: int,
+                                  status: str = "pending_processing") -> Optional[Dict]:
+        tasks = await self._run(
+            self._select_tasks,
+            "SELECT id, doc FROM tasks WHERE user_id = ? AND ordinal = ? AND status = ?",
+            (int(user_id), int(ordinal), status)
+        )
+        return tasks[0] if tasks else None
+
+    def _ensure_ordinals_sync(self, tasks: List[Dict]):
+        with self._transaction() as conn:
+            for task in tasks:
+                if "ordinal" in task or task.get("user_id") is None:
+                    continue
+                stored = self._load_task(conn, task["_id"])
+                if stored is None or "ordinal" in stored:
+                    continue
+                stored["ordinal"] = self._next_ordinal_sync(conn, task["user_id"])
+                self._save_task(conn, stored)
+                task["ordinal"] = stored["ordinal"]
+
+    async def ensure_task_ordinals(self, tasks: List[Dict]):
+        if any("ordinal" not in task for task in tasks):
+            await self._run(self._ensure_ordinals_sync, tasks)
+
+    async def count_user_tasks(self, user_id: int, status: str = "pending_processing") -> int:
+        row = await self._run(lambda: self._conn.execute(
+            "SELECT COUNT(*) AS n FROM tasks WHERE user_id = ? AND status = ?", (int(user_id), status)
+        ).fetchone())
+        return row["n"]
+
+    async def get_tasks_page(self, user_id: int, status: str = "pending_processing",
+                             cursor: Optional[Tuple[datetime, ObjectId]] = None, backwards: bool = False,
+                             limit: int = PANEL_PAGE_SIZE) -> Tuple[List[Dict], bool]:
+        op, direction = ("<", "DESC") if backwards else (">", "ASC")
+        sql = "SELECT id, doc FROM tasks WHERE user_id = ? AND status = ?"
+        params: List[Any] = [int(user_id), status]
+        if cursor is not None:
+            sql += f" AND (created_at, id) {op} (?, ?)"
+            params += [_to_millis(cursor[0]), str(cursor[1])]
+        sql += f" ORDER BY created_at {direction}, id {direction} LIMIT ?"
+        params.append(limit + 1)
+        docs = await self._run(self._select_tasks, sql, tuple(params))
+        has_more = len(docs) > limit
+        docs = docs[:limit]
+        if backwards:
+            docs.reverse()
+        return docs, has_more
+
+    def _modify_task_sync(self, task_id: str, changes: Callable[[Dict], bool]) -> Optional[Dict]:
+        """Aplica `changes` al documento dentro de una transacción; si devuelve False no se guarda."""
+        with self._transaction() as conn:
+            doc = self._load_task(conn, task_id)
+            if doc is None or changes(doc) is False:
+                return None
+            self._save_task(conn, doc)
+            return doc
+
+    async def update_task_fields(self, task_id: str, fields: Dict[str, Any]):
+        """Escritura inmediata: en local no compensa diferirla."""
+        fields = dict(fields)
+        if fields.get("status") in TERMINAL_TASK_STATUSES:
+            fields.setdefault("finished_at", datetime.utcnow())
+
+        def _apply(doc: Dict):
+            # Igual que en Mongo: un cambio de estado no pisa un estado final (p. ej. tras cancel_task).
+            if "status" in fields and doc.get("status") in TERMINAL_TASK_STATUSES:
+                return False
+            for path, value in fields.items():
+                _set_path(doc, path, value)
+        await self._run(self._modify_task_sync, task_id, _apply)
+
+    async def finish_task(self, task_id: str, status: str, fields: Optional[Dict[str, Any]] = None) -> bool:
+        changes = {**(fields or {}), "status": status, "finished_at": datetime.utcnow()}
+
+        def _apply(doc: Dict):
+            if doc.get("status") in TERMINAL_TASK_STATUSES:
+                return False
+            for path, value in changes.items():
+                _set_path(doc, path, value)
+        doc = await self._run(self._modify_task_sync, task_id, _apply)
+        if doc is None:
+            logger.info(f"Tarea {task_id} ya tenía un estado final; no se marca como '{status}'.")
+            return False
+        self.record_task_event(doc.get("user_id"), status)
+        return True
+
+    async def update_task_field(self, task_id: str, field: str, value: Any):
+        await self._run(self._modify_task_sync, task_id, lambda doc: _set_path(doc, field, value))
+
+    async def update_task_config(self, task_id: str, key: str, value: Any):
+        await self._run(self._modify_task_sync, task_id, lambda doc: _set_path(doc, f"processing_config.{key}", value))
+
+    async def unset_task_config_key(self, task_id: str, key: str):
+        await self._run(self._modify_task_sync, task_id, lambda doc: _unset_path(doc, f"processing_config.{key}"))
+
+    def _execute_write(self, sql: str, params: Tuple) -> int:
+        with self._transaction() as conn:
+            return conn.execute(sql, params).rowcount
+
+    async def delete_task_by_id(self, task_id: str):
+        return await self._run(self._execute_write, "DELETE FROM tasks WHERE id = ?", (str(task_id),))
+
+    async def delete_all_pending_tasks(self, user_id: int):
+        return await self._run(
+            self._execute_write, "DELETE FROM tasks WHERE user_id = ? AND status = 'pending_processing'", (int(user_id),)
+        )
+
+    async def cancel_task(self, task_id: str) -> bool:
+        def _cancel(doc: Dict):
+            if doc.get("status") not in CANCELLABLE_TASK_STATUSES:
+                return False
+            now = datetime.utcnow()
+            doc.update({"status": "cancelled", "cancelled_at": now, "finished_at": now})
+        try:
+            doc = await self._run(self._modify_task_sync, task_id, _cancel)
+        except Exception as e:
+            logger.error(f"Error al cancelar la tarea {task_id}: {e}")
+            return False
+        if doc:
+            self.record_task_event(doc.get("user_id"), "cancelled")
+        return doc is not None
+
+    async def get_cancelled_task_ids(self, task_ids: List[str]) -> List[str]:
+        if not task_ids:
+            return []
+        placeholders = ",".join("?" * len(task_ids))
+        rows = await self._run(lambda: self._conn.execute(
+            f"SELECT id FROM tasks WHERE status = 'cancelled' AND id IN ({placeholders})", tuple(map(str, task_ids))
+        ).fetchall())
+        return [row["id"] for row in rows]
+
+    # --- Cola del worker ---
+
+    async def get_queued_user_ids(self) -> List[int]:
+        rows = await self._run(lambda: self._conn.execute(
+            "SELECT DISTINCT user_id FROM tasks WHERE status = 'queued'"
+        ).fetchall())
+        return [row["user_id"] for row in rows]
+
+    async def count_tasks_by_status(self, status: str) -> int:
+        row = await self._run(lambda: self._conn.execute(
+            "SELECT COUNT(*) AS n FROM tasks WHERE status = ?", (status,)
+        ).fetchone())
+        return row["n"]
+
+    async def get_tasks_by_status(self, status: str, limit: int = 100) -> List[Dict]:
+        return await self._run(
+            self._select_tasks, "SELECT id, doc FROM tasks WHERE status = ? ORDER BY created_at LIMIT ?", (status, limit)
+        )
+
+    def _claim_sync(self, user_id: int, queue_position: int) -> Optional[Dict]:
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT id, doc FROM tasks WHERE status = 'queued' AND user_id = ? "
+                "ORDER BY priority DESC, created_at LIMIT 1", (int(user_id),)
+            ).fetchone()
+            if row is None:
+                return None
+            doc = _loads(row["doc"], ObjectId(row["id"]))
+            doc.update({"status": "processing", "processed_at": datetime.utcnow(), "queue_position": queue_position})
+            self._save_task(conn, doc)
+            return doc
+
+    async def claim_next_task(self, user_id: int, queue_position: int) -> Optional[Dict]:
+        return await self._run(self._claim_sync, user_id, queue_position)
+
+    # --- Contadores ---
+
+    def _increment_sync(self, increments: Dict[str, Dict[str, int]]):
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT INTO counters (id, field, value) VALUES (?, ?, ?) "
+                "ON CONFLICT (id, field) DO UPDATE SET value = value + excluded.value",
+                [(key, field, delta) for key, fields in increments.items() for field, delta in fields.items()]
+            )
+
+    def increment_counters(self, user_id: Optional[int], fields: Dict[str, int],
+                           global_fields: Optional[Dict[str, int]] = None):
+        increments = {"global": global_fields if global_fields is not None else fields}
+        if user_id is not None:
+            increments[f"user:{int(user_id)}"] = fields
+        self._submit(self._increment_sync, increments)
+
+    def record_task_event(self, user_id: int, event: str):
+        """Transición de una tarea: 'created', 'queued', 'done', 'error' o 'cancelled'."""
+        field = f"tasks_{event}"
+        increments = {"global": {field: 1}}
+        if user_id is not None:
+            increments[f"user:{int(user_id)}"] = {field: 1}
+        if event == "created":
+            increments[f"daily:{datetime.utcnow():%Y-%m-%d}"] = {"tasks_created": 1}
+        self._submit(self._increment_sync, increments)
+
+    def record_media_dc(self, kind: str, dc_id: int):
+        self._submit(self._increment_sync, {f"daily:{datetime.utcnow():%Y-%m-%d}": {f"media_dc_{kind}_{dc_id}": 1}})
+
+    async def get_counters(self, key: str) -> Dict:
+        rows = await self._run(lambda: self._conn.execute(
+            "SELECT field, value FROM counters WHERE id = ?", (key,)
+        ).fetchall())
+        if not rows:
+            return {}
+        return {"_id": key, **{row["field"]: row["value"] for row in rows}}
+
+    async def get_top_users_by_tasks(self, limit: int = 5) -> List[Dict]:
+        rows = await self._run(lambda: self._conn.execute(
+            "SELECT id, value FROM counters WHERE field = 'tasks_created' AND id LIKE 'user:%' "
+            "ORDER BY value DESC LIMIT ?", (limit,)
+        ).fetchall())
+        return [{"_id": int(row["id"].split(":", 1)[1]), "total": row["value"]} for row in rows]
+
+    def _rebuild_counters_sync(self) -> int:
+        # Mismo criterio que en Mongo: estado actual con $set, acumulados con $max, tasks_queued intacto.
+        terminal_statuses = {"done", "error", "cancelled"}
+        sets: Dict[str, Dict[str, int]] = {"global": {"monitored_channels": 0}}
+        maxes: Dict[str, Dict[str, int]] = {"global": {}}
+
+        def _add(target: Dict[str, Dict[str, int]], key: str, field: str, n: int):
+            fields = target.setdefault(key, {})
+            fields[field] = fields.get(field, 0) + n
+
+        with self._transaction() as conn:
+            for row in conn.execute("SELECT user_id, status, COUNT(*) AS n FROM tasks GROUP BY user_id, status"):
+                keys = ["global"] + ([f"user:{row['user_id']}"] if row["user_id"] is not None else [])
+                for key in keys:
+                    _add(maxes, key, "tasks_created", row["n"])
+                    if row["status"] in terminal_statuses:
+                        _add(maxes, key, f"tasks_{row['status']}", row["n"])
+            for row in conn.execute(
+                "SELECT strftime('%Y-%m-%d', created_at / 1000, 'unixepoch') AS day, COUNT(*) AS n FROM tasks GROUP BY day"
+            ):
+                if row["day"]:
+                    _add(maxes, f"daily:{row['day']}", "tasks_created", row["n"])
+            for row in conn.execute("SELECT user_id, COUNT(*) AS n FROM monitored_channels WHERE active = 1 GROUP BY user_id"):
+                _add(sets, f"user:{row['user_id']}", "monitored_channels", row["n"])
+                _add(sets, "global", "monitored_channels", row["n"])
+            sets["global"]["users_total"] = conn.execute("SELECT COUNT(*) FROM user_settings").fetchone()[0]
+            sets["global"]["users_banned"] = conn.execute("SELECT COUNT(*) FROM user_settings WHERE banned = 1").fetchone()[0]
+
+            # La secuencia de ordinales nunca retrocede: /p N debe seguir apuntando a la misma tarea.
+            for row in conn.execute("SELECT user_id, MAX(ordinal) AS max_ordinal FROM tasks WHERE ordinal IS NOT NULL GROUP BY user_id"):
+                fields = maxes.setdefault(f"user:{row['user_id']}", {})
+                fields["task_seq"] = max(fields.get("task_seq", 0), row["max_ordinal"])
+
+            # Usuarios que ya no monitorean ningún canal.
+            conn.execute("UPDATE counters SET value = 0 WHERE field = 'monitored_channels'")
+            conn.executemany(
+                "INSERT INTO counters (id, field, value) VALUES (?, ?, ?) "
+                "ON CONFLICT (id, field) DO UPDATE SET value = excluded.value",
+                [(key, field, value) for key, fields in sets.items() for field, value in fields.items()]
+            )
+            conn.executemany(
+                "INSERT INTO counters (id, field, value) VALUES (?, ?, ?) "
+                "ON CONFLICT (id, field) DO UPDATE SET value = MAX(value, excluded.value)",
+                [(key, field, value) for key, fields in maxes.items() for field, value in fields.items()]
+            )
+        return len(set(sets) | set(maxes))
+
+    async def rebuild_counters(self) -> int:
+        total = await self._run(self._rebuild_counters_sync)
+        logger.info(f"Contadores reconstruidos: {total} documentos.")
+        return total
+
+    # --- Usuarios ---
+
+    def _load_user(self, conn, user_id: int) -> Optional[Dict]:
+        row = conn.execute("SELECT doc FROM user_settings WHERE id = ?", (int(user_id),)).fetchone()
+        return _loads(row["doc"], int(user_id)) if row else None
+
+    def _save_user(self, conn, doc: Dict):
+        conn.execute(
+            "INSERT INTO user_settings (id, banned, doc) VALUES (?, ?, ?) "
+            "ON CONFLICT (id) DO UPDATE SET banned = excluded.banned, doc = excluded.doc",
+            (int(doc["_id"]), 1 if doc.get("banned") else 0, _dumps(doc))
+        )
+
+    def _modify_user_sync(self, user_id: int, changes: Callable[[Dict], Any], upsert: bool = True) -> Tuple[bool, Any]:
+        """Aplica `changes` al documento del usuario. Devuelve (creado, resultado de changes)."""
+        with self._transaction() as conn:
+            doc = self._load_user(conn, user_id)
+            created = doc is None
+            if created:
+                if not upsert:
+                    return False, None
+                doc = {"_id": int(user_id)}
+            result = changes(doc)
+            self._save_user(conn, doc)
+        if created:
+            self.increment_counters(None, {"users_total": 1})
+        return created, result
+
+    def touch_user_activity(self, user_id: int, when: Optional[datetime] = None):
+        when = when or datetime.utcnow()
+
+        def _touch(doc: Dict):
+            if doc.get("last_active") is None or when > doc["last_active"]:
+                doc["last_active"] = when
+        self._submit(self._modify_user_sync, user_id, _touch)
+
+    def _get_or_create_user_sync(self, user_id: int) -> Tuple[bool, Dict]:
+        with self._transaction() as conn:
+            doc = self._load_user(conn, user_id)
+            if doc is not None:
+                return False, doc
+            doc = default_user_settings(int(user_id))
+            self._save_user(conn, doc)
+        self.increment_counters(None, {"users_total": 1})
+        return True, doc
+
+    async def get_user_settings(self, user_id: int) -> Dict:
+        created, doc = await self._run(self._get_or_create_user_sync, user_id)
+        if created:
+            logger.info(f"Nuevo perfil de usuario creado en la DB para el ID: {user_id}")
+        return doc
+
+    async def get_user_document(self, user_id: int) -> Optional[Dict]:
+        return await self._run(lambda: self._load_user(self._conn, user_id))
+
+    async def add_restricted_channel(self, user_id: int, channel_id: int, channel_title: str) -> bool:
+        """Registra un canal restringido para un usuario."""
+        def _add(doc: Dict):
+            doc.setdefault("restricted_channels", {})[str(channel_id)] = {
+                "title": channel_title,
+                "added_at": datetime.utcnow()
+            }
+        try:
+            await self._run(self._modify_user_sync, user_id, _add)
+            return True
+        except Exception as e:
+            logger.error(f"Error al añadir canal restringido: {e}")
+            return False
+
+    async def get_restricted_channels(self, user_id: int) -> Dict:
+        settings = await self.get_user_settings(user_id)
+        return settings.get("restricted_channels", {})
+
+    async def set_user_state(self, user_id: int, status: str, data: Optional[Dict] = None):
+        state_data = {"status": status, "data": data or {}}
+        await self._run(self._modify_user_sync, user_id, lambda doc: doc.__setitem__("user_state", state_data))
+
+    async def get_user_state(self, user_id: int) -> Dict:
+        settings = await self.get_user_settings(user_id)
+        return settings.get("user_state", {"status": "idle", "data": {}})
+
+    async def register_user(self, user_id: int) -> bool:
+        try:
+            created, _ = await self._run(self._get_or_create_user_sync, user_id)
+            logger.info(f"Usuario {user_id} registrado exitosamente" if created else f"Usuario {user_id} ya existe en la base de datos")
+            return True
+        except Exception as e:
+            logger.error(f"Error registrando usuario {user_id}: {e}")
+            return False
+
+    async def get_banned_users(self) -> Dict[int, Optional[Dict]]:
+        rows = await self._run(lambda: self._conn.execute(
+            "SELECT id, doc FROM user_settings WHERE banned = 1"
+        ).fetchall())
+        return {row["id"]: _loads(row["doc"], row["id"]).get("ban_info") for row in rows}
+
+    async def set_user_ban(self, user_id: int, ban_info: Dict) -> bool:
+        created, _ = await self._run(self._modify_user_sync, user_id, lambda doc: doc.update({"banned": True, "ban_info": ban_info}))
+        return created
+
+    async def clear_user_ban(self, user_id: int, admin_id: Optional[int] = None) -> bool:
+        def _unban(doc: Dict):
+            doc["banned"] = False
+            doc.setdefault("unban_history", []).append({"unbanned_by": admin_id, "unbanned_at": datetime.utcnow()})
+            return True
+        _, modified = await self._run(self._modify_user_sync, user_id, _unban, False)
+        return bool(modified)
+
+    # --- Perfiles ---
+
+    def _add_preset_sync(self, user_id: int, preset_name: str, config_data: Dict):
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT id, doc FROM user_presets WHERE user_id = ? AND preset_name = ?", (user_id, preset_name)
+            ).fetchone()
+            if row:
+                doc = _loads(row["doc"], ObjectId(row["id"]))
+            else:
+                doc = {"_id": ObjectId(), "created_at": datetime.utcnow()}
+            doc.update({"user_id": user_id, "preset_name": preset_name, "config_data": config_data})
+            conn.execute(
+                "INSERT INTO user_presets (id, user_id, preset_name, doc) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET doc = excluded.doc",
+                (str(doc["_id"]), user_id, preset_name, _dumps(doc))
+            )
+
+    async def add_preset(self, user_id: int, preset_name: str, config_data: Dict):
+        await self._run(self._add_preset_sync, user_id, preset_name.lower().strip(), config_data)
+        logger.info(f"Perfil '{preset_name}' guardado para el usuario {user_id}.")
+
+    async def get_user_presets(self, user_id: int) -> List[Dict]:
+        rows = await self._run(lambda: self._conn.execute(
+            "SELECT id, doc FROM user_presets WHERE user_id = ? ORDER BY preset_name LIMIT 50", (user_id,)
+        ).fetchall())
+        return [_loads(row["doc"], ObjectId(row["id"])) for row in rows]
+
+    async def get_preset_by_id(self, preset_id: str) -> Optional[Dict]:
+        row = await self._run(lambda: self._conn.execute(
+            "SELECT id, doc FROM user_presets WHERE id = ?", (str(preset_id),)
+        ).fetchone())
+        return _loads(row["doc"], ObjectId(row["id"])) if row else None
+
+    def _delete_preset_sync(self, preset_id: str) -> Optional[Dict]:
+        with self._transaction() as conn:
+            row = conn.execute("SELECT id, user_id FROM user_presets WHERE id = ?", (preset_id,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("DELETE FROM user_presets WHERE id = ?", (preset_id,))
+            return {"_id": ObjectId(row["id"]), "user_id": row["user_id"]}
+
+    async def delete_preset_by_id(self, preset_id: str):
+        try:
+            return await self._run(self._delete_preset_sync, str(preset_id))
+        except Exception:
+            return None
+
+    # --- Canales monitoreados ---
+
+    @staticmethod
+    def _channel_doc(row) -> Dict:
+        return {
+            "_id": ObjectId(row["id"]),
+            "channel_id": row["channel_id"],
+            "user_id": row["user_id"],
+            "added_on": _from_millis(row["added_on"]),
+            "last_message_id": row["last_message_id"],
+            "active": bool(row["active"]),
+        }
+
+    async def add_monitored_channel(self, channel_id: int, user_id: int) -> bool:
+        try:
+            await self._run(
+                self._execute_write,
+                "INSERT INTO monitored_channels (id, channel_id, user_id, active, last_message_id, added_on) VALUES (?, ?, ?, 1, 0, ?)",
+                (str(ObjectId()), channel_id, user_id, _to_millis(datetime.utcnow()))
+            )
+            self.increment_counters(user_id, {"monitored_channels": 1})
+            return True
+        except Exception as e:
+            logger.error(f"Error al añadir canal monitoreado: {e}")
+            return False
+
+    async def is_channel_monitored(self, channel_id: int, user_id: int) -> bool:
+        row = await self._run(lambda: self._conn.execute(
+            "SELECT 1 FROM monitored_channels WHERE channel_id = ? AND user_id = ? AND active = 1 LIMIT 1",
+            (channel_id, user_id)
+        ).fetchone())
+        return row is not None
+
+    async def get_monitored_channels(self, user_id: int) -> List[Dict]:
+        rows = await self._run(lambda: self._conn.execute(
+            "SELECT * FROM monitored_channels WHERE user_id = ? AND active = 1 LIMIT 100", (user_id,)
+        ).fetchall())
+        return [self._channel_doc(row) for row in rows]
+
+    async def remove_monitored_channel(self, channel_id: int, user_id: int) -> bool:
+        try:
+            changed = await self._run(
+                self._execute_write,
+                "UPDATE monitored_channels SET active = 0 WHERE channel_id = ? AND user_id = ? AND active = 1",
+                (channel_id, user_id)
+            )
+            if changed:
+                self.increment_counters(user_id, {"monitored_channels": -changed})
+            return changed > 0
+        except Exception as e:
+            logger.error(f"Error al eliminar canal monitoreado: {e}")
+            return False
+
+    async def get_active_monitored_channels(self, limit: int = 5000) -> List[Dict]:
+        rows = await self._run(lambda: self._conn.execute(
+            "SELECT * FROM monitored_channels WHERE active = 1 ORDER BY channel_id LIMIT ?", (limit,)
+        ).fetchall())
+        return [self._channel_doc(row) for row in rows]
+
+    async def update_last_message_id(self, channel_id: int, message_id: int):
+        await self._run(
+            self._execute_write,
+            "UPDATE monitored_channels SET last_message_id = MAX(last_message_id, ?) WHERE channel_id = ?",
+            (message_id, channel_id)
+        )
+
+    # --- Sesiones de búsqueda ---
+
+    def _purge_search_sessions(self):
+        cutoff = _to_millis(datetime.utcnow() - timedelta(seconds=SEARCH_SESSION_TTL))
+        self._execute_write("DELETE FROM search_sessions WHERE created_at < ?", (cutoff,))
+
+    def _create_search_session_sync(self, user_id: int, data: Dict) -> str:
+        self._purge_search_sessions()
+        session_id = str(ObjectId())
+        self._execute_write(
+            "INSERT INTO search_sessions (id, user_id, created_at, doc) VALUES (?, ?, ?, ?)",
+            (session_id, user_id, _to_millis(datetime.utcnow()), _dumps(data))
+        )
+        return session_id
+
+    async def create_search_session(self, user_id: int, data: Dict) -> str:
+        return await self._run(self._create_search_session_sync, user_id, data)
+
+    async def get_search_session(self, session_id: str) -> Optional[Dict]:
+        cutoff = _to_millis(datetime.utcnow() - timedelta(seconds=SEARCH_SESSION_TTL))
+        row = await self._run(lambda: self._conn.execute(
+            "SELECT * FROM search_sessions WHERE id = ? AND created_at >= ?", (str(session_id), cutoff)
+        ).fetchone())
+        if row is None:
+            return None
+        doc = _loads(row["doc"], ObjectId(row["id"]))
+        doc.update({"user_id": row["user_id"], "created_at": _from_millis(row["created_at"])})
+        return doc
+
+    async def delete_search_session(self, session_id: str):
+        await self._run(self._execute_write, "DELETE FROM search_sessions WHERE id = ?", (str(session_id),))
+
+    # --- Peers de Telegram ---
+
+    @staticmethod
+    def _peer_doc(row) -> Dict:
+        return {
+            "_id": f"{row['owner_id']}:{row['peer_id']}",
+            "owner_id": row["owner_id"],
+            "peer_id": row["peer_id"],
+            "access_hash": row["access_hash"],
+            "type": row["type"],
+            "username": row["username"],
+            "phone_number": row["phone_number"],
+            "updated_at": _from_millis(row["updated_at"]),
+        }
+
+    def _upsert_peers_sync(self, owner_id: int, peers: List[Tuple]):
+        now = _to_millis(datetime.utcnow())
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT INTO telegram_peers (owner_id, peer_id, access_hash, type, username, phone_number, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (owner_id, peer_id) DO UPDATE SET "
+                "access_hash = excluded.access_hash, type = excluded.type, username = excluded.username, "
+                "phone_number = excluded.phone_number, updated_at = excluded.updated_at",
+                [(owner_id, peer_id, access_hash, peer_type, username.lower() if username else None, phone_number, now)
+                 for peer_id, access_hash, peer_type, username, phone_number in peers]
+            )
+
+    async def upsert_telegram_peers(self, owner_id: int, peers: List[Tuple]):
+        if peers:
+            await self._run(self._upsert_peers_sync, owner_id, peers)
+
+    async def get_telegram_peer(self, owner_id: int, peer_id: int) -> Optional[Dict]:
+        row = await self._run(lambda: self._conn.execute(
+            "SELECT * FROM telegram_peers WHERE owner_id = ? AND peer_id = ?", (owner_id, peer_id)
+        ).fetchone())
+        return self._peer_doc(row) if row else None
+
+    async def get_telegram_peer_by_username(self, owner_id: int, username: str) -> Optional[Dict]:
+        row = await self._run(lambda: self._conn.execute(
+            "SELECT * FROM telegram_peers WHERE owner_id = ? AND username = ? ORDER BY updated_at DESC LIMIT 1",
+            (owner_id, username.lower())
+        ).fetchone())
+        return self._peer_doc(row) if row else None
+
+    async def has_telegram_peers(self, owner_id: int) -> bool:
+        row = await self._run(lambda: self._conn.execute(
+            "SELECT 1 FROM telegram_peers WHERE owner_id = ? LIMIT 1", (owner_id,)
+        ).fetchone())
+        return row is not None
@@ -0,0 +1,108 @@
+# --- START OF FILE src/helpers/metrics.py ---
+
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, List, Optional, Sequence
+
+# Límites superiores por defecto de los buckets de los histogramas (en la unidad de cada métrica).
+DEFAULT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+
+class Histogram:
+    """Histograma de buckets fijos: conteo, suma, máximo y percentiles aproximados."""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # el último bucket es +inf
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q: float) -> float:
+        """Límite superior del bucket que contiene el percentil q (0-1)."""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= target:
+                return min(self.buckets[index], self.max) if index < len(self.buckets) else self.max
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def snapshot(self) -> Dict:
+        return {
+            "count": self.count,
+            "mean": round(self.mean, 3),
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+            "p99": self.percentile(0.99),
+            "max": round(self.max, 3),
+        }
+
+
+class MetricsRegistry:
+    """
+    Registro de métricas en proceso: contadores, valores instantáneos e histogramas.
+    Es seguro entre hilos porque los listeners de pymongo notifican desde el executor de Motor.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: Dict[str, float] = {}
+        self.gauges: Dict[str, float] = {}
+        self.histograms: Dict[str, Histogram] = {}
+        self.started_at = time.time()
+
+    def inc(self, name: str, value: float = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_gauge(self, name: str, value: float):
+        with self._lock:
+            self.gauges[name] = value
+
+    def observe(self, name: str, value: float, buckets: Optional[Sequence[float]] = None):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram(buckets or DEFAULT_BUCKETS)
+            histogram.observe(value)
+
+    def remove_prefix(self, prefix: str):
+        """Elimina las series de una entidad que ya no existe (p. ej. una tarea terminada)."""
+        with self._lock:
+            for store in (self.counters, self.gauges, self.histograms):
+                for name in [name for name in store if name.startswith(prefix)]:
+                    del store[name]
+
+    def snapshot(self, prefix: str = "") -> Dict:
+        with self._lock:
+            return {
+                "uptime": round(time.time() - self.started_at, 1),
+                "counters": {k: v for k, v in self.counters.items() if k.startswith(prefix)},
+                "gauges": {k: v for k, v in self.gauges.items() if k.startswith(prefix)},
+                "histograms": {k: h.snapshot() for k, h in self.histograms.items() if k.startswith(prefix)},
+            }
+
+    def top_histograms(self, prefix: str, limit: int = 10, key: str = "count") -> List[tuple]:
+        """Los histogramas con más observaciones (o mayor `key` del snapshot) bajo un prefijo."""
+        with self._lock:
+            items = [(name, h.snapshot()) for name, h in self.histograms.items() if name.startswith(prefix)]
+        return sorted(items, key=lambda item: item[1][key], reverse=True)[:limit]
+
+
+# Instancia singleton para ser usada en todo el proyecto.
+metrics = MetricsRegistry()
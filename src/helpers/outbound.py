@@ -0,0 +1,287 @@
+# --- START OF FILE src/helpers/outbound.py ---
+
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, List, Optional
+
+from pyrogram.errors import FloodWait, MessageNotModified
+
+from src.helpers.cache import TTLCache
+from src.helpers.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Límites de Telegram para bots: ~30 mensajes/s en total, ~1/s por chat privado y
+# ~20/min por grupo o canal. Se dejan por debajo para tener margen.
+OUTBOUND_GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE", "25"))
+OUTBOUND_GLOBAL_BURST = float(os.getenv("OUTBOUND_GLOBAL_BURST", "25"))
+OUTBOUND_CHAT_RATE = float(os.getenv("OUTBOUND_CHAT_RATE", "1"))
+OUTBOUND_CHAT_BURST = float(os.getenv("OUTBOUND_CHAT_BURST", "3"))
+OUTBOUND_GROUP_RATE = float(os.getenv("OUTBOUND_GROUP_RATE", "0.33"))
+# Llamadas a la API en vuelo a la vez.
+OUTBOUND_CONCURRENCY = int(os.getenv("OUTBOUND_CONCURRENCY", "8"))
+# Reintentos de una misma operación tras FloodWait antes de descartarla.
+OUTBOUND_MAX_FLOOD_RETRIES = int(os.getenv("OUTBOUND_MAX_FLOOD_RETRIES", "3"))
+
+# Prioridades: menor valor se envía antes.
+PRIORITY_USER = 0       # respuestas a una acción del usuario
+PRIORITY_STATUS = 1     # cambios de estado de una tarea
+PRIORITY_PROGRESS = 2   # barras de progreso
+
+_PRIORITIES = (PRIORITY_USER, PRIORITY_STATUS, PRIORITY_PROGRESS)
+
+
+class TokenBucket:
+    """Cubo de fichas clásico: `rate` fichas por segundo hasta un máximo de `burst`."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """Segundos hasta que haya una ficha disponible (0 si ya la hay)."""
+        self._refill(time.monotonic())
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self._refill(time.monotonic())
+        self.tokens -= 1
+
+
+@dataclass
+class _Outgoing:
+    key: Hashable
+    chat_id: int
+    priority: int
+    call: Callable[[], Awaitable[Any]]
+    text: Optional[str] = None
+    enqueued_at: float = field(default_factory=time.monotonic)
+    waiters: List[asyncio.Future] = field(default_factory=list)
+    flood_retries: int = 0
+
+
+class OutboundScheduler:
+    """
+    Punto único de salida hacia Telegram para ediciones y respuestas.
+    - Coalescencia: por mensaje solo se guarda el último texto pendiente.
+    - Cubos de fichas global y por chat para respetar los límites de Telegram.
+    - Un FloodWait pausa todo el envío, no solo a quien lo recibió.
+    - Las respuestas al usuario salen antes que los cambios de estado y el progreso.
+    """
+
+    def __init__(self):
+        self._pending: Dict[Hashable, _Outgoing] = {}
+        self._queues: Dict[int, Deque[Hashable]] = {priority: deque() for priority in _PRIORITIES}
+        self._inflight: set = set()
+        self._global_bucket = TokenBucket(OUTBOUND_GLOBAL_RATE, OUTBOUND_GLOBAL_BURST)
+        self._chat_buckets = TTLCache(maxsize=10000, ttl=600)
+        # Último texto entregado por mensaje: evita ediciones idénticas (MESSAGE_NOT_MODIFIED).
+        self._last_sent = TTLCache(maxsize=10000, ttl=900)
+        self._paused_until = 0.0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._sequence = 0
+
+    # --- API pública ---
+
+    def edit(self, client, chat_id: int, message_id: int, text: str, *, reply_markup=None,
+             parse_mode=None, priority: int = PRIORITY_PROGRESS) -> asyncio.Future:
+        """
+        Programa la edición de un mensaje y devuelve un futuro que se resuelve al entregarla
+        (o al entregar un texto más reciente que la sustituya). No hace falta esperarlo.
+        """
+        key = ("edit", chat_id, message_id)
+        if reply_markup is None and text == self._last_sent.get(key) and key not in self._pending:
+            return self._resolved(None)
+
+        kwargs = {"chat_id": chat_id, "message_id": message_id, "text": text}
+        if reply_markup is not None:
+            kwargs["reply_markup"] = reply_markup
+        if parse_mode is not None:
+            kwargs["parse_mode"] = parse_mode
+        return self._enqueue(key, chat_id, priority, lambda: client.edit_message_text(**kwargs), text)
+
+    def edit_message(self, message, text: str, *, reply_markup=None, parse_mode=None,
+                     priority: int = PRIORITY_USER) -> asyncio.Future:
+        """Atajo para editar un objeto Message de Pyrogram (equivalente a message.edit)."""
+        return self.edit(message._client, message.chat.id, message.id, text,
+                         reply_markup=reply_markup, parse_mode=parse_mode, priority=priority)
+
+    def call(self, chat_id: int, func: Callable[[], Awaitable[Any]],
+             priority: int = PRIORITY_USER) -> asyncio.Future:
+        """Programa una llamada arbitraria (p. ej. una respuesta) sujeta a los mismos límites."""
+        self._sequence += 1
+        return self._enqueue(("call", self._sequence), chat_id, priority, func)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": len(self._pending),
+            "inflight": len(self._inflight),
+            "paused_for": max(0.0, self._paused_until - time.monotonic()),
+        }
+
+    # --- Cola ---
+
+    @staticmethod
+    def _resolved(value: Any) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(value)
+        return future
+
+    def _enqueue(self, key: Hashable, chat_id: int, priority: int,
+                 call: Callable[[], Awaitable[Any]], text: Optional[str] = None) -> asyncio.Future:
+        self._ensure_dispatcher()
+        future = asyncio.get_running_loop().create_future()
+        current = self._pending.get(key)
+        if current is not None:
+            # Se sustituye el contenido; quien esperaba el texto anterior recibe la entrega del nuevo.
+            metrics.inc("telegram.outbound.coalesced")
+            current.call, current.text = call, text
+            current.waiters.append(future)
+            if priority < current.priority:
+                self._queues[current.priority].remove(key)
+                current.priority = priority
+                self._queues[priority].append(key)
+        else:
+            self._pending[key] = _Outgoing(key, chat_id, priority, call, text, waiters=[future])
+            self._queues[priority].append(key)
+        metrics.set_gauge("telegram.outbound.pending", len(self._pending))
+        self._wakeup.set()
+        return future
+
+    def _ensure_dispatcher(self):
+        if self._dispatcher is None or self._dispatcher.done():
+            self._wakeup = asyncio.Event()
+            self._semaphore = asyncio.Semaphore(OUTBOUND_CONCURRENCY)
+            self._dispatcher = asyncio.create_task(self._dispatch_loop())
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            is_private = isinstance(chat_id, int) and chat_id > 0
+            rate = OUTBOUND_CHAT_RATE if is_private else OUTBOUND_GROUP_RATE
+            bucket = TokenBucket(rate, OUTBOUND_CHAT_BURST)
+        self._chat_buckets.set(chat_id, bucket)
+        return bucket
+
+    def _next_ready(self) -> tuple:
+        """(elemento listo o None, segundos hasta el próximo posible)."""
+        soonest = None
+        for priority in _PRIORITIES:
+            for key in self._queues[priority]:
+                if key in self._inflight:
+                    continue
+                item = self._pending[key]
+                delay = self._chat_bucket(item.chat_id).delay()
+                if delay == 0:
+                    return item, 0.0
+                soonest = delay if soonest is None else min(soonest, delay)
+        return None, soonest
+
+    async def _dispatch_loop(self):
+        while True:
+            try:
+                if not self._pending:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+
+                pause = self._paused_until - time.monotonic()
+                if pause > 0:
+                    await asyncio.sleep(pause)
+                    continue
+
+                item, wait = self._next_ready()
+                if item is None:
+                    # Nada enviable ahora: esperar a una ficha de chat o a un elemento nuevo.
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=wait if wait is not None else None)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                global_delay = self._global_bucket.delay()
+                if global_delay > 0:
+                    await asyncio.sleep(global_delay)
+                    continue
+
+                await self._semaphore.acquire()
+                self._global_bucket.take()
+                self._chat_bucket(item.chat_id).take()
+                self._queues[item.priority].remove(item.key)
+                del self._pending[item.key]
+                self._inflight.add(item.key)
+                asyncio.create_task(self._deliver(item))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"[OUTBOUND] Error en el despachador: {e}", exc_info=True)
+                await asyncio.sleep(1)
+
+    async def _deliver(self, item: _Outgoing):
+        result, error = None, None
+        try:
+            result = await item.call()
+            if item.text is not None:
+                self._last_sent.set(item.key, item.text)
+            metrics.inc("telegram.outbound.sent")
+            metrics.observe("telegram.outbound.queue_ms", (time.monotonic() - item.enqueued_at) * 1000)
+        except MessageNotModified:
+            if item.text is not None:
+                self._last_sent.set(item.key, item.text)
+        except FloodWait as e:
+            metrics.inc("telegram.outbound.floodwait")
+            self._paused_until = max(self._paused_until, time.monotonic() + e.value + 1)
+            logger.warning(f"[OUTBOUND] FloodWait de {e.value}s: envío pausado globalmente.")
+            if item.flood_retries < OUTBOUND_MAX_FLOOD_RETRIES:
+                item.flood_retries += 1
+                self._requeue(item)
+                item = None
+            else:
+                error = e
+        except Exception as e:
+            error = e
+        finally:
+            self._semaphore.release()
+            if item is not None:
+                self._inflight.discard(item.key)
+                self._settle(item, result, error)
+            self._wakeup.set()
+
+    def _requeue(self, item: _Outgoing):
+        """Devuelve un elemento a la cola tras un FloodWait, salvo que ya haya uno más reciente."""
+        self._inflight.discard(item.key)
+        newer = self._pending.get(item.key)
+        if newer is not None:
+            newer.waiters.extend(item.waiters)
+            return
+        self._pending[item.key] = item
+        self._queues[item.priority].appendleft(item.key)
+
+    @staticmethod
+    def _settle(item: _Outgoing, result: Any, error: Optional[BaseException]):
+        for future in item.waiters:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+                # Nadie tiene por qué esperar las ediciones de progreso: evita el aviso de excepción no recuperada.
+                future.exception()
+            else:
+                future.set_result(result)
+
+
+# Instancia singleton para ser usada en todo el proyecto.
+outbound = OutboundScheduler()
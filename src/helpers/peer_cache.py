@@ -0,0 +1,172 @@
+# --- START OF FILE src/helpers/peer_cache.py ---
+
+import asyncio
+import logging
+import os
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, Optional, Union
+
+from pyrogram.errors import BadRequest, ChannelPrivate, Forbidden
+
+from src.helpers.cache import TTLCache
+from src.helpers.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Vida de cada tipo de resultado (segundos).
+PEER_CACHE_ME_TTL = float(os.getenv("PEER_CACHE_ME_TTL", "3600"))
+PEER_CACHE_CHAT_TTL = float(os.getenv("PEER_CACHE_CHAT_TTL", "600"))
+PEER_CACHE_MEMBER_TTL = float(os.getenv("PEER_CACHE_MEMBER_TTL", "120"))
+# Vida de un error cacheado (canal privado, usuario inexistente, no miembro...).
+PEER_CACHE_NEGATIVE_TTL = float(os.getenv("PEER_CACHE_NEGATIVE_TTL", "60"))
+PEER_CACHE_MAXSIZE = int(os.getenv("PEER_CACHE_MAXSIZE", "5000"))
+# Consultas get_chat simultáneas en get_chats().
+PEER_CACHE_BATCH_CONCURRENCY = int(os.getenv("PEER_CACHE_BATCH_CONCURRENCY", "5"))
+
+# Solo se cachean los errores que describen el estado del peer (4xx; CHANNEL_PRIVATE llega como 406).
+# FloodWait, errores internos de Telegram y de red se propagan sin guardar para que el siguiente
+# intento vaya a la API.
+NEGATIVE_CACHEABLE_ERRORS = (BadRequest, Forbidden, ChannelPrivate)
+
+ChatRef = Union[int, str]
+
+
+class _CachedError:
+    __slots__ = ("error",)
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+class PeerCache:
+    """
+    Caché compartida de get_me, get_chat y get_chat_member por cliente de Pyrogram.
+    - TTL por tipo de dato y caché negativa de errores 4xx.
+    - Una sola llamada en vuelo por clave: las peticiones simultáneas esperan la misma.
+    - Los chats se guardan también por id y username, así que buscar por uno sirve al otro.
+    """
+
+    def __init__(self):
+        self._cache = TTLCache(maxsize=PEER_CACHE_MAXSIZE, ttl=PEER_CACHE_CHAT_TTL)
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+
+    # --- API pública ---
+
+    async def get_me(self, client, fresh: bool = False):
+        return await self._fetch(("me", id(client)), "me", PEER_CACHE_ME_TTL, client.get_me, fresh)
+
+    async def get_chat(self, client, chat_id: ChatRef, fresh: bool = False):
+        """Equivalente a client.get_chat(chat_id). `fresh=True` ignora lo cacheado y lo reemplaza."""
+        key = ("chat", id(client), self._normalize(chat_id))
+        chat = await self._fetch(key, "chat", PEER_CACHE_CHAT_TTL, lambda: client.get_chat(chat_id), fresh)
+        self._alias_chat(client, chat)
+        return chat
+
+    async def get_chat_member(self, client, chat_id: ChatRef, user_id: ChatRef = "me", fresh: bool = False):
+        key = ("member", id(client), self._normalize(chat_id), self._normalize(user_id))
+        return await self._fetch(key, "member", PEER_CACHE_MEMBER_TTL,
+                                 lambda: client.get_chat_member(chat_id, user_id), fresh)
+
+    async def get_chats(self, client, chat_ids: Iterable[ChatRef],
+                        concurrency: int = PEER_CACHE_BATCH_CONCURRENCY) -> Dict[ChatRef, Optional[Any]]:
+        """
+        Resuelve varios chats a la vez con concurrencia acotada. Los que fallan quedan como None
+        (el error se cachea igual que en get_chat).
+        """
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+
+        async def _one(chat_id: ChatRef):
+            async with semaphore:
+                try:
+                    return chat_id, await self.get_chat(client, chat_id)
+                except Exception as e:
+                    logger.debug(f"[PEER_CACHE] get_chat({chat_id}) falló en lote: {e}")
+                    return chat_id, None
+
+        results = await asyncio.gather(*(_one(chat_id) for chat_id in dict.fromkeys(chat_ids)))
+        return dict(results)
+
+    def remember_chat(self, client, chat):
+        """Guarda un chat obtenido por otra vía (p. ej. el resultado de join_chat)."""
+        self._alias_chat(client, chat)
+
+    def invalidate_chat(self, client, chat_id: ChatRef):
+        """Olvida un chat y la membresía del cliente en él (tras unirse o salir)."""
+        client_key = id(client)
+        cached = self._cache.pop(("chat", client_key, self._normalize(chat_id)))
+        refs = {self._normalize(chat_id)}
+        if cached is not None and not isinstance(cached, _CachedError):
+            refs.add(cached.id)
+            if getattr(cached, "username", None):
+                refs.add(self._normalize(cached.username))
+        for ref in refs:
+            self._cache.pop(("chat", client_key, ref))
+            self._cache.pop(("member", client_key, ref, "me"))
+
+    def invalidate_member(self, client, chat_id: ChatRef, user_id: ChatRef = "me"):
+        self._cache.pop(("member", id(client), self._normalize(chat_id), self._normalize(user_id)))
+
+    # --- Internos ---
+
+    @staticmethod
+    def _normalize(ref: ChatRef) -> Hashable:
+        """ids numéricos como int y usernames sin @ en minúsculas; los enlaces de invitación tal cual."""
+        if isinstance(ref, int):
+            return ref
+        ref = str(ref).strip()
+        if ref.lstrip("-").isdigit():
+            return int(ref)
+        if ref.startswith(("http://", "https://", "t.me/")):
+            return ref
+        return ref.lstrip("@").lower()
+
+    def _alias_chat(self, client, chat):
+        if chat is None:
+            return
+        client_key = id(client)
+        self._cache.set(("chat", client_key, chat.id), chat, PEER_CACHE_CHAT_TTL)
+        if getattr(chat, "username", None):
+            self._cache.set(("chat", client_key, self._normalize(chat.username)), chat, PEER_CACHE_CHAT_TTL)
+
+    async def _fetch(self, key: Hashable, kind: str, ttl: float,
+                     loader: Callable[[], Awaitable[Any]], fresh: bool) -> Any:
+        if not fresh:
+            cached = self._cache.get(key)
+            if isinstance(cached, _CachedError):
+                metrics.inc(f"peer_cache.negative_hit.{kind}")
+                raise cached.error
+            if cached is not None:
+                metrics.inc(f"peer_cache.hit.{kind}")
+                return cached
+            inflight = self._inflight.get(key)
+            if inflight is not None:
+                metrics.inc(f"peer_cache.coalesced.{kind}")
+                return await asyncio.shield(inflight)
+
+        metrics.inc(f"peer_cache.miss.{kind}")
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await loader()
+        except NEGATIVE_CACHEABLE_ERRORS as e:
+            self._cache.set(key, _CachedError(e), PEER_CACHE_NEGATIVE_TTL)
+            future.set_exception(e)
+            future.exception()  # marcada como recuperada si nadie más esperaba
+            raise
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()
+            raise
+        else:
+            self._cache.set(key, value, ttl)
+            future.set_result(value)
+            return value
+        finally:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+
+# Instancia singleton para ser usada en todo el proyecto.
+peer_cache = PeerCache()
@@ -1,8 +1,6 @@
 # --- START OF FILE src/helpers/utils.py ---
 
 import os
-import time
-import asyncio
 from html import escape
 from datetime import timedelta
 import re
@@ -44,78 +42,6 @@ try:
 except (TypeError, ValueError):
     ADMIN_USER_ID = 0
 
-from .retry import retry_async
-
-
-def _resolve_parse_mode_html():
-    """Devuelve un valor de parse_mode compatible con Pyrogram."""
-    mode = getattr(ParseMode, "HTML", None)
-    if mode is None:
-        return "HTML"
-    return mode
-
-@retry_async(retry_exceptions=(FloodWait, BadRequest), max_attempts=3)
-async def _try_edit_message(bot, chat_id, message_id, text):
-    """Try to edit a message with retries."""
-    kwargs = {"chat_id": chat_id, "message_id": message_id, "text": text}
-
-    try:
-        await bot.edit_message_text(**kwargs)
-        return
-    except BadRequest as exc:
-        # Si el error no está relacionado con formato/parseo, propágalo.
-        if "not modified" in str(exc).lower():
-            raise
-        if "entities" not in str(exc).lower() and "parse mode" not in str(exc).lower():
-            raise
-
-    # Si llegamos aquí es porque el texto posiblemente contiene HTML/Markdown.
-    try:
-        kwargs["parse_mode"] = _resolve_parse_mode_html()
-        await bot.edit_message_text(**kwargs)
-    except BadRequest as exc:
-        if "parse mode" in str(exc).lower():
-            kwargs.pop("parse_mode", None)
-            await bot.edit_message_text(**kwargs)
-        else:
-            raise
-
-async def _edit_status_message(user_id: int, text: str, progress_tracker: dict):
-    """Edita un mensaje de estado de forma segura, evitando spam y manejando errores."""
-    ctx = progress_tracker.get(user_id)
-    if not ctx or not ctx.message or text == ctx.last_update_text: 
-        return
-
-    # Rate limiting for status updates (max 1 update per second)
-    now = time.time()
-    if hasattr(ctx, 'last_edit_time') and now - ctx.last_edit_time < 1:
-        return
-    ctx.last_edit_time = now
-    
-    try:
-        # Only update if content changed
-        if text != ctx.last_update_text:
-            await _try_edit_message(
-                ctx.bot,
-                ctx.message.chat.id,
-                ctx.message.id,
-                text
-            )
-            ctx.last_update_text = text
-    except MessageNotModified:
-        pass
-    except FloodWait as e:
-        logger.warning(f"FloodWait al editar mensaje para {user_id}. Esperando {e.value}s.")
-        await asyncio.sleep(e.value + 1)
-    except BadRequest as e:
-        if "MESSAGE_ID_INVALID" in str(e):
-            logger.warning(f"No se pudo editar el mensaje de estado para {user_id} (ID: {ctx.message.id}). Probablemente fue borrado.")
-            ctx.message = None  # Prevent further edit attempts
-        else:
-            logger.error(f"Error BadRequest no manejado al editar mensaje para {user_id}: {e}")
-    except Exception as e:
-        logger.error(f"Error inesperado al editar mensaje de estado para {user_id}: {e}")
-
 def get_greeting(user_id: int) -> str:
     """Devuelve un saludo personalizado."""
     return "Jefe" if user_id == ADMIN_USER_ID else "Usuario"
@@ -1,18 +1,19 @@
 import logging
 import os
-from datetime import datetime
 from typing import Union
 from pyrogram import Client, filters, StopPropagation
 from pyrogram.types import Message, CallbackQuery
 from pyrogram.enums import ParseMode
 from pyrogram import StopPropagation  # Importación corregida
 
-from src.core.admin_manager import AdminManager
+from src.core.admin_manager import admin_manager
 from src.helpers.utils import escape_html
 from src.db.mongo_manager import db_instance
+from src.db.indexes import report_index_usage, verify_query_plans
+from src.db.monitoring import begin_update
+from src.helpers.metrics import metrics
 
 logger = logging.getLogger(__name__)
-admin_manager = AdminManager()
 
 def get_admin_ids():
     """Obtiene la lista de IDs de administradores desde las variables de entorno."""
@@ -134,7 +135,7 @@ async def stats_command(client: Client, message: Message):
         f"• Total: {stats['total_tasks']}\n"
         f"• Completadas: {stats['tasks_completed']}\n"
         f"• Fallidas: {stats['tasks_failed']}\n"
-        f"• Tasa de éxito: {(stats['tasks_completed']/stats['total_tasks']*100):.1f}%\n\n"
+        f"• Tasa de éxito: {(stats['tasks_completed']/max(stats['total_tasks'], 1)*100):.1f}%\n\n"
         f"📺 <b>Canales:</b>\n"
         f"• Monitoreados: {stats['monitored_channels']}\n\n"
         f"🏆 <b>Top 5 Usuarios:</b>\n{top_users_text}"
@@ -142,6 +143,68 @@ async def stats_command(client: Client, message: Message):
     
     await message.reply(stats_text, parse_mode=ParseMode.HTML)
 
+@Client.on_message(filters.command("indexes") & filters.private)
+@admin_only
+async def indexes_command(client: Client, message: Message):
+    """Informa de los índices sin uso y de las consultas calientes que hacen COLLSCAN."""
+    if db_instance.backend_name != "mongo":
+        await message.reply("ℹ️ /indexes solo está disponible con el backend MongoDB.")
+        return
+    usage = await report_index_usage(db_instance.db)
+    collscans = await verify_query_plans(db_instance.db)
+
+    unused = [item for item in usage if item["ops"] == 0 and item["name"] != "_id_"]
+    unused_text = "".join(
+        f"• <code>{item['collection']}.{item['name']}</code> (desde {item['since']:%Y-%m-%d})\n"
+        if item.get("since") else f"• <code>{item['collection']}.{item['name']}</code>\n"
+        for item in unused
+    ) or "• Ninguno\n"
+    collscan_text = "".join(
+        f"• <code>{shape['collection']}</code> ← {shape['origin']}\n" for shape in collscans
+    ) or "• Ninguna\n"
+
+    await message.reply(
+        "🗂️ <b>Índices de la base de datos</b>\n\n"
+        f"📉 <b>Sin uso:</b>\n{unused_text}\n"
+        f"🐢 <b>Consultas con COLLSCAN:</b>\n{collscan_text}",
+        parse_mode=ParseMode.HTML
+    )
+
+@Client.on_message(filters.command("dbstats") & filters.private)
+@admin_only
+async def dbstats_command(client: Client, message: Message):
+    """Latencias de Mongo por colección y comando, consultas lentas y operaciones por actualización."""
+    snapshot = metrics.snapshot("mongo.")
+    counters = snapshot["counters"]
+    lines = []
+    for name, stats in metrics.top_histograms("mongo.latency.", limit=12):
+        lines.append(
+            f"• <code>{name[len('mongo.latency.'):]}</code>: {stats['count']} ops, "
+            f"p50 {stats['p50']:g} ms, p95 {stats['p95']:g} ms, máx {stats['max']:.0f} ms"
+        )
+    per_update = snapshot["histograms"].get("mongo.ops_per_update", {})
+
+    text = (
+        "🗄️ <b>Estadísticas de MongoDB</b>\n\n"
+        f"• Operaciones: {int(counters.get('mongo.ops', 0))}\n"
+        f"• Lentas: {int(counters.get('mongo.slow_ops', 0))}\n"
+        f"• Por actualización: media {per_update.get('mean', 0):.1f}, p95 {per_update.get('p95', 0):g}\n\n"
+        f"⏱️ <b>Latencias:</b>\n" + ("\n".join(lines) or "• Sin datos")
+    )
+    await message.reply(text, parse_mode=ParseMode.HTML)
+
+@Client.on_message(filters.command("rebuildcounters") & filters.private)
+@admin_only
+async def rebuild_counters_command(client: Client, message: Message):
+    """Recalcula los contadores de /stats y /user desde las colecciones de origen."""
+    status = await message.reply("🔄 Reconstruyendo contadores...")
+    try:
+        total = await db_instance.rebuild_counters()
+        await status.edit_text(f"✅ Contadores reconstruidos ({total} documentos).")
+    except Exception as e:
+        logger.error(f"Error reconstruyendo contadores: {e}", exc_info=True)
+        await status.edit_text(f"❌ Error: {str(e)}")
+
 @Client.on_message(filters.command("user") & filters.private)
 @admin_only
 async def user_info_command(client: Client, message: Message):
@@ -203,6 +266,15 @@ async def user_info_command(client: Client, message: Message):
     except Exception as e:
         await message.reply(f"❌ Error: {str(e)}")
 
+# Middleware de métricas: abre el contador de operaciones de Mongo de cada actualización
+@Client.on_message(group=-3)
+async def db_ops_message_middleware(client: Client, message: Message):
+    begin_update("message")
+
+@Client.on_callback_query(group=-3)
+async def db_ops_callback_middleware(client: Client, query: CallbackQuery):
+    begin_update("callback")
+
 # Middleware para verificar baneos
 @Client.on_message(group=-2)
 async def ban_check_middleware(client: Client, message: Message):
@@ -217,9 +289,9 @@ async def ban_check_middleware(client: Client, message: Message):
     if user_id in admins:
         return
         
-    # Verificar si está baneado
-    is_banned, ban_info = await admin_manager.is_user_banned(user_id)
-    if is_banned:
+    # Verificar si está baneado (consulta en memoria)
+    if admin_manager.is_banned(user_id):
+        _, ban_info = await admin_manager.is_user_banned(user_id)
         reason = ban_info.get('reason', 'No especificada') if ban_info else 'No especificada'
         await message.reply(
             f"⛔ <b>Acceso denegado</b>\n"
@@ -229,9 +301,5 @@ async def ban_check_middleware(client: Client, message: Message):
         )
         raise StopPropagation
         
-    # Actualizar última actividad del usuario
-    await db_instance.user_settings.update_one(
-        {"_id": user_id},
-        {"$set": {"last_active": datetime.utcnow()}},
-        upsert=True
-    )
\ No newline at end of file
+    # Actualizar última actividad del usuario (se escribe en lote, sin ida y vuelta a la DB)
+    db_instance.touch_user_activity(user_id)
\ No newline at end of file
@@ -3,11 +3,14 @@ import re
 import os
 import asyncio
 import time
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 from typing import Optional, Union, Tuple, Dict, Any
 
 from pyrogram import Client, filters, StopPropagation
-from pyrogram.types import Message, CallbackQuery, Chat, InlineKeyboardMarkup, InlineKeyboardButton
+from pyrogram.types import (
+    Message, CallbackQuery, Chat, InlineKeyboardMarkup, InlineKeyboardButton,
+    InputMediaAudio, InputMediaDocument, InputMediaPhoto, InputMediaVideo
+)
 from pyrogram.enums import ParseMode
 from pyrogram.errors import (
     PeerIdInvalid, UsernameNotOccupied, ChannelPrivate, 
@@ -28,6 +31,12 @@ from src.helpers.utils import (
     get_greeting, escape_html, sanitize_filename,
     format_time, format_task_details_rich
 )
+from src.helpers.outbound import outbound
+from src.helpers.peer_cache import peer_cache
+from src.core.userbot_pool import userbot_pool, IncompleteDownloadError
+from src.core.progress_bus import progress_bus, ProgressEvent, TelegramStatusSink, MetricsSink
+from src.core.batch_ingest import batch_ingestor, parse_batch_link
+from src.core.channel_monitor import channel_monitor
 from src.core import downloader
 from src.core.exceptions import AuthenticationError, NetworkError
 from .processing_handler import main_processing_router, handle_text_input_for_state, handle_media_input_for_state
@@ -50,89 +59,6 @@ os.makedirs(base_download_dir, exist_ok=True)
 
 # --- Funciones de utilidad para manejo de enlaces ---
 
-async def force_dialog_sync(client: Client, chat_id: int, status_msg: Message = None) -> bool:
-    """
-    Fuerza una sincronización de diálogos para resolver problemas de caché de PeerIdInvalid.
-    
-    Args:
-        client: Cliente de Pyrogram
-        chat_id: ID del chat a buscar
-        status_msg: Mensaje opcional para actualizar el progreso
-        
-    Returns:
-        bool: True si se encontró el chat en los diálogos, False en caso contrario
-    """
-    try:
-        # Primer intento: sincronización rápida
-        if status_msg:
-            try:
-                await status_msg.edit(
-                    "🔄 <b>Sincronizando caché...</b>\n"
-                    "Buscando el canal en los diálogos recientes...",
-                    parse_mode=ParseMode.HTML
-                )
-            except Exception as edit_error:
-                logger.warning(f"Error editando mensaje de estado: {edit_error}")
-        
-        # Buscar en diálogos recientes (más eficiente)
-        dialog_count = 0
-        async for dialog in client.get_dialogs(limit=100):
-            dialog_count += 1
-            if dialog.chat.id == chat_id:
-                logger.info(f"Canal {chat_id} encontrado en sincronización rápida (diálogo {dialog_count})")
-                return True
-                
-        # Segundo intento: sincronización profunda solo si es necesario
-        if status_msg:
-            try:
-                await status_msg.edit(
-                    "🔄 <b>Realizando sincronización profunda...</b>\n"
-                    "Esto puede tomar un momento...",
-                    parse_mode=ParseMode.HTML
-                )
-            except Exception as edit_error:
-                logger.warning(f"Error editando mensaje de estado: {edit_error}")
-            
-        # Sincronización profunda con límite para evitar timeouts
-        max_dialogs = 500
-        async for dialog in client.get_dialogs():
-            dialog_count += 1
-            if dialog.chat.id == chat_id:
-                logger.info(f"Canal {chat_id} encontrado en sincronización profunda (diálogo {dialog_count})")
-                return True
-                
-            # Actualizar progreso cada 50 diálogos
-            if status_msg and dialog_count % 50 == 0:
-                try:
-                    await status_msg.edit(
-                        f"🔄 <b>Sincronización en progreso...</b>\n"
-                        f"Chats procesados: {dialog_count}",
-                        parse_mode=ParseMode.HTML
-                    )
-                except Exception as edit_error:
-                    logger.debug(f"Error actualizando progreso: {edit_error}")
-                    
-            # Límite de seguridad para evitar bucles infinitos
-            if dialog_count >= max_dialogs:
-                logger.warning(f"Límite de {max_dialogs} diálogos alcanzado")
-                break
-                
-        logger.warning(f"Canal {chat_id} no encontrado después de procesar {dialog_count} diálogos")
-        return False
-        
-    except Exception as e:
-        logger.error(f"Error durante la sincronización de diálogos: {e}")
-        if status_msg:
-            try:
-                await status_msg.edit(
-                    "❌ <b>Error durante la sincronización</b>\n"
-                    f"Detalles: {escape_html(str(e))}",
-                    parse_mode=ParseMode.HTML
-                )
-            except Exception as edit_error:
-                logger.error(f"Error editando mensaje de error: {edit_error}")
-        return False
-
 def normalize_chat_id(chat_id: Union[str, int]) -> int:
     """
     Normaliza un ID de chat al formato correcto de Telegram (-100...).
@@ -267,108 +193,29 @@ def format_size(size: int) -> str:
 
 # --- Funciones para manejo de progress bar ---
 
-class ProgressTracker:
-    """Clase para rastrear y mostrar el progreso de descargas y subidas."""
-    
-    def __init__(self):
-        self.last_update_time = {}
-        self.start_times = {}
-        self.user_info = {}
-        
-    def reset(self, operation_id: str):
-        """Reinicia los tiempos para una operación específica."""
-        self.start_times[operation_id] = asyncio.get_event_loop().time()
-        self.last_update_time[operation_id] = 0
-    
-    def get_elapsed(self, operation_id: str) -> float:
-        """Obtiene el tiempo transcurrido desde el inicio de la operación."""
-        if operation_id not in self.start_times:
-            self.reset(operation_id)
-        return asyncio.get_event_loop().time() - self.start_times[operation_id]
-
-# Instancia global para rastrear progreso
-progress_tracker = ProgressTracker()
+def _format_transfer_progress(event: ProgressEvent) -> str:
+    """Barra de progreso de las descargas y subidas hechas con el userbot."""
+    done = int(event.percentage / 7.7)  # 13 bloques en total
+    return (
+        f"{event.title}\n"
+        f"[{'▤' * done}{'□' * (13 - done)}] {event.percentage:.2f}%\n"
+        f"┠ Procesado: {format_size(event.current)} de {format_size(event.total)}\n"
+        f"┠ Archivo: {event.file_info or '1/1'}\n"
+        f"┠ Estado: {event.status_tag}\n"
+        f"┠ ETA: {format_time(event.eta)}\n"
+        f"┠ Velocidad: {format_size(event.speed)}/s\n"
+        f"┠ Tiempo: {format_time(event.elapsed)}\n"
+        f"┖ Motor: {event.engine}"
+    )
 
-async def show_progress(
-    current: int, 
-    total: int, 
-    status_msg: Message, 
-    action: str, 
-    operation_id: str, 
-    user_client=None
-):
-    """
-    Muestra una barra de progreso detallada con estadísticas.
-    
-    Args:
-        current: Bytes procesados actualmente
-        total: Total de bytes a procesar
-        status_msg: Mensaje donde mostrar el progreso
-        action: Descripción de la acción (ej: "Descargando")
-        operation_id: Identificador único de la operación
-        user_client: Cliente de Pyrogram (opcional)
-    """
-    if total <= 0:
-        return
-    
+async def _engine_label(account) -> str:
+    """Nombre de la cuenta del pool que se muestra como motor en la barra de progreso."""
     try:
-        # Evitar actualizaciones demasiado frecuentes (cada 0.5 segundos)
-        now = asyncio.get_event_loop().time()
-        if operation_id in progress_tracker.last_update_time:
-            if now - progress_tracker.last_update_time[operation_id] < 0.5:
-                return
-        progress_tracker.last_update_time[operation_id] = now
-        
-        if operation_id not in progress_tracker.start_times:
-            progress_tracker.reset(operation_id)
-            
-        elapsed_time = progress_tracker.get_elapsed(operation_id)
-        if elapsed_time <= 0:
-            return
-            
-        percent = current * 100 / total
-        done = int(percent / 7.7)  # 13 bloques en total
-        pending = 13 - done
-        
-        speed = current / elapsed_time
-        eta = (total - current) / speed if speed > 0 else 0
-        
-        # Obtener información del userbot si está disponible
-        me = None
-        if user_client:
-            try:
-                if operation_id in progress_tracker.user_info:
-                    me = progress_tracker.user_info[operation_id]
-                else:
-                    me = await user_client.get_me()
-                    progress_tracker.user_info[operation_id] = me
-            except Exception as e:
-                logger.debug(f"Error obteniendo info de usuario: {e}")
-        
-        # Construir barra de progreso
-        status_tag = "#TelegramDownload" if "Descarg" in action else "#TelegramUpload"
-        progress_bar = (
-            f"{action}\n"
-            f"[{'▤' * done}{'□' * pending}] {percent:.2f}%\n"
-            f"┠ Procesado: {format_size(current)} de {format_size(total)}\n"
-            f"┠ Archivo: 1/1\n"
-            f"┠ Estado: {status_tag}\n"
-            f"┠ ETA: {format_time(eta)}\n"
-            f"┠ Velocidad: {format_size(speed)}/s\n"
-            f"┠ Tiempo: {format_time(elapsed_time)}\n"
-        )
-        
-        if me:
-            progress_bar += f"┠ Motor: {me.first_name}\n"
-            progress_bar += f"┖ ID: {me.id}"
-        else:
-            progress_bar += f"┖ Progreso en curso..."
-        
-        await status_msg.edit(progress_bar)
-    except MessageNotModified:
-        pass
+        me = await peer_cache.get_me(account.client)
+        return f"{me.first_name} ({me.id})"
     except Exception as e:
-        logger.debug(f"Error mostrando progreso: {e}")
+        logger.debug(f"Error obteniendo info de usuario: {e}")
+        return account.name
 
 async def get_media_info(message: Message) -> dict:
     """
@@ -463,51 +310,53 @@ async def handle_telegram_link(client: Client, message: Message, url: str = None
     )
     
     try:
+        # Rangos (t.me/canal/100-250) y chats completos (t.me/canal/all?desde=...): ingesta por lotes
+        try:
+            batch_spec = parse_batch_link(url)
+            job = await batch_ingestor.start(client, user_id, batch_spec, status_msg) if batch_spec else None
+        except ValueError as e:
+            await outbound.edit_message(status_msg, f"❌ <b>{escape_html(str(e))}</b>", parse_mode=ParseMode.HTML)
+            return
+        if job:
+            batch = job["batch"]
+            await outbound.edit_message(
+                status_msg,
+                f"📦 <b>Importando lote de {escape_html(str(batch['chat_title'] or batch['chat_id']))}</b>\n"
+                f"Mensajes {batch['start_id']}–{batch['end_id']}. Los archivos irán apareciendo en /panel.",
+                parse_mode=ParseMode.HTML
+            )
+            return
+
         # PASO 1: Analizar el enlace y extraer información
         parsed_url = parse_telegram_url(url)
         logger.info(f"Parsed Telegram URL: {parsed_url}")
         
-        # Inicializar cliente de usuario (userbot)
-        user_client = getattr(client, 'user_client', None)
-        if not user_client:
-            await status_msg.edit(
+        # Elegir la cuenta userbot: la menos cargada, fuera de FloodWait y, si el enlace
+        # identifica el chat, que ya sea miembro (o que se una si es público).
+        if not userbot_pool.accounts:
+            await outbound.edit_message(
+                status_msg,
                 "❌ <b>Error de configuración:</b> No se ha configurado el cliente de usuario (userbot).",
                 parse_mode=ParseMode.HTML
             )
             return
+        account = await userbot_pool.pick(
+            parsed_url["username"] or parsed_url["chat_id"], join_ref=parsed_url["username"]
+        )
+        user_client = account.client
             
         # PASO 2: Verificar acceso según el tipo de enlace
         if parsed_url["type"] == "invitation":
             # 2.A: Es un enlace de invitación
-            await status_msg.edit("🔄 Intentando unirse al canal con el enlace de invitación...")
+            await outbound.edit_message(status_msg, "🔄 Intentando unirse al canal con el enlace de invitación...")
             
             try:
                 chat = await user_client.join_chat(url)
+                peer_cache.invalidate_chat(user_client, chat.id)
+                # join_chat ya deja el peer en el almacén persistente: no hace falta sincronizar diálogos.
                 
-                # Forzar sincronización inmediata después de unirse
-                await status_msg.edit(
-                    "🔄 <b>Unido al canal. Sincronizando caché...</b>\n"
-                    "Esto puede tomar unos segundos...",
-                    parse_mode=ParseMode.HTML
-                )
-                
-                # Forzar actualización de diálogos
-                dialog_count = 0
-                async for dialog in user_client.get_dialogs(limit=100):
-                    dialog_count += 1
-                    if dialog.chat.id == chat.id:
-                        break
-                        
-                # Esperar un momento para que Telegram procese la unión
-                await asyncio.sleep(2)
-                
-                # Intentar obtener el chat nuevamente para asegurar la sincronización
-                try:
-                    chat = await user_client.get_chat(chat.id)
-                except Exception as e:
-                    logger.warning(f"Error en segunda verificación del chat: {e}")
-                
-                await status_msg.edit(
+                await outbound.edit_message(
+                    status_msg,
                     f"✅ <b>¡Unido exitosamente al canal!</b>\n\n"
                     f"Nombre: <b>{escape_html(chat.title)}</b>\n\n"
                     f"📤 Ahora envía el enlace del mensaje específico que quieres descargar.\n"
@@ -515,35 +364,39 @@ async def handle_telegram_link(client: Client, message: Message, url: str = None
                     parse_mode=ParseMode.HTML
                 )
                 
-                # Registrar el canal en la base de datos (opcional)
+                # Monitorear el canal: sus posts nuevos llegan al panel como tareas pendientes (opcional)
                 try:
-                    await db_instance.add_monitored_channel(user_id, str(chat.id))
+                    await channel_monitor.add_monitored_channel(chat.id, user_id, join_ref=url)
                 except Exception as db_error:
                     logger.error(f"Error registrando canal en DB: {db_error}")
                     
             except InviteHashExpired:
-                await status_msg.edit(
+                await outbound.edit_message(
+                    status_msg,
                     "❌ <b>El enlace de invitación ha expirado.</b>\n\n"
                     "Por favor, solicita un nuevo enlace de invitación.",
                     parse_mode=ParseMode.HTML
                 )
                 return
             except InviteRequestSent:
-                await status_msg.edit(
+                await outbound.edit_message(
+                    status_msg,
                     "📩 <b>Se ha enviado una solicitud para unirse al canal.</b>\n\n"
                     "Por favor, espera a que sea aceptada por los administradores del canal.",
                     parse_mode=ParseMode.HTML
                 )
                 return
             except UserAlreadyParticipant:
-                await status_msg.edit(
+                await outbound.edit_message(
+                    status_msg,
                     "ℹ️ <b>Ya eres miembro de este canal.</b>\n\n"
                     "Por favor, envía el enlace del mensaje específico que quieres descargar.",
                     parse_mode=ParseMode.HTML
                 )
                 return
             except FloodWait as e:
-                await status_msg.edit(
+                await outbound.edit_message(
+                    status_msg,
                     f"⏳ <b>Telegram ha impuesto un límite de tiempo.</b>\n\n"
                     f"Por favor, espera {e.value} segundos antes de intentarlo nuevamente.",
                     parse_mode=ParseMode.HTML
@@ -551,7 +404,8 @@ async def handle_telegram_link(client: Client, message: Message, url: str = None
                 return
             except Exception as e:
                 logger.error(f"Error al unirse al canal: {e}")
-                await status_msg.edit(
+                await outbound.edit_message(
+                    status_msg,
                     f"❌ <b>Error al unirse al canal:</b> {escape_html(str(e))}\n\n"
                     f"Por favor, verifica que el enlace sea válido y que el userbot tenga permisos para unirse.",
                     parse_mode=ParseMode.HTML
@@ -563,15 +417,15 @@ async def handle_telegram_link(client: Client, message: Message, url: str = None
             username = parsed_url["username"]
             message_id = parsed_url["message_id"]
             
-            await status_msg.edit(f"🔄 Verificando acceso al canal <b>@{escape_html(username)}</b>...")
+            await outbound.edit_message(status_msg, f"🔄 Verificando acceso al canal <b>@{escape_html(username)}</b>...")
             
             try:
                 # Intentar obtener información del chat
-                chat = await user_client.get_chat(username)
+                chat = await peer_cache.get_chat(user_client, username)
                 
                 # Verificar si somos miembros
                 try:
-                    member = await user_client.get_chat_member(chat.id, "me")
+                    member = await peer_cache.get_chat_member(user_client, chat.id, "me")
                     is_member = True
                 except Exception:
                     is_member = False
@@ -580,13 +434,16 @@ async def handle_telegram_link(client: Client, message: Message, url: str = None
                 if not is_member:
                     try:
                         await user_client.join_chat(username)
-                        await status_msg.edit(
+                        peer_cache.invalidate_chat(user_client, chat.id)
+                        await outbound.edit_message(
+                            status_msg,
                             f"✅ <b>¡Unido exitosamente al canal @{escape_html(username)}!</b>",
                             parse_mode=ParseMode.HTML
                         )
                     except Exception as join_error:
                         logger.error(f"Error al unirse al canal @{username}: {join_error}")
-                        await status_msg.edit(
+                        await outbound.edit_message(
+                            status_msg,
                             f"❌ <b>No se pudo unir al canal @{escape_html(username)}:</b>\n"
                             f"{escape_html(str(join_error))}\n\n"
                             f"Es posible que el canal sea privado o requiera aprobación manual.",
@@ -596,7 +453,8 @@ async def handle_telegram_link(client: Client, message: Message, url: str = None
                 
                 # Si tenemos un ID de mensaje, procesar mensaje específico
                 if message_id:
-                    await status_msg.edit(
+                    await outbound.edit_message(
+                        status_msg,
                         f"🔄 Accediendo al mensaje {message_id} de <b>@{escape_html(username)}</b>...",
                         parse_mode=ParseMode.HTML
                     )
@@ -604,14 +462,16 @@ async def handle_telegram_link(client: Client, message: Message, url: str = None
                     try:
                         target_message = await user_client.get_messages(chat.id, message_id)
                         if not target_message:
-                            await status_msg.edit(
+                            await outbound.edit_message(
+                                status_msg,
                                 "❌ <b>No se encontró el mensaje especificado.</b>",
                                 parse_mode=ParseMode.HTML
                             )
                             return
                             
                         if not target_message.media:
-                            await status_msg.edit(
+                            await outbound.edit_message(
+                                status_msg,
                                 "❌ <b>El mensaje no contiene archivos multimedia.</b>",
                                 parse_mode=ParseMode.HTML
                             )
@@ -622,14 +482,16 @@ async def handle_telegram_link(client: Client, message: Message, url: str = None
                         
                     except Exception as msg_error:
                         logger.error(f"Error accediendo al mensaje {message_id}: {msg_error}")
-                        await status_msg.edit(
+                        await outbound.edit_message(
+                            status_msg,
                             f"❌ <b>Error al acceder al mensaje:</b> {escape_html(str(msg_error))}",
                             parse_mode=ParseMode.HTML
                         )
                         return
                 else:
                     # No hay ID de mensaje, solo informar sobre el acceso al canal
-                    await status_msg.edit(
+                    await outbound.edit_message(
+                        status_msg,
                         f"✅ <b>Acceso verificado al canal @{escape_html(username)}</b>\n\n"
                         f"📤 Ahora envía el enlace del mensaje específico que quieres descargar.\n"
                         f"Ejemplo: <code>https://t.me/{username}/123</code>",
@@ -637,13 +499,15 @@ async def handle_telegram_link(client: Client, message: Message, url: str = None
                     )
             
             except UsernameNotOccupied:
-                await status_msg.edit(
+                await outbound.edit_message(
+                    status_msg,
                     f"❌ <b>El nombre de usuario @{escape_html(username)} no existe.</b>",
                     parse_mode=ParseMode.HTML
                 )
                 return
             except PeerIdInvalid:
-                await status_msg.edit(
+                await outbound.edit_message(
+                    status_msg,
                     f"❌ <b>No se pudo acceder al canal @{escape_html(username)}.</b>\n\n"
                     f"El canal podría ser privado. Necesito un enlace de invitación (t.me/+...).",
                     parse_mode=ParseMode.HTML
@@ -651,7 +515,8 @@ async def handle_telegram_link(client: Client, message: Message, url: str = None
                 return
             except Exception as e:
                 logger.error(f"Error accediendo al canal público {username}: {e}")
-                await status_msg.edit(
+                await outbound.edit_message(
+                    status_msg,
                     f"❌ <b>Error al acceder al canal:</b> {escape_html(str(e))}",
                     parse_mode=ParseMode.HTML
                 )
@@ -667,14 +532,15 @@ async def handle_telegram_link(client: Client, message: Message, url: str = None
             original_message = message
             
             if not chat_id:
-                await status_msg.edit(
+                await outbound.edit_message(
+                    status_msg,
                     "❌ <b>No se pudo procesar el ID del canal.</b>\n\n"
                     "Formato esperado: https://t.me/c/ID_CANAL/ID_MENSAJE",
                     parse_mode=ParseMode.HTML
                 )
                 return
                 
-            await status_msg.edit(f"🔄 Uniendo al canal privado...")
+            await outbound.edit_message(status_msg, f"🔄 Uniendo al canal privado...")
             
             try:
                 # Intentar unirse al canal con el userbot
@@ -682,7 +548,7 @@ async def handle_telegram_link(client: Client, message: Message, url: str = None
                 
                 # Primero intentar obtener información del chat
                 try:
-                    chat = await user_client.get_chat(chat_id)
+                    chat = await peer_cache.get_chat(user_client, chat_id)
                     logger.info(f"Canal encontrado: {chat.title}")
                 except Exception as get_chat_error:
                     logger.error(f"Error obteniendo chat: {get_chat_error}")
@@ -692,7 +558,7 @@ async def handle_telegram_link(client: Client, message: Message, url: str = None
                         try:
                             # Intentar con el ID original sin el prefijo -100
                             original_id = int(raw_chat_id)
-                            chat = await user_client.get_chat(original_id)
+                            chat = await peer_cache.get_chat(user_client, original_id)
                             logger.info(f"Canal encontrado con ID original: {chat.title}")
                         except Exception as original_error:
                             logger.error(f"Error con ID original: {original_error}")
@@ -701,7 +567,8 @@ async def handle_telegram_link(client: Client, message: Message, url: str = None
                         raise get_chat_error
                 
                 # Si llegamos aquí, el userbot tiene acceso al canal
-                await status_msg.edit(
+                await outbound.edit_message(
+                    status_msg,
                     "✅ <b>Ya eres miembro de este canal.</b>\n\n"
                     "Por favor, envía el enlace del mensaje específico que quieres descargar.",
                     parse_mode=ParseMode.HTML
@@ -713,19 +580,21 @@ async def handle_telegram_link(client: Client, message: Message, url: str = None
                 
                 # Si llegamos aquí, tenemos acceso al canal
                 if message_id:
-                    await status_msg.edit(f"🔄 Accediendo al mensaje {message_id}...")
+                    await outbound.edit_message(status_msg, f"🔄 Accediendo al mensaje {message_id}...")
                     
                     try:
                         target_message = await user_client.get_messages(chat.id, message_id)
                         if not target_message:
-                            await status_msg.edit(
+                            await outbound.edit_message(
+                                status_msg,
                                 "❌ <b>No se encontró el mensaje especificado.</b>",
                                 parse_mode=ParseMode.HTML
                             )
                             return
                             
                         if not target_message.media:
-                            await status_msg.edit(
+                            await outbound.edit_message(
+                                status_msg,
                                 "❌ <b>El mensaje no contiene archivos multimedia.</b>",
                                 parse_mode=ParseMode.HTML
                             )
@@ -736,14 +605,16 @@ async def handle_telegram_link(client: Client, message: Message, url: str = None
                         
                     except Exception as msg_error:
                         logger.error(f"Error accediendo al mensaje {message_id}: {msg_error}")
-                        await status_msg.edit(
+                        await outbound.edit_message(
+                            status_msg,
                             f"❌ <b>Error al acceder al mensaje:</b> {escape_html(str(msg_error))}",
                             parse_mode=ParseMode.HTML
                         )
                         return
                 else:
                     # No hay ID de mensaje, solo informar sobre el acceso al canal
-                    await status_msg.edit(
+                    await outbound.edit_message(
+                        status_msg,
                         f"✅ <b>Acceso verificado al canal privado</b>\n\n"
                         f"Nombre: <b>{escape_html(chat.title)}</b>\n\n"
                         f"📤 Ahora envía el enlace del mensaje específico que quieres descargar.\n"
@@ -752,177 +623,20 @@ async def handle_telegram_link(client: Client, message: Message, url: str = None
                     )
             
             except PeerIdInvalid:
-                # Implementar múltiples intentos de recuperación
-                logger.warning(f"PeerIdInvalid inicial para {chat_id}. Iniciando proceso de recuperación...")
-                
-                await status_msg.edit(
-                    "🔄 <b>Verificando acceso al canal...</b>\n"
-                    "Iniciando proceso de sincronización...",
+                # Los peers del userbot persisten en la base de datos (src/core/peer_storage.py): si
+                # get_chat no lo resuelve, el userbot nunca ha visto el canal y recorrer los diálogos
+                # o reconectar no lo va a encontrar.
+                logger.warning(f"PeerIdInvalid para {chat_id}: el canal no está en el almacén de peers del userbot.")
+                await outbound.edit_message(
+                    status_msg,
+                    "❌ <b>No tengo acceso a este canal privado.</b>\n\n"
+                    "El userbot no conoce este canal.\n"
+                    "Posibles soluciones:\n"
+                    "1. Envía un enlace de invitación (t.me/+...)\n"
+                    "2. Asegúrate de que el userbot sea miembro del canal",
                     parse_mode=ParseMode.HTML
                 )
-                
-                try:
-                    # Primer intento: Esperar y reintentar directamente
-                    await asyncio.sleep(2)
-                    try:
-                        chat = await user_client.get_chat(chat_id)
-                        logger.info(f"Acceso recuperado al canal {chat_id} después de una breve espera")
-                        found_in_dialogs = True
-                    except PeerIdInvalid:
-                        # Segundo intento: Forzar sincronización de diálogos
-                        found_in_dialogs = await force_dialog_sync(user_client, chat_id, status_msg)
-                        
-                        if not found_in_dialogs:
-                            # Tercer intento: Forzar recarga de sesión
-                            await status_msg.edit(
-                                "🔄 <b>Intentando reconexión...</b>\n"
-                                "Por favor, espera un momento...",
-                                parse_mode=ParseMode.HTML
-                            )
-                            
-                            try:
-                                await status_msg.edit(
-                                    "🔄 <b>Reiniciando sesión...</b>\n"
-                                    "Esto puede tomar unos momentos.",
-                                    parse_mode=ParseMode.HTML
-                                )
-                                
-                                # Forzar reconexión del cliente
-                                try:
-                                    await user_client.disconnect()
-                                except Exception:
-                                    pass
-                                    
-                                await asyncio.sleep(2)
-                                
-                                # Intentar reconectar varias veces si es necesario
-                                for attempt in range(3):
-                                    try:
-                                        if not user_client.is_connected:
-                                            await user_client.connect()
-                                        
-                                        # Verificar que realmente estamos conectados
-                                        me = await user_client.get_me()
-                                        if me:
-                                            logger.info(f"Reconexión exitosa después del intento {attempt + 1}")
-                                            break
-                                    except Exception as conn_error:
-                                        logger.warning(f"Intento de reconexión {attempt + 1} falló: {conn_error}")
-                                        await asyncio.sleep(2)
-                                
-                                await status_msg.edit(
-                                    "🔄 <b>Verificando acceso...</b>\n"
-                                    "Realizando comprobación final.",
-                                    parse_mode=ParseMode.HTML
-                                )
-                                
-                                # Esperar a que la sesión se estabilice
-                                await asyncio.sleep(2)
-                                
-                                # Intentar sincronización una última vez
-                                found_in_dialogs = await force_dialog_sync(user_client, chat_id, status_msg)
-                                
-                                if not found_in_dialogs:
-                                    # Último intento: acceso directo
-                                    try:
-                                        chat = await user_client.get_chat(chat_id)
-                                        if chat:
-                                            found_in_dialogs = True
-                                            logger.info(f"Acceso recuperado a {chat_id} después de reconexión")
-                                    except Exception as final_error:
-                                        logger.error(f"Error en intento final de acceso: {final_error}")
-                                        
-                            except Exception as e:
-                                logger.error(f"Error durante la reconexión: {e}")
-                                found_in_dialogs = False
-                                await status_msg.edit(
-                                    "❌ <b>Error de conexión</b>\n"
-                                    "No se pudo restablecer la sesión.\n"
-                                    "Por favor, intenta nuevamente en unos momentos.",
-                                    parse_mode=ParseMode.HTML
-                                )
-                            
-                        # Actualizar mensaje de estado cada 20 diálogos
-                        if dialog_count % 20 == 0:
-                            await status_msg.edit(
-                                f"🔄 <b>Sincronizando caché de sesión...</b>\n\n"
-                                f"Chats procesados: {dialog_count}\n"
-                                f"Buscando acceso al canal...",
-                                parse_mode=ParseMode.HTML
-                            )
-                    
-                    if found_in_dialogs:
-                        await status_msg.edit(
-                            "✅ <b>¡Canal encontrado!</b>\n\n"
-                            "Intentando acceder nuevamente...",
-                            parse_mode=ParseMode.HTML
-                        )
-                        
-                        # Intentar acceder al chat nuevamente después del refresco
-                        try:
-                            chat = await user_client.get_chat(chat_id)
-                            
-                            if message_id:
-                                await status_msg.edit(f"🔄 Accediendo al mensaje {message_id}...")
-                                target_message = await user_client.get_messages(chat.id, message_id)
-                                
-                                if not target_message:
-                                    await status_msg.edit(
-                                        "❌ <b>No se encontró el mensaje especificado.</b>",
-                                        parse_mode=ParseMode.HTML
-                                    )
-                                    return
-                                    
-                                if not target_message.media:
-                                    await status_msg.edit(
-                                        "❌ <b>El mensaje no contiene archivos multimedia.</b>",
-                                        parse_mode=ParseMode.HTML
-                                    )
-                                    return
-                                    
-                                # Procesar y descargar el mensaje
-                                await process_media_message(client, original_message, target_message, status_msg)
-                            else:
-                                await status_msg.edit(
-                                    f"✅ <b>Acceso verificado al canal privado</b>\n\n"
-                                    f"Nombre: <b>{escape_html(chat.title)}</b>\n\n"
-                                    f"📤 Ahora envía el enlace del mensaje específico que quieres descargar.\n"
-                                    f"Ejemplo: <code>https://t.me/c/{raw_chat_id}/123</code>",
-                                    parse_mode=ParseMode.HTML
-                                )
-                                
-                        except PeerIdInvalid:
-                            logger.error(f"PeerIdInvalid persistente para {chat_id} incluso después del refresco")
-                            await status_msg.edit(
-                                "❌ <b>Error persistente de acceso</b>\n\n"
-                                "A pesar de encontrar el canal en mis diálogos, no puedo acceder.\n"
-                                "Esto puede indicar un problema con los permisos o la sesión.\n\n"
-                                "Por favor, intenta:\n"
-                                "1. Enviar un nuevo enlace de invitación (t.me/+...)\n"
-                                "2. Verificar que el userbot siga siendo miembro del canal",
-                                parse_mode=ParseMode.HTML
-                            )
-                            return
-                    else:
-                        await status_msg.edit(
-                            "❌ <b>No tengo acceso a este canal privado.</b>\n\n"
-                            "No encontré el canal en mi lista de diálogos.\n"
-                            "Posibles soluciones:\n"
-                            "1. Envía un enlace de invitación (t.me/+...)\n"
-                            "2. Asegúrate de que el userbot sea miembro del canal",
-                            parse_mode=ParseMode.HTML
-                        )
-                        return
-                        
-                except Exception as refresh_error:
-                    logger.error(f"Error durante el refresco de diálogos: {refresh_error}")
-                    await status_msg.edit(
-                        "❌ <b>Error durante la sincronización</b>\n\n"
-                        f"No se pudo completar el proceso: {escape_html(str(refresh_error))}\n\n"
-                        "Por favor, intenta nuevamente o proporciona un enlace de invitación.",
-                        parse_mode=ParseMode.HTML
-                    )
-                    return
+                return
             except Exception as e:
                 logger.error(f"Error accediendo al canal privado {chat_id}: {e}")
                 
@@ -946,12 +660,13 @@ async def handle_telegram_link(client: Client, message: Message, url: str = None
                         "Por favor, verifica el enlace e intenta nuevamente."
                     )
                 
-                await status_msg.edit(error_message, parse_mode=ParseMode.HTML)
+                await outbound.edit_message(status_msg, error_message, parse_mode=ParseMode.HTML)
                 return
         
         else:
             # Tipo de enlace desconocido o no soportado
-            await status_msg.edit(
+            await outbound.edit_message(
+                status_msg,
                 "❌ <b>Formato de enlace no reconocido.</b>\n\n"
                 "Formatos válidos:\n"
                 "• Canal privado: https://t.me/+abc123...\n"
@@ -963,7 +678,8 @@ async def handle_telegram_link(client: Client, message: Message, url: str = None
     
     except Exception as e:
         logger.error(f"Error procesando enlace {url}: {e}", exc_info=True)
-        await status_msg.edit(
+        await outbound.edit_message(
+            status_msg,
             f"❌ <b>Error inesperado al procesar el enlace:</b>\n"
             f"{escape_html(str(e))}",
             parse_mode=ParseMode.HTML
@@ -979,11 +695,19 @@ async def process_media_message(client: Client, original_message: Message, targe
         target_message: Mensaje de Telegram con el contenido multimedia a descargar
         status_msg: Mensaje de estado donde mostrar el progreso
     """
+    if target_message.media_group_id:
+        return await process_media_group(client, original_message, target_message, status_msg)
+
+    operation_id = f"media_{original_message.id}"
+    progress = progress_bus.open(
+        operation_id,
+        user_id=original_message.from_user.id,
+        sinks=[TelegramStatusSink(status_msg, formatter=_format_transfer_progress), MetricsSink()]
+    )
     try:
-        # Usar el userbot para las operaciones
-        user_client = client.user_client
-        operation_id = f"media_{original_message.id}"
-        progress_tracker.reset(operation_id)
+        # Cuenta del pool que obtuvo el mensaje (la principal si no es del pool)
+        account = userbot_pool.account_for(target_message._client) or userbot_pool.primary
+        user_client = account.client
         
         # Obtener información del archivo
         media_info = await get_media_info(target_message)
@@ -1008,7 +732,7 @@ async def process_media_message(client: Client, original_message: Message, targe
         
         initial_message += "\n⏳ Iniciando descarga..."
         
-        await status_msg.edit(initial_message, parse_mode=ParseMode.HTML)
+        await outbound.edit_message(status_msg, initial_message, parse_mode=ParseMode.HTML)
         await asyncio.sleep(1)  # Breve pausa para mostrar la info
         
         # Preparar carpeta temporal
@@ -1020,17 +744,26 @@ async def process_media_message(client: Client, original_message: Message, targe
         safe_filename = sanitize_filename(media_info['file_name'])
         file_path = os.path.join(temp_path, f"{unique_id}_{safe_filename}")
         
-        # Descargar el archivo usando el userbot
+        # Descargar el archivo usando el userbot; si la cuenta entra en FloodWait, el pool
+        # reintenta con otra cuenta miembro del chat.
+        async def _download_args(acc):
+            return {"progress_args": ("Descargando archivo", "#TelegramDownload", media_info['file_size'],
+                                      None, await _engine_label(acc))}
+
         download_start_time = asyncio.get_event_loop().time()
-        downloaded_path = await user_client.download_media(
+        downloaded_path, account = await userbot_pool.download_media(
             target_message,
+            join_ref=target_message.chat.username,
+            on_account=_download_args,
             file_name=file_path,
-            progress=show_progress,
-            progress_args=(status_msg, "Descargando archivo", operation_id, user_client)
+            progress=progress.pyrogram_callback
         )
+        user_client = account.client
+        engine = await _engine_label(account)
         
         if not downloaded_path or not os.path.exists(downloaded_path):
-            await status_msg.edit(
+            await outbound.edit_message(
+                status_msg,
                 "❌ <b>Error:</b> No se pudo descargar el archivo.",
                 parse_mode=ParseMode.HTML
             )
@@ -1040,7 +773,8 @@ async def process_media_message(client: Client, original_message: Message, targe
         download_time = asyncio.get_event_loop().time() - download_start_time
         download_speed = media_info['file_size'] / download_time if download_time > 0 else 0
         
-        await status_msg.edit(
+        await outbound.edit_message(
+            status_msg,
             f"✅ <b>Descarga completada</b>\n\n"
             f"⚡️ <b>Velocidad promedio:</b> {format_size(download_speed)}/s\n"
             f"⏱ <b>Tiempo total:</b> {format_time(download_time)}\n\n"
@@ -1067,73 +801,78 @@ async def process_media_message(client: Client, original_message: Message, targe
         
         # Iniciar subida
         upload_start_time = asyncio.get_event_loop().time()
-        progress_tracker.reset(operation_id)  # Resetear tiempo para la subida
         
         try:
-            # Enviar el archivo según su tipo
-            if target_message.video:
-                await user_client.send_video(
-                    original_message.chat.id,
-                    downloaded_path,
-                    thumb=thumb_path,
-                    duration=media_info['duration'],
-                    width=media_info['width'],
-                    height=media_info['height'],
-                    caption=caption,
-                    progress=show_progress,
-                    progress_args=(status_msg, "Subiendo video", operation_id, user_client),
-                    supports_streaming=True
-                )
-            elif target_message.document:
-                await user_client.send_document(
-                    original_message.chat.id,
-                    downloaded_path,
-                    thumb=thumb_path,
-                    caption=caption,
-                    progress=show_progress,
-                    progress_args=(status_msg, "Subiendo documento", operation_id, user_client)
-                )
-            elif target_message.audio:
-                await user_client.send_audio(
-                    original_message.chat.id,
-                    downloaded_path,
-                    duration=media_info['duration'],
-                    caption=caption,
-                    progress=show_progress,
-                    progress_args=(status_msg, "Subiendo audio", operation_id, user_client)
-                )
-            elif target_message.photo:
-                await user_client.send_photo(
-                    original_message.chat.id,
-                    downloaded_path,
-                    caption=caption
-                )
-            elif target_message.animation:
-                await user_client.send_animation(
-                    original_message.chat.id,
-                    downloaded_path,
-                    caption=caption,
-                    progress=show_progress,
-                    progress_args=(status_msg, "Subiendo animación", operation_id, user_client)
-                )
-            else:
-                # Tipo de archivo no identificado específicamente, enviar como documento
-                await user_client.send_document(
-                    original_message.chat.id,
-                    downloaded_path,
-                    caption=caption,
-                    progress=show_progress,
-                    progress_args=(status_msg, "Subiendo archivo", operation_id, user_client)
-                )
+            # Envío con la misma cuenta, dentro de su límite de transferencias simultáneas
+            async with userbot_pool.transfer(account):
+                # Enviar el archivo según su tipo
+                if target_message.video:
+                    await user_client.send_video(
+                        original_message.chat.id,
+                        downloaded_path,
+                        thumb=thumb_path,
+                        duration=media_info['duration'],
+                        width=media_info['width'],
+                        height=media_info['height'],
+                        caption=caption,
+                        progress=progress.pyrogram_callback,
+                        progress_args=("Subiendo video", "#TelegramUpload", media_info['file_size'], None, engine),
+                        supports_streaming=True
+                    )
+                elif target_message.document:
+                    await user_client.send_document(
+                        original_message.chat.id,
+                        downloaded_path,
+                        thumb=thumb_path,
+                        caption=caption,
+                        progress=progress.pyrogram_callback,
+                        progress_args=("Subiendo documento", "#TelegramUpload", media_info['file_size'], None, engine)
+                    )
+                elif target_message.audio:
+                    await user_client.send_audio(
+                        original_message.chat.id,
+                        downloaded_path,
+                        duration=media_info['duration'],
+                        caption=caption,
+                        progress=progress.pyrogram_callback,
+                        progress_args=("Subiendo audio", "#TelegramUpload", media_info['file_size'], None, engine)
+                    )
+                elif target_message.photo:
+                    await user_client.send_photo(
+                        original_message.chat.id,
+                        downloaded_path,
+                        caption=caption
+                    )
+                elif target_message.animation:
+                    await user_client.send_animation(
+                        original_message.chat.id,
+                        downloaded_path,
+                        caption=caption,
+                        progress=progress.pyrogram_callback,
+                        progress_args=("Subiendo animación", "#TelegramUpload", media_info['file_size'], None, engine)
+                    )
+                else:
+                    # Tipo de archivo no identificado específicamente, enviar como documento
+                    await user_client.send_document(
+                        original_message.chat.id,
+                        downloaded_path,
+                        caption=caption,
+                        progress=progress.pyrogram_callback,
+                        progress_args=("Subiendo archivo", "#TelegramUpload", media_info['file_size'], None, engine)
+                    )
+
+            userbot_pool.record_transfer(account, "upload", media_info['file_size'] or 0,
+                                         asyncio.get_event_loop().time() - upload_start_time)
                 
             # Mostrar resumen final
-            total_time = asyncio.get_event_loop().time() - progress_tracker.start_times[operation_id]
+            total_time = progress.elapsed
             upload_time = asyncio.get_event_loop().time() - upload_start_time
             upload_speed = media_info['file_size'] / upload_time if upload_time > 0 else 0
             
-            me = await user_client.get_me()
+            me = await peer_cache.get_me(user_client)
             
-            await status_msg.edit(
+            await outbound.edit_message(
+                status_msg,
                 f"✅ <b>¡Tarea Completada!</b>\n\n"
                 f"📁 <b>Archivo:</b> {escape_html(media_info['file_name'])}\n"
                 f"📊 <b>Tamaño:</b> {format_size(media_info['file_size'])}\n"
@@ -1146,7 +885,8 @@ async def process_media_message(client: Client, original_message: Message, targe
             
         except Exception as e:
             logger.error(f"Error al enviar el archivo: {e}")
-            await status_msg.edit(
+            await outbound.edit_message(
+                status_msg,
                 f"❌ <b>Error al enviar el archivo</b>\n\n"
                 f"<code>{escape_html(str(e))}</code>",
                 parse_mode=ParseMode.HTML
@@ -1154,7 +894,8 @@ async def process_media_message(client: Client, original_message: Message, targe
             
     except Exception as e:
         logger.error(f"Error procesando mensaje multimedia: {e}")
-        await status_msg.edit(
+        await outbound.edit_message(
+            status_msg,
             f"❌ <b>Error al procesar el contenido:</b>\n"
             f"<code>{escape_html(str(e))}</code>",
             parse_mode=ParseMode.HTML
@@ -1168,6 +909,146 @@ async def process_media_message(client: Client, original_message: Message, targe
                 os.remove(thumb_path)
         except Exception as cleanup_error:
             logger.error(f"Error al limpiar archivos temporales: {cleanup_error}")
+        await progress_bus.close(operation_id)
+
+def _album_input_media(member: Message, path: str):
+    """InputMedia de un miembro del álbum con su pie de foto original."""
+    caption = {"caption": member.caption or "", "caption_entities": member.caption_entities}
+    if member.photo:
+        return InputMediaPhoto(path, **caption)
+    if member.video:
+        return InputMediaVideo(path, duration=member.video.duration or 0, width=member.video.width or 0,
+                               height=member.video.height or 0, supports_streaming=True, **caption)
+    if member.audio:
+        return InputMediaAudio(path, duration=member.audio.duration or 0, performer=member.audio.performer,
+                               title=member.audio.title, **caption)
+    return InputMediaDocument(path, **caption)
+
+async def process_media_group(client: Client, original_message: Message, target_message: Message, status_msg: Message):
+    """
+    Procesa un álbum completo a partir de uno de sus mensajes: resuelve el grupo con
+    get_media_group, descarga los miembros a la vez (cada cuenta del pool limita sus
+    transferencias simultáneas) y los reenvía con un único send_media_group, en el mismo
+    orden y con sus pies de foto. Un solo mensaje de estado para todo el álbum.
+    """
+    operation_id = f"album_{original_message.id}"
+    progress = progress_bus.open(
+        operation_id,
+        user_id=original_message.from_user.id,
+        sinks=[TelegramStatusSink(status_msg, formatter=_format_transfer_progress), MetricsSink()]
+    )
+    paths: Dict[int, str] = {}
+    try:
+        account = userbot_pool.account_for(target_message._client) or userbot_pool.primary
+        members = sorted(
+            await account.client.get_media_group(target_message.chat.id, target_message.id),
+            key=lambda member: member.id
+        )
+        infos = [await get_media_info(member) for member in members]
+        total_size = sum(info['file_size'] or 0 for info in infos)
+
+        await outbound.edit_message(
+            status_msg,
+            f"📥 <b>Preparando descarga del álbum</b>\n\n"
+            f"🗂 <b>Archivos:</b> {len(members)}\n"
+            f"📊 <b>Tamaño:</b> {format_size(total_size)}",
+            parse_mode=ParseMode.HTML
+        )
+
+        temp_path = os.path.join(os.getcwd(), "downloads")
+        os.makedirs(temp_path, exist_ok=True)
+        unique_id = f"{int(time.time())}_{original_message.from_user.id}"
+
+        # Progreso agregado: bytes descargados de todos los miembros sobre el tamaño del álbum.
+        received = [0] * len(members)
+        completed = 0
+        progress.stage("Descargando álbum", "#TelegramDownload", await _engine_label(account),
+                       f"0/{len(members)}", total=total_size)
+
+        def _member_progress(index: int):
+            async def _on_progress(current: int, total: int):
+                received[index] = current
+                await progress.update(sum(received))
+            return _on_progress
+
+        async def _download(index: int, member: Message):
+            nonlocal completed
+            info = infos[index]
+            file_name = info['file_name'] or f"{info['type']}_{member.id}"
+            path, _ = await userbot_pool.download_media(
+                member,
+                join_ref=target_message.chat.username,
+                file_name=os.path.join(temp_path, f"{unique_id}_{index:02d}_{sanitize_filename(file_name)}"),
+                progress=_member_progress(index)
+            )
+            if not path or not os.path.exists(path):
+                raise FileNotFoundError(f"No se pudo descargar el elemento {index + 1} del álbum.")
+            paths[index] = path
+            # Un miembro truncado no debe llegar a send_media_group: el álbum saldría corrupto.
+            if info['file_size'] and os.path.getsize(path) != info['file_size']:
+                raise IncompleteDownloadError(
+                    f"El elemento {index + 1} del álbum se descargó incompleto "
+                    f"({format_size(os.path.getsize(path))} de {format_size(info['file_size'])})."
+                )
+            completed += 1
+            progress.file_info = f"{completed}/{len(members)}"
+
+        download_start_time = asyncio.get_event_loop().time()
+        # Se esperan todas las descargas (también si una falla) para poder limpiar sus archivos.
+        results = await asyncio.gather(*(_download(i, member) for i, member in enumerate(members)),
+                                       return_exceptions=True)
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            raise errors[0]
+        download_time = asyncio.get_event_loop().time() - download_start_time
+
+        await outbound.edit_message(
+            status_msg,
+            f"✅ <b>Álbum descargado</b>\n\n"
+            f"⚡️ <b>Velocidad promedio:</b> {format_size(total_size / download_time if download_time > 0 else 0)}/s\n"
+            f"⏱ <b>Tiempo total:</b> {format_time(download_time)}\n\n"
+            f"🔄 Enviando {len(members)} archivos en un solo mensaje...",
+            parse_mode=ParseMode.HTML
+        )
+
+        upload_start_time = asyncio.get_event_loop().time()
+        async with userbot_pool.transfer(account):
+            await account.client.send_media_group(
+                original_message.chat.id,
+                [_album_input_media(member, paths[i]) for i, member in enumerate(members)]
+            )
+        userbot_pool.record_transfer(account, "upload", total_size,
+                                     asyncio.get_event_loop().time() - upload_start_time)
+
+        me = await peer_cache.get_me(account.client)
+        await outbound.edit_message(
+            status_msg,
+            f"✅ <b>¡Álbum Completado!</b>\n\n"
+            f"🗂 <b>Archivos:</b> {len(members)}\n"
+            f"📊 <b>Tamaño:</b> {format_size(total_size)}\n"
+            f"⏱ <b>Tiempo total:</b> {format_time(progress.elapsed)}\n"
+            f"🚀 <b>Modo:</b> Telegram\n"
+            f"👤 <b>Procesado por:</b> {me.first_name}\n"
+            f"🆔 <b>ID:</b> {me.id}",
+            parse_mode=ParseMode.HTML
+        )
+
+    except Exception as e:
+        logger.error(f"Error procesando álbum: {e}")
+        await outbound.edit_message(
+            status_msg,
+            f"❌ <b>Error al procesar el álbum:</b>\n"
+            f"<code>{escape_html(str(e))}</code>",
+            parse_mode=ParseMode.HTML
+        )
+    finally:
+        for path in paths.values():
+            try:
+                if os.path.exists(path):
+                    os.remove(path)
+            except Exception as cleanup_error:
+                logger.error(f"Error al limpiar archivos temporales: {cleanup_error}")
+        await progress_bus.close(operation_id)
 
 # --- Manejadores de Pyrogram ---
 
@@ -1270,16 +1151,75 @@ async def handle_direct_video(client: Client, message: Message):
     else:
         await message.reply("Failed to create task.")
 
+def _encode_panel_cursor(task: Dict) -> str:
+    """Clave (created_at, _id) de una tarea como texto corto para callback_data (<64 bytes)."""
+    created_at = task["created_at"]
+    millis = int((created_at - datetime(1970, 1, 1)) / timedelta(milliseconds=1))
+    return f"{millis}_{task['_id']}"
+
+def _decode_panel_cursor(value: str) -> Tuple[datetime, ObjectId]:
+    millis, oid = value.split("_", 1)
+    return datetime(1970, 1, 1) + timedelta(milliseconds=int(millis)), ObjectId(oid)
+
+async def _render_panel_page(user_id: int, cursor: Optional[Tuple[datetime, ObjectId]] = None,
+                             backwards: bool = False) -> Optional[Tuple[str, InlineKeyboardMarkup]]:
+    """Construye una página del panel. Devuelve None si el usuario no tiene tareas pendientes."""
+    tasks, has_more = await db_instance.get_tasks_page(user_id, "pending_processing", cursor=cursor, backwards=backwards)
+    if not tasks and cursor is not None:
+        # La página pedida quedó vacía (tareas borradas o procesadas): volver al principio.
+        cursor, backwards = None, False
+        tasks, has_more = await db_instance.get_tasks_page(user_id, "pending_processing")
+    if not tasks:
+        return None
+    await db_instance.ensure_task_ordinals(tasks)
+
+    if backwards:
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = cursor is not None, has_more
+
+    total = await db_instance.count_user_tasks(user_id, "pending_processing")
+    panel_text = f"📋 <b>Panel de Control</b>\n\n"
+    panel_text += f"📊 <b>Total de archivos:</b> {total}\n\n"
+
+    emoji_map = {'video': '🎬', 'audio': '🎵', 'document': '📄'}
+    for task in tasks:
+        file_name = task.get('original_filename') or 'Archivo sin nombre'
+        file_size = task.get('file_metadata', {}).get('size', 0)
+        duration = task.get('file_metadata', {}).get('duration', 0)
+        emoji = emoji_map.get(task.get('file_type', 'document'), '📁')
+        number = task.get('ordinal', '?')
+
+        panel_text += f"{number}. {emoji} <code>{escape_html(file_name[:50])}</code>\n"
+        if file_size > 0:
+            panel_text += f"   📊 {format_size(file_size)}"
+        if duration > 0:
+            panel_text += f" | ⏱️ {format_time(duration)}"
+        panel_text += "\n\n"
+    panel_text += "💡 Usa <code>/p N</code> con el número de la tarea para configurarla."
+
+    navigation = []
+    if has_prev:
+        navigation.append(InlineKeyboardButton("⬅️ Anterior", callback_data=f"panel_p_{_encode_panel_cursor(tasks[0])}"))
+    if has_next:
+        navigation.append(InlineKeyboardButton("Siguiente ➡️", callback_data=f"panel_n_{_encode_panel_cursor(tasks[-1])}"))
+
+    rows = [navigation] if navigation else []
+    rows += [
+        [InlineKeyboardButton("🔄 Actualizar Panel", callback_data="refresh_panel")],
+        [InlineKeyboardButton("🗑️ Limpiar Todo", callback_data="panel_delete_all_confirm")],
+        [InlineKeyboardButton("⚙️ Configurar Archivo", callback_data="select_file_to_configure")]
+    ]
+    return panel_text, InlineKeyboardMarkup(rows)
+
 @Client.on_message(filters.command("panel") & filters.private)
 async def panel_command(client: Client, message: Message):
-    """Muestra el panel de control con todas las tareas del usuario."""
+    """Muestra la primera página del panel de control con las tareas del usuario."""
     try:
         user_id = message.from_user.id
+        page = await _render_panel_page(user_id)
         
-        # Obtener tareas pendientes del usuario
-        pending_tasks = await db_instance.get_pending_tasks(user_id, status_filter="pending_processing")
-        
-        if not pending_tasks:
+        if page is None:
             await message.reply(
                 "📋 <b>Panel de Control</b>\n\n"
                 "No tienes archivos en el panel.\n\n"
@@ -1291,35 +1231,7 @@ async def panel_command(client: Client, message: Message):
             )
             return
         
-        # Construir mensaje del panel
-        panel_text = f"📋 <b>Panel de Control</b>\n\n"
-        panel_text += f"📊 <b>Total de archivos:</b> {len(pending_tasks)}\n\n"
-        
-        for i, task in enumerate(pending_tasks, 1):
-            file_name = task.get('original_filename', 'Archivo sin nombre')
-            file_type = task.get('file_type', 'document')
-            file_size = task.get('file_metadata', {}).get('size', 0)
-            duration = task.get('file_metadata', {}).get('duration', 0)
-            
-            # Emoji según tipo de archivo
-            emoji_map = {'video': '🎬', 'audio': '🎵', 'document': '📄'}
-            emoji = emoji_map.get(file_type, '📁')
-            
-            # Información del archivo
-            panel_text += f"{i}. {emoji} <code>{escape_html(file_name[:50])}</code>\n"
-            if file_size > 0:
-                panel_text += f"   📊 {format_size(file_size)}"
-            if duration > 0:
-                panel_text += f" | ⏱️ {format_time(duration)}"
-            panel_text += "\n\n"
-        
-        # Crear teclado con opciones
-        keyboard = InlineKeyboardMarkup([
-            [InlineKeyboardButton("🔄 Actualizar Panel", callback_data="refresh_panel")],
-            [InlineKeyboardButton("🗑️ Limpiar Todo", callback_data="panel_delete_all_confirm")],
-            [InlineKeyboardButton("⚙️ Configurar Archivo", callback_data="select_file_to_configure")]
-        ])
-        
+        panel_text, keyboard = page
         await message.reply(panel_text, parse_mode=ParseMode.HTML, reply_markup=keyboard)
         
     except Exception as e:
@@ -1331,6 +1243,31 @@ async def panel_command(client: Client, message: Message):
             parse_mode=ParseMode.HTML
         )
 
+@Client.on_callback_query(filters.regex(r"^(refresh_panel$|panel_[np]_)"))
+async def panel_page_callback(client: Client, query: CallbackQuery):
+    """Navegación del panel: siguiente/anterior página por cursor y actualización."""
+    try:
+        cursor, backwards = None, False
+        if query.data.startswith(("panel_n_", "panel_p_")):
+            backwards = query.data.startswith("panel_p_")
+            try:
+                cursor = _decode_panel_cursor(query.data[len("panel_n_"):])
+            except (ValueError, TypeError):
+                cursor = None
+
+        page = await _render_panel_page(query.from_user.id, cursor=cursor, backwards=backwards)
+        if page is None:
+            await query.message.edit_text("📋 <b>Panel de Control</b>\n\nNo tienes archivos en el panel.", parse_mode=ParseMode.HTML)
+        else:
+            panel_text, keyboard = page
+            await query.message.edit_text(panel_text, parse_mode=ParseMode.HTML, reply_markup=keyboard)
+        await query.answer()
+    except MessageNotModified:
+        await query.answer("El panel ya está actualizado.")
+    except Exception as e:
+        logger.error(f"Error en panel_page_callback: {e}", exc_info=True)
+        await query.answer("❌ Error al cargar el panel.", show_alert=True)
+
 @Client.on_message(filters.command("get_restricted") & filters.private)
 async def get_restricted_command(client: Client, message: Message):
     """Inicia el proceso de obtener contenido de un canal restringido."""
@@ -1391,28 +1328,17 @@ async def p_command(client: Client, message: Message):
             )
             return
         
-        # Obtener tareas del usuario
-        pending_tasks = await db_instance.get_pending_tasks(user_id, status_filter="pending_processing")
-        
-        if not pending_tasks:
-            await message.reply(
-                "❌ <b>No hay archivos en el panel</b>\n\n"
-                "Usa <code>/panel</code> para ver tus archivos o envía un video al bot.",
-                parse_mode=ParseMode.HTML
-            )
-            return
+        # Los números del panel son ordinales estables: una consulta puntual por {user_id, ordinal}.
+        selected_task = await db_instance.get_task_by_ordinal(user_id, video_number)
         
-        if video_number < 1 or video_number > len(pending_tasks):
+        if selected_task is None:
             await message.reply(
-                f"❌ <b>Número fuera de rango</b>\n\n"
-                f"Tienes {len(pending_tasks)} archivo(s) en el panel.\n"
-                f"Usa un número entre 1 y {len(pending_tasks)}",
+                f"❌ <b>No hay ninguna tarea pendiente con el número {video_number}</b>\n\n"
+                "Usa <code>/panel</code> para ver los números de tus archivos.",
                 parse_mode=ParseMode.HTML
             )
             return
         
-        # Obtener la tarea seleccionada
-        selected_task = pending_tasks[video_number - 1]
         task_id = str(selected_task['_id'])
         
         # Abrir el menú de funcionalidades para este video usando el router central
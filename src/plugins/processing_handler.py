@@ -15,6 +15,8 @@ from bson.objectid import ObjectId
 from src.db.mongo_manager import db_instance
 from src.helpers.keyboards import build_processing_menu, build_transcode_menu, build_tracks_menu, build_watermark_menu, build_position_menu, build_thumbnail_menu, build_audio_metadata_menu, build_back_button
 from src.helpers.utils import sanitize_filename, escape_html, get_media_info
+from src.core.cancellation import cancellation_registry
+from src.core.ffmpeg_supervisor import run_ffmpeg
 
 logger = logging.getLogger(__name__)
 
@@ -69,6 +71,7 @@ async def main_processing_router(client: Client, query: CallbackQuery):
             action, task_id = data.split("_")[1], data.split("_")[2]
             if action == "queuesingle":
                 await db_instance.update_task_field(task_id, "status", "queued")
+                db_instance.record_task_event(user_id, "queued")
                 await query.message.edit_text("✅ Tarea enviada a la cola.\nRecibirás el archivo cuando finalice.", parse_mode=ParseMode.HTML)
             elif action == "delete":
                 await db_instance.delete_task_by_id(task_id)
@@ -85,6 +88,22 @@ async def main_processing_router(client: Client, query: CallbackQuery):
         logger.error(f"Error en el router de procesamiento: {e}", exc_info=True)
         await query.answer("❌ Ocurrió un error inesperado.", show_alert=True)
 
+@Client.on_callback_query(filters.regex(r"^cancel_task_"))
+async def cancel_task_callback(client: Client, query: CallbackQuery):
+    """Cancela una tarea: la marca en la DB y detiene su ejecución si corre en este proceso."""
+    task_id = query.data.split("_")[2]
+    task = await db_instance.get_task(task_id)
+    if not task or task.get('user_id') != query.from_user.id:
+        return await query.answer("❌ La tarea ya no existe.", show_alert=True)
+
+    marked = await db_instance.cancel_task(task_id)
+    # Señal en proceso: corta descargas, FFmpeg y subidas sin esperar al change stream.
+    stopped = cancellation_registry.cancel(task_id)
+    if marked or stopped:
+        await query.answer("🚫 Cancelando tarea...")
+    else:
+        await query.answer("ℹ️ La tarea ya había finalizado.", show_alert=True)
+
 # --- [REFACTORIZADO] Manejadores de Lógica Específica ---
 
 async def handle_config_selection(client: Client, query: CallbackQuery):
@@ -135,7 +154,7 @@ async def handle_config_selection(client: Client, query: CallbackQuery):
         "replace_audio": "🎼 Envíame el nuevo archivo de <b>audio</b> que reemplazará al original.",
         "watermark_text": "💧 Envíame el <b>texto</b> que quieres usar como marca de agua.",
         "watermark_image": "🖼️ Envíame la <b>imagen</b> que quieres usar como marca de agua.",
-        "audiotags": "✍️ Envíame los metadatos con el formato:\n<code>Título: Mi Canción\nArtista: El Artista</code>",
+        "audiotags": "✍️ Envíame los metadatos con el formato:\n<code>Título: Mi Canción\nArtista: El Artista\nÁlbum: El Álbum</code>",
         "audiothumb": "🖼️ Envíame la imagen de la <b>carátula</b>."
     }
 
@@ -192,6 +211,23 @@ async def handle_set_value(client: Client, query: CallbackQuery):
 
 # --- [REFACTORIZADO] Manejadores de Entrada de Usuario (Texto y Media) ---
 
+# Claves aceptadas en el mensaje de metadatos de audio, en español e inglés.
+_AUDIO_TAG_ALIASES = {
+    "titulo": "title", "título": "title", "title": "title",
+    "artista": "artist", "artist": "artist",
+    "album": "album", "álbum": "album",
+}
+
+def _parse_audio_tags(text: str) -> dict:
+    """Convierte líneas 'Clave: valor' en un diccionario de etiquetas de audio."""
+    tags = {}
+    for line in text.splitlines():
+        key, sep, value = line.partition(":")
+        if not sep: continue
+        if (tag := _AUDIO_TAG_ALIASES.get(key.strip().lower())) and value.strip():
+            tags[tag] = value.strip()
+    return tags
+
 async def handle_text_input_for_state(client: Client, message: Message, user_state: dict):
     """Maneja la entrada de texto del usuario y actualiza el menú principal."""
     user_id, user_input = message.from_user.id, message.text.strip()
@@ -216,6 +252,19 @@ async def handle_text_input_for_state(client: Client, message: Message, user_sta
         if user_input:
             await db_instance.update_task_config(task_id, "watermark", {"type": "text", "text": user_input, "position": "bottom_right"})
             success = True
+    elif state == "awaiting_gif":
+        parts = user_input.split()
+        if len(parts) == 2 and all(part.replace('.', '', 1).isdigit() for part in parts):
+            duration, fps = float(parts[0]), int(float(parts[1]))
+            if 0 < duration <= 60 and 1 <= fps <= 30:
+                await db_instance.update_task_config(task_id, "gif_options", {"duration": duration, "fps": fps})
+                success = True
+    elif state == "awaiting_audiotags":
+        if tags := _parse_audio_tags(user_input):
+            task = await db_instance.get_task(task_id)
+            current_tags = (task or {}).get('processing_config', {}).get('audio_tags', {})
+            await db_instance.update_task_config(task_id, "audio_tags", {**current_tags, **tags})
+            success = True
             
     # [Añadir más lógica para otros estados aquí]
     
@@ -257,6 +306,10 @@ async def handle_media_input_for_state(client: Client, message: Message, user_st
         if message.photo or (hasattr(media, 'mime_type') and media.mime_type.startswith("image/")):
             await db_instance.update_task_config(task_id, "watermark", {"type": "image", "file_id": media.file_id, "position": "bottom_right"})
             success = True
+    elif state == "awaiting_audiothumb":
+        if message.photo or (hasattr(media, 'mime_type') and media.mime_type.startswith("image/")):
+            await db_instance.update_task_config(task_id, "audio_thumbnail_file_id", media.file_id)
+            success = True
     
     # [Añadir más lógica para otros estados aquí]
 
@@ -345,49 +398,36 @@ async def handle_ffmpeg_errors(input_file: str, output_file: str) -> str:
     try:
         # Validar el archivo antes de procesarlo
         validate_command = ["ffmpeg", "-v", "error", "-i", input_file, "-f", "null", "-"]
-        validate_process = await asyncio.create_subprocess_exec(
-            *validate_command,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        _, validate_stderr = await validate_process.communicate()
+        validate_result = await run_ffmpeg(validate_command)
 
-        if validate_process.returncode != 0:
-            logger.error(f"Error validando archivo: {validate_stderr.decode()}")
+        if validate_result.returncode != 0:
+            logger.error(f"Error validando archivo: {''.join(validate_result.stderr_tail)}")
             return "❌ Error: Archivo inválido o corrupto."
 
         # Intentar reparar el archivo si el error es "moov atom not found"
         repair_command = [
             "ffmpeg", "-i", input_file, "-c", "copy", output_file
         ]
-        repair_process = await asyncio.create_subprocess_exec(
-            *repair_command,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        _, repair_stderr = await repair_process.communicate()
+        repair_result = await run_ffmpeg(repair_command)
+        repair_stderr = "".join(repair_result.stderr_tail)
 
-        if repair_process.returncode == 0:
+        if repair_result.ok:
             return f"✅ Archivo reparado exitosamente: {output_file}"
-        elif b"moov atom not found" in repair_stderr:
-            logger.error(f"Error reparando archivo: {repair_stderr.decode()}")
+        elif "moov atom not found" in repair_stderr:
+            logger.error(f"Error reparando archivo: {repair_stderr}")
             return "❌ Error: Archivo corrupto. No se pudo reparar."
 
         # Intentar conversión segura si el error es "Conversion failed"
         conversion_command = [
             "ffmpeg", "-i", input_file, "-preset", "ultrafast", "-c:v", "libx264", "-c:a", "aac", output_file
         ]
-        conversion_process = await asyncio.create_subprocess_exec(
-            *conversion_command,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        _, conversion_stderr = await conversion_process.communicate()
+        conversion_result = await run_ffmpeg(conversion_command)
+        conversion_stderr = "".join(conversion_result.stderr_tail)
 
-        if conversion_process.returncode == 0:
+        if conversion_result.ok:
             return f"✅ Conversión completada: {output_file}"
-        elif b"Conversion failed" in conversion_stderr:
-            logger.error(f"Error en conversión: {conversion_stderr.decode()}")
+        elif "Conversion failed" in conversion_stderr:
+            logger.error(f"Error en conversión: {conversion_stderr}")
             return "❌ Error: Fallo en la conversión. Parámetros incompatibles."
 
         return "❌ Error desconocido durante el procesamiento con FFmpeg."
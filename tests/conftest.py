@@ -0,0 +1,96 @@
+# --- START OF FILE tests/conftest.py ---
+
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+# Los módulos que importan db_instance deben crear el backend SQLite, no conectar a MongoDB.
+os.environ.setdefault("STORAGE_BACKEND", "sqlite")
+os.environ.setdefault("SQLITE_PATH", ":memory:")
+
+
+def run(coro):
+    """Ejecuta una corrutina en un bucle nuevo (los tests no dependen de pytest-asyncio)."""
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def storage(monkeypatch):
+    """Backend SQLite nuevo sobre una base en memoria para cada test."""
+    pytest.importorskip("bson")
+    from src.db import sqlite_backend
+
+    monkeypatch.setattr(sqlite_backend, "SQLITE_PATH", ":memory:")
+    monkeypatch.setattr(sqlite_backend.SQLiteDatabase, "_instance", None)
+    monkeypatch.setattr(sqlite_backend.SQLiteDatabase, "_initialized", False)
+    db = sqlite_backend.SQLiteDatabase()
+    run(db.init_db())
+    yield db
+    db._executor.shutdown(wait=True)
+
+
+def _matches(doc: dict, query: dict) -> bool:
+    for key, condition in query.items():
+        value = doc.get(key)
+        if isinstance(condition, dict):
+            if "$in" in condition and value not in condition["$in"]:
+                return False
+            if "$nin" in condition and value in condition["$nin"]:
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+class FakeCollection:
+    """Lo justo de una colección de Motor para probar el write-behind: $set, bulk_write y filtros $in/$nin."""
+
+    def __init__(self):
+        self.docs = {}
+        self.writes = []
+
+    def _update(self, query: dict, update: dict):
+        for doc in self.docs.values():
+            if _matches(doc, query):
+                doc.update(update["$set"])
+                return doc
+        return None
+
+    async def insert_one(self, doc: dict):
+        self.docs[doc["_id"]] = doc
+
+    async def find_one(self, query: dict, projection=None):
+        return next((dict(doc) for doc in self.docs.values() if _matches(doc, query)), None)
+
+    async def find_one_and_update(self, query: dict, update: dict, projection=None):
+        self.writes.append(("find_one_and_update", update["$set"]))
+        doc = self._update(query, update)
+        return dict(doc) if doc else None
+
+    async def update_one(self, query: dict, update: dict):
+        self.writes.append(("update_one", update["$set"]))
+        self._update(query, update)
+
+    async def bulk_write(self, operations, ordered=True):
+        for operation in operations:
+            self.writes.append(("bulk_write", operation._doc["$set"]))
+            self._update(operation._filter, operation._doc)
+
+
+@pytest.fixture
+def mongo_storage(monkeypatch):
+    """Backend Mongo sin servidor: la colección de tareas es un FakeCollection en memoria."""
+    pytest.importorskip("motor")
+    from src.db import mongo_manager
+
+    monkeypatch.setenv("MONGO_URI", "mongodb://localhost:1")
+    monkeypatch.setattr(mongo_manager.Database, "_instance", None)
+    db = mongo_manager.Database()
+    monkeypatch.setattr(db, "tasks", FakeCollection())
+    monkeypatch.setattr(db, "start_write_behind", lambda: None)
+    return db
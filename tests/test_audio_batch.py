@@ -0,0 +1,80 @@
+# --- START OF FILE tests/test_audio_batch.py ---
+
+import asyncio
+
+import pytest
+
+from conftest import run
+
+from src.core import audio_batch as audio_batch_module
+from src.core import ffmpeg
+from src.core.audio_batch import AudioBatchProcessor, is_stream_copy
+
+OPUS_INFO = {"streams": [{"codec_type": "video", "codec_name": "h264"}, {"codec_type": "audio", "codec_name": "opus"}]}
+AC3_INFO = {"streams": [{"codec_type": "audio", "codec_name": "ac3"}]}
+
+
+@pytest.fixture(autouse=True)
+def no_ffprobe(monkeypatch):
+    """Los constructores de comandos usan la información ya obtenida: nunca lanzan ffprobe."""
+    def _forbidden(path):
+        raise AssertionError("get_media_info no debe llamarse al construir el comando")
+    monkeypatch.setattr(ffmpeg, "get_media_info", _forbidden)
+
+
+@pytest.mark.parametrize("command, expected", [
+    (["ffmpeg", "-i", "a", "-c", "copy", "b"], True),
+    (["ffmpeg", "-i", "a", "-c:a", "copy", "-c:v", "copy", "b"], True),
+    (["ffmpeg", "-i", "a", "-c:a", "aac", "b"], False),
+    (["ffmpeg", "-i", "a", "-c:v", "copy", "-c:a", "libmp3lame", "b"], False),
+    (["ffmpeg", "-i", "a", "b"], False),
+])
+def test_is_stream_copy(command, expected):
+    assert is_stream_copy(command) is expected
+
+
+def test_extract_audio_copies_into_the_native_container():
+    task = {"processing_config": {"extract_audio": True}}
+    [command], output = ffmpeg.build_ffmpeg_command(task, "in.mkv", "out/song.m4a", media_info=OPUS_INFO)
+    assert output == "out/song.opus"
+    assert is_stream_copy(command)
+
+
+def test_extract_audio_without_native_container_reencodes():
+    task = {"processing_config": {"extract_audio": True}}
+    [command], output = ffmpeg.build_ffmpeg_command(task, "in.mkv", "out/song.m4a", media_info=AC3_INFO)
+    assert output == "out/song.m4a"
+    assert not is_stream_copy(command)
+
+
+def test_audio_tags_are_written_with_stream_copy():
+    task = {"file_type": "audio", "processing_config": {"audio_tags": {"title": "T", "artist": "A"}}}
+    [command], output = ffmpeg.build_ffmpeg_command(task, "in.ogg", "out/song.ogg", media_info=AC3_INFO)
+    assert output == "out/song.mka"
+    assert is_stream_copy(command)
+    assert "title=T" in command and "artist=A" in command
+
+
+def test_submit_bounds_concurrency_and_limits_only_stream_copies(monkeypatch):
+    running, peak, wall_limits = 0, 0, []
+
+    async def fake_run_ffmpeg(command, cancel_token=None, wall_limit=None):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        wall_limits.append(wall_limit)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return command
+
+    monkeypatch.setattr(audio_batch_module, "run_ffmpeg", fake_run_ffmpeg)
+
+    async def scenario():
+        processor = AudioBatchProcessor(max_workers=2)
+        copies = [processor.submit(["ffmpeg", "-c", "copy", str(i)], timeout=30) for i in range(4)]
+        reencode = processor.submit(["ffmpeg", "-c:a", "aac", "x"], timeout=30)
+        await asyncio.gather(*copies, reencode)
+
+    run(scenario())
+    assert peak == 2
+    assert sorted(wall_limits, key=str) == [30, 30, 30, 30, None]
@@ -0,0 +1,48 @@
+# --- START OF FILE tests/test_batch_ingest.py ---
+
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip("pyrogram")
+pytest.importorskip("motor")
+
+from src.core.batch_ingest import parse_batch_link
+
+
+def test_public_range():
+    spec = parse_batch_link("https://t.me/micanal/100-250")
+    assert (spec.chat_ref, spec.start_id, spec.end_id) == ("micanal", 100, 250)
+
+
+def test_private_channel_uses_internal_id():
+    spec = parse_batch_link("t.me/c/123456/5-9")
+    assert spec.chat_ref == -100123456
+
+
+def test_reversed_range_is_swapped():
+    spec = parse_batch_link("https://t.me/micanal/250-100")
+    assert (spec.start_id, spec.end_id) == (100, 250)
+
+
+def test_open_range_and_whole_chat():
+    open_range = parse_batch_link("https://t.me/micanal/100-")
+    whole = parse_batch_link("https://t.me/micanal/all")
+    assert (open_range.start_id, open_range.end_id) == (100, None)
+    assert (whole.start_id, whole.end_id) == (None, None)
+
+
+def test_date_window_includes_the_last_day():
+    spec = parse_batch_link("https://t.me/micanal/todo?desde=2024-01-01&hasta=2024-03-31")
+    assert spec.since == datetime(2024, 1, 1)
+    assert spec.until == datetime(2024, 4, 1)
+
+
+def test_bad_date_is_rejected():
+    with pytest.raises(ValueError):
+        parse_batch_link("https://t.me/micanal/all?since=01-01-2024")
+
+
+@pytest.mark.parametrize("url", ["https://t.me/micanal/100", "https://youtube.com/watch?v=x", "t.me/abc/1-2"])
+def test_single_message_and_other_links_are_not_batches(url):
+    assert parse_batch_link(url) is None
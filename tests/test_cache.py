@@ -0,0 +1,55 @@
+# --- START OF FILE tests/test_cache.py ---
+
+from src.helpers.cache import TTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_entries_expire_after_ttl():
+    clock = FakeClock()
+    cache = TTLCache(ttl=10, clock=clock)
+    cache.set("a", 1)
+    clock.now = 9.9
+    assert cache.get("a") == 1
+    clock.now = 10
+    assert cache.get("a", "caducada") == "caducada"
+    assert "a" not in cache
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_per_entry_ttl_overrides_default():
+    clock = FakeClock()
+    cache = TTLCache(ttl=10, clock=clock)
+    cache.set("corta", 1, ttl=1)
+    cache.set("larga", 2)
+    clock.now = 5
+    assert "corta" not in cache
+    assert cache.get("larga") == 2
+
+
+def test_evicts_least_recently_used():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert "a" in cache
+    assert "b" not in cache
+    assert len(cache) == 2
+
+
+def test_items_skips_expired_without_touching_order():
+    clock = FakeClock()
+    cache = TTLCache(maxsize=2, ttl=10, clock=clock)
+    cache.set("vieja", 1, ttl=1)
+    cache.set("nueva", 2)
+    clock.now = 2
+    assert list(cache.items()) == [("nueva", 2)]
+    assert cache.pop("nueva") == 2
+    assert cache.pop("nueva", "sin valor") == "sin valor"
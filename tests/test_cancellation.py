@@ -0,0 +1,164 @@
+# --- START OF FILE tests/test_cancellation.py ---
+
+import asyncio
+import sys
+
+import pytest
+
+from conftest import run
+
+from src.core import cancellation
+from src.core.cancellation import CancellationRegistry, CancellationToken, terminate_process
+from src.core.exceptions import TaskCancelledError
+
+SLEEPER = [sys.executable, "-c", "import time; time.sleep(30)"]
+# Ignora SIGTERM y avisa cuando el manejador ya está instalado.
+STUBBORN = [sys.executable, "-c",
+            "import signal, sys, time; signal.signal(signal.SIGTERM, signal.SIG_IGN); "
+            "print('listo', flush=True); time.sleep(30)"]
+
+
+def test_cancel_runs_callbacks_once_and_raises():
+    calls = []
+    token = CancellationToken("t1")
+    token.add_callback(lambda: calls.append("a"))
+    remove = token.add_callback(lambda: calls.append("b"))
+    remove()
+
+    async def scenario():
+        token.cancel("motivo")
+        token.cancel("otra vez")
+
+    run(scenario())
+    assert calls == ["a"]
+    with pytest.raises(TaskCancelledError, match="motivo"):
+        token.raise_if_cancelled()
+
+
+def test_callback_added_after_cancel_runs_immediately():
+    token = CancellationToken("t1")
+    calls = []
+
+    async def scenario():
+        token.cancel()
+        token.add_callback(lambda: calls.append("tarde"))
+
+    run(scenario())
+    assert calls == ["tarde"]
+
+
+def test_stop_transmission_only_when_cancelled():
+    class Client:
+        stops = 0
+
+        def stop_transmission(self):
+            self.stops += 1
+
+    client, token = Client(), CancellationToken("t1")
+    token.stop_transmission_if_cancelled(client)
+    assert client.stops == 0
+
+    async def scenario():
+        token.cancel()
+
+    run(scenario())
+    token.stop_transmission_if_cancelled(client)
+    assert client.stops == 1
+
+
+def test_cancel_terminates_attached_processes():
+    async def scenario():
+        token = CancellationToken("t1")
+        process = await asyncio.create_subprocess_exec(*SLEEPER)
+        token.attach_process(process)
+        token.cancel()
+        return await asyncio.wait_for(process.wait(), timeout=5)
+
+    assert run(scenario()) < 0
+
+
+def test_process_attached_after_cancel_is_terminated():
+    async def scenario():
+        token = CancellationToken("t1")
+        token.cancel()
+        process = await asyncio.create_subprocess_exec(*SLEEPER)
+        token.attach_process(process)
+        return await asyncio.wait_for(process.wait(), timeout=5)
+
+    assert run(scenario()) < 0
+
+
+def test_terminate_process_kills_when_sigterm_is_ignored():
+    async def scenario():
+        process = await asyncio.create_subprocess_exec(*STUBBORN, stdout=asyncio.subprocess.PIPE)
+        await process.stdout.readline()
+        await terminate_process(process, grace=0.2)
+        return process.returncode
+
+    assert run(scenario()) == -9
+
+
+def test_registry_cancel_only_reaches_active_tokens():
+    registry = CancellationRegistry()
+
+    async def scenario():
+        registry.create("t1")
+        registry.create("t2")
+        assert registry.cancel("t1")
+        assert not registry.cancel("desconocida")
+
+    run(scenario())
+    assert registry.active_task_ids() == ["t2"]
+    registry.release("t2")
+    assert registry.get("t2") is None
+
+
+def test_watch_database_uses_the_change_stream_when_available(monkeypatch):
+    pytest.importorskip("motor")
+    from src.db import mongo_manager
+
+    class StreamingDb:
+        handler = None
+
+        async def watch_collection(self, collection, pipeline, handler, full_document=None):
+            StreamingDb.handler = handler
+            return True
+
+    monkeypatch.setattr(mongo_manager, "db_instance", StreamingDb())
+    registry = CancellationRegistry()
+
+    async def scenario():
+        token = registry.create("t1")
+        await asyncio.wait_for(registry.watch_database(), timeout=1)
+        await StreamingDb.handler({"documentKey": {"_id": "t1"}})
+        return token
+
+    token = run(scenario())
+    assert token.cancelled
+    assert token.reason == "Cancelada desde la base de datos"
+
+
+def test_watch_database_polls_when_change_streams_are_unavailable(storage, monkeypatch):
+    pytest.importorskip("motor")
+    from src.db import mongo_manager
+
+    monkeypatch.setattr(mongo_manager, "db_instance", storage)
+    monkeypatch.setattr(cancellation, "CANCEL_POLL_INTERVAL", 0.01)
+    registry = CancellationRegistry()
+
+    async def scenario():
+        cancelled_id = str(await storage.add_task(1, "video", "a.mp4"))
+        running_id = str(await storage.add_task(1, "video", "b.mp4"))
+        cancelled, running = registry.create(cancelled_id), registry.create(running_id)
+        watcher = asyncio.create_task(registry.watch_database())
+        try:
+            assert await storage.cancel_task(cancelled_id)
+            await asyncio.wait_for(cancelled.wait(), timeout=2)
+            await asyncio.sleep(0.05)
+        finally:
+            watcher.cancel()
+        return cancelled, running
+
+    cancelled, running = run(scenario())
+    assert cancelled.cancelled
+    assert not running.cancelled
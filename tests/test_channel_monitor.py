@@ -0,0 +1,226 @@
+# --- START OF FILE tests/test_channel_monitor.py ---
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from conftest import run
+
+pytest.importorskip("pyrogram")
+pytest.importorskip("motor")
+
+from pyrogram.errors import FloodWait
+
+from src.core import channel_monitor as channel_monitor_module
+from src.core.channel_monitor import ChannelMonitor
+from src.core.userbot_pool import UserbotAccount, UserbotPool
+
+CHANNEL_ID, USER_ID = -1001, 7
+
+
+def post(message_id: int):
+    return SimpleNamespace(id=message_id, chat=SimpleNamespace(id=CHANNEL_ID), empty=False,
+                           video=SimpleNamespace(file_name=f"{message_id}.mp4", file_size=10))
+
+
+class FakeUserbot:
+    """Cuenta userbot con el historial de un canal: get_messages por ids y el último mensaje."""
+
+    def __init__(self, top: int):
+        self.top = top
+        self.requested = []
+
+    async def get_messages(self, chat_id, ids):
+        self.requested.append(list(ids))
+        return [post(i) if i <= self.top else None for i in ids]
+
+    async def get_chat_history(self, chat_id, limit=1):
+        if self.top:
+            yield post(self.top)
+
+    async def get_chat_member(self, chat_id, user_id):
+        return SimpleNamespace(status=SimpleNamespace(name="MEMBER"))
+
+    def add_handler(self, handler, group):
+        pass
+
+    def remove_handler(self, handler, group):
+        pass
+
+
+@pytest.fixture
+def monitor(storage, monkeypatch):
+    """ChannelMonitor con la cuenta principal `monitor.client` y el backend SQLite en memoria."""
+    pool = UserbotPool()
+    pool.accounts = [UserbotAccount(FakeUserbot(top=100), 0)]
+    monkeypatch.setattr(channel_monitor_module, "userbot_pool", pool)
+    monkeypatch.setattr(channel_monitor_module, "db_instance", storage)
+    monkeypatch.setattr(channel_monitor_module, "CHANNEL_BACKFILL_PAGE_DELAY", 0)
+    monitor = ChannelMonitor()
+    monitor._page_delay = 0
+    monitor.pool, monitor.client, monitor.storage = pool, pool.accounts[0].client, storage
+    return monitor
+
+
+async def stored_cursor(storage) -> int:
+    [doc] = await storage.get_active_monitored_channels()
+    return doc["last_message_id"]
+
+
+async def drain(monitor):
+    """Espera a que terminen los rellenos lanzados por los updates."""
+    for channel in monitor._channels.values():
+        if channel.backfill is not None:
+            await channel.backfill
+
+
+def test_new_channel_starts_at_the_current_last_message(monitor):
+    async def scenario():
+        assert await monitor.add_monitored_channel(CHANNEL_ID, USER_ID)
+        return monitor._channels[CHANNEL_ID], await stored_cursor(monitor.storage)
+
+    channel, cursor = run(scenario())
+    assert channel.last_message_id == channel.high_water == 100
+    assert cursor == 100
+
+
+def test_contiguous_posts_are_ingested_live_and_move_the_cursor(monitor, monkeypatch):
+    monkeypatch.setattr(channel_monitor_module, "CHANNEL_CHECKPOINT_INTERVAL", 3600)
+
+    async def scenario():
+        await monitor.add_monitored_channel(CHANNEL_ID, USER_ID)
+        for message_id in (101, 102, 102, 100):
+            await monitor._on_message(monitor.client, post(message_id))
+        await drain(monitor)
+        return (monitor._channels[CHANNEL_ID].last_message_id, await stored_cursor(monitor.storage),
+                await monitor.storage.count_user_tasks(USER_ID))
+
+    cursor, stored, tasks = run(scenario())
+    assert cursor == 102
+    assert tasks == 2
+    # En directo el cursor se guarda como mucho cada CHANNEL_CHECKPOINT_INTERVAL.
+    assert stored == 100
+    assert monitor.client.requested == []
+
+
+def test_stop_persists_the_cursor(monitor, monkeypatch):
+    monkeypatch.setattr(channel_monitor_module, "CHANNEL_CHECKPOINT_INTERVAL", 3600)
+
+    async def scenario():
+        await monitor.add_monitored_channel(CHANNEL_ID, USER_ID)
+        await monitor._on_message(monitor.client, post(101))
+        await monitor._on_message(monitor.client, post(102))
+        await monitor.stop()
+        return await stored_cursor(monitor.storage)
+
+    assert run(scenario()) == 102
+
+
+def test_start_loads_cursors_and_only_watches_monitored_channels(monitor):
+    async def scenario():
+        await monitor.storage.add_monitored_channel(CHANNEL_ID, USER_ID)
+        await monitor.storage.update_last_message_id(CHANNEL_ID, 100)
+        count = await monitor.start()
+        await monitor._resync
+        await monitor._on_message(monitor.client, SimpleNamespace(id=5, chat=SimpleNamespace(id=-2002)))
+        return count
+
+    assert run(scenario()) == 1
+    channel = monitor._channels[CHANNEL_ID]
+    assert channel.user_ids == {USER_ID}
+    assert channel.last_message_id == 100
+    assert list(monitor._channels) == [CHANNEL_ID]
+
+
+class FloodedUserbot(FakeUserbot):
+    """Primera petición con FloodWait; luego responde con normalidad."""
+
+    def __init__(self, top: int, seconds: int):
+        super().__init__(top)
+        self.seconds = seconds
+
+    async def get_messages(self, chat_id, ids):
+        if self.seconds:
+            seconds, self.seconds = self.seconds, 0
+            raise FloodWait(value=seconds)
+        return await super().get_messages(chat_id, ids)
+
+
+def record_checkpoints(storage, monkeypatch) -> list:
+    saved = []
+    update = storage.update_last_message_id
+
+    async def _update(channel_id, message_id):
+        saved.append(message_id)
+        await update(channel_id, message_id)
+
+    monkeypatch.setattr(storage, "update_last_message_id", _update)
+    return saved
+
+
+def test_gap_is_backfilled_page_by_page_without_duplicates(monitor, monkeypatch):
+    monkeypatch.setattr(channel_monitor_module, "BATCH_FETCH_SIZE", 2)
+
+    async def scenario():
+        await monitor.add_monitored_channel(CHANNEL_ID, USER_ID)
+        saved = record_checkpoints(monitor.storage, monkeypatch)
+        monitor.client.top = 105
+        await monitor._on_message(monitor.client, post(105))
+        # El post en directo se ingiere ya, pero el cursor no salta el hueco.
+        assert monitor._channels[CHANNEL_ID].last_message_id == 100
+        await drain(monitor)
+        return saved, await monitor.storage.count_user_tasks(USER_ID)
+
+    saved, tasks = run(scenario())
+    assert monitor.client.requested == [[101, 102], [103, 104], [105]]
+    assert saved == [102, 104, 105]
+    assert monitor._channels[CHANNEL_ID].last_message_id == 105
+    assert tasks == 5
+
+
+def test_posts_arriving_during_a_backfill_extend_it(monitor, monkeypatch):
+    monkeypatch.setattr(channel_monitor_module, "BATCH_FETCH_SIZE", 2)
+
+    async def scenario():
+        await monitor.add_monitored_channel(CHANNEL_ID, USER_ID)
+        monitor.client.top = 108
+        await monitor._on_message(monitor.client, post(103))
+        await monitor._on_message(monitor.client, post(108))
+        await drain(monitor)
+        return await stored_cursor(monitor.storage), await monitor.storage.count_user_tasks(USER_ID)
+
+    cursor, tasks = run(scenario())
+    assert cursor == 108
+    assert tasks == 8
+
+
+def test_restart_resumes_from_the_stored_cursor(monitor):
+    async def scenario():
+        await monitor.storage.add_monitored_channel(CHANNEL_ID, USER_ID)
+        await monitor.storage.update_last_message_id(CHANNEL_ID, 97)
+        await monitor.start()
+        await monitor._resync
+        return await stored_cursor(monitor.storage), await monitor.storage.count_user_tasks(USER_ID)
+
+    cursor, tasks = run(scenario())
+    assert monitor.client.requested == [[98, 99, 100]]
+    assert (cursor, tasks) == (100, 3)
+
+
+def test_flood_wait_moves_the_page_to_another_member_account(monitor, monkeypatch):
+    primary, secondary = FloodedUserbot(top=102, seconds=5), FakeUserbot(top=102)
+    monitor.pool.accounts = [UserbotAccount(primary, 0), UserbotAccount(secondary, 1)]
+
+    async def scenario():
+        await monitor.storage.add_monitored_channel(CHANNEL_ID, USER_ID)
+        await monitor.storage.update_last_message_id(CHANNEL_ID, 100)
+        await monitor.start()
+        await asyncio.wait_for(monitor._resync, timeout=5)
+        return await stored_cursor(monitor.storage)
+
+    assert run(scenario()) == 102
+    assert secondary.requested == [[101, 102]]
+    assert monitor.pool.accounts[0].throttled
+    # La pausa entre páginas subió a lo pedido por Telegram y empieza a relajarse tras la página servida.
+    assert monitor._page_delay == pytest.approx(4)
@@ -0,0 +1,67 @@
+# --- START OF FILE tests/test_counters.py ---
+
+"""Contadores incrementales: cada tarea cuenta una sola transición final."""
+
+from conftest import run
+
+
+def test_counters_follow_task_events(storage):
+    async def scenario():
+        await storage.add_task(1, "video", "a.mp4")
+        task_id = str(await storage.add_task(2, "video", "b.mp4", status="queued"))
+        await storage.claim_next_task(2, queue_position=0)
+        assert await storage.finish_task(task_id, "done")
+        return await storage.get_counters("global"), await storage.get_counters("user:2")
+
+    global_counters, user_counters = run(scenario())
+    assert global_counters["tasks_created"] == 2
+    assert global_counters["tasks_queued"] == 1
+    assert user_counters["tasks_done"] == 1
+
+
+def test_cancel_then_error_counts_only_the_cancellation(storage):
+    async def scenario():
+        task_id = str(await storage.add_task(1, "video", "a.mp4", status="queued"))
+        await storage.claim_next_task(1, queue_position=0)
+        assert await storage.cancel_task(task_id)
+        # El worker falla después (p. ej. FFmpeg muerto por la cancelación) e intenta marcar error.
+        assert not await storage.finish_task(task_id, "error", {"last_error": "ffmpeg terminó con código 255"})
+        assert not await storage.finish_task(task_id, "done")
+        return await storage.get_task(task_id), await storage.get_counters("user:1")
+
+    task, counters = run(scenario())
+    assert task["status"] == "cancelled"
+    assert counters["tasks_cancelled"] == 1
+    assert "tasks_error" not in counters
+    assert "tasks_done" not in counters
+    finished = sum(counters.get(f"tasks_{status}", 0) for status in ("done", "error", "cancelled"))
+    assert finished <= counters["tasks_created"]
+
+
+def test_cancel_then_error_counts_only_the_cancellation_in_mongo(mongo_storage):
+    from bson import ObjectId
+
+    db = mongo_storage
+    task_id = ObjectId()
+    run(db.tasks.insert_one({"_id": task_id, "user_id": 1, "status": "processing"}))
+
+    async def scenario():
+        assert await db.cancel_task(str(task_id))
+        assert not await db.finish_task(str(task_id), "error", {"last_error": "boom"})
+
+    run(scenario())
+    assert db._pending_counters["user:1"] == {"tasks_cancelled": 1}
+    assert db._pending_counters["global"] == {"tasks_cancelled": 1}
+
+
+def test_rebuild_counters_keeps_unrelated_fields(storage):
+    async def scenario():
+        await storage.add_task(1, "video", "a.mp4", status="queued")
+        storage.increment_counters(1, {"bytes_uploaded": 1000})
+        await storage.rebuild_counters()
+        return await storage.get_counters("user:1")
+
+    counters = run(scenario())
+    assert counters["tasks_created"] == 1
+    assert counters["tasks_queued"] == 1
+    assert counters["bytes_uploaded"] == 1000
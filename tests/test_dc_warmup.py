@@ -0,0 +1,191 @@
+# --- START OF FILE tests/test_dc_warmup.py ---
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from conftest import run
+
+pytest.importorskip("pyrogram")
+pytest.importorskip("motor")
+
+from pyrogram import raw
+from pyrogram.file_id import FileId, FileType
+
+from src.core import dc_warmup
+from src.helpers.metrics import metrics
+
+HOME_DC, FOREIGN_DC = 2, 4
+PAYLOAD = b"0123456789"
+
+
+class FakeSession:
+    """Sesión de medios que sirve PAYLOAD por bloques; con `fail_at` falla al pedir ese offset."""
+
+    opened = []
+
+    def __init__(self, client, dc_id, auth_key, test_mode, is_media=False, **kwargs):
+        self.dc_id = dc_id
+        self.fail_at = None
+        self.stopped = False
+        self.requests = []
+        FakeSession.opened.append(self)
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        self.stopped = True
+
+    async def invoke(self, query, sleep_threshold=None):
+        if isinstance(query, raw.functions.auth.ImportAuthorization):
+            return True
+        self.requests.append(query.offset)
+        if query.offset == self.fail_at:
+            raise ConnectionError("sesión caída")
+        return raw.types.upload.File(type=raw.types.storage.FileUnknown(), mtime=0,
+                                     bytes=PAYLOAD[query.offset:query.offset + query.limit])
+
+
+class FakeAuth:
+    def __init__(self, client, dc_id, test_mode):
+        pass
+
+    async def create(self):
+        return b"k" * 256
+
+
+class FakeClient:
+    def __init__(self, name: str = "user_bot"):
+        self.name = name
+        self.media_sessions = {}
+        self.media_sessions_lock = asyncio.Lock()
+        self.get_file_semaphore = asyncio.Semaphore(4)
+        self.storage = SimpleNamespace(dc_id=self._value(HOME_DC), test_mode=self._value(False),
+                                       auth_key=self._value(b"h" * 256))
+        self.loop, self.executor = asyncio.get_running_loop(), None
+        self.fallbacks = []
+        dc_warmup.use_kept_media_sessions(self)
+
+    @staticmethod
+    def _value(value):
+        async def getter():
+            return value
+        return getter
+
+    async def invoke(self, query):
+        return SimpleNamespace(id=1, bytes=b"exported")
+
+
+async def original_get_file(client, file_id, file_size, limit, offset, progress, progress_args):
+    """Client.get_file de Pyrogram: abre su propia sesión y sigue desde el bloque `offset`."""
+    client.fallbacks.append((limit, offset))
+    chunk = dc_warmup._CHUNK_SIZE
+    for start in range(offset * chunk, len(PAYLOAD), chunk):
+        yield PAYLOAD[start:start + chunk]
+
+
+@pytest.fixture(autouse=True)
+def fake_pyrogram(monkeypatch):
+    FakeSession.opened = []
+    monkeypatch.setattr(dc_warmup, "Session", FakeSession)
+    monkeypatch.setattr(dc_warmup, "Auth", FakeAuth)
+    monkeypatch.setattr(dc_warmup, "Client", SimpleNamespace(get_file=original_get_file))
+    monkeypatch.setattr(dc_warmup, "_CHUNK_SIZE", 4)
+
+
+def document(dc_id: int) -> FileId:
+    return FileId(file_type=FileType.DOCUMENT, dc_id=dc_id, media_id=1, access_hash=2, file_reference=b"")
+
+
+async def download(client, file_id: FileId, **kwargs) -> bytes:
+    return b"".join([chunk async for chunk in client.get_file(file_id, len(PAYLOAD), **kwargs)])
+
+
+def test_downloads_from_the_same_dc_reuse_one_session():
+    async def scenario():
+        client = FakeClient()
+        progress = []
+        first = await download(client, document(HOME_DC), progress=lambda current, total: progress.append(current))
+        second = await download(client, document(HOME_DC))
+        return client, first, second, progress
+
+    client, first, second, progress = run(scenario())
+    assert first == second == PAYLOAD
+    assert len(FakeSession.opened) == 1
+    assert client.media_sessions == {HOME_DC: FakeSession.opened[0]}
+    assert progress == [4, 8, 10]
+    assert client.fallbacks == []
+
+
+def test_foreign_dc_session_is_opened_once_with_exported_auth():
+    async def scenario():
+        client = FakeClient()
+        await download(client, document(FOREIGN_DC))
+        await download(client, document(FOREIGN_DC))
+        return client
+
+    client = run(scenario())
+    [session] = FakeSession.opened
+    assert session.dc_id == FOREIGN_DC
+    assert client.media_sessions == {FOREIGN_DC: session}
+
+
+def test_failed_session_is_dropped_and_the_download_resumes_from_the_current_chunk():
+    async def scenario():
+        client = FakeClient()
+        await dc_warmup.open_media_session(client, HOME_DC)
+        client.media_sessions[HOME_DC].fail_at = 4
+        return client, await download(client, document(HOME_DC))
+
+    client, data = run(scenario())
+    assert data == PAYLOAD
+    assert client.fallbacks == [(0, 1)]
+    assert FakeSession.opened[0].stopped
+    assert client.media_sessions == {}
+
+
+def test_limit_and_offset_are_honoured_across_the_fallback():
+    async def scenario():
+        client = FakeClient()
+        await dc_warmup.open_media_session(client, HOME_DC)
+        client.media_sessions[HOME_DC].fail_at = 8
+        return client, await download(client, document(HOME_DC), limit=2, offset=1)
+
+    client, data = run(scenario())
+    assert data == PAYLOAD[4:]
+    assert client.fallbacks == [(1, 2)]
+
+
+def test_warm_up_opens_the_most_used_dcs_per_client_kind(storage, monkeypatch):
+    monkeypatch.setattr(dc_warmup, "db_instance", storage)
+    monkeypatch.setattr(dc_warmup, "MEDIA_DC_WARMUP_TOP", 1)
+    for kind, dc_id in [("userbot", FOREIGN_DC), ("userbot", FOREIGN_DC), ("userbot", HOME_DC), ("bot", 1)]:
+        storage.record_media_dc(kind, dc_id)
+
+    async def scenario():
+        bot, userbot = FakeClient("bot"), FakeClient("user_bot")
+        report = await dc_warmup.warm_up_media_dcs({"bot": [bot], "userbot": [userbot]})
+        return bot, userbot, report
+
+    bot, userbot, report = run(scenario())
+    assert set(bot.media_sessions) == {1}
+    assert set(userbot.media_sessions) == {FOREIGN_DC}
+    assert set(report) == {"bot", "user_bot"}
+
+
+def test_first_chunk_is_labelled_warm_only_when_the_session_was_open():
+    prefix = "telegram.media.first_chunk_ms.test"
+    metrics.remove_prefix(prefix)
+
+    async def scenario():
+        client = FakeClient()
+        for _ in range(2):
+            probe = dc_warmup.TransferProbe(client, "test", HOME_DC)
+            await download(client, document(HOME_DC), progress=probe.wrap(None))
+
+    run(scenario())
+    histograms = metrics.snapshot(prefix)["histograms"]
+    assert histograms[f"{prefix}.cold"]["count"] == 1
+    assert histograms[f"{prefix}.warm"]["count"] == 1
@@ -0,0 +1,115 @@
+# --- START OF FILE tests/test_ffmpeg_supervisor.py ---
+
+"""run_ffmpeg con procesos Python que imitan la salida de FFmpeg (no hace falta ffmpeg instalado)."""
+
+import asyncio
+import sys
+
+import pytest
+
+from conftest import run
+
+from src.core import ffmpeg_supervisor
+from src.core.cancellation import CancellationToken
+from src.core.exceptions import FFmpegProcessingError, TaskCancelledError
+from src.core.ffmpeg_supervisor import compute_wall_limit, run_ffmpeg
+
+
+def script(code: str) -> list:
+    return [sys.executable, "-c", code]
+
+
+# Informa out_time por stderr cada 50 ms, como `ffmpeg -progress pipe:2`, durante `seconds` segundos.
+def progressing(seconds: float) -> list:
+    return script(
+        "import sys, time\n"
+        f"for i in range(int({seconds} / 0.05)):\n"
+        "    print(f'out_time_us={(i + 1) * 100000}', file=sys.stderr, flush=True)\n"
+        "    time.sleep(0.05)\n"
+    )
+
+
+@pytest.fixture(autouse=True)
+def fast_supervisor(monkeypatch):
+    monkeypatch.setattr(ffmpeg_supervisor, "FFMPEG_NICE", 0)
+    monkeypatch.setattr(ffmpeg_supervisor, "FFMPEG_IONICE_CLASS", "")
+    monkeypatch.setattr(ffmpeg_supervisor, "FFMPEG_KILL_GRACE", 0.3)
+
+
+def test_progress_is_reported_and_resources_are_accounted():
+    seen = []
+
+    async def on_progress(seconds):
+        seen.append(seconds)
+
+    command = script(
+        "import sys\n"
+        "print('Input #0, matroska', file=sys.stderr)\n"
+        "for us in (500000, 1000000, 1000000, 1500000):\n"
+        "    print(f'out_time_us={us}', file=sys.stderr)\n"
+        "print('progress=end', file=sys.stderr)\n"
+    )
+    result = run(run_ffmpeg(command, duration=2, on_progress=on_progress))
+
+    assert result.ok
+    assert seen == [0.5, 1.0, 1.5]
+    assert result.processed_seconds == 1.5
+    assert result.stderr_tail == ["Input #0, matroska\n"]
+    assert result.wall_time > 0 and result.max_rss_kb > 0
+
+
+def test_failed_exit_keeps_the_stderr_tail():
+    result = run(run_ffmpeg(script("import sys; print('códec no soportado', file=sys.stderr); sys.exit(3)")))
+
+    assert result.returncode == 3 and not result.ok
+    with pytest.raises(FFmpegProcessingError, match="código 3"):
+        result.raise_for_status()
+
+
+def test_stalled_process_is_stopped():
+    result = run(run_ffmpeg(script("import time; time.sleep(30)"), stall_timeout=0.3, wall_limit=30))
+
+    assert result.kill_reason.startswith("sin progreso")
+    assert result.wall_time < 5
+    with pytest.raises(FFmpegProcessingError, match="detenido"):
+        result.raise_for_status()
+
+
+def test_progress_does_not_save_a_process_over_the_wall_limit():
+    result = run(run_ffmpeg(progressing(30), stall_timeout=30, wall_limit=0.6))
+
+    assert result.kill_reason.startswith("superó el límite")
+    assert result.processed_seconds > 0
+    assert result.wall_time < 5
+
+
+def test_process_ignoring_sigterm_is_killed():
+    command = script(
+        "import signal, time\n"
+        "signal.signal(signal.SIGTERM, signal.SIG_IGN)\n"
+        "time.sleep(30)\n"
+    )
+    result = run(run_ffmpeg(command, stall_timeout=0.3, wall_limit=30))
+
+    assert result.kill_reason is not None
+    assert result.returncode == -9
+
+
+def test_cancel_stops_the_process_and_raises():
+    async def scenario():
+        token = CancellationToken("t1")
+        asyncio.get_running_loop().call_later(0.2, token.cancel)
+        await run_ffmpeg(progressing(30), cancel_token=token, wall_limit=30)
+
+    with pytest.raises(TaskCancelledError):
+        run(scenario())
+
+
+def test_wall_limit_scales_with_duration(monkeypatch):
+    monkeypatch.setattr(ffmpeg_supervisor, "FFMPEG_MIN_WALL", 600)
+    monkeypatch.setattr(ffmpeg_supervisor, "FFMPEG_WALL_FACTOR", 6)
+    monkeypatch.setattr(ffmpeg_supervisor, "FFMPEG_MAX_WALL_UNKNOWN", 7200)
+
+    assert compute_wall_limit(10) == 600
+    assert compute_wall_limit(3600) == 21600
+    assert compute_wall_limit(0) == 7200
@@ -0,0 +1,93 @@
+# --- START OF FILE tests/test_outbound.py ---
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from conftest import run
+
+pytest.importorskip("pyrogram")
+
+from pyrogram.errors import FloodWait
+
+from src.helpers import outbound as outbound_module
+from src.helpers.outbound import OutboundScheduler, TokenBucket, PRIORITY_PROGRESS, PRIORITY_USER
+
+
+class FakeTime:
+    def __init__(self, monkeypatch):
+        self.now = 100.0
+        monkeypatch.setattr(outbound_module, "time", SimpleNamespace(monotonic=lambda: self.now))
+
+
+class FakeClient:
+    def __init__(self, fail_with=None):
+        self.edits = []
+        self.fail_with = list(fail_with or [])
+
+    async def edit_message_text(self, chat_id, message_id, text, **kwargs):
+        if self.fail_with:
+            raise self.fail_with.pop(0)
+        self.edits.append((chat_id, message_id, text))
+
+
+def test_token_bucket_refills_at_rate(monkeypatch):
+    clock = FakeTime(monkeypatch)
+    bucket = TokenBucket(rate=2, burst=2)
+    bucket.take()
+    bucket.take()
+    assert bucket.delay() == pytest.approx(0.5)
+    clock.now += 0.5
+    assert bucket.delay() == 0
+    clock.now += 10
+    bucket.take()
+    assert bucket.tokens == pytest.approx(1)
+
+
+def test_edits_to_the_same_message_are_coalesced():
+    async def scenario():
+        scheduler, client = OutboundScheduler(), FakeClient()
+        first = scheduler.edit(client, 1, 10, "10%")
+        second = scheduler.edit(client, 1, 10, "20%")
+        await asyncio.gather(first, second)
+        # Mismo texto que el último entregado: ni se encola.
+        await scheduler.edit(client, 1, 10, "20%")
+        return client.edits, scheduler.stats()
+
+    edits, stats = run(scenario())
+    assert edits == [(1, 10, "20%")]
+    assert stats["pending"] == 0
+
+
+def test_user_replies_go_before_progress():
+    async def scenario():
+        scheduler, client, order = OutboundScheduler(), FakeClient(), []
+
+        async def reply():
+            order.append("respuesta")
+
+        progress = scheduler.edit(client, 1, 10, "50%", priority=PRIORITY_PROGRESS)
+        answer = scheduler.call(2, reply, priority=PRIORITY_USER)
+        await asyncio.gather(progress, answer)
+        order.extend(text for _, _, text in client.edits)
+        return order
+
+    assert run(scenario()) == ["respuesta", "50%"]
+
+
+def test_flood_wait_pauses_and_retries(monkeypatch):
+    monkeypatch.setattr(outbound_module, "OUTBOUND_MAX_FLOOD_RETRIES", 1)
+
+    async def scenario():
+        scheduler = OutboundScheduler()
+        client = FakeClient(fail_with=[FloodWait(value=0)])
+        await scheduler.edit(client, 1, 10, "hecho", priority=PRIORITY_USER)
+        failing = FakeClient(fail_with=[FloodWait(value=0), FloodWait(value=0)])
+        with pytest.raises(FloodWait):
+            await scheduler.edit(failing, 1, 11, "nunca", priority=PRIORITY_USER)
+        return client.edits, scheduler._paused_until > 0
+
+    edits, paused = run(scenario())
+    assert edits == [(1, 10, "hecho")]
+    assert paused
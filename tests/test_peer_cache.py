@@ -0,0 +1,76 @@
+# --- START OF FILE tests/test_peer_cache.py ---
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from conftest import run
+
+pytest.importorskip("pyrogram")
+
+from pyrogram.errors import ChannelPrivate, FloodWait
+
+from src.helpers.peer_cache import PeerCache
+
+
+class FakeClient:
+    def __init__(self, error=None):
+        self.calls = 0
+        self.error = error
+
+    async def get_chat(self, chat_id):
+        self.calls += 1
+        await asyncio.sleep(0)
+        if self.error is not None:
+            raise self.error
+        return SimpleNamespace(id=-1001, username="Canal")
+
+
+def test_concurrent_lookups_share_one_call():
+    async def scenario():
+        cache, client = PeerCache(), FakeClient()
+        chats = await asyncio.gather(*(cache.get_chat(client, -1001) for _ in range(5)))
+        return chats, client.calls
+
+    chats, calls = run(scenario())
+    assert calls == 1
+    assert all(chat is chats[0] for chat in chats)
+
+
+def test_chat_is_aliased_by_username():
+    async def scenario():
+        cache, client = PeerCache(), FakeClient()
+        await cache.get_chat(client, -1001)
+        by_name = await cache.get_chat(client, "@canal")
+        cache.invalidate_chat(client, "canal")
+        await cache.get_chat(client, -1001)
+        return by_name, client.calls
+
+    by_name, calls = run(scenario())
+    assert by_name.id == -1001
+    assert calls == 2
+
+
+def test_peer_errors_are_cached_but_flood_wait_is_not():
+    async def scenario():
+        cache = PeerCache()
+        private = FakeClient(error=ChannelPrivate())
+        for _ in range(2):
+            with pytest.raises(ChannelPrivate):
+                await cache.get_chat(private, -1001)
+        flooded = FakeClient(error=FloodWait(value=5))
+        for _ in range(2):
+            with pytest.raises(FloodWait):
+                await cache.get_chat(flooded, -1001)
+        return private.calls, flooded.calls
+
+    assert run(scenario()) == (1, 2)
+
+
+def test_get_chats_returns_none_for_failures():
+    async def scenario():
+        cache = PeerCache()
+        return await cache.get_chats(FakeClient(error=ChannelPrivate()), [-1001, -1001])
+
+    assert run(scenario()) == {-1001: None}
@@ -0,0 +1,93 @@
+# --- START OF FILE tests/test_progress_bus.py ---
+
+import math
+from types import SimpleNamespace
+
+import pytest
+
+from conftest import run
+
+pytest.importorskip("pyrogram")
+pytest.importorskip("motor")
+
+from src.core import progress_bus
+from src.core.progress_bus import ProgressContext, ProgressSink
+
+
+class RecordingSink(ProgressSink):
+    def __init__(self):
+        self.events = []
+
+    def emit(self, ctx, event):
+        self.events.append(event)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = SimpleNamespace(now=0.0)
+    fake.monotonic = lambda: fake.now
+    monkeypatch.setattr(progress_bus, "time", fake)
+    monkeypatch.setattr(progress_bus, "PROGRESS_SAMPLE_INTERVAL", 1.0)
+    monkeypatch.setattr(progress_bus, "PROGRESS_EWMA_ALPHA", 0.5)
+    return fake
+
+
+def test_samples_are_throttled_by_interval(clock):
+    sink = RecordingSink()
+    ctx = ProgressContext("t1", sinks=[sink])
+    ctx.stage("Descargando", total=1000)
+    clock.now = 0.5
+    run(ctx.update(100))
+    assert sink.events == []
+    clock.now = 1.0
+    run(ctx.update(100))
+    assert [event.current for event in sink.events] == [100]
+
+
+def test_speed_is_smoothed_and_eta_follows_it(clock):
+    sink = RecordingSink()
+    ctx = ProgressContext("t1", sinks=[sink])
+    ctx.stage("Descargando", total=1000)
+    clock.now = 1.0
+    run(ctx.update(100))   # 100 B/s
+    clock.now = 2.0
+    run(ctx.update(400))   # 300 B/s -> 0.5 * 300 + 0.5 * 100
+    first, second = sink.events
+    assert first.speed == pytest.approx(100)
+    assert second.speed == pytest.approx(200)
+    assert second.eta == pytest.approx((1000 - 400) / 200)
+    assert second.percentage == pytest.approx(40)
+
+
+def test_final_sample_is_emitted_once_and_clamped(clock):
+    sink = RecordingSink()
+    ctx = ProgressContext("t1", sinks=[sink])
+    ctx.stage("Subiendo", total=1000)
+    clock.now = 0.1
+    run(ctx.update(1200))
+    clock.now = 5.0
+    run(ctx.update(1000))
+    [event] = sink.events
+    assert event.final
+    assert event.current == 1000
+    assert event.eta == 0
+
+
+def test_unknown_speed_gives_infinite_eta(clock):
+    sink = RecordingSink()
+    ctx = ProgressContext("t1", sinks=[sink])
+    ctx.stage("Procesando", total=1000)
+    clock.now = 1.0
+    run(ctx.update(0))
+    assert math.isinf(sink.events[0].eta)
+
+
+def test_failing_sink_does_not_stop_the_others(clock):
+    class BrokenSink(RecordingSink):
+        def emit(self, ctx, event):
+            raise RuntimeError("roto")
+
+    sink = RecordingSink()
+    ctx = ProgressContext("t1", sinks=[BrokenSink(), sink])
+    ctx.text("Descargando subtítulos...")
+    assert [event.text for event in sink.events] == ["Descargando subtítulos..."]
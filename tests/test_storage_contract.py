@@ -0,0 +1,137 @@
+# --- START OF FILE tests/test_storage_contract.py ---
+
+"""Contrato de StorageBackend, ejecutado contra el backend SQLite en memoria."""
+
+from conftest import run
+
+from src.db.backend import StorageBackend, build_task_document
+
+
+def test_backend_implements_contract(storage):
+    assert isinstance(storage, StorageBackend)
+    assert not getattr(type(storage), "__abstractmethods__", None)
+
+
+def test_add_task_assigns_per_user_ordinals(storage):
+    async def scenario():
+        first = await storage.add_task(1, "video", "a.mp4")
+        second = await storage.add_task(1, "video", "b.mp4")
+        other = await storage.add_task(2, "audio", "c.mp3")
+        task = await storage.get_task_by_ordinal(1, 2)
+        return [(await storage.get_task(str(t)))["ordinal"] for t in (first, second, other)], task
+
+    ordinals, task = run(scenario())
+    assert ordinals == [1, 2, 1]
+    assert task["original_filename"] == "b.mp4"
+    assert task["final_filename"] == "b"
+
+
+def test_add_tasks_skips_existing_dedupe_key(storage):
+    def docs():
+        return [build_task_document(1, "video", f"{n}.mp4", custom_fields={"dedupe_key": f"lote:{n}"})
+                for n in range(3)]
+
+    async def scenario():
+        first = await storage.add_tasks(docs())
+        again = await storage.add_tasks(docs()[1:] + [build_task_document(1, "video", "nuevo.mp4")])
+        return first, again, await storage.count_user_tasks(1)
+
+    first, again, total = run(scenario())
+    assert len(first) == 3
+    assert len(again) == 1
+    assert total == 4
+
+
+def test_job_document_has_no_ordinal_nor_counters(storage):
+    async def scenario():
+        job_id = await storage.add_job_document(build_task_document(1, "batch_ingest", "lote", status="ingesting"))
+        task_id = await storage.add_task(1, "video", "a.mp4")
+        return await storage.get_task(str(job_id)), await storage.get_task(str(task_id)), await storage.get_counters("user:1")
+
+    job, task, counters = run(scenario())
+    assert job.get("ordinal") is None
+    assert task["ordinal"] == 1
+    assert counters["tasks_created"] == 1
+
+
+def test_get_tasks_page_walks_both_directions(storage):
+    async def scenario():
+        for n in range(5):
+            await storage.add_task(1, "video", f"{n}.mp4")
+        first, more = await storage.get_tasks_page(1, limit=2)
+        last = first[-1]
+        second, _ = await storage.get_tasks_page(1, cursor=(last["created_at"], last["_id"]), limit=2)
+        head = second[0]
+        back, _ = await storage.get_tasks_page(1, cursor=(head["created_at"], head["_id"]), backwards=True, limit=2)
+        return first, more, second, back
+
+    first, more, second, back = run(scenario())
+    assert more
+    assert [t["original_filename"] for t in first] == ["0.mp4", "1.mp4"]
+    assert [t["original_filename"] for t in second] == ["2.mp4", "3.mp4"]
+    assert [t["original_filename"] for t in back] == ["0.mp4", "1.mp4"]
+
+
+def test_claim_next_task_takes_queued_by_priority(storage):
+    async def scenario():
+        await storage.add_task(1, "video", "normal.mp4", status="queued")
+        urgent = await storage.add_task(1, "video", "urgente.mp4", status="queued")
+        await storage.update_task_fields(str(urgent), {"priority": 5})
+        await storage.flush_task_updates()
+        claimed = await storage.claim_next_task(1, queue_position=0)
+        return claimed, await storage.count_tasks_by_status("queued"), await storage.claim_next_task(2, 0)
+
+    claimed, still_queued, nothing = run(scenario())
+    assert claimed["original_filename"] == "urgente.mp4"
+    assert claimed["status"] == "processing"
+    assert still_queued == 1
+    assert nothing is None
+
+
+def test_buffered_write_does_not_revert_cancellation(storage):
+    async def scenario():
+        task_id = str(await storage.add_task(1, "video", "a.mp4", status="queued"))
+        cancelled = await storage.cancel_task(task_id)
+        await storage.update_task_fields(task_id, {"status": "processing", "last_error": None})
+        await storage.flush_task_updates(task_id)
+        return cancelled, await storage.get_task(task_id), await storage.get_cancelled_task_ids([task_id])
+
+    cancelled, task, cancelled_ids = run(scenario())
+    assert cancelled
+    assert task["status"] == "cancelled"
+    assert cancelled_ids == [str(task["_id"])]
+
+
+def test_cancel_only_cancellable_tasks(storage):
+    async def scenario():
+        task_id = str(await storage.add_task(1, "video", "a.mp4"))
+        await storage.update_task_fields(task_id, {"status": "done"})
+        return await storage.cancel_task(task_id), await storage.get_task(task_id)
+
+    cancelled, task = run(scenario())
+    assert not cancelled
+    assert task["status"] == "done"
+
+
+def test_user_settings_and_state(storage):
+    async def scenario():
+        assert await storage.register_user(7)
+        await storage.set_user_state(7, "awaiting_name", {"task_id": "x"})
+        return await storage.get_user_settings(7), await storage.get_user_state(7)
+
+    settings, state = run(scenario())
+    assert settings["_id"] == 7
+    assert state == {"status": "awaiting_name", "data": {"task_id": "x"}}
+
+
+def test_monitored_channels_cursor_only_moves_forward(storage):
+    async def scenario():
+        assert await storage.add_monitored_channel(-1001, 1)
+        assert await storage.is_channel_monitored(-1001, 1)
+        await storage.update_last_message_id(-1001, 50)
+        await storage.update_last_message_id(-1001, 40)
+        return await storage.get_active_monitored_channels()
+
+    [channel] = run(scenario())
+    assert channel["channel_id"] == -1001
+    assert channel["last_message_id"] == 50
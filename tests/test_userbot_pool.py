@@ -0,0 +1,136 @@
+# --- START OF FILE tests/test_userbot_pool.py ---
+
+import inspect
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from conftest import run
+
+pytest.importorskip("pyrogram")
+pytest.importorskip("motor")
+
+from pyrogram import StopTransmission
+from pyrogram.errors import FloodWait
+
+from src.core import worker
+from src.core.cancellation import CancellationToken
+from src.core.exceptions import TaskCancelledError
+from src.core.progress_bus import ProgressContext
+from src.core.userbot_pool import IncompleteDownloadError, UserbotAccount, UserbotPool
+
+CHAT_ID, MESSAGE_ID, SIZE = -1001, 5, 10
+
+
+class FakeUserbot:
+    """Cliente de Pyrogram mínimo: descarga `payload` bytes o imita un FloodWait/una cancelación."""
+
+    def __init__(self, payload: bytes = b"x" * SIZE, flood: int = 0, on_progress=None):
+        self.payload = payload
+        self.flood = flood
+        self.on_progress = on_progress
+        self.downloads = 0
+
+    async def get_chat_member(self, chat_id, user_id):
+        return SimpleNamespace(status=SimpleNamespace(name="MEMBER"))
+
+    async def get_messages(self, chat_id, message_id):
+        return make_message(self)
+
+    async def download_media(self, message, file_name=None, progress=None, progress_args=(), **kwargs):
+        self.downloads += 1
+        if self.flood:
+            raise FloodWait(value=self.flood)
+        try:
+            if self.on_progress:
+                self.on_progress()
+            if progress:
+                # Como Pyrogram, admite callbacks síncronos y asíncronos.
+                result = progress(SIZE // 2, SIZE, *progress_args)
+                if inspect.isawaitable(result):
+                    await result
+        except StopTransmission:
+            # Pyrogram 2.0.106 (handle_download) traga StopTransmission y devuelve None.
+            return None
+        with open(file_name, "wb") as f:
+            f.write(self.payload)
+        return file_name
+
+    def stop_transmission(self):
+        raise StopTransmission
+
+
+def make_message(client):
+    return SimpleNamespace(chat=SimpleNamespace(id=CHAT_ID), id=MESSAGE_ID, _client=client,
+                           video=SimpleNamespace(file_size=SIZE), empty=False)
+
+
+def make_pool(*clients) -> UserbotPool:
+    pool = UserbotPool()
+    pool.accounts = [UserbotAccount(client, index) for index, client in enumerate(clients)]
+    return pool
+
+
+def test_truncated_download_benches_account_and_retries_on_another(tmp_path):
+    truncated, healthy = FakeUserbot(payload=b"x" * 3), FakeUserbot()
+    pool = make_pool(truncated, healthy)
+
+    path, account = run(pool.download_media(make_message(truncated), file_name=str(tmp_path / "a.mp4")))
+
+    assert account.client is healthy
+    assert open(path, "rb").read() == healthy.payload
+    assert pool.accounts[0].throttled
+    assert not pool.accounts[1].throttled
+
+
+def test_flood_wait_routes_to_the_next_account(tmp_path):
+    flooded, healthy = FakeUserbot(flood=30), FakeUserbot()
+    pool = make_pool(flooded, healthy)
+
+    _, account = run(pool.download_media(make_message(flooded), file_name=str(tmp_path / "a.mp4")))
+
+    assert account.client is healthy
+    assert pool.accounts[0].flood_until > time.monotonic() + 20
+
+
+def test_every_account_incomplete_raises(tmp_path):
+    pool = make_pool(FakeUserbot(payload=b""), FakeUserbot(payload=b"x"))
+
+    with pytest.raises(IncompleteDownloadError):
+        run(pool.download_media(make_message(pool.accounts[0].client), file_name=str(tmp_path / "a.mp4")))
+    assert all(account.throttled for account in pool.accounts)
+    assert not (tmp_path / "a.mp4").exists()
+
+
+def test_cancel_mid_download_does_not_bench_or_retry(tmp_path):
+    token = CancellationToken("t1")
+    first = FakeUserbot(on_progress=token.cancel)
+    second = FakeUserbot()
+    pool = make_pool(first, second)
+    progress = ProgressContext("t1", cancel_token=token, client=first)
+
+    async def scenario():
+        await pool.download_media(make_message(first), cancel_token=token, file_name=str(tmp_path / "a.mp4"),
+                                  progress=progress.pyrogram_callback,
+                                  progress_args=("↓ Downloading ...", "#Download", SIZE, "a.mp4"))
+
+    with pytest.raises(TaskCancelledError):
+        run(scenario())
+    assert (first.downloads, second.downloads) == (1, 0)
+    assert not any(account.throttled for account in pool.accounts)
+
+
+def test_cancelled_source_download_reaches_the_worker_as_cancellation(tmp_path, monkeypatch):
+    token = CancellationToken("t1")
+    userbot = FakeUserbot(on_progress=token.cancel)
+    pool = make_pool(userbot, FakeUserbot())
+    monkeypatch.setattr(worker, "userbot_pool", pool)
+    bot = FakeUserbot()
+    progress = ProgressContext("t1", cancel_token=token, client=bot)
+    task = {"_id": "t1", "user_id": 1, "original_filename": "a.mp4", "file_metadata": {"size": SIZE},
+            "source": {"chat_id": CHAT_ID, "message_id": MESSAGE_ID}}
+
+    with pytest.raises(TaskCancelledError):
+        run(worker._process_media_task(bot, task, str(tmp_path), progress))
+    assert not any(account.throttled for account in pool.accounts)
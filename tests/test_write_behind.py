@@ -0,0 +1,91 @@
+# --- START OF FILE tests/test_write_behind.py ---
+
+"""Escrituras diferidas de tareas (Mongo) frente a cancel_task y a los estados finales."""
+
+import pytest
+
+from conftest import run
+
+pytest.importorskip("motor")
+
+from bson import ObjectId
+
+
+def add_task(db, status: str = "processing") -> str:
+    task_id = ObjectId()
+    run(db.tasks.insert_one({"_id": task_id, "user_id": 1, "status": status}))
+    return str(task_id)
+
+
+def test_updates_are_coalesced_into_one_set(mongo_storage):
+    db = mongo_storage
+    task_id = add_task(db)
+
+    async def scenario():
+        await db.update_task_fields(task_id, {"progress": 10})
+        await db.update_task_fields(task_id, {"progress": 20, "stage": "ffmpeg"})
+        await db.flush_task_updates()
+
+    run(scenario())
+    assert db.tasks.writes == [("bulk_write", {"progress": 20, "stage": "ffmpeg"})]
+
+
+def test_cancel_flushes_buffered_fields_before_cancelling(mongo_storage):
+    db = mongo_storage
+    task_id = add_task(db, status="queued")
+
+    async def scenario():
+        await db.update_task_fields(task_id, {"status": "processing", "queue_position": 1})
+        assert await db.cancel_task(task_id)
+        await db.flush_task_updates()
+        return await db.get_task(task_id)
+
+    task = run(scenario())
+    assert [kind for kind, _ in db.tasks.writes] == ["bulk_write", "find_one_and_update"]
+    assert task["status"] == "cancelled"
+    assert task["queue_position"] == 1
+
+
+def test_buffered_status_never_overwrites_a_final_status(mongo_storage):
+    db = mongo_storage
+    task_id = add_task(db, status="queued")
+
+    async def scenario():
+        assert await db.cancel_task(task_id)
+        # Un estado que llega al buffer después (p. ej. del worker) no revierte la cancelación.
+        await db.update_task_fields(task_id, {"status": "processing", "stage": "descarga"})
+        await db.flush_task_updates()
+        return await db.get_task(task_id)
+
+    assert run(scenario())["status"] == "cancelled"
+
+
+def test_finish_task_after_cancel_is_not_applied_nor_counted(mongo_storage):
+    db = mongo_storage
+    task_id = add_task(db)
+
+    async def scenario():
+        assert await db.cancel_task(task_id)
+        applied = await db.finish_task(task_id, "error", {"last_error": "boom"})
+        return applied, await db.get_task(task_id)
+
+    applied, task = run(scenario())
+    assert not applied
+    assert task["status"] == "cancelled"
+    assert "last_error" not in task
+    assert db._pending_counters["user:1"] == {"tasks_cancelled": 1}
+
+
+def test_finish_task_writes_buffered_fields_first(mongo_storage):
+    db = mongo_storage
+    task_id = add_task(db)
+
+    async def scenario():
+        await db.update_task_fields(task_id, {"stage": "subida"})
+        assert await db.finish_task(task_id, "done")
+        return await db.get_task(task_id)
+
+    task = run(scenario())
+    assert (task["status"], task["stage"]) == ("done", "subida")
+    assert task["finished_at"] is not None
+    assert db._pending_counters["user:1"] == {"tasks_done": 1}